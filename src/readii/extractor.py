@@ -0,0 +1,372 @@
+"""PyRadiomics feature extractor with numpy engines for selected feature classes.
+
+`NumpyFeatureExtractor` is a drop in replacement for
+`radiomics.featureextractor.RadiomicsFeatureExtractor`. It computes the firstorder class with
+`readii.firstorder.firstOrderFeatures` and the glcm, glrlm and glszm classes with
+`readii.texture.textureFeatures`, depending on the chosen engines. Every other feature class,
+image type and setting is handled by PyRadiomics, so the output keys and their order are the
+same as with PyRadiomics.
+
+`parallelExecute` runs the extraction of one ROI with any of these extractors over several
+workers, one for each image type and for each feature class of each filtered image.
+"""
+
+import copy
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import SimpleITK as sitk
+from joblib import Parallel, delayed
+from radiomics import featureextractor, generalinfo, imageoperations, logging
+from radiomics.featureextractor import getFeatureClasses
+
+from readii.firstorder import firstOrderFeatures
+from readii.logqueue import forwardLogs
+from readii.texture import isTextureEngineSupported, textureFeatures
+from readii.threads import budgetedJobs, limitThreads, workerThreads
+
+# Engines that can compute the firstorder and texture feature classes during feature extraction
+FEATURE_ENGINES = ("pyradiomics", "numpy")
+# joblib backends parallelExecute can split the extraction of one ROI over.
+# PyRadiomics computes the texture matrices while holding the GIL, so only the image filters run in parallel with threads.
+PARALLEL_BACKENDS = ("processes", "threads")
+
+# Filtered image cropped to the ROI, its mask, image type name and settings
+CroppedFilteredImage = tuple[sitk.Image, sitk.Image, str, Dict[str, Any]]
+
+
+class NumpyFeatureExtractor(featureextractor.RadiomicsFeatureExtractor):
+	"""PyRadiomics feature extractor that computes some feature classes with numpy engines.
+
+	Parameters
+	----------
+	*args
+		Parameter file or dictionary, passed on to `RadiomicsFeatureExtractor`.
+	firstOrderEngine : {"pyradiomics", "numpy"}, default "numpy"
+		Engine computing the firstorder feature class.
+	textureEngine : {"pyradiomics", "numpy"}, default "pyradiomics"
+		Engine computing the glcm, glrlm and glszm feature classes. Settings the numpy engine
+		does not support, e.g. force2D, fall back to PyRadiomics.
+	**kwargs
+		Settings passed on to `RadiomicsFeatureExtractor`.
+
+	Notes
+	-----
+	Voxel based extraction is left to PyRadiomics entirely.
+
+	Each image is extracted on its own, so `readii.texture.textureFeatures` gets a batch of one
+	replicate. Its speed-up comes from building the matrices of many replicates at once, so the
+	numpy texture engine is not faster than PyRadiomics here, and can be slower. It computes the
+	same features, e.g. to check the batched engine on real data.
+	"""
+
+	def __init__(
+		self,
+		*args: Any,  # noqa: ANN401
+		firstOrderEngine: str = "numpy",
+		textureEngine: str = "pyradiomics",
+		**kwargs: Any,  # noqa: ANN401
+	) -> None:
+		for engineName, engine in (
+			("firstOrderEngine", firstOrderEngine),
+			("textureEngine", textureEngine),
+		):
+			if engine not in FEATURE_ENGINES:
+				msg = f"{engineName} must be one of {FEATURE_ENGINES}, got {engine}."
+				raise ValueError(msg)
+
+		self.firstOrderEngine = firstOrderEngine
+		self.textureEngine = textureEngine
+		super().__init__(*args, **kwargs)
+
+	def _usesNumpyEngine(self, featureClassName: str, settings: Dict[str, Any]) -> bool:
+		if featureClassName == "firstorder":
+			return self.firstOrderEngine == "numpy"
+		return self.textureEngine == "numpy" and isTextureEngineSupported(
+			featureClassName, settings
+		)
+
+	def computeFeatures(
+		self,
+		image: sitk.Image,
+		mask: sitk.Image,
+		imageTypeName: str,
+		**kwargs: Any,  # noqa: ANN401
+	) -> OrderedDict[str, Any]:
+		"""Compute the enabled features for one image type, in PyRadiomics output order."""
+		if kwargs.get("voxelBased", False):
+			return super().computeFeatures(image, mask, imageTypeName, **kwargs)
+
+		featureVector = OrderedDict()
+		featureClasses = getFeatureClasses()
+
+		for featureClassName, featureNames in self.enabledFeatures.items():
+			# Shape features are computed separately in execute
+			if featureClassName.startswith("shape") or featureClassName not in featureClasses:
+				continue
+
+			if not self._usesNumpyEngine(featureClassName, kwargs):
+				featureClass = featureClasses[featureClassName](image, mask, **kwargs)
+				for featureName in featureNames or []:
+					featureClass.enableFeatureByName(featureName)
+				featureValues = featureClass.execute()
+			elif featureClassName == "firstorder":
+				roiMask = sitk.GetArrayViewFromImage(mask) == kwargs.get("label", 1)
+				featureValues = firstOrderFeatures(
+					sitk.GetArrayViewFromImage(image)[roiMask][None, :],
+					voxelVolume=float(np.prod(image.GetSpacing())),
+					binWidth=kwargs.get("binWidth", 25),
+					binCount=kwargs.get("binCount"),
+					voxelArrayShift=kwargs.get("voxelArrayShift", 0),
+					featureNames=featureNames,
+				)
+				featureValues = {name: values[0] for name, values in featureValues.items()}
+			else:
+				featureValues = textureFeatures(
+					sitk.GetArrayViewFromImage(image)[None],
+					sitk.GetArrayViewFromImage(mask),
+					(featureClassName,),
+					spacing=image.GetSpacing(),
+					featureNames={featureClassName: featureNames},
+					**kwargs,
+				)[featureClassName]
+				featureValues = {name: values[0] for name, values in featureValues.items()}
+
+			for featureName, featureValue in featureValues.items():
+				featureVector[f"{imageTypeName}_{featureClassName}_{featureName}"] = featureValue
+
+		return featureVector
+
+
+def getFeatureExtractor(
+	pyradiomicsParamFilePath: str | Path,
+	firstOrderEngine: str = "pyradiomics",
+	textureEngine: str = "pyradiomics",
+) -> featureextractor.RadiomicsFeatureExtractor:
+	"""Create a PyRadiomics feature extractor that uses the chosen feature engines.
+
+	Parameters
+	----------
+	pyradiomicsParamFilePath : str | Path
+		Path to file containing configuration settings for pyradiomics feature extraction.
+	firstOrderEngine : {"pyradiomics", "numpy"}, default "pyradiomics"
+		Engine computing the firstorder feature class.
+	textureEngine : {"pyradiomics", "numpy"}, default "pyradiomics"
+		Engine computing the glcm, glrlm and glszm feature classes.
+
+	Returns
+	-------
+	featureextractor.RadiomicsFeatureExtractor
+		The configured feature extractor. A plain `RadiomicsFeatureExtractor` if both engines
+		are "pyradiomics".
+
+	Raises
+	------
+	ValueError
+		If an engine is not one of FEATURE_ENGINES.
+	"""
+	if firstOrderEngine == textureEngine == "pyradiomics":
+		return featureextractor.RadiomicsFeatureExtractor(str(pyradiomicsParamFilePath))
+
+	return NumpyFeatureExtractor(
+		str(pyradiomicsParamFilePath),
+		firstOrderEngine=firstOrderEngine,
+		textureEngine=textureEngine,
+	)
+
+
+def _workerExtractor(
+	featureExtractor: featureextractor.RadiomicsFeatureExtractor,
+	featureClassName: Optional[str] = None,
+) -> featureextractor.RadiomicsFeatureExtractor:
+	"""Copy of a feature extractor to send to a worker, with only one feature class enabled if given."""
+	workerExtractor = copy.copy(featureExtractor)
+	# A loadImage set on the instance (e.g. a cache) is only needed before the work is split, and may not be picklable
+	vars(workerExtractor).pop("loadImage", None)
+	if featureClassName is not None:
+		workerExtractor.enabledFeatures = {
+			featureClassName: featureExtractor.enabledFeatures[featureClassName]
+		}
+	return workerExtractor
+
+
+def _filteredImages(
+	image: sitk.Image,
+	mask: sitk.Image,
+	boundingBox: np.ndarray,
+	imageType: str,
+	settings: Dict[str, Any],
+	*,
+	radiomicsLogLevel: int,
+	nThreads: int,
+) -> List[CroppedFilteredImage]:
+	"""Compute the images of one image type and crop them to the ROI, like featureExtractor.execute."""
+	# Worker processes do not inherit the PyRadiomics log level or thread limits
+	logging.getLogger("radiomics").setLevel(radiomicsLogLevel)
+	with limitThreads(nThreads):
+		return [
+			(
+				*imageoperations.cropToTumorMask(inputImage, mask, boundingBox),
+				imageTypeName,
+				inputKwargs,
+			)
+			for inputImage, imageTypeName, inputKwargs in getattr(
+				imageoperations, f"get{imageType}Image"
+			)(image, mask, **settings)
+		]
+
+
+def _loadImageAndShapeFeatures(
+	featureExtractor: featureextractor.RadiomicsFeatureExtractor,
+	image: sitk.Image,
+	mask: sitk.Image,
+	settings: Dict[str, Any],
+) -> tuple[OrderedDict[str, Any], sitk.Image, sitk.Image, np.ndarray]:
+	"""Load the image and mask, and compute the diagnostics and shape features, like featureExtractor.execute.
+
+	Returns
+	-------
+	tuple[OrderedDict[str, Any], sitk.Image, sitk.Image, np.ndarray]
+		Diagnostics and shape features, the loaded image, the mask for the other feature classes, and its bounding box.
+	"""
+	label = settings.get("label", 1)
+
+	generalInfo = None
+	if settings.get("additionalInfo", False):
+		generalInfo = generalinfo.GeneralInfo()
+		generalInfo.addGeneralSettings(settings)
+		generalInfo.addEnabledImageTypes(featureExtractor.enabledImagetypes)
+
+	featureVector = OrderedDict()
+	image, mask = featureExtractor.loadImage(image, mask, generalInfo, **settings)
+	boundingBox, correctedMask = imageoperations.checkMask(image, mask, **settings)
+	if correctedMask is not None:
+		if generalInfo is not None:
+			generalInfo.addMaskElements(image, correctedMask, label, "corrected")
+		mask = correctedMask
+
+	resegmentedMask = None
+	if settings.get("resegmentRange") is not None:
+		resegmentedMask = imageoperations.resegmentMask(image, mask, **settings)
+		boundingBox, _ = imageoperations.checkMask(image, resegmentedMask, **settings)
+		if generalInfo is not None:
+			generalInfo.addMaskElements(image, resegmentedMask, label, "resegmented")
+
+	if generalInfo is not None:
+		featureVector.update(generalInfo.getGeneralInfo())
+
+	# Shape features use the resegmented mask only if resegmentShape is set, other feature classes always do
+	if settings.get("resegmentShape", False) and resegmentedMask is not None:
+		mask = resegmentedMask
+	featureVector.update(featureExtractor.computeShape(image, mask, boundingBox, **settings))
+	if resegmentedMask is not None:
+		mask = resegmentedMask
+
+	return featureVector, image, mask, boundingBox
+
+
+def _classFeatures(
+	workerExtractor: featureextractor.RadiomicsFeatureExtractor,
+	filteredImage: CroppedFilteredImage,
+	radiomicsLogLevel: int,
+	nThreads: int,
+) -> OrderedDict[str, Any]:
+	logging.getLogger("radiomics").setLevel(radiomicsLogLevel)
+	inputImage, inputMask, imageTypeName, inputKwargs = filteredImage
+	with limitThreads(nThreads):
+		return workerExtractor.computeFeatures(inputImage, inputMask, imageTypeName, **inputKwargs)
+
+
+def parallelExecute(
+	featureExtractor: featureextractor.RadiomicsFeatureExtractor,
+	image: sitk.Image,
+	mask: sitk.Image,
+	label: Optional[int] = None,
+	*,
+	nJobs: int = -1,
+	backend: str = "processes",
+) -> OrderedDict[str, Any]:
+	"""Run featureExtractor.execute(image, mask, label=label) with the work split over several workers.
+
+	Loading, checking and resegmenting the mask, and the shape features are computed first, like execute does.
+	Each enabled image type is then computed by its own worker, and each feature class of each filtered image by
+	its own worker. The results are merged in the order of execute, so the feature vector is the same.
+
+	Parameters
+	----------
+	featureExtractor : featureextractor.RadiomicsFeatureExtractor
+		Feature extractor configured with the pyradiomics parameters of the run. Not for voxel based extraction.
+	image : sitk.Image
+		Image to extract features from.
+	mask : sitk.Image
+		Mask of the ROI in the image.
+	label : int, optional
+		Voxel value of the ROI. The label setting of the extractor by default.
+	nJobs : int, default -1
+		Number of workers, as for joblib.Parallel. -1 uses all CPUs. At most the threads of the budget available
+		(see readii.threads), each of which gets an equal share of it for SimpleITK and BLAS.
+	backend : {"processes", "threads"}, default "processes"
+		Run the workers as processes or threads. The images are copied to each process. Thread workers share the
+		thread limits of this process.
+
+	Returns
+	-------
+	OrderedDict[str, Any]
+		The diagnostics and features, as from featureExtractor.execute.
+	"""
+	if backend not in PARALLEL_BACKENDS:
+		msg = f"backend must be one of {PARALLEL_BACKENDS}, got {backend}."
+		raise ValueError(msg)
+
+	settings = featureExtractor.settings.copy()
+	if label is not None:
+		settings["label"] = label
+
+	featureVector, image, mask, boundingBox = _loadImageAndShapeFeatures(
+		featureExtractor, image, mask, settings
+	)
+
+	featureClassNames = [
+		featureClassName
+		for featureClassName in featureExtractor.enabledFeatures
+		if not featureClassName.startswith("shape") and featureClassName in getFeatureClasses()
+	]
+	workerExtractors = [
+		_workerExtractor(featureExtractor, featureClassName)
+		for featureClassName in featureClassNames
+	]
+
+	radiomicsLogLevel = logging.getLogger("radiomics").level
+	nJobs = budgetedJobs(nJobs)
+	nThreads = workerThreads(nJobs)
+	# Thread workers share the limits set here, worker processes set their own
+	with limitThreads(nThreads), Parallel(n_jobs=nJobs, prefer=backend) as parallel:
+		imageTypeImages = parallel(
+			delayed(forwardLogs(_filteredImages))(
+				image,
+				mask,
+				boundingBox,
+				imageType,
+				{**settings, **customKwargs},
+				radiomicsLogLevel=radiomicsLogLevel,
+				nThreads=nThreads,
+			)
+			for imageType, customKwargs in featureExtractor.enabledImagetypes.items()
+		)
+		filteredImages = [
+			filteredImage for filteredImages in imageTypeImages for filteredImage in filteredImages
+		]
+		classFeatureVectors = parallel(
+			delayed(forwardLogs(_classFeatures))(
+				workerExtractor, filteredImage, radiomicsLogLevel, nThreads
+			)
+			for filteredImage in filteredImages
+			for workerExtractor in workerExtractors
+		)
+
+	for classFeatureVector in classFeatureVectors:
+		featureVector.update(classFeatureVector)
+
+	return featureVector
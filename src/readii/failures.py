@@ -0,0 +1,167 @@
+"""Failure manifests of feature extraction runs, to retry only the series that failed.
+
+With keep_running, a series that fails is skipped and the run goes on. featureExtraction records the
+stage each failure happened at, and radiomicFeatureExtraction writes the failures of a feature set to
+failures/failures_{feature set}_{dataset}.csv next to its features. A retry (retryFailed in
+radiomicFeatureExtraction, --retry_failed in the pipeline) extracts only the series in the manifest
+and merges them into the existing outputs with `mergeRetriedSeries`.
+"""
+
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import pandas as pd
+
+from readii.utils import logger
+
+FAILURE_COLUMNS = (
+	"patient_ID",
+	"series_CT",
+	"series_seg",
+	"negative_control",
+	"stage",
+	"exception_type",
+	"message",
+)
+# Stage of a series that failed without an error, e.g. because it has no ROIs to extract
+NO_FEATURES_STAGE = "no_features"
+
+
+def recordFailure(
+	failures: Optional[List[Dict[str, Any]]],
+	ctSeriesID: str,
+	stage: str,
+	exception: BaseException,
+	*,
+	segSeriesID: Optional[str] = None,
+	message: Optional[str] = None,
+) -> None:
+	"""Append an exception raised while extracting a series to a list of failures, if there is one.
+
+	The message is the message of the exception if None.
+	"""
+	if failures is None:
+		return
+	failures.append(
+		{
+			"series_CT": ctSeriesID,
+			"series_seg": segSeriesID,
+			"stage": stage,
+			"exception_type": type(exception).__name__,
+			"message": message if message is not None else str(exception),
+		}
+	)
+
+
+def failureManifest(
+	failures: List[Dict[str, Any]],
+	failedSeriesIDs: Sequence[str],
+	pdImageInfo: pd.DataFrame,
+	negativeControl: Optional[str] = None,
+) -> pd.DataFrame:
+	"""Build the failure manifest of a run.
+
+	Parameters
+	----------
+	failures : List[Dict[str, Any]]
+		Failures recorded with recordFailure.
+	failedSeriesIDs : Sequence[str]
+		CT series that gave no features. Those without a recorded failure get a row with the stage NO_FEATURES_STAGE.
+	pdImageInfo : pd.DataFrame
+		Match list of the run, to get the patient of each series from.
+	negativeControl : str, optional
+		Negative control of the run.
+
+	Returns
+	-------
+	pd.DataFrame
+		A row for each failure, with the columns in FAILURE_COLUMNS.
+	"""
+	recordedSeriesIDs = {failure["series_CT"] for failure in failures}
+	unrecorded = [
+		{
+			"series_CT": ctSeriesID,
+			"stage": NO_FEATURES_STAGE,
+			"message": "No features were extracted from the series.",
+		}
+		for ctSeriesID in failedSeriesIDs
+		if ctSeriesID not in recordedSeriesIDs
+	]
+	manifest = pd.DataFrame([*failures, *unrecorded], columns=list(FAILURE_COLUMNS))
+
+	patientIDs = pdImageInfo.drop_duplicates(subset="series_CT").set_index("series_CT")[
+		"patient_ID"
+	]
+	manifest["patient_ID"] = manifest["series_CT"].map(patientIDs)
+	manifest["negative_control"] = negativeControl
+	return manifest
+
+
+def failureManifestPath(outputDir: str | Path, featureSetName: str, datasetName: str) -> Path:
+	"""Get the path of the failure manifest of a feature set, e.g. "original" or a negative control name."""
+	return Path(outputDir) / "failures" / f"failures_{featureSetName}_{datasetName}"
+
+
+def readTable(tablePath: str | Path) -> pd.DataFrame:
+	"""Read a table saved by a run, or get an empty table if the file does not exist or has no columns."""
+	try:
+		return pd.read_csv(tablePath)
+	except (FileNotFoundError, pd.errors.EmptyDataError):
+		return pd.DataFrame()
+
+
+def retryImageInfo(pdImageInfo: pd.DataFrame, manifestPath: str | Path) -> pd.DataFrame:
+	"""Get the rows of a match list for the CT series in a failure manifest.
+
+	All rows are kept if there is no manifest, i.e. the feature set was never extracted.
+	"""
+	if not Path(manifestPath).exists():
+		logger.warning(
+			"No failure manifest to retry from. Extracting all series.", manifest=manifestPath
+		)
+		return pdImageInfo
+
+	failedSeriesIDs = readTable(manifestPath).get("series_CT", pd.Series(dtype=str))
+	logger.info(f"Retrying {failedSeriesIDs.nunique()} failed CT series.", manifest=manifestPath)
+	return pdImageInfo.loc[pdImageInfo["series_CT"].isin(failedSeriesIDs)]
+
+
+def mergeRetriedSeries(
+	existingTable: pd.DataFrame,
+	retriedTable: pd.DataFrame,
+	retriedSeriesIDs: Sequence[str],
+	seriesOrder: Sequence[str],
+) -> pd.DataFrame:
+	"""Merge the rows of retried series into a table of an earlier run, e.g. of features or ROI QC statistics.
+
+	Rows of the retried series in the existing table are replaced. The rows are sorted by the order of their
+	"series_UID" in seriesOrder, keeping the order of the rows of each series.
+
+	Parameters
+	----------
+	existingTable : pd.DataFrame
+		Table of the earlier run, possibly empty.
+	retriedTable : pd.DataFrame
+		Table of the retried series.
+	retriedSeriesIDs : Sequence[str]
+		CT series that were retried, including those that failed again.
+	seriesOrder : Sequence[str]
+		CT series in the order of the match list.
+
+	Returns
+	-------
+	pd.DataFrame
+		The merged table.
+	"""
+	if "series_UID" in existingTable:
+		existingTable = existingTable.loc[~existingTable["series_UID"].isin(retriedSeriesIDs)]
+	tables = [table for table in (existingTable, retriedTable) if not table.empty]
+	if not tables:
+		return retriedTable if not retriedTable.columns.empty else existingTable
+
+	seriesRanks = {ctSeriesID: rank for rank, ctSeriesID in enumerate(seriesOrder)}
+	return (
+		pd.concat(tables, ignore_index=True)
+		.sort_values("series_UID", key=lambda seriesIDs: seriesIDs.map(seriesRanks), kind="stable")
+		.reset_index(drop=True)
+	)
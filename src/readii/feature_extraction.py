@@ -1,14 +1,26 @@
 from collections import OrderedDict
+from contextlib import contextmanager
+from functools import partial
 from itertools import chain
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
 
+import numpy as np
 import pandas as pd
 import SimpleITK as sitk  # noqa
 from imgtools.io.readers import read_dicom_auto
 from joblib import Parallel, delayed
-from radiomics import featureextractor, imageoperations, logging
-
+from radiomics import featureextractor, generalinfo, imageoperations, logging
+
+from readii.extractor import getFeatureExtractor, parallelExecute
+from readii.failures import (
+	failureManifest,
+	failureManifestPath,
+	mergeRetriedSeries,
+	readTable,
+	recordFailure,
+	retryImageInfo,
+)
 from readii.image_processing import (
 	alignImages,
 	flattenImage,
@@ -17,13 +29,39 @@ from readii.image_processing import (
 from readii.loaders import (
 	loadSegmentation,
 )
+from readii.logqueue import forwardLogs
 from readii.metadata import (
 	saveDataframeCSV,
 )
 from readii.negative_controls import (
 	applyNegativeControl,
 )
-from readii.utils import logger
+from readii.negative_controls_refactor.buffer_pool import BufferPool
+from readii.negative_controls_refactor.perturbations import PerturbationManager
+from readii.options import DEFAULT_EXTRACTION_OPTIONS, ExtractionOptions
+from readii.pilot import downsampleImage, downsampleMask
+from readii.preflight import planFeatureExtraction, plannedImageInfo
+from readii.progress import ExtractionProgress, ctVoxelCount, trackedFeatureSet
+from readii.qc import ROIQCCriteria, roiQCStatistics
+from readii.scheduler import memoryAdmittedMap, seriesMemoryEstimates
+from readii.supervisor import SupervisedProcessPool, WorkerCrashError, describeExitCode
+from readii.threads import budgetedJobs, limitThreads, workerThreads
+from readii.utils import LazyLogValue, logger
+
+# Feature classes computed from the mask alone, so they are the same for every negative control
+MASK_FEATURE_CLASSES = ("shape", "shape2D")
+# Feature classes computed from the histogram of ROI intensities, which shuffling within the ROI does not change
+ROI_HISTOGRAM_FEATURE_CLASSES = ("firstorder",)
+# Extractor settings that make the images features are computed from depend on the ROI. With preCrop, the image and
+# mask are cropped to the ROI when they are loaded, so the filtered images would not match the geometry of the mask.
+ROI_DEPENDENT_SETTINGS = ("normalize", "resampledPixelSpacing", "resegmentRange", "preCrop")
+# Image types that are computed with the ROI mask
+ROI_DEPENDENT_IMAGE_TYPES = ("LBP3D",)
+
+# Filtered image, image type name and settings, as yielded by radiomics.imageoperations.get{imageType}Image
+FilteredImage = tuple[sitk.Image, str, Dict[str, Any]]
+# Ways to combine the features of the slices of an ROI in 2D extraction, see aggregateSliceFeatures
+SLICE_AGGREGATIONS = ("mean", "max", "slices")
 
 
 def generateNegativeControl(
@@ -31,28 +69,148 @@ def generateNegativeControl(
 	negativeControl: str,
 	alignedROIImage: sitk.Image,
 	randomSeed: Optional[int],
+	slabSize: Optional[int] = None,
+	*,
+	bufferPool: Optional[BufferPool] = None,
 ) -> sitk.Image:
 	"""Generate a negative control for a CT image based on the type of negative control specified.
 
 	negativeControlType : str
 		This string is of the format {negativeControlType}_{negativeControlRegion}
+	slabSize : int, optional
+		If set, generate the negative control in slabs of this many slices to bound memory use.
+	bufferPool : BufferPool, optional
+		Pool to reuse full-volume working arrays from across negative controls.
 	"""
-	if "non_roi" in negativeControl:
-		negativeControlType = negativeControl.rsplit("_", 2)[0]
-		negativeControlRegion = "non_roi"
-	else:
-		negativeControlComponents = negativeControl.rsplit("_", 1)
-		negativeControlType = negativeControlComponents[0]
-		negativeControlRegion = negativeControlComponents[1]
-	logger.debug(f"Negative control region: {negativeControlRegion}")
-	logger.debug(f"Negative control type: {negativeControlType}")
+	negativeControlType, negativeControlRegion = splitNegativeControlName(negativeControl)
+	logger.debug(
+		"Generating negative control.",
+		negativeControlType=negativeControlType,
+		negativeControlRegion=negativeControlRegion,
+	)
 	return applyNegativeControl(
 		baseImage=ctImage,
 		negativeControlType=negativeControlType,
 		negativeControlRegion=negativeControlRegion,
 		roiMask=alignedROIImage,
 		randomSeed=randomSeed,
+		slabSize=slabSize,
+		bufferPool=bufferPool,
+	)
+
+
+def splitNegativeControlName(negativeControl: str) -> tuple[str, str]:
+	"""Split a negative control name of the format {negativeControlType}_{negativeControlRegion} into its parts."""
+	if "non_roi" in negativeControl:
+		return negativeControl.rsplit("_", 2)[0], "non_roi"
+	negativeControlType, negativeControlRegion = negativeControl.rsplit("_", 1)
+	return negativeControlType, negativeControlRegion
+
+
+def invariantFeatureClasses(
+	negativeControl: str,
+	featureExtractor: featureextractor.RadiomicsFeatureExtractor,
+) -> List[str]:
+	"""Find the enabled feature classes whose values a negative control cannot change.
+
+	Negative controls only change CT intensities, so shape features are always the same as for the original image.
+	Intensity based features of the original image type are also unchanged when the ROI voxel values are:
+	shuffling within the ROI keeps every first order statistic, and non-ROI controls leave the ROI untouched.
+	This only holds when the extractor does not resample or normalize the image, which would mix in or rescale by
+	voxels outside the ROI, and when no filtered image types are enabled.
+
+	Parameters
+	----------
+	negativeControl : str
+		Name of the negative control, of the format {negativeControlType}_{negativeControlRegion}.
+	featureExtractor : featureextractor.RadiomicsFeatureExtractor
+		Feature extractor configured with the pyradiomics parameters of the run.
+
+	Returns
+	-------
+	List[str]
+		Names of the enabled feature classes that have the same values as for the original image.
+	"""
+	negativeControlType, negativeControlRegion = splitNegativeControlName(negativeControl)
+
+	invariantClasses = list(MASK_FEATURE_CLASSES)
+
+	settings = featureExtractor.settings
+	intensitiesUnaltered = (
+		set(featureExtractor.enabledImagetypes) == {"Original"}
+		and settings.get("resampledPixelSpacing") is None
+		and not settings.get("normalize", False)
 	)
+	if intensitiesUnaltered and negativeControlRegion == "non_roi":
+		invariantClasses.extend(featureExtractor.enabledFeatures)
+	elif intensitiesUnaltered and (negativeControlType, negativeControlRegion) == (
+		"shuffled",
+		"roi",
+	):
+		invariantClasses.extend(ROI_HISTOGRAM_FEATURE_CLASSES)
+
+	return [
+		featureClass
+		for featureClass in featureExtractor.enabledFeatures
+		if featureClass in invariantClasses
+	]
+
+
+def findOriginalFeatureVector(
+	originalFeatures: Optional[pd.DataFrame],
+	ctSeriesID: str,
+	segSeriesID: str,
+	roiImageName: str,
+) -> Optional[Dict[str, Any]]:
+	"""Get the row of an original image feature table for one ROI, or None if it is not in the table."""
+	if originalFeatures is None:
+		return None
+
+	originalRows = originalFeatures.loc[
+		(originalFeatures["series_UID"] == ctSeriesID)
+		& (originalFeatures["seg_series_UID"] == segSeriesID)
+		& (originalFeatures["roi"].astype(str) == str(roiImageName))
+	]
+	if len(originalRows) != 1:
+		return None
+	return originalRows.iloc[0].to_dict()
+
+
+def findOriginalFeatureVectors(
+	originalFeatures: Optional[Dict[str, pd.DataFrame]],
+	ctSeriesID: str,
+	segSeriesID: str,
+	roiImageName: str,
+) -> Dict[str, Optional[Dict[str, Any]]]:
+	"""Get the row for one ROI from the original image feature table of each PyRadiomics configuration."""
+	return {
+		configName: findOriginalFeatureVector(configFeatures, ctSeriesID, segSeriesID, roiImageName)
+		for configName, configFeatures in (originalFeatures or {}).items()
+	}
+
+
+def mergeInvariantFeatures(
+	featureVector: OrderedDict[Any, Any],
+	originalFeatureVector: Dict[str, Any],
+	invariantClasses: List[str],
+) -> OrderedDict[Any, Any]:
+	"""Fill in the features of invariant classes from the original image, in the column order of the original.
+
+	Feature names are of the format {imageType}_{featureClass}_{featureName}, e.g. original_shape_VoxelVolume.
+	"""
+	mergedFeatureVector = OrderedDict()
+	for featureName, value in originalFeatureVector.items():
+		nameParts = featureName.split("_", 2)
+		if len(nameParts) > 1 and nameParts[1] in invariantClasses:
+			mergedFeatureVector[featureName] = value
+		elif featureName in featureVector:
+			mergedFeatureVector[featureName] = featureVector[featureName]
+
+	# Keep any features that the original extraction did not have
+	for featureName, value in featureVector.items():
+		mergedFeatureVector.setdefault(featureName, value)
+
+	return mergedFeatureVector
 
 
 def cropImageAndMask(
@@ -61,11 +219,16 @@ def cropImageAndMask(
 	segBoundingBox: tuple,
 	negativeControl: Optional[str],
 	randomSeed: Optional[int],
+	*,
+	slabSize: Optional[int] = None,
+	bufferPool: Optional[BufferPool] = None,
 ) -> tuple[sitk.Image, sitk.Image]:
 	"""Crop the CT and ROI images to the bounding box of the segmentation."""
 	if negativeControl:
 		logger.info(f"Generating {negativeControl} negative control for CT.")
-		ctImage = generateNegativeControl(ctImage, negativeControl, alignedROIImage, randomSeed)
+		ctImage = generateNegativeControl(
+			ctImage, negativeControl, alignedROIImage, randomSeed, slabSize, bufferPool=bufferPool
+		)
 
 	croppedCT, croppedROI = imageoperations.cropToTumorMask(
 		ctImage, alignedROIImage, segBoundingBox
@@ -74,43 +237,27 @@ def cropImageAndMask(
 	return croppedCT, croppedROI
 
 
-def singleRadiomicFeatureExtraction(
+def alignAndCheckMask(
 	ctImage: sitk.Image,
 	roiImage: sitk.Image,
-	pyradiomicsParamFilePath: Optional[str | Path] = "./src/readii/data/default_pyradiomics.yaml",
 	segmentationLabel: Optional[int] = None,
-	negativeControl: Optional[str] = None,
-	randomSeed: Optional[int] = None,
-) -> OrderedDict[Any, Any]:
-	"""Perform radiomic feature extraction for a single CT image and its corresponding segmentation.
-
-	CT and segmentation will be aligned and cropped prior to extraction.
+) -> tuple[sitk.Image, int, tuple]:
+	"""Align a segmentation to its CT and check that they can be used for feature extraction.
 
 	Parameters
 	----------
 	ctImage : sitk.Image
-		CT image to perform feature extraction on. Will be cropped and potentially generate a negative control (see negativeControl arg)
+		CT image the segmentation belongs to.
 	roiImage : sitk.Image
-		Region of interest (ROI) to extract radiomic features from within the CT.
-	pyradiomicsParamFilePath : str
-		Path to file containing configuration settings for pyradiomics feature extraction. Will use the provided config file in 'data/' by default if no file passed in.
-	negativeControl : str
-		Name of negative control to generate from the CT to perform feature extraction on. If set to None, will extract features from original CT image.
-	randomSeed : int
-		Value to set random seed with for negative control creation to be reproducible.
+		Region of interest (ROI) segmentation. An extra axis of size 1 is removed.
+	segmentationLabel : int, optional
+		Voxel value of the ROI. Found from the segmentation if not given.
 
 	Returns
 	-------
-	OrderedDict[Any, Any]
-		Dictionary containing image metadata, versions for key packages used for extraction, and radiomic features
+	tuple[sitk.Image, int, tuple]
+		The aligned (and possibly corrected) ROI image, the segmentation label, and the bounding box of the ROI.
 	"""
-	# If no pyradiomics paramater file passed, use default
-	if pyradiomicsParamFilePath is None:
-		pyradiomicsParamFilePath = "./src/readii/data/default_pyradiomics.yaml"
-	elif not Path(pyradiomicsParamFilePath).exists():
-		msg = f"PyRadiomics parameter file not found at {pyradiomicsParamFilePath}"
-		raise FileNotFoundError(msg)
-
 	# In case segmentation contains extra axis, flatten to 3D by removing it
 	roiImage = flattenImage(roiImage)
 
@@ -124,7 +271,6 @@ def singleRadiomicFeatureExtraction(
 		except ValueError as e:
 			logger.exception(f"Error getting segmentation label: {e}")
 			raise e
-	
 
 	# Check that CT and segmentation correspond, segmentationLabel is present, and dimensions match
 	try:
@@ -139,45 +285,1098 @@ def singleRadiomicFeatureExtraction(
 	if correctedROIImage is not None:
 		alignedROIImage = correctedROIImage
 
+	return alignedROIImage, segmentationLabel, segBoundingBox
+
+
+def singleRadiomicFeatureExtraction(
+	ctImage: sitk.Image,
+	roiImage: sitk.Image,
+	pyradiomicsParamFilePath: Optional[str | Path] = "./src/readii/data/default_pyradiomics.yaml",
+	segmentationLabel: Optional[int] = None,
+	negativeControl: Optional[str] = None,
+	randomSeed: Optional[int] = None,
+	*,
+	slabSize: Optional[int] = None,
+	bufferPool: Optional[BufferPool] = None,
+	originalFeatureVector: Optional[Dict[str, Any]] = None,
+	firstOrderEngine: str = "pyradiomics",
+	textureEngine: str = "pyradiomics",
+	roiJobs: Optional[int] = None,
+	roiParallelBackend: str = "processes",
+) -> OrderedDict[Any, Any]:
+	"""Perform radiomic feature extraction for a single CT image and its corresponding segmentation.
+
+	CT and segmentation will be aligned and cropped prior to extraction.
+
+	Parameters
+	----------
+	ctImage : sitk.Image
+		CT image to perform feature extraction on. Will be cropped and potentially generate a negative control (see negativeControl arg)
+	roiImage : sitk.Image
+		Region of interest (ROI) to extract radiomic features from within the CT.
+	pyradiomicsParamFilePath : str
+		Path to file containing configuration settings for pyradiomics feature extraction. Will use the provided config file in 'data/' by default if no file passed in.
+	negativeControl : str
+		Name of negative control to generate from the CT to perform feature extraction on. If set to None, will extract features from original CT image.
+	randomSeed : int
+		Value to set random seed with for negative control creation to be reproducible.
+	slabSize : int
+		If set, generate the negative control in slabs of this many slices to bound memory use for very large volumes.
+	bufferPool : BufferPool
+		Pool to reuse full-volume working arrays from when generating the negative control. The arrays are returned
+		to the pool once the negative control image is created.
+	originalFeatureVector : Dict[str, Any]
+		Features extracted from the original CT for this ROI. If given with a negative control, the feature classes the
+		negative control cannot change (see invariantFeatureClasses) are copied from it instead of being recomputed.
+	firstOrderEngine : {"pyradiomics", "numpy"}
+		Engine to compute first order features with. "numpy" uses the vectorized engine in readii.firstorder, which
+		matches PyRadiomics to floating point tolerance.
+	textureEngine : {"pyradiomics", "numpy"}
+		Engine to compute glcm, glrlm and glszm features with. "numpy" uses the batched engine in readii.texture,
+		which gives the same results as PyRadiomics. Settings it does not support fall back to PyRadiomics. Each image
+		is a batch of one, so it is not faster than PyRadiomics, see readii.extractor.NumpyFeatureExtractor.
+	roiJobs : int
+		If set, split the extraction over this many workers, one for each image type and for each feature class of
+		each filtered image (see readii.extractor.parallelExecute). -1 uses all CPUs. The features are the same.
+	roiParallelBackend : {"processes", "threads"}
+		Run the roiJobs workers as processes or threads. Threads only run the image filters in parallel.
+
+	Returns
+	-------
+	OrderedDict[Any, Any]
+		Dictionary containing image metadata, versions for key packages used for extraction, and radiomic features
+	"""
+	# If no pyradiomics paramater file passed, use default
+	if pyradiomicsParamFilePath is None:
+		pyradiomicsParamFilePath = "./src/readii/data/default_pyradiomics.yaml"
+	elif not Path(pyradiomicsParamFilePath).exists():
+		msg = f"PyRadiomics parameter file not found at {pyradiomicsParamFilePath}"
+		raise FileNotFoundError(msg)
+
+	alignedROIImage, segmentationLabel, segBoundingBox = alignAndCheckMask(
+		ctImage, roiImage, segmentationLabel
+	)
+
 	try:
 		croppedCT, croppedROI = cropImageAndMask(
-			ctImage, alignedROIImage, segBoundingBox, negativeControl, randomSeed
+			ctImage,
+			alignedROIImage,
+			segBoundingBox,
+			negativeControl,
+			randomSeed,
+			slabSize=slabSize,
+			bufferPool=bufferPool,
 		)
 	except Exception as e:
 		logger.exception(f"Error cropping CT and ROI for feature extraction: {e}")
 		raise e
 
+	return extractCroppedFeatures(
+		croppedCT,
+		croppedROI,
+		segmentationLabel,
+		pyradiomicsParamFilePath,
+		negativeControl,
+		originalFeatureVector=originalFeatureVector,
+		firstOrderEngine=firstOrderEngine,
+		textureEngine=textureEngine,
+		roiJobs=roiJobs,
+		roiParallelBackend=roiParallelBackend,
+	)
+
+
+def extractCroppedFeatures(
+	croppedCT: sitk.Image,
+	croppedROI: sitk.Image,
+	segmentationLabel: int,
+	pyradiomicsParamFilePath: str | Path,
+	negativeControl: Optional[str] = None,
+	*,
+	originalFeatureVector: Optional[Dict[str, Any]] = None,
+	filteredImages: Optional[List[FilteredImage]] = None,
+	firstOrderEngine: str = "pyradiomics",
+	textureEngine: str = "pyradiomics",
+	roiJobs: Optional[int] = None,
+	roiParallelBackend: str = "processes",
+) -> OrderedDict[Any, Any]:
+	"""Run PyRadiomics feature extraction with one parameter file on a CT and ROI that are already cropped.
+
+	Parameters
+	----------
+	croppedCT : sitk.Image
+		CT image, or negative control of it, cropped to the ROI by cropImageAndMask.
+	croppedROI : sitk.Image
+		ROI image cropped to the same region.
+	segmentationLabel : int
+		Voxel value of the ROI.
+	pyradiomicsParamFilePath : str | Path
+		Path to file containing configuration settings for pyradiomics feature extraction.
+	negativeControl : str
+		Name of the negative control the CT was generated with, if any.
+	originalFeatureVector : Dict[str, Any]
+		Features extracted from the original CT for this ROI with the same parameter file, see singleRadiomicFeatureExtraction.
+	filteredImages : List[FilteredImage]
+		Image types of croppedCT computed beforehand by computeFilteredImages, e.g. shared between the ROIs of a CT.
+		If not given, PyRadiomics computes them.
+	firstOrderEngine : {"pyradiomics", "numpy"}
+		Engine to compute first order features with.
+	textureEngine : {"pyradiomics", "numpy"}
+		Engine to compute glcm, glrlm and glszm features with.
+	roiJobs : int
+		If set, split the extraction over this many workers, see singleRadiomicFeatureExtraction. Not used with filteredImages.
+	roiParallelBackend : {"processes", "threads"}
+		Run the roiJobs workers as processes or threads.
+
+	Returns
+	-------
+	OrderedDict[Any, Any]
+		Dictionary containing image metadata, versions for key packages used for extraction, and radiomic features
+	"""
 	# Load PyRadiomics feature extraction parameters to use
 	# Initialize feature extractor with parameters
 	try:
 		logger.info("Setting up Pyradiomics feature extractor...")
-		featureExtractor = featureextractor.RadiomicsFeatureExtractor(pyradiomicsParamFilePath)
+		featureExtractor = getFeatureExtractor(
+			pyradiomicsParamFilePath, firstOrderEngine, textureEngine
+		)
 	except OSError as e:
 		logger.exception(
 			f"Supplied pyradiomics parameter file {pyradiomicsParamFilePath} does not exist or is not at that location: {e}"
 		)
 		raise e
 
+	invariantClasses = []
+	if negativeControl and originalFeatureVector is not None:
+		# Skip the feature classes the negative control cannot change, they are copied from the original below
+		invariantClasses = invariantFeatureClasses(negativeControl, featureExtractor)
+		logger.debug("Reusing original image features.", featureClasses=invariantClasses)
+		for featureClass in invariantClasses:
+			del featureExtractor.enabledFeatures[featureClass]
+
 	try:
 		logger.info("Starting radiomic feature extraction...")
 		# Extract radiomic features from CT with segmentation as mask
-		idFeatureVector = featureExtractor.execute(croppedCT, croppedROI, label=segmentationLabel)
+		if filteredImages is None and roiJobs is not None:
+			idFeatureVector = parallelExecute(
+				featureExtractor,
+				croppedCT,
+				croppedROI,
+				segmentationLabel,
+				nJobs=roiJobs,
+				backend=roiParallelBackend,
+			)
+		elif filteredImages is None:
+			idFeatureVector = featureExtractor.execute(
+				croppedCT, croppedROI, label=segmentationLabel
+			)
+		else:
+			idFeatureVector = extractWithFilteredImages(
+				featureExtractor, croppedCT, croppedROI, segmentationLabel, filteredImages
+			)
 	except Exception as e:
 		logger.exception(f"An error occurred while extracting radiomic features: {e}")
 		raise e
 
+	if invariantClasses:
+		idFeatureVector = mergeInvariantFeatures(
+			idFeatureVector, originalFeatureVector, invariantClasses
+		)
+
 	return idFeatureVector
 
 
+def pyradiomicsConfigName(pyradiomicsParamFilePath: str | Path) -> str:
+	"""Name of a PyRadiomics parameter file used in output file names, e.g. "binWidth25" for "configs/binWidth25.yaml"."""
+	return Path(pyradiomicsParamFilePath).stem
+
+
+def multiConfigRadiomicFeatureExtraction(
+	ctImage: sitk.Image,
+	roiImage: sitk.Image,
+	pyradiomicsParamFilePaths: Sequence[str | Path],
+	*,
+	segmentationLabel: Optional[int] = None,
+	negativeControl: Optional[str] = None,
+	randomSeed: Optional[int] = None,
+	slabSize: Optional[int] = None,
+	bufferPool: Optional[BufferPool] = None,
+	originalFeatureVectors: Optional[Dict[str, Optional[Dict[str, Any]]]] = None,
+	firstOrderEngine: str = "pyradiomics",
+	textureEngine: str = "pyradiomics",
+	roiJobs: Optional[int] = None,
+	roiParallelBackend: str = "processes",
+) -> Dict[str, OrderedDict[Any, Any]]:
+	"""Perform radiomic feature extraction with several PyRadiomics parameter files for a single CT and segmentation.
+
+	The CT and segmentation are aligned, cropped and turned into a negative control once, and every parameter
+	file is used on the same cropped images. Each result is the same as singleRadiomicFeatureExtraction with
+	that parameter file.
+
+	Parameters
+	----------
+	ctImage : sitk.Image
+		CT image to perform feature extraction on.
+	roiImage : sitk.Image
+		Region of interest (ROI) to extract radiomic features from within the CT.
+	pyradiomicsParamFilePaths : Sequence[str | Path]
+		Paths to the PyRadiomics parameter files. Their file names (see pyradiomicsConfigName) must be unique.
+	segmentationLabel : int
+		Voxel value of the ROI. Found from the segmentation if not given.
+	negativeControl : str
+		Name of negative control to generate from the CT to perform feature extraction on.
+	randomSeed : int
+		Value to set random seed with for negative control creation to be reproducible.
+	slabSize : int
+		If set, generate the negative control in slabs of this many slices to bound memory use for very large volumes.
+	bufferPool : BufferPool
+		Pool to reuse full-volume working arrays from when generating the negative control.
+	originalFeatureVectors : Dict[str, Dict[str, Any]]
+		Features extracted from the original CT for this ROI, by configuration name. See singleRadiomicFeatureExtraction.
+	firstOrderEngine : {"pyradiomics", "numpy"}
+		Engine to compute first order features with.
+	textureEngine : {"pyradiomics", "numpy"}
+		Engine to compute glcm, glrlm and glszm features with.
+	roiJobs : int
+		If set, split the extraction for each parameter file over this many workers, see singleRadiomicFeatureExtraction.
+	roiParallelBackend : {"processes", "threads"}
+		Run the roiJobs workers as processes or threads.
+
+	Returns
+	-------
+	Dict[str, OrderedDict[Any, Any]]
+		Feature vector for each configuration name, in the order of pyradiomicsParamFilePaths.
+	"""
+	configPaths = checkPyradiomicsParamFiles(pyradiomicsParamFilePaths)
+
+	alignedROIImage, segmentationLabel, segBoundingBox = alignAndCheckMask(
+		ctImage, roiImage, segmentationLabel
+	)
+	croppedCT, croppedROI = cropImageAndMask(
+		ctImage,
+		alignedROIImage,
+		segBoundingBox,
+		negativeControl,
+		randomSeed,
+		slabSize=slabSize,
+		bufferPool=bufferPool,
+	)
+
+	return OrderedDict(
+		(
+			configName,
+			extractCroppedFeatures(
+				croppedCT,
+				croppedROI,
+				segmentationLabel,
+				configPath,
+				negativeControl,
+				originalFeatureVector=(originalFeatureVectors or {}).get(configName),
+				firstOrderEngine=firstOrderEngine,
+				textureEngine=textureEngine,
+				roiJobs=roiJobs,
+				roiParallelBackend=roiParallelBackend,
+			),
+		)
+		for configName, configPath in configPaths.items()
+	)
+
+
+def checkPyradiomicsParamFiles(pyradiomicsParamFilePaths: Sequence[str | Path]) -> Dict[str, Path]:
+	"""Check that PyRadiomics parameter files exist and have unique names.
+
+	Returns
+	-------
+	Dict[str, Path]
+		Path of each parameter file by its configuration name (see pyradiomicsConfigName).
+	"""
+	configPaths = OrderedDict()
+	for pyradiomicsParamFilePath in pyradiomicsParamFilePaths:
+		if not Path(pyradiomicsParamFilePath).exists():
+			msg = f"PyRadiomics parameter file not found at {pyradiomicsParamFilePath}"
+			raise FileNotFoundError(msg)
+
+		configName = pyradiomicsConfigName(pyradiomicsParamFilePath)
+		if configName in configPaths:
+			msg = f"PyRadiomics parameter files {configPaths[configName]} and {pyradiomicsParamFilePath} have the same name {configName}."
+			raise ValueError(msg)
+		configPaths[configName] = Path(pyradiomicsParamFilePath)
+
+	return configPaths
+
+
+def canShareFilteredImages(
+	featureExtractor: featureextractor.RadiomicsFeatureExtractor,
+	negativeControl: Optional[str] = None,
+) -> bool:
+	"""Check whether the filtered images of a CT can be computed once and used for all of its ROIs.
+
+	This needs images that do not depend on the ROI: no resampling, normalization, resegmentation or pre-cropping by
+	the extractor, no image types computed with the mask (LBP3D), and no negative control restricted to or around the ROI.
+	"""
+	if negativeControl and splitNegativeControlName(negativeControl)[1] != "full":
+		return False
+	return not any(
+		featureExtractor.settings.get(setting) for setting in ROI_DEPENDENT_SETTINGS
+	) and not any(
+		imageType in featureExtractor.enabledImagetypes for imageType in ROI_DEPENDENT_IMAGE_TYPES
+	)
+
+
+def unionBoundingBox(boundingBoxes: Sequence[np.ndarray]) -> np.ndarray:
+	"""Smallest PyRadiomics bounding box ([xMin, xMax, yMin, yMax, zMin, zMax]) containing all of the given ones."""
+	boundingBoxes = np.asarray(boundingBoxes)
+	union = boundingBoxes.max(axis=0)
+	union[0::2] = boundingBoxes[:, 0::2].min(axis=0)
+	return union
+
+
+def computeFilteredImages(
+	featureExtractor: featureextractor.RadiomicsFeatureExtractor,
+	image: sitk.Image,
+	mask: sitk.Image,
+	maxBytes: float,
+) -> Optional[List[FilteredImage]]:
+	"""Compute every enabled image type of an image, like featureExtractor.execute does.
+
+	Parameters
+	----------
+	featureExtractor : featureextractor.RadiomicsFeatureExtractor
+		Feature extractor configured with the pyradiomics parameters of the run.
+	image : sitk.Image
+		Image to filter, e.g. a CT cropped to the union of its ROIs.
+	mask : sitk.Image
+		Mask with the same geometry as the image. Not used by image types that canShareFilteredImages allows.
+	maxBytes : float
+		Maximum memory for the filtered images.
+
+	Returns
+	-------
+	Optional[List[FilteredImage]]
+		The filtered image, image type name and settings for each image type, or None if they need more than maxBytes.
+	"""
+	filteredImages, totalBytes = [], 0
+	for imageType, customKwargs in featureExtractor.enabledImagetypes.items():
+		imageTypeSettings = {**featureExtractor.settings, **customKwargs}
+		imageGenerator = getattr(imageoperations, f"get{imageType}Image")(
+			image, mask, **imageTypeSettings
+		)
+		for filteredImage, imageTypeName, inputKwargs in imageGenerator:
+			totalBytes += (
+				filteredImage.GetNumberOfPixels()
+				* filteredImage.GetNumberOfComponentsPerPixel()
+				* filteredImage.GetSizeOfPixelComponent()
+			)
+			if totalBytes > maxBytes:
+				return None
+			filteredImages.append((filteredImage, imageTypeName, inputKwargs))
+
+	return filteredImages
+
+
+def extractWithFilteredImages(
+	featureExtractor: featureextractor.RadiomicsFeatureExtractor,
+	croppedCT: sitk.Image,
+	croppedROI: sitk.Image,
+	segmentationLabel: int,
+	filteredImages: List[FilteredImage],
+) -> OrderedDict[Any, Any]:
+	"""Run featureExtractor.execute(croppedCT, croppedROI, label=segmentationLabel) with filtered images computed beforehand.
+
+	Follows the steps of execute for extractors that canShareFilteredImages allows, taking the image types from
+	filteredImages (see computeFilteredImages) instead of filtering croppedCT.
+	"""
+	settings = {**featureExtractor.settings, "label": segmentationLabel}
+	featureVector = OrderedDict()
+
+	generalInfo = None
+	if settings.get("additionalInfo", False):
+		generalInfo = generalinfo.GeneralInfo()
+		generalInfo.addGeneralSettings(settings)
+		generalInfo.addEnabledImageTypes(featureExtractor.enabledImagetypes)
+
+	image, mask = featureExtractor.loadImage(croppedCT, croppedROI, generalInfo, **settings)
+	boundingBox, correctedMask = imageoperations.checkMask(image, mask, **settings)
+	if correctedMask is not None:
+		if generalInfo is not None:
+			generalInfo.addMaskElements(image, correctedMask, segmentationLabel, "corrected")
+		mask = correctedMask
+
+	if generalInfo is not None:
+		featureVector.update(generalInfo.getGeneralInfo())
+	featureVector.update(featureExtractor.computeShape(image, mask, boundingBox, **settings))
+
+	for filteredImage, imageTypeName, inputKwargs in filteredImages:
+		inputImage, inputMask = imageoperations.cropToTumorMask(filteredImage, mask, boundingBox)
+		featureVector.update(
+			featureExtractor.computeFeatures(
+				inputImage, inputMask, imageTypeName, **{**inputKwargs, "label": segmentationLabel}
+			)
+		)
+
+	return featureVector
+
+
+def unionCropFeatureExtraction(
+	ctImage: sitk.Image,
+	roiImages: Dict[str, sitk.Image],
+	pyradiomicsParamFilePath: str | Path,
+	*,
+	maxBytes: float,
+	negativeControl: Optional[str] = None,
+	randomSeed: Optional[int] = None,
+	originalFeatureVectors: Optional[Dict[str, Optional[Dict[str, Any]]]] = None,
+	options: ExtractionOptions = DEFAULT_EXTRACTION_OPTIONS,
+) -> Dict[str, OrderedDict[Any, Any]]:
+	"""Perform radiomic feature extraction for several ROIs of a CT, filtering the CT once for all of them.
+
+	The CT is cropped to the union of the ROI bounding boxes, the negative control and filtered images (e.g. LoG,
+	wavelet) are computed once on this crop, and every ROI's features are computed from them. Original image and
+	shape features are the same as with singleRadiomicFeatureExtraction. Filtered image features can differ near
+	the ROI border, where the filters see the neighbouring CT voxels instead of the edge of the ROI crop.
+
+	Falls back to singleRadiomicFeatureExtraction for each ROI when the filtered images need more than maxBytes or
+	depend on the ROI (see canShareFilteredImages).
+
+	Parameters
+	----------
+	ctImage : sitk.Image
+		CT image to perform feature extraction on.
+	roiImages : Dict[str, sitk.Image]
+		ROI images of the CT by name.
+	pyradiomicsParamFilePath : str | Path
+		Path to file containing configuration settings for pyradiomics feature extraction.
+	maxBytes : float
+		Maximum memory for the filtered images of the union crop.
+	negativeControl : str
+		Name of negative control to generate from the CT to perform feature extraction on.
+	randomSeed : int
+		Value to set random seed with for negative control creation to be reproducible.
+	originalFeatureVectors : Dict[str, Dict[str, Any]]
+		Features extracted from the original CT, by ROI name. See singleRadiomicFeatureExtraction.
+	options : ExtractionOptions
+		Options of the run. The slabSize, bufferPool, engines, roiJobs and roiParallelBackend are used, roiJobs only
+		when extracting features for each ROI separately.
+
+	Returns
+	-------
+	Dict[str, OrderedDict[Any, Any]]
+		Feature vector for each ROI name.
+	"""
+	originalFeatureVectors = originalFeatureVectors or {}
+	featureExtractor = getFeatureExtractor(
+		pyradiomicsParamFilePath, options.firstOrderEngine, options.textureEngine
+	)
+
+	alignedROIs = {
+		roiImageName: alignAndCheckMask(ctImage, roiImage)
+		for roiImageName, roiImage in roiImages.items()
+	}
+	unionBox = unionBoundingBox([segBoundingBox for _, _, segBoundingBox in alignedROIs.values()])
+	# The original image type alone is a float64 copy of the union crop
+	unionBytes = np.prod(unionBox[1::2] - unionBox[0::2] + 1) * np.dtype(np.float64).itemsize
+
+	filteredImages = None
+	if unionBytes <= maxBytes and canShareFilteredImages(featureExtractor, negativeControl):
+		unionROIImage = next(iter(alignedROIs.values()))[0]
+		croppedCT, croppedUnionROI = cropImageAndMask(
+			ctImage,
+			unionROIImage,
+			unionBox,
+			negativeControl,
+			randomSeed,
+			slabSize=options.slabSize,
+			bufferPool=options.bufferPool,
+		)
+		filteredImages = computeFilteredImages(
+			featureExtractor, croppedCT, croppedUnionROI, maxBytes
+		)
+
+	if filteredImages is None:
+		logger.info(
+			"Filtered images of the ROI union crop cannot be shared, extracting features for each ROI separately."
+		)
+		return {
+			roiImageName: singleRadiomicFeatureExtraction(
+				ctImage,
+				roiImage,
+				pyradiomicsParamFilePath,
+				negativeControl=negativeControl,
+				randomSeed=randomSeed,
+				slabSize=options.slabSize,
+				bufferPool=options.bufferPool,
+				originalFeatureVector=originalFeatureVectors.get(roiImageName),
+				firstOrderEngine=options.firstOrderEngine,
+				textureEngine=options.textureEngine,
+				roiJobs=options.roiJobs,
+				roiParallelBackend=options.roiParallelBackend,
+			)
+			for roiImageName, roiImage in roiImages.items()
+		}
+
+	roiFeatureVectors = OrderedDict()
+	for roiImageName, (alignedROIImage, segmentationLabel, _) in alignedROIs.items():
+		logger.info(f"Calculating radiomic features for segmentation: {roiImageName}")
+		_, croppedROI = imageoperations.cropToTumorMask(alignedROIImage, alignedROIImage, unionBox)
+		roiFeatureVectors[roiImageName] = extractCroppedFeatures(
+			croppedCT,
+			croppedROI,
+			segmentationLabel,
+			pyradiomicsParamFilePath,
+			negativeControl,
+			originalFeatureVector=originalFeatureVectors.get(roiImageName),
+			filteredImages=filteredImages,
+			firstOrderEngine=options.firstOrderEngine,
+			textureEngine=options.textureEngine,
+			roiJobs=options.roiJobs,
+			roiParallelBackend=options.roiParallelBackend,
+		)
+
+	return roiFeatureVectors
+
+
+def perturbationFeatureExtraction(
+	ctImage: sitk.Image,
+	roiImage: sitk.Image,
+	perturbationManager: PerturbationManager,
+	pyradiomicsParamFilePath: Optional[str | Path] = "./src/readii/data/default_pyradiomics.yaml",
+	*,
+	segmentationLabel: Optional[int] = None,
+	negativeControl: Optional[str] = None,
+	randomSeed: Optional[int] = None,
+	firstOrderEngine: str = "pyradiomics",
+	textureEngine: str = "pyradiomics",
+) -> List[OrderedDict[Any, Any]]:
+	"""Perform radiomic feature extraction on every perturbation of a CT image and its segmentation.
+
+	The perturbations are generated in batches on a padded crop around the ROI (see
+	readii.negative_controls_refactor.perturbations), so the CT is only cropped once for all of them.
+
+	Parameters
+	----------
+	ctImage : sitk.Image
+		CT image to perturb and perform feature extraction on.
+	roiImage : sitk.Image
+		Region of interest (ROI) to extract radiomic features from within the CT.
+	perturbationManager : PerturbationManager
+		Perturbation strategies to apply to the CT and ROI.
+	pyradiomicsParamFilePath : str
+		Path to file containing configuration settings for pyradiomics feature extraction.
+	segmentationLabel : int
+		Voxel value of the ROI. Found from the segmentation if not given.
+	negativeControl : str
+		Name of negative control to generate from the CT before perturbing it. If None, the original CT is perturbed.
+	randomSeed : int
+		Value to set random seed with for negative control creation to be reproducible.
+	firstOrderEngine : {"pyradiomics", "numpy"}
+		Engine to compute first order features with, see singleRadiomicFeatureExtraction.
+	textureEngine : {"pyradiomics", "numpy"}
+		Engine to compute glcm, glrlm and glszm features with, see singleRadiomicFeatureExtraction.
+
+	Returns
+	-------
+	List[OrderedDict[Any, Any]]
+		One dictionary of radiomic features per perturbation, with the perturbation name and index under "perturbation".
+	"""
+	if pyradiomicsParamFilePath is None:
+		pyradiomicsParamFilePath = "./src/readii/data/default_pyradiomics.yaml"
+	elif not Path(pyradiomicsParamFilePath).exists():
+		msg = f"PyRadiomics parameter file not found at {pyradiomicsParamFilePath}"
+		raise FileNotFoundError(msg)
+
+	alignedROIImage, segmentationLabel, _ = alignAndCheckMask(ctImage, roiImage, segmentationLabel)
+
+	if negativeControl:
+		logger.info(f"Generating {negativeControl} negative control for CT.")
+		ctImage = generateNegativeControl(ctImage, negativeControl, alignedROIImage, randomSeed)
+
+	featureExtractor = getFeatureExtractor(
+		pyradiomicsParamFilePath, firstOrderEngine, textureEngine
+	)
+
+	perturbedFeatureVectors = []
+	for perturbedCT, perturbedROI, perturbationName, perturbationIndex in perturbationManager.apply(
+		ctImage, alignedROIImage
+	):
+		try:
+			idFeatureVector = featureExtractor.execute(
+				perturbedCT, perturbedROI, label=segmentationLabel
+			)
+		except Exception as e:
+			logger.exception(
+				f"An error occurred while extracting radiomic features from perturbation {perturbationName}_{perturbationIndex}: {e}"
+			)
+			raise e
+
+		perturbedFeatureVectors.append(
+			OrderedDict(perturbation=f"{perturbationName}_{perturbationIndex}", **idFeatureVector)
+		)
+
+	return perturbedFeatureVectors
+
+
+def _sliceFeatures(
+	featureExtractor: featureextractor.RadiomicsFeatureExtractor,
+	sliceCT: sitk.Image,
+	sliceROI: sitk.Image,
+	segmentationLabel: int,
+	*,
+	radiomicsLogLevel: int,
+	nThreads: int,
+) -> Optional[OrderedDict[Any, Any]]:
+	"""Extract the features of one slice, or None if the ROI in the slice is too small for PyRadiomics."""
+	# Worker processes do not inherit the PyRadiomics log level or thread limits
+	logging.getLogger("radiomics").setLevel(radiomicsLogLevel)
+	try:
+		imageoperations.checkMask(
+			sliceCT, sliceROI, **{**featureExtractor.settings, "label": segmentationLabel}
+		)
+	except ValueError:
+		return None
+	with limitThreads(nThreads):
+		return featureExtractor.execute(sliceCT, sliceROI, label=segmentationLabel)
+
+
+def aggregateSliceFeatures(
+	sliceFeatureVectors: Dict[int, OrderedDict[Any, Any]],
+	sliceAggregation: str,
+) -> List[OrderedDict[Any, Any]]:
+	"""Combine the feature vectors of the slices of an ROI into the rows of the feature table.
+
+	Parameters
+	----------
+	sliceFeatureVectors : Dict[int, OrderedDict[Any, Any]]
+		Feature vector of each slice by its index in the CT.
+	sliceAggregation : {"mean", "max", "slices"}
+		"slices" keeps a row for each slice, with its index under "slice". "mean" and "max" give one row with the mean or
+		maximum of each feature over the slices, the aggregation under "slice_aggregation" and the number of slices under
+		"n_slices". Diagnostics are taken from the first slice.
+
+	Returns
+	-------
+	List[OrderedDict[Any, Any]]
+		Rows of the feature table.
+	"""
+	if sliceAggregation not in SLICE_AGGREGATIONS:
+		msg = f"sliceAggregation must be one of {SLICE_AGGREGATIONS}, got {sliceAggregation}."
+		raise ValueError(msg)
+
+	if sliceAggregation == "slices":
+		return [
+			OrderedDict(slice=sliceIndex, **featureVector)
+			for sliceIndex, featureVector in sliceFeatureVectors.items()
+		]
+
+	aggregate = np.mean if sliceAggregation == "mean" else np.max
+	featureVectors = list(sliceFeatureVectors.values())
+	aggregatedFeatureVector = OrderedDict(
+		slice_aggregation=sliceAggregation, n_slices=len(featureVectors)
+	)
+	for featureName, value in featureVectors[0].items():
+		if featureName.startswith("diagnostics_"):
+			aggregatedFeatureVector[featureName] = value
+		else:
+			aggregatedFeatureVector[featureName] = float(
+				aggregate([float(featureVector[featureName]) for featureVector in featureVectors])
+			)
+
+	return [aggregatedFeatureVector]
+
+
+def sliceRadiomicFeatureExtraction(
+	ctImage: sitk.Image,
+	roiImage: sitk.Image,
+	pyradiomicsParamFilePath: Optional[str | Path] = "./src/readii/data/default_pyradiomics.yaml",
+	*,
+	sliceAggregation: str = "mean",
+	sliceJobs: int = -1,
+	segmentationLabel: Optional[int] = None,
+	negativeControl: Optional[str] = None,
+	randomSeed: Optional[int] = None,
+	slabSize: Optional[int] = None,
+	bufferPool: Optional[BufferPool] = None,
+	firstOrderEngine: str = "pyradiomics",
+	textureEngine: str = "pyradiomics",
+) -> List[OrderedDict[Any, Any]]:
+	"""Perform 2D radiomic feature extraction on each axial slice of an ROI, in parallel over the slices.
+
+	The CT and segmentation are aligned, cropped and turned into a negative control once, like in
+	singleRadiomicFeatureExtraction. Each slice of the crop that contains the ROI is then extracted with the force2D
+	setting, and the slice features are aggregated with aggregateSliceFeatures. Slices where the ROI is too small for
+	PyRadiomics (see radiomics.imageoperations.checkMask) are skipped.
+
+	Parameters
+	----------
+	ctImage : sitk.Image
+		CT image to perform feature extraction on.
+	roiImage : sitk.Image
+		Region of interest (ROI) to extract radiomic features from within the CT.
+	pyradiomicsParamFilePath : str
+		Path to file containing configuration settings for pyradiomics feature extraction. force2D is always enabled,
+		so enable the shape2D feature class for 2D shape features.
+	sliceAggregation : {"mean", "max", "slices"}, default "mean"
+		How to combine the slice features into rows of the feature table, see aggregateSliceFeatures.
+	sliceJobs : int, default -1
+		Number of worker processes to extract the slices with, as for joblib.Parallel. -1 uses all CPUs.
+	segmentationLabel : int
+		Voxel value of the ROI. Found from the segmentation if not given.
+	negativeControl : str
+		Name of negative control to generate from the CT to perform feature extraction on.
+	randomSeed : int
+		Value to set random seed with for negative control creation to be reproducible.
+	slabSize : int
+		If set, generate the negative control in slabs of this many slices to bound memory use for very large volumes.
+	bufferPool : BufferPool
+		Pool to reuse full-volume working arrays from when generating the negative control.
+	firstOrderEngine : {"pyradiomics", "numpy"}
+		Engine to compute first order features with, see singleRadiomicFeatureExtraction.
+	textureEngine : {"pyradiomics", "numpy"}
+		Engine to compute glcm, glrlm and glszm features with, see singleRadiomicFeatureExtraction.
+
+	Returns
+	-------
+	List[OrderedDict[Any, Any]]
+		Rows of the feature table, see aggregateSliceFeatures.
+
+	Raises
+	------
+	ValueError
+		If sliceAggregation is not one of SLICE_AGGREGATIONS, or no slice has an ROI large enough for extraction.
+	"""
+	if sliceAggregation not in SLICE_AGGREGATIONS:
+		msg = f"sliceAggregation must be one of {SLICE_AGGREGATIONS}, got {sliceAggregation}."
+		raise ValueError(msg)
+	if pyradiomicsParamFilePath is None:
+		pyradiomicsParamFilePath = "./src/readii/data/default_pyradiomics.yaml"
+	elif not Path(pyradiomicsParamFilePath).exists():
+		msg = f"PyRadiomics parameter file not found at {pyradiomicsParamFilePath}"
+		raise FileNotFoundError(msg)
+
+	alignedROIImage, segmentationLabel, segBoundingBox = alignAndCheckMask(
+		ctImage, roiImage, segmentationLabel
+	)
+	croppedCT, croppedROI = cropImageAndMask(
+		ctImage,
+		alignedROIImage,
+		segBoundingBox,
+		negativeControl,
+		randomSeed,
+		slabSize=slabSize,
+		bufferPool=bufferPool,
+	)
+
+	featureExtractor = getFeatureExtractor(
+		pyradiomicsParamFilePath, firstOrderEngine, textureEngine
+	)
+	# Axial slices, which are along the first numpy (last SimpleITK) axis
+	featureExtractor.settings.update(force2D=True, force2Ddimension=0)
+
+	sliceIndices = range(croppedCT.GetSize()[2])
+	logger.info(f"Extracting 2D radiomic features from {len(sliceIndices)} slices.")
+	radiomicsLogLevel = logging.getLogger("radiomics").level
+	sliceJobs = budgetedJobs(sliceJobs)
+	sliceResults = Parallel(n_jobs=sliceJobs, prefer="processes")(
+		delayed(forwardLogs(_sliceFeatures))(
+			featureExtractor,
+			croppedCT[:, :, sliceIndex : sliceIndex + 1],
+			croppedROI[:, :, sliceIndex : sliceIndex + 1],
+			segmentationLabel,
+			radiomicsLogLevel=radiomicsLogLevel,
+			nThreads=workerThreads(sliceJobs),
+		)
+		for sliceIndex in sliceIndices
+	)
+
+	# Slice index in the CT for each slice of the crop
+	sliceFeatureVectors = OrderedDict(
+		(int(segBoundingBox[4]) + sliceIndex, featureVector)
+		for sliceIndex, featureVector in zip(sliceIndices, sliceResults, strict=True)
+		if featureVector is not None
+	)
+	if not sliceFeatureVectors:
+		msg = "No slice of the ROI is large enough for 2D feature extraction."
+		raise ValueError(msg)
+	if len(sliceFeatureVectors) < len(sliceIndices):
+		logger.warning(
+			f"Skipped {len(sliceIndices) - len(sliceFeatureVectors)} slices with an ROI too small for 2D feature extraction."
+		)
+
+	return aggregateSliceFeatures(sliceFeatureVectors, sliceAggregation)
+
+
+def roiFeatureExtraction(
+	ctImage: sitk.Image,
+	roiImage: sitk.Image,
+	*,
+	ctSeriesID: str,
+	segSeriesID: str,
+	roiImageName: str,
+	pyradiomicsParamFilePath: Optional[str | Sequence[str]] = None,
+	negativeControl: Optional[str] = None,
+	randomSeed: Optional[int] = None,
+	perturbationManager: Optional[PerturbationManager] = None,
+	originalFeatures: Optional[pd.DataFrame | Dict[str, pd.DataFrame]] = None,
+	options: ExtractionOptions = DEFAULT_EXTRACTION_OPTIONS,
+) -> List[OrderedDict[Any, Any]]:
+	"""Extract the feature vectors of one ROI in a CT, see featureExtraction for the parameters.
+
+	Returns
+	-------
+	List[OrderedDict[Any, Any]]
+		One feature vector, or one for every perturbation or every PyRadiomics parameter file, or the 2D slice features.
+	"""
+	if options.sliceAggregation is not None:
+		# Extract 2D radiomic features from each slice of this CT/segmentation pair
+		return sliceRadiomicFeatureExtraction(
+			ctImage,
+			roiImage,
+			pyradiomicsParamFilePath,
+			sliceAggregation=options.sliceAggregation,
+			sliceJobs=options.sliceJobs,
+			negativeControl=negativeControl,
+			randomSeed=randomSeed,
+			slabSize=options.slabSize,
+			bufferPool=options.bufferPool,
+			firstOrderEngine=options.firstOrderEngine,
+			textureEngine=options.textureEngine,
+		)
+
+	if perturbationManager is not None:
+		# Extract radiomic features from every perturbation of this CT/segmentation pair
+		return perturbationFeatureExtraction(
+			ctImage=ctImage,
+			roiImage=roiImage,
+			perturbationManager=perturbationManager,
+			pyradiomicsParamFilePath=pyradiomicsParamFilePath,
+			negativeControl=negativeControl,
+			randomSeed=randomSeed,
+			firstOrderEngine=options.firstOrderEngine,
+			textureEngine=options.textureEngine,
+		)
+
+	if isinstance(pyradiomicsParamFilePath, (list, tuple)):
+		# Extract radiomic features with every parameter file from one crop of this CT/segmentation pair
+		configFeatureVectors = multiConfigRadiomicFeatureExtraction(
+			ctImage=ctImage,
+			roiImage=roiImage,
+			pyradiomicsParamFilePaths=pyradiomicsParamFilePath,
+			negativeControl=negativeControl,
+			randomSeed=randomSeed,
+			slabSize=options.slabSize,
+			bufferPool=options.bufferPool,
+			originalFeatureVectors=findOriginalFeatureVectors(
+				originalFeatures, ctSeriesID, segSeriesID, roiImageName
+			),
+			firstOrderEngine=options.firstOrderEngine,
+			textureEngine=options.textureEngine,
+			roiJobs=options.roiJobs,
+			roiParallelBackend=options.roiParallelBackend,
+		)
+		return [
+			OrderedDict(pyradiomics_config=configName, **idFeatureVector)
+			for configName, idFeatureVector in configFeatureVectors.items()
+		]
+
+	# Extract radiomic features from this CT/segmentation pair
+	return [
+		singleRadiomicFeatureExtraction(
+			ctImage=ctImage,
+			roiImage=roiImage,
+			pyradiomicsParamFilePath=pyradiomicsParamFilePath,
+			negativeControl=negativeControl,
+			randomSeed=randomSeed,
+			slabSize=options.slabSize,
+			bufferPool=options.bufferPool,
+			originalFeatureVector=findOriginalFeatureVector(
+				originalFeatures, ctSeriesID, segSeriesID, roiImageName
+			),
+			firstOrderEngine=options.firstOrderEngine,
+			textureEngine=options.textureEngine,
+			roiJobs=options.roiJobs,
+			roiParallelBackend=options.roiParallelBackend,
+		)
+	]
+
+
+def matchingROIImages(
+	ctImage: sitk.Image,
+	segImages: Dict[str, sitk.Image],
+	plogger: Any = logger,  # noqa: ANN401
+) -> Dict[str, tuple[int, sitk.Image]]:
+	"""Get the ROIs of a segmentation file that have the same dimensions as the CT.
+
+	Returns
+	-------
+	Dict[str, tuple[int, sitk.Image]]
+		ROI number (position in the segmentation file, starting at 1) and ROI image by ROI name.
+	"""
+	roiImages = OrderedDict()
+	for i, roiImageName in enumerate(segImages):
+		# Get sitk Image object for this ROI
+		roiImage = segImages[roiImageName]
+
+		# Check if segmentation just has an extra axis with a size of 1 and remove it
+		if roiImage.GetDimension() > 3 and roiImage.GetSize()[3] == 1:  # noqa
+			roiImage = flattenImage(roiImage)
+
+		# Check that image and segmentation mask have the same dimensions
+		if ctImage.GetSize() != roiImage.GetSize():
+			# Checking if number of segmentation slices is less than CT
+			msg = "CT and ROI dimensions do not match."
+			plogger.warning(
+				msg,
+				roi=roiImageName,
+				ctImage_size=ctImage.GetSize(),
+				roiImage_size=roiImage.GetSize(),
+			)
+			continue
+
+		roiImages[roiImageName] = (i + 1, roiImage)
+
+	return roiImages
+
+
+def qcROIImages(
+	ctImage: sitk.Image,
+	roiImages: Dict[str, tuple[int, sitk.Image]],
+	roiQC: ROIQCCriteria,
+	*,
+	qcStatistics: Optional[List[Dict[str, Any]]] = None,
+	qcMetadata: Optional[Dict[str, Any]] = None,
+	plogger: Any = logger,  # noqa: ANN401
+) -> Dict[str, tuple[int, sitk.Image]]:
+	"""Compute the QC statistics of the ROIs of a segmentation file and drop the ROIs that fail the QC criteria.
+
+	Parameters
+	----------
+	ctImage : sitk.Image
+		CT image the ROIs belong to.
+	roiImages : Dict[str, tuple[int, sitk.Image]]
+		ROI number and image by ROI name, as from matchingROIImages.
+	roiQC : ROIQCCriteria
+		Criteria the ROIs must meet to be kept.
+	qcStatistics : List[Dict[str, Any]]
+		If given, a row for each ROI is appended to it, with qcMetadata, the ROI name and number, its
+		roiQCStatistics and the failed criteria under "qc_failures".
+	qcMetadata : Dict[str, Any]
+		Metadata to start each QC row with, e.g. the patient and series IDs.
+	plogger : Any
+		Logger to warn about excluded ROIs with.
+
+	Returns
+	-------
+	Dict[str, tuple[int, sitk.Image]]
+		The ROIs that pass the QC criteria.
+	"""
+	passedROIImages = OrderedDict()
+	for roiImageName, (roiNumber, roiImage) in roiImages.items():
+		roiStatistics = roiQCStatistics(ctImage, roiImage)
+		qcFailures = roiQC.failures(roiStatistics)
+		if qcStatistics is not None:
+			qcStatistics.append(
+				{
+					**(qcMetadata or {}),
+					"roi": roiImageName,
+					"roi_number": roiNumber,
+					**roiStatistics,
+					"qc_failures": "; ".join(qcFailures),
+				}
+			)
+
+		if qcFailures:
+			plogger.warning(
+				"Excluding ROI that fails QC from feature extraction.",
+				roi=roiImageName,
+				qc_failures=qcFailures,
+			)
+			continue
+		passedROIImages[roiImageName] = (roiNumber, roiImage)
+
+	return passedROIImages
+
+
+def segmentationFeatureExtraction(
+	ctImage: sitk.Image,
+	roiImages: Dict[str, sitk.Image],
+	*,
+	ctSeriesID: str,
+	segSeriesID: str,
+	pyradiomicsParamFilePath: Optional[str | Sequence[str]] = None,
+	negativeControl: Optional[str] = None,
+	randomSeed: Optional[int] = None,
+	perturbationManager: Optional[PerturbationManager] = None,
+	originalFeatures: Optional[pd.DataFrame | Dict[str, pd.DataFrame]] = None,
+	options: ExtractionOptions = DEFAULT_EXTRACTION_OPTIONS,
+) -> Dict[str, List[OrderedDict[Any, Any]]]:
+	"""Extract the feature vectors of the ROIs of one segmentation file, see featureExtraction for the parameters.
+
+	Returns
+	-------
+	Dict[str, List[OrderedDict[Any, Any]]]
+		Feature vectors of each ROI by name, see roiFeatureExtraction.
+	"""
+	if (
+		options.unionCropMaxBytes is not None
+		and perturbationManager is None
+		and options.sliceAggregation is None
+		and not isinstance(pyradiomicsParamFilePath, (list, tuple))
+	):
+		# Filter the CT once for all ROIs
+		unionFeatureVectors = unionCropFeatureExtraction(
+			ctImage,
+			roiImages,
+			pyradiomicsParamFilePath,
+			maxBytes=options.unionCropMaxBytes,
+			negativeControl=negativeControl,
+			randomSeed=randomSeed,
+			originalFeatureVectors={
+				roiImageName: findOriginalFeatureVector(
+					originalFeatures, ctSeriesID, segSeriesID, roiImageName
+				)
+				for roiImageName in roiImages
+			},
+			options=options,
+		)
+		return {
+			roiImageName: [idFeatureVector]
+			for roiImageName, idFeatureVector in unionFeatureVectors.items()
+		}
+
+	segFeatureVectors = OrderedDict()
+	for roiImageName, roiImage in roiImages.items():
+		# Extract features listed in the parameter file
+		logger.info(f"Calculating radiomic features for segmentation: {roiImageName}")
+		segFeatureVectors[roiImageName] = roiFeatureExtraction(
+			ctImage,
+			roiImage,
+			ctSeriesID=ctSeriesID,
+			segSeriesID=segSeriesID,
+			roiImageName=roiImageName,
+			pyradiomicsParamFilePath=pyradiomicsParamFilePath,
+			negativeControl=negativeControl,
+			randomSeed=randomSeed,
+			perturbationManager=perturbationManager,
+			originalFeatures=originalFeatures,
+			options=options,
+		)
+
+	return segFeatureVectors
+
+
 def featureExtraction(
 	ctSeriesID: str,
 	pdImageInfo: pd.DataFrame,
 	imageDirPath: Path,
-	pyradiomicsParamFilePath: Optional[str] = None,
+	pyradiomicsParamFilePath: Optional[str | Sequence[str]] = None,
 	roiNames: Optional[str] = None,
 	negativeControl: Optional[str] = None,
 	randomSeed: Optional[int] = None,
 	keep_running: bool = False,
+	*,
+	options: ExtractionOptions = DEFAULT_EXTRACTION_OPTIONS,
+	perturbationManager: Optional[PerturbationManager] = None,
+	originalFeatures: Optional[pd.DataFrame | Dict[str, pd.DataFrame]] = None,
+	qcStatistics: Optional[List[Dict[str, Any]]] = None,
+	failures: Optional[List[Dict[str, Any]]] = None,
 ) -> List[Dict[str, Any]]:
 	"""Extract PyRadiomics features for all ROIs present in a CT.
 
@@ -189,8 +1388,9 @@ def featureExtraction(
 			DataFrame containing image metadata
 	imageDirPath : Path
 			Base directory containing image data
-	pyradiomics_params_path : Optional[str]
-			Path to PyRadiomics parameters file
+	pyradiomics_params_path : Optional[str | Sequence[str]]
+			Path to PyRadiomics parameters file. If a list of paths, each ROI is cropped once and every parameter
+			file is used on it, with one row per parameter file and its name in a "pyradiomics_config" column.
 	roiNames : Optional[str]
 			Name pattern for the ROIs
 	negativeControl : Optional[str]
@@ -199,6 +1399,18 @@ def featureExtraction(
 			Random seed for reproducibility
 	keep_running : bool
 			Whether to continue on error
+	options : ExtractionOptions
+			Options of the run, e.g. the engines, workers and ROI QC criteria. See readii.options.ExtractionOptions
+	perturbationManager : Optional[PerturbationManager]
+			If set, extract features from every perturbation of each ROI instead of the ROI itself.
+			The CT is still only loaded once.
+	originalFeatures : Optional[pd.DataFrame | Dict[str, pd.DataFrame]]
+			Features extracted from the original images, to copy the features a negative control cannot change from.
+			By configuration name if there are several parameter files.
+	qcStatistics : Optional[List[Dict[str, Any]]]
+			List to append the QC statistics row of each ROI to when options.roiQC is set. See qcROIImages
+	failures : Optional[List[Dict[str, Any]]]
+			List to append the stage, type and message of an error to, see readii.failures.recordFailure
 
 	Returns
 	-------
@@ -214,6 +1426,9 @@ def featureExtraction(
 
 	plogger.info("Starting Feature Extraction")
 
+	# Stage and segmentation being processed, recorded in the failure manifest if an error is raised
+	stage = "load_ct"
+	segSeriesID = None
 	# Get absolute path to CT image files
 	try:
 		ctDirPath = dataset_directory / ctSeriesInfo.iloc[0]["folder_CT"]
@@ -221,12 +1436,18 @@ def featureExtraction(
 		plogger.debug("Loading CT images", ctDirPath=ctDirPath)
 		# Load CT by passing in specific series to find in a directory
 		ctImage = read_dicom_auto(path=ctDirPath.as_posix(), series_id=ctSeriesID)
+		# The segmentations are checked against the CT as loaded
+		loadedCTImage = ctImage
+		if options.downsampleFactor is not None:
+			ctImage = downsampleImage(ctImage, options.downsampleFactor)
 
 		# Get list of segmentations to iterate over
 		segSeriesIDList = ctSeriesInfo["series_seg"].unique()
 
 		plogger.debug(
-			f"Found {len(segSeriesIDList)} segmentations.", segSeriesIDList=segSeriesIDList
+			"Found segmentations.",
+			nSegmentations=len(segSeriesIDList),
+			segSeriesIDList=LazyLogValue(segSeriesIDList.tolist),
 		)
 
 		# Initialize dictionary to store radiomics data for each segmentation (image metadata + features)
@@ -234,6 +1455,7 @@ def featureExtraction(
 
 		# Loop over every segmentation associated with this CT - only loading CT once
 		for _, segSeriesID in enumerate(segSeriesIDList):
+			stage = "load_segmentation"
 			segSeriesInfo = ctSeriesInfo.loc[ctSeriesInfo["series_seg"] == segSeriesID]
 
 			if (
@@ -243,7 +1465,12 @@ def featureExtraction(
 				and not segSeriesInfo.duplicated(subset=["series_CT"], keep=False).all()
 			):
 				errmsg = "Some kind of duplication of segmentation and CT matches not being caught. Check seg_and_ct_dicom_list in readii_output."
-				plogger.error(errmsg, segSeriesInfo=segSeriesInfo)
+				plogger.error(
+					errmsg,
+					duplicateMatches=LazyLogValue(
+						partial(segSeriesInfo[["series_CT", "series_seg"]].to_dict, "records")
+					),
+				)
 				raise RuntimeError(errmsg)
 
 			# Get absolute path to segmentation image file
@@ -263,39 +1490,44 @@ def featureExtraction(
 				plogger.warning(log_msg)
 				continue
 
-			# Loop over each ROI contained in the segmentation to perform radiomic feature extraction
-			for i, roiImageName in enumerate(segImages):
-				# Extract features listed in the parameter file
-				plogger.info(f"Calculating radiomic features for segmentation: {roiImageName}")
-
-				# Get sitk Image object for this ROI
-				roiImage = segImages[roiImageName]
-
-				# Check if segmentation just has an extra axis with a size of 1 and remove it
-				if roiImage.GetDimension() > 3 and roiImage.GetSize()[3] == 1:  # noqa
-					roiImage = flattenImage(roiImage)
-
-				# Check that image and segmentation mask have the same dimensions
-				if ctImage.GetSize() != roiImage.GetSize():
-					# Checking if number of segmentation slices is less than CT
-					msg = "CT and ROI dimensions do not match."
-					plogger.warning(
-						msg,
-						patientID=patID,
-						ctImage_size=ctImage.GetSize(),
-						roiImage_size=roiImage.GetSize(),
-					)
-					continue
-
-				# Extract radiomic features from this CT/segmentation pair
-				idFeatureVector = singleRadiomicFeatureExtraction(
-					ctImage=ctImage,
-					roiImage=roiImage,
-					pyradiomicsParamFilePath=pyradiomicsParamFilePath,
-					negativeControl=negativeControl,
-					randomSeed=randomSeed,
+			# Only keep the ROIs that can be used with this CT
+			stage = "roi_check"
+			roiImages = matchingROIImages(loadedCTImage, segImages, plogger)
+			if options.downsampleFactor is not None:
+				roiImages = OrderedDict(
+					(roiImageName, (roiNumber, downsampleMask(roiImage, loadedCTImage, ctImage)))
+					for roiImageName, (roiNumber, roiImage) in roiImages.items()
 				)
+			if options.roiQC is not None:
+				roiImages = qcROIImages(
+					ctImage,
+					roiImages,
+					options.roiQC,
+					qcStatistics=qcStatistics,
+					qcMetadata={
+						"patient_ID": patID,
+						"series_UID": ctSeriesID,
+						"seg_series_UID": segSeriesID,
+					},
+					plogger=plogger,
+				)
+
+			# Extract radiomic features from each CT/ROI pair, or each perturbation or parameter file of it
+			stage = "extraction"
+			segFeatureVectors = segmentationFeatureExtraction(
+				ctImage,
+				{roiImageName: roiImage for roiImageName, (_, roiImage) in roiImages.items()},
+				ctSeriesID=ctSeriesID,
+				segSeriesID=segSeriesID,
+				pyradiomicsParamFilePath=pyradiomicsParamFilePath,
+				negativeControl=negativeControl,
+				randomSeed=randomSeed,
+				perturbationManager=perturbationManager,
+				originalFeatures=originalFeatures,
+				options=options,
+			)
 
+			for roiImageName, (roiNumber, _) in roiImages.items():
 				# Create dictionary of image metadata to append to front of output table
 				sampleROIData = {
 					"patient_ID": patID,
@@ -308,19 +1540,21 @@ def featureExtraction(
 					"seg_modality": segSeriesInfo.iloc[0]["modality_seg"],
 					"seg_ref_image": segSeriesInfo.iloc[0]["reference_ct_seg"],
 					"roi": roiImageName,
-					"roi_number": i + 1,
+					"roi_number": roiNumber,
 					"negative_control": negativeControl,
 				}
 
-				# Concatenate image metadata with PyRadiomics features
-				sampleROIData.update(idFeatureVector)
-				# Store this ROI's info in the segmentation level list
-				ctAllData.append(sampleROIData)
+				# Concatenate image metadata with PyRadiomics features and store each row in the segmentation level list
+				ctAllData.extend(
+					{**sampleROIData, **idFeatureVector}
+					for idFeatureVector in segFeatureVectors[roiImageName]
+				)
 
 		return ctAllData
 		###### END featureExtraction #######
 	except Exception as e:
 		errmsg = f"Error processing patient {patID}, series {ctSeriesID}: {e}"
+		recordFailure(failures, ctSeriesID, stage, e, segSeriesID=segSeriesID)
 		if keep_running:
 			plogger.error(errmsg)
 		else:
@@ -328,17 +1562,250 @@ def featureExtraction(
 			raise RuntimeError(errmsg) from e
 
 
+def _isolatedFeaturesAndQC(
+	seriesFeatureExtraction: Callable[..., Optional[List[Dict[str, Any]]]],
+	ctSeriesID: str,
+	*,
+	radiomicsLogLevel: int,
+	nThreads: int,
+) -> tuple[Optional[List[Dict[str, Any]]], List[Dict[str, Any]], List[Dict[str, Any]]]:
+	"""Extract the features of a series in a worker process, returning its ROI QC statistics and failures with them."""
+	# Worker processes do not inherit the PyRadiomics log level or thread limits
+	logging.getLogger("radiomics").setLevel(radiomicsLogLevel)
+	qcStatistics = []
+	failures = []
+	with limitThreads(nThreads):
+		seriesFeatures = seriesFeatureExtraction(
+			ctSeriesID, qcStatistics=qcStatistics, failures=failures
+		)
+	return seriesFeatures, qcStatistics, failures
+
+
+def isolatedFeatureExtraction(
+	ctSeriesID: str,
+	*,
+	workerPool: SupervisedProcessPool,
+	seriesFeatureExtraction: Callable[..., Optional[List[Dict[str, Any]]]],
+	nThreads: int,
+	qcStatistics: Optional[List[Dict[str, Any]]] = None,
+	failures: Optional[List[Dict[str, Any]]] = None,
+	keep_running: bool = False,
+) -> Optional[List[Dict[str, Any]]]:
+	"""Extract the features of a series with featureExtraction in a supervised worker process.
+
+	Parameters
+	----------
+	ctSeriesID : str
+		CT series to extract.
+	workerPool : SupervisedProcessPool
+		Pool of worker processes to run the extraction in.
+	seriesFeatureExtraction : Callable[..., Optional[List[Dict[str, Any]]]]
+		featureExtraction with every argument but ctSeriesID, qcStatistics and failures set. Must be picklable.
+	nThreads : int
+		SimpleITK and BLAS threads of the worker process.
+	qcStatistics : List[Dict[str, Any]], optional
+		List to append the ROI QC statistics from the worker to.
+	failures : List[Dict[str, Any]], optional
+		List to append the failures from the worker to, or a crash of the worker with its stderr.
+	keep_running : bool, default False
+		Log a crash of the worker, e.g. a segmentation fault in ITK, and return None instead of raising an error.
+
+	Returns
+	-------
+	Optional[List[Dict[str, Any]]]
+		Features for each ROI of the series as from featureExtraction, or None if the worker crashed.
+	"""
+	try:
+		seriesFeatures, seriesQCStatistics, seriesFailures = workerPool.submit(
+			forwardLogs(_isolatedFeaturesAndQC),
+			seriesFeatureExtraction,
+			ctSeriesID,
+			radiomicsLogLevel=logging.getLogger("radiomics").level,
+			nThreads=nThreads,
+		).result()
+	except WorkerCrashError as e:
+		errmsg = (
+			f"Worker process crashed with {describeExitCode(e.exitcode)} on series {ctSeriesID}."
+		)
+		recordFailure(
+			failures, ctSeriesID, "worker_process", e, message=f"{e}\n{e.stderr}".rstrip()
+		)
+		if not keep_running:
+			msg = f"{errmsg}\n{e.stderr}"
+			raise RuntimeError(msg) from e
+		logger.error(errmsg, series_CT=ctSeriesID, exitcode=e.exitcode, stderr=e.stderr)
+		return None
+
+	if qcStatistics is not None:
+		qcStatistics.extend(seriesQCStatistics)
+	if failures is not None:
+		failures.extend(seriesFailures)
+	return seriesFeatures
+
+
+@contextmanager
+def seriesWorkers(
+	seriesFeatureExtraction: Callable[..., Optional[List[Dict[str, Any]]]],
+	options: ExtractionOptions,
+	nJobs: int,
+	*,
+	nThreads: int,
+	qcStatistics: Optional[List[Dict[str, Any]]] = None,
+	failures: Optional[List[Dict[str, Any]]] = None,
+	keep_running: bool = False,
+) -> Iterator[Callable[[str], Optional[List[Dict[str, Any]]]]]:
+	"""Get the function extracting the features of one series, in this process or in a supervised worker process.
+
+	With options.isolateSeries, nJobs worker processes are started for the block. The bufferPool of the options is
+	shared within this process only, so it is not used in the workers.
+	"""
+	if not options.isolateSeries:
+		yield seriesFeatureExtraction
+		return
+
+	with SupervisedProcessPool(nJobs) as workerPool:
+		yield partial(
+			isolatedFeatureExtraction,
+			workerPool=workerPool,
+			seriesFeatureExtraction=partial(
+				seriesFeatureExtraction,
+				options=options.forWorkerProcess(),
+				qcStatistics=None,
+				failures=None,
+			),
+			nThreads=nThreads,
+			qcStatistics=qcStatistics,
+			failures=failures,
+			keep_running=keep_running,
+		)
+
+
+def featureTables(
+	flatFeatures: List[Dict[str, Any]],
+	configNames: Optional[List[str]] = None,
+) -> Dict[Optional[str], pd.DataFrame]:
+	"""Convert feature rows into a table, or into a table for each PyRadiomics configuration name.
+
+	The only key is None when a single configuration is used. Otherwise the rows are split by their
+	"pyradiomics_config" value, which is dropped.
+	"""
+	if configNames is None:
+		return {None: pd.DataFrame(flatFeatures)}
+
+	# Split the rows of every parameter file into their own table
+	return {
+		configName: pd.DataFrame(
+			[
+				{key: value for key, value in row.items() if key != "pyradiomics_config"}
+				for row in flatFeatures
+				if row["pyradiomics_config"] == configName
+			]
+		)
+		for configName in configNames
+	}
+
+
+def checkSliceAggregation(
+	sliceAggregation: Optional[str],
+	pyradiomicsParamFilePath: Optional[str | Sequence[str]],
+	perturbationManager: Optional[PerturbationManager] = None,
+) -> None:
+	"""Check that 2D slice feature extraction can be used with the other options of a run.
+
+	Raises
+	------
+	ValueError
+		If sliceAggregation is not one of SLICE_AGGREGATIONS, or is combined with perturbations or several parameter files.
+	"""
+	if sliceAggregation is None:
+		return
+	if sliceAggregation not in SLICE_AGGREGATIONS:
+		msg = f"sliceAggregation must be one of {SLICE_AGGREGATIONS}, got {sliceAggregation}."
+		raise ValueError(msg)
+	if perturbationManager is not None or isinstance(pyradiomicsParamFilePath, (list, tuple)):
+		msg = "2D slice feature extraction supports a single PyRadiomics parameter file and no perturbations."
+		raise ValueError(msg)
+
+
+def saveExtractionOutputs(
+	outputDir: Path,
+	featuresTables: Dict[Optional[str], pd.DataFrame],
+	*,
+	featureSetName: str,
+	datasetName: str,
+	qcTable: Optional[pd.DataFrame] = None,
+	mergeRetried: Optional[Callable[[pd.DataFrame, pd.DataFrame], pd.DataFrame]] = None,
+) -> Dict[Optional[str], pd.DataFrame]:
+	"""Save the feature tables of a run, by configuration name, and its ROI QC statistics to outputDir.
+
+	With mergeRetried, e.g. mergeRetriedSeries for a retry of failed series, each table is first merged into the
+	file of the earlier run. Returns the feature tables as saved.
+	"""
+	if qcTable is not None:
+		qcOutputFilePath = outputDir / "qc" / f"roiqc_{datasetName}"
+		if mergeRetried is not None:
+			qcTable = mergeRetried(readTable(qcOutputFilePath), qcTable)
+		logger.info("Saving ROI QC statistics to file.", output_file=qcOutputFilePath)
+		saveDataframeCSV(qcTable, qcOutputFilePath)
+
+	savedTables = {}
+	# Setup output file name with the dataset name as a suffix
+	for configName, featuresTable in featuresTables.items():
+		configSuffix = f"_{configName}" if configName is not None else ""
+		outFileName = f"radiomicfeatures_{featureSetName}{configSuffix}_{datasetName}"
+
+		outputFilePath = outputDir / "features" / outFileName
+
+		savedTables[configName] = (
+			mergeRetried(readTable(outputFilePath), featuresTable)
+			if mergeRetried is not None
+			else featuresTable
+		)
+
+		logger.info("Saving output to file.", output_file=outputFilePath)
+
+		# Save out the features
+		saveDataframeCSV(savedTables[configName], outputFilePath)
+
+	return savedTables
+
+
+def parameterFileConfigNames(
+	pyradiomicsParamFilePath: str | Sequence[str],
+	perturbationManager: Optional[PerturbationManager] = None,
+) -> Optional[List[str]]:
+	"""Get the configuration names of several PyRadiomics parameter files, or None for a single file.
+
+	Raises a ValueError if several parameter files are combined with perturbations.
+	"""
+	if not isinstance(pyradiomicsParamFilePath, (list, tuple)):
+		return None
+	if perturbationManager is not None:
+		msg = "Perturbation feature extraction supports a single PyRadiomics parameter file."
+		raise ValueError(msg)
+	return list(checkPyradiomicsParamFiles(pyradiomicsParamFilePath))
+
+
 def radiomicFeatureExtraction(
 	imageMetadataPath: str,
 	imageDirPath: str,
 	roiNames: Optional[str] = None,
-	pyradiomicsParamFilePath: Optional[str] = "src/readii/data/default_pyradiomics.yaml",
+	pyradiomicsParamFilePath: Optional[
+		str | Sequence[str]
+	] = "src/readii/data/default_pyradiomics.yaml",
 	outputDirPath: Optional[str] = None,
 	negativeControl: Optional[str] = None,
 	randomSeed: Optional[int] = None,
 	parallel: bool = False,
 	keep_running: bool = False,
-) -> pd.DataFrame:
+	*,
+	options: ExtractionOptions = DEFAULT_EXTRACTION_OPTIONS,
+	perturbationManager: Optional[PerturbationManager] = None,
+	originalFeatures: Optional[pd.DataFrame | Dict[str, pd.DataFrame]] = None,
+	seriesPlan: Optional[pd.DataFrame] = None,
+	retryFailed: bool = False,
+	progress: Optional[ExtractionProgress] = None,
+) -> pd.DataFrame | Dict[str, pd.DataFrame]:
 	"""Perform radiomic feature extraction using PyRadiomics on CT images with a corresponding segmentation.
 
 	Utilizes outputs from med-imagetools (https://github.com/bhklab/med-imagetools) run on the image dataset.
@@ -352,8 +1819,10 @@ def radiomicFeatureExtraction(
 		and be the same as the input path used in med-imagetools
 	roiNames : str
 		Name pattern for the ROIs to load for the RTSTRUCTs. Can be None for DICOM SEG segmentations.
-	pyradiomicsParamFilePath : str
+	pyradiomicsParamFilePath : str | Sequence[str]
 		Path to file containing configuration settings for pyradiomics feature extraction. Will use the provided config file in 'data/' by default if no file passed in.
+		If a list of paths, each series is loaded and each ROI is aligned and cropped once for all of them, and a table is made for each
+		parameter file. Its name (see pyradiomicsConfigName) is added to the output file name.
 	outputDirPath : str
 		Path to directory save the dataframe of extracted features to as a csv
 	negativeControl : str
@@ -364,11 +1833,38 @@ def radiomicFeatureExtraction(
 		Flag to decide whether to run extraction in parallel.
 	keep_running : bool
 		Flag to keep pipeline running even when feature extraction for a patient fails.
+	options : ExtractionOptions
+		How the series are extracted: the engines, the parallel workers and memory limits, ROI QC, downsampling for
+		pilot runs and the buffer pool and resample cache to share between runs. See readii.options.ExtractionOptions.
+		Without a negative control, the ROI QC statistics of options.roiQC are saved to qc/roiqc_{dataset}.csv in
+		outputDirPath.
+	perturbationManager : PerturbationManager
+		If set, extract features from every perturbation of each ROI, with one row per perturbation. The output file
+		name gets a "_perturbed" suffix after the negative control name.
+	originalFeatures : pd.DataFrame | Dict[str, pd.DataFrame]
+		Features extracted from the original images, e.g. the output of this function without a negative control.
+		If given, the feature classes a negative control cannot change (see invariantFeatureClasses) are copied
+		from the matching ROI in this table instead of being recomputed. The output has the same columns either way.
+		With several parameter files, a table for each configuration name.
+	seriesPlan : pd.DataFrame
+		Pre-flight check of the match list from readii.preflight.planFeatureExtraction. If given, only the
+		CT/segmentation pairs that passed it are extracted.
+
+	retryFailed : bool
+		Only extract the CT series in the failure manifest of an earlier run in outputDirPath, and merge their features
+		and ROI QC statistics into the existing files. Every run writes the series that gave no features, with the
+		stage, exception type and message of each failure, to failures/failures_{feature set}_{dataset}.csv in
+		outputDirPath, see readii.failures. All series are extracted if there is no manifest.
+
+	progress : ExtractionProgress
+		Progress of the run to count the series of this feature set in, with their throughput, the ETA of the run,
+		active workers and memory in use, see readii.progress.
 
 	Returns
 	-------
-	pd.DataFrame
-		Dataframe containing the image metadata and extracted radiomic features.
+	pd.DataFrame | Dict[str, pd.DataFrame]
+		Dataframe containing the image metadata and extracted radiomic features. With several parameter files, a
+		dataframe for each configuration name.
 	"""
 	# Setting pyradiomics verbosity lower
 	radiomics_logger: logging.Logger = logging.getLogger("radiomics")
@@ -378,50 +1874,111 @@ def radiomicFeatureExtraction(
 	if pyradiomicsParamFilePath == None:
 		pyradiomicsParamFilePath = "./src/readii/data/default_pyradiomics.yaml"
 
+	checkSliceAggregation(options.sliceAggregation, pyradiomicsParamFilePath, perturbationManager)
+
+	configNames = parameterFileConfigNames(pyradiomicsParamFilePath, perturbationManager)
+
+	if retryFailed and outputDirPath is None:
+		msg = "Retrying failed series needs the outputDirPath of the earlier run."
+		raise ValueError(msg)
+
+	# Feature set and dataset names of the output files
+	featureSetName = (
+		f"{negativeControl or 'original'}{'_perturbed' if perturbationManager is not None else ''}"
+	)
+	datasetName = imageMetadataPath.partition("match_list_")[2]
+
 	# Load in summary file generated by radiogenomic_pipeline
 	pdImageInfo = pd.read_csv(imageMetadataPath, header=0)
+	# Order of the series in the output files, to merge retried series back in
+	seriesOrder = pdImageInfo["series_CT"].unique()
+	if retryFailed:
+		pdImageInfo = retryImageInfo(
+			pdImageInfo, failureManifestPath(outputDirPath, featureSetName, datasetName)
+		)
+	if seriesPlan is not None:
+		# Skip the CT/segmentation pairs that failed the pre-flight check before loading any images
+		pdImageInfo = plannedImageInfo(pdImageInfo, seriesPlan)
 
 	# Get array of unique CT series' IDs to iterate over
 	ctSeriesIDList = pdImageInfo["series_CT"].unique()
 
+	# Rows of the ROI QC table and of the failure manifest, appended to by featureExtraction
+	qcStatistics = [] if options.roiQC is not None else None
+	failures = []
+
 	# Extract radiomic features for each CT, get a list of dictionaries
 	# Each dictionary contains features for each ROI in a single CT
-	if not parallel:
-		# Run feature extraction over samples in sequence - will be slower
-		features = [
-			featureExtraction(
-				ctSeriesID=ctSeriesID,
-				pdImageInfo=pdImageInfo,
-				imageDirPath=Path(imageDirPath),
-				pyradiomicsParamFilePath=pyradiomicsParamFilePath,
-				roiNames=roiNames,
-				negativeControl=negativeControl,
-				randomSeed=randomSeed,
-				keep_running=keep_running,
+	seriesFeatureExtraction = partial(
+		featureExtraction,
+		pdImageInfo=pdImageInfo,
+		imageDirPath=Path(imageDirPath),
+		pyradiomicsParamFilePath=pyradiomicsParamFilePath,
+		roiNames=roiNames,
+		negativeControl=negativeControl,
+		randomSeed=randomSeed,
+		keep_running=keep_running,
+		options=options,
+		perturbationManager=perturbationManager,
+		originalFeatures=originalFeatures,
+		qcStatistics=qcStatistics,
+		failures=failures,
+	)
+	# Share the thread budget between the series extracted at once, see readii.threads
+	seriesJobs = budgetedJobs(-1) if parallel else 1
+	with (
+		limitThreads(workerThreads(seriesJobs)),
+		seriesWorkers(
+			seriesFeatureExtraction,
+			options,
+			seriesJobs,
+			nThreads=workerThreads(seriesJobs),
+			qcStatistics=qcStatistics,
+			failures=failures,
+			keep_running=keep_running,
+		) as extractSeries,
+		trackedFeatureSet(
+			progress,
+			featureSetName,
+			ctSeriesIDList,
+			extractSeries,
+			partial(ctVoxelCount, pdImageInfo, imageDirPath),
+		) as extractSeries,
+	):
+		if not parallel:
+			# Run feature extraction over samples in sequence - will be slower
+			features = [extractSeries(ctSeriesID) for ctSeriesID in ctSeriesIDList]
+		elif options.memoryBudget is None:
+			# Run feature extraction in parallel
+			features = Parallel(n_jobs=seriesJobs, require="sharedmem")(
+				delayed(extractSeries)(ctSeriesID) for ctSeriesID in ctSeriesIDList
 			)
-			for ctSeriesID in ctSeriesIDList
-		]
-	else:
-		# Run feature extraction in parallel
-		features = Parallel(n_jobs=-1, require="sharedmem")(
-			delayed(featureExtraction)(
-				ctSeriesID=ctSeriesID,
-				pdImageInfo=pdImageInfo,
-				imageDirPath=Path(imageDirPath),
-				pyradiomicsParamFilePath=pyradiomicsParamFilePath,
-				roiNames=roiNames,
-				negativeControl=negativeControl,
-				randomSeed=randomSeed,
-				keep_running=keep_running,
+		else:
+			# Run feature extraction in parallel, as long as the series running fit in the memory budget.
+			# The peak memory of each series is estimated from a pre-flight plan
+			memoryPlan = (
+				seriesPlan
+				if seriesPlan is not None
+				else planFeatureExtraction(
+					imageMetadataPath, imageDirPath, roiNames, int(negativeControl is not None)
+				)
 			)
-			for ctSeriesID in ctSeriesIDList
-		)
+			features = memoryAdmittedMap(
+				extractSeries,
+				ctSeriesIDList,
+				seriesMemoryEstimates(memoryPlan, ctSeriesIDList),
+				options.memoryBudget,
+				nJobs=seriesJobs,
+			)
+
+	# Series that failed (None) or had no ROIs to extract (empty list), before they are filtered out
+	failed_features = [
+		ctSeriesID for ctSeriesID, f in zip(ctSeriesIDList, features, strict=True) if not f
+	]
 
 	# Filter out None and ensure each result is a list (even if it's empty)
 	features = [f for f in features if (isinstance(f, list) and len(f) > 0)]
 
-	failed_features = [ctSeriesID for ctSeriesID, f in zip(ctSeriesIDList, features) if not f]
-
 	logger.info("Finished feature extraction.", num_features=len(features))
 
 	if failed_features:
@@ -432,11 +1989,11 @@ def radiomicFeatureExtraction(
 	# Flatten the list of dictionaries (happens when there are multiple ROIs or SEGs associated with a single CT)
 	flatFeatures = list(chain.from_iterable(features))
 	# Convert list of feature sets into a pandas dataframe to save out
-	featuresTable = pd.DataFrame(flatFeatures)
+	featuresTables = featureTables(flatFeatures, configNames)
 
 	if outputDirPath is None:
 		logger.info("No output directory specified. Returning features table.")
-		return featuresTable
+		return featuresTables[None] if configNames is None else featuresTables
 
 	# Save out the features to a csv file
 	outputDir = Path(outputDirPath)
@@ -447,16 +2004,30 @@ def radiomicFeatureExtraction(
 		logger.info(f"Directory {outputDirPath} does not exist. Creating...")
 		outputDir.mkdir(parents=True)
 
-	datasetName = imageMetadataPath.partition("match_list_")[2]
-
-	# Setup output file name with the dataset name as a suffix
-	outFileName = f"radiomicfeatures_{negativeControl or 'original'}_{datasetName}"
-
-	outputFilePath = outputDir / "features" / outFileName
-
-	logger.info("Saving output to file.", output_file=outputFilePath)
+	# Rewrite the manifest of this feature set, so a retry only finds the series that are still failing
+	manifestPath = failureManifestPath(outputDir, featureSetName, datasetName)
+	logger.info(
+		f"Saving failure manifest of {len(failed_features)} series.", output_file=manifestPath
+	)
+	saveDataframeCSV(
+		failureManifest(failures, failed_features, pdImageInfo, negativeControl), manifestPath
+	)
 
-	# Save out the features
-	saveDataframeCSV(featuresTable, outputFilePath)
+	featuresTables = saveExtractionOutputs(
+		outputDir,
+		featuresTables,
+		featureSetName=featureSetName,
+		datasetName=datasetName,
+		# The QC statistics are of the original images, so they are only saved once
+		qcTable=pd.DataFrame(qcStatistics)
+		if qcStatistics is not None and negativeControl is None
+		else None,
+		# Replace the rows of the retried series in the files of the earlier run
+		mergeRetried=partial(
+			mergeRetriedSeries, retriedSeriesIDs=ctSeriesIDList, seriesOrder=seriesOrder
+		)
+		if retryFailed
+		else None,
+	)
 
-	return featuresTable
+	return featuresTables[None] if configNames is None else featuresTables
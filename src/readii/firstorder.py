@@ -0,0 +1,235 @@
+"""Vectorized first order radiomic features.
+
+PyRadiomics computes first order features with one pass over the ROI per feature, plus the
+overhead of setting up a feature class for every image type. `firstOrderFeatures` computes
+the same features with numpy for a batch of ROIs at once, e.g. all replicates of a negative
+control, sharing the centered values, percentiles and histogram between features.
+
+The definitions, the discretization used by Entropy and Uniformity (`binWidth` or `binCount`),
+and the handling of flat regions follow `radiomics.firstorder.RadiomicsFirstOrder`, so results
+match PyRadiomics to floating point tolerance.
+"""
+
+from functools import cached_property
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+from radiomics import imageoperations
+from radiomics.firstorder import RadiomicsFirstOrder
+
+
+def getFirstOrderFeatureNames(featureNames: Optional[Sequence[str]] = None) -> List[str]:
+	"""Get the first order features to compute, in PyRadiomics output order.
+
+	Parameters
+	----------
+	featureNames : Sequence[str], optional
+		Features to compute. If None or empty, all features that are not deprecated in PyRadiomics.
+
+	Returns
+	-------
+	List[str]
+		Names of the features, without the image type and class prefix, e.g. "Entropy".
+	"""
+	allFeatureNames = RadiomicsFirstOrder.getFeatureNames()
+	if not featureNames:
+		return [name for name, isDeprecated in allFeatureNames.items() if not isDeprecated]
+
+	unknownNames = [name for name in featureNames if name not in allFeatureNames]
+	if unknownNames:
+		msg = f"Unknown first order features: {unknownNames}"
+		raise ValueError(msg)
+	return list(featureNames)
+
+
+class _FirstOrderBatch:
+	"""Intermediate values shared between first order features of a batch of ROIs.
+
+	Feature methods are named like those of `RadiomicsFirstOrder` and return one value per ROI.
+	"""
+
+	def __init__(
+		self,
+		roiValues: np.ndarray,
+		voxelVolume: float,
+		binSettings: Dict[str, Any],
+		voxelArrayShift: float,
+	) -> None:
+		# Shape (ROIs, voxels), padded with NaN when ROIs have different numbers of voxels
+		self.values = roiValues
+		self.voxelVolume = voxelVolume
+		self.binSettings = binSettings
+		self.voxelArrayShift = voxelArrayShift
+		self.ragged = bool(np.isnan(roiValues).any())
+
+	def _mean(self, values: np.ndarray, keepdims: bool = False) -> np.ndarray:
+		mean = np.nanmean if self.ragged else np.mean
+		return mean(values, axis=1, keepdims=keepdims)
+
+	@cached_property
+	def nVoxels(self) -> np.ndarray:
+		return np.sum(~np.isnan(self.values), axis=1).astype(float)
+
+	@cached_property
+	def mean(self) -> np.ndarray:
+		return self._mean(self.values)
+
+	@cached_property
+	def centered(self) -> np.ndarray:
+		return self.values - self.mean[:, None]
+
+	@cached_property
+	def secondMoment(self) -> np.ndarray:
+		return self._mean(self.centered**2)
+
+	@cached_property
+	def energy(self) -> np.ndarray:
+		return np.nansum((self.values + self.voxelArrayShift) ** 2, axis=1)
+
+	@cached_property
+	def percentiles(self) -> Dict[int, np.ndarray]:
+		percentile = np.nanpercentile if self.ragged else np.percentile
+		quantiles = [10, 25, 50, 75, 90]
+		return dict(zip(quantiles, percentile(self.values, quantiles, axis=1), strict=True))
+
+	@cached_property
+	def probabilities(self) -> np.ndarray:
+		"""Normalized histogram of each ROI, shape (ROIs, bins), discretized like PyRadiomics."""
+		histograms = []
+		for rowValues in self.values:
+			roiValues = rowValues[~np.isnan(rowValues)]
+			binEdges = imageoperations.getBinEdges(roiValues, **self.binSettings)
+			histograms.append(np.bincount(np.digitize(roiValues, binEdges)))
+
+		probabilities = np.zeros((len(histograms), max(len(counts) for counts in histograms)))
+		for roiProbabilities, counts in zip(probabilities, histograms, strict=True):
+			roiProbabilities[: len(counts)] = counts / counts.sum()
+		return probabilities
+
+	def getEnergyFeatureValue(self) -> np.ndarray:
+		return self.energy
+
+	def getTotalEnergyFeatureValue(self) -> np.ndarray:
+		return self.energy * self.voxelVolume
+
+	def getEntropyFeatureValue(self) -> np.ndarray:
+		eps = np.spacing(1)
+		return -1.0 * np.sum(self.probabilities * np.log2(self.probabilities + eps), axis=1)
+
+	def getMinimumFeatureValue(self) -> np.ndarray:
+		return np.nanmin(self.values, axis=1)
+
+	def get10PercentileFeatureValue(self) -> np.ndarray:
+		return self.percentiles[10]
+
+	def get90PercentileFeatureValue(self) -> np.ndarray:
+		return self.percentiles[90]
+
+	def getMaximumFeatureValue(self) -> np.ndarray:
+		return np.nanmax(self.values, axis=1)
+
+	def getRangeFeatureValue(self) -> np.ndarray:
+		return self.getMaximumFeatureValue() - self.getMinimumFeatureValue()
+
+	def getMeanFeatureValue(self) -> np.ndarray:
+		return self.mean
+
+	def getMedianFeatureValue(self) -> np.ndarray:
+		return self.percentiles[50]
+
+	def getInterquartileRangeFeatureValue(self) -> np.ndarray:
+		return self.percentiles[75] - self.percentiles[25]
+
+	def getMeanAbsoluteDeviationFeatureValue(self) -> np.ndarray:
+		return self._mean(np.abs(self.centered))
+
+	def getRobustMeanAbsoluteDeviationFeatureValue(self) -> np.ndarray:
+		lowerBound = self.percentiles[10][:, None]
+		upperBound = self.percentiles[90][:, None]
+		robustValues = np.where(
+			(self.values >= lowerBound) & (self.values <= upperBound), self.values, np.nan
+		)
+		robustMean = np.nanmean(robustValues, axis=1, keepdims=True)
+		return np.nanmean(np.abs(robustValues - robustMean), axis=1)
+
+	def getRootMeanSquaredFeatureValue(self) -> np.ndarray:
+		return np.sqrt(self.energy / self.nVoxels)
+
+	def getStandardDeviationFeatureValue(self) -> np.ndarray:
+		return np.sqrt(self.secondMoment)
+
+	def getVarianceFeatureValue(self) -> np.ndarray:
+		return self.secondMoment
+
+	def getSkewnessFeatureValue(self) -> np.ndarray:
+		secondMoment = np.where(self.secondMoment == 0, 1, self.secondMoment)
+		return self._mean(self.centered**3) / secondMoment**1.5
+
+	def getKurtosisFeatureValue(self) -> np.ndarray:
+		secondMoment = np.where(self.secondMoment == 0, 1, self.secondMoment)
+		return self._mean(self.centered**4) / secondMoment**2.0
+
+	def getUniformityFeatureValue(self) -> np.ndarray:
+		return np.sum(self.probabilities**2, axis=1)
+
+
+def _stackRoiValues(roiValues: np.ndarray | Sequence[np.ndarray]) -> np.ndarray:
+	"""Stack the voxel values of several ROIs into a float array, padding shorter ROIs with NaN."""
+	if isinstance(roiValues, np.ndarray) and roiValues.ndim <= 2:  # noqa: PLR2004
+		# A 1D array holds the values of a single ROI
+		stacked = np.atleast_2d(roiValues).astype(float)
+	else:
+		roiValues = [np.asarray(values, dtype=float).ravel() for values in roiValues]
+		stacked = np.full((len(roiValues), max(map(len, roiValues), default=0)), np.nan)
+		for row, values in zip(stacked, roiValues, strict=True):
+			row[: len(values)] = values
+
+	if stacked.size == 0 or np.isnan(stacked).all(axis=1).any():
+		msg = "Every ROI must contain at least one voxel to compute first order features."
+		raise ValueError(msg)
+	return stacked
+
+
+def firstOrderFeatures(
+	roiValues: np.ndarray | Sequence[np.ndarray],
+	voxelVolume: float = 1.0,
+	*,
+	binWidth: float = 25,
+	binCount: Optional[int] = None,
+	voxelArrayShift: float = 0,
+	featureNames: Optional[Sequence[str]] = None,
+) -> Dict[str, np.ndarray]:
+	"""Compute PyRadiomics first order features for a batch of ROIs at once.
+
+	Parameters
+	----------
+	roiValues : np.ndarray | Sequence[np.ndarray]
+		Voxel values inside each ROI. Either a 2D array of shape (ROIs, voxels), e.g. several
+		negative control replicates of the same ROI, a sequence of 1D arrays of any length, or
+		a 1D array for a single ROI.
+	voxelVolume : float, default 1.0
+		Volume of a voxel in cubic mm, used by TotalEnergy.
+	binWidth : float, default 25
+		Bin width used to discretize the values for Entropy and Uniformity.
+	binCount : int, optional
+		Number of bins to discretize the values into. Overrides binWidth if set.
+	voxelArrayShift : float, default 0
+		Value added to the intensities for Energy, TotalEnergy and RootMeanSquared.
+	featureNames : Sequence[str], optional
+		Features to compute. By default, all features that are not deprecated in PyRadiomics.
+
+	Returns
+	-------
+	Dict[str, np.ndarray]
+		Array with one value per ROI for each feature, in PyRadiomics output order.
+	"""
+	batch = _FirstOrderBatch(
+		_stackRoiValues(roiValues),
+		voxelVolume=voxelVolume,
+		binSettings={"binWidth": binWidth, "binCount": binCount},
+		voxelArrayShift=voxelArrayShift,
+	)
+	return {
+		featureName: getattr(batch, f"get{featureName}FeatureValue")()
+		for featureName in getFirstOrderFeatureNames(featureNames)
+	}
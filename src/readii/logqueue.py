@@ -0,0 +1,196 @@
+"""Logs of worker processes sent through a queue to a single listener in the main process.
+
+Worker processes (joblib's process workers and readii.supervisor's workers) otherwise each write their
+logs to their own stderr, where lines of different workers interleave, and the logs of a worker that
+is killed can be lost. Within `aggregatedLogs`, tasks wrapped with `forwardLogs` send the log records
+of readii from their worker process through a queue instead. A listener thread in the main process
+hands them to the readii handlers there: the console and a JSON lines file of the run, which gets the
+logs of the main process too.
+
+Records are made picklable in the worker before they are queued: `LazyLogValue`s are resolved,
+exceptions are formatted and values other than numbers, strings and their lists and dicts are
+converted to strings.
+"""
+
+import copy
+import logging
+import multiprocessing
+import os
+import warnings
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from functools import partial
+from logging.handlers import QueueHandler, QueueListener
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, Optional
+
+import structlog
+
+from readii.supervisor import WORKER_START_METHOD
+from readii.utils import LazyLogValue
+
+# Name of the logger whose records are forwarded from worker processes
+FORWARDED_LOGGER = "readii"
+
+# Queue of the active aggregatedLogs block and the process its listener runs in
+_logQueue: Optional[Any] = None
+_listenerPid: Optional[int] = None
+
+
+def _portableValue(value: Any) -> Any:  # noqa: ANN401
+	"""Convert a log value into one that can be pickled and rendered as JSON in another process."""
+	if isinstance(value, LazyLogValue):
+		value = value.resolve()
+	if value is None or isinstance(value, (str, int, float, bool)):
+		return value
+	if isinstance(value, (list, tuple)):
+		return [_portableValue(item) for item in value]
+	if isinstance(value, dict):
+		return {str(key): _portableValue(item) for key, item in value.items()}
+	return str(value)
+
+
+class WorkerQueueHandler(QueueHandler):
+	"""Queue handler that sends the structlog event of a record, instead of the message formatted in the worker."""
+
+	def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+		"""Copy a record with a picklable event, see the module docstring."""
+		record = copy.copy(record)
+		if isinstance(record.msg, dict):
+			# Format the exception while it is being handled, in the thread that logged it
+			eventDict = structlog.processors.format_exc_info(None, "", dict(record.msg))
+			record.msg = {key: _portableValue(value) for key, value in eventDict.items()}
+		else:
+			record.msg = logging.Formatter().format(record)
+		record.args = ()
+		record.exc_info = None
+		record.exc_text = None
+		return record
+
+
+def _addRecordInfo(
+	_logger: logging.Logger, _methodName: str, eventDict: Dict[str, Any]
+) -> Dict[str, Any]:
+	"""Add the time and process of a record to its event, as the record may be formatted later in another process."""
+	record = eventDict["_record"]
+	eventDict["timestamp"] = datetime.fromtimestamp(record.created).isoformat()
+	eventDict["process"] = record.process
+	return eventDict
+
+
+def runLogHandler(runLogPath: str | Path) -> logging.Handler:
+	"""Get a handler writing each log record as a line of JSON to runLogPath."""
+	runLogPath = Path(runLogPath)
+	runLogPath.parent.mkdir(parents=True, exist_ok=True)
+	handler = logging.FileHandler(runLogPath)
+	handler.setFormatter(
+		structlog.stdlib.ProcessorFormatter(
+			processors=[
+				_addRecordInfo,
+				structlog.stdlib.ProcessorFormatter.remove_processors_meta,
+				structlog.processors.dict_tracebacks,
+				structlog.processors.JSONRenderer(),
+			],
+			foreign_pre_chain=[structlog.stdlib.add_log_level, structlog.stdlib.add_logger_name],
+		)
+	)
+	return handler
+
+
+@contextmanager
+def _workerLogListener(readiiLogger: logging.Logger) -> Iterator[None]:
+	"""Hand the log records that worker processes send to the queue of the block to the handlers of readiiLogger."""
+	global _logQueue, _listenerPid  # noqa: PLW0603
+	# A manager queue, unlike a multiprocessing.Queue, can be sent to workers that are already running
+	with (
+		multiprocessing.get_context(WORKER_START_METHOD).Manager() as manager,
+		warnings.catch_warnings(),
+	):
+		# Exceptions of worker processes arrive formatted, which the console renderer of the listener prints as they
+		# are. WorkerQueueHandler.prepare formats them in the worker, but the renderer warns in the listener thread.
+		warnings.filterwarnings("ignore", message="Remove `format_exc_info`", category=UserWarning)
+		logQueue = manager.Queue()
+		listener = QueueListener(logQueue, *readiiLogger.handlers, respect_handler_level=True)
+		listener.start()
+		_logQueue, _listenerPid = logQueue, os.getpid()
+		try:
+			yield
+		finally:
+			_logQueue = _listenerPid = None
+			listener.stop()
+
+
+@contextmanager
+def aggregatedLogs(
+	runLogPath: Optional[str | Path] = None, processWorkers: bool = True
+) -> Iterator[None]:
+	"""Collect the logs of readii from this process and its worker processes within the block.
+
+	Parameters
+	----------
+	runLogPath : str | Path, optional
+		JSON lines file to also write the logs of the block to, e.g. readii_outputs/logs/readii_{dataset}_{time}.jsonl.
+	processWorkers : bool, default True
+		Whether tasks run in worker processes within the block. Otherwise, no queue and listener are started, as
+		thread workers log to the handlers of this process directly, and only the run log is written.
+	"""
+	if _logQueue is not None:
+		# Nested blocks share the listener of the outermost one
+		yield
+		return
+
+	readiiLogger = logging.getLogger(FORWARDED_LOGGER)
+	runHandler = runLogHandler(runLogPath) if runLogPath is not None else None
+	if runHandler is not None:
+		readiiLogger.addHandler(runHandler)
+
+	try:
+		with _workerLogListener(readiiLogger) if processWorkers else nullcontext():
+			yield
+	finally:
+		if runHandler is not None:
+			readiiLogger.removeHandler(runHandler)
+			runHandler.close()
+
+
+def _forwardingTask(
+	function: Callable[..., Any],
+	logQueue: Any,  # noqa: ANN401
+	listenerPid: int,
+	logLevel: int,
+	/,
+	*args: Any,  # noqa: ANN401
+	**kwargs: Any,  # noqa: ANN401
+) -> Any:  # noqa: ANN401
+	"""Run a task, sending the readii log records of a worker process to logQueue while it runs."""
+	if os.getpid() == listenerPid:
+		# Thread workers log to the handlers of the main process directly
+		return function(*args, **kwargs)
+
+	readiiLogger = logging.getLogger(FORWARDED_LOGGER)
+	workerHandlers, workerLevel = readiiLogger.handlers, readiiLogger.level
+	readiiLogger.handlers = [WorkerQueueHandler(logQueue)]
+	readiiLogger.setLevel(logLevel)
+	try:
+		return function(*args, **kwargs)
+	finally:
+		# Worker processes are reused by later runs, which may not forward their logs
+		readiiLogger.handlers = workerHandlers
+		readiiLogger.setLevel(workerLevel)
+
+
+def forwardLogs(function: Callable[..., Any]) -> Callable[..., Any]:
+	"""Wrap a task for a worker process so that its logs go to the listener of the active aggregatedLogs block.
+
+	The worker logs at the level of the readii logger of this process. The task is returned as it is outside of an
+	aggregatedLogs block.
+	"""
+	if _logQueue is None:
+		return function
+	return partial(
+		_forwardingTask,
+		function,
+		_logQueue,
+		_listenerPid,
+		logging.getLogger(FORWARDED_LOGGER).getEffectiveLevel(),
+	)
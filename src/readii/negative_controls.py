@@ -1,8 +1,16 @@
+import ctypes
+
 import SimpleITK as sitk
 from SimpleITK import Image
 import numpy as np
+from joblib import Parallel, delayed
 
 from readii.image_processing import alignImages
+from readii.negative_controls_refactor.buffer_pool import BufferPool
+from readii.negative_controls_refactor.chunked import randomize_slabs, sample_slabs, shuffle_slabs
+from readii.negative_controls_refactor.histogram import ValueHistogram
+from readii.negative_controls_refactor.parallel_random import random_integers
+from readii.utils.shared_volume import SharedVolume, SharedVolumeHandle
 
 from typing import Optional, Union
 from numpy import ndarray
@@ -36,6 +44,7 @@ def getArrayFromImageOrArray(imageOrArray: Union[Image, ndarray]) -> ndarray:
 def makeShuffleImage(
     baseImage: Union[Image, ndarray],
     randomSeed: Optional[int] = None,
+    bufferPool: Optional[BufferPool] = None,
 ) -> Union[Image, ndarray]:
     
     """Function to shuffle all pixel values in a sitk.Image or np.ndarray (developed for 3D, should work on 2D as well)
@@ -46,33 +55,43 @@ def makeShuffleImage(
         Image to shuffle the pixels in. Can be a sitk.Image or np.ndarray.
     randomSeed : int
         Value to initialize random number generator with. Set for reproducible results.
+    bufferPool : BufferPool, optional
+        Pool to take full-volume working arrays from when baseImage is a sitk.Image. The arrays are given back to the
+        pool once the output image is created, so they are reused by the next negative control of the same size.
         
     Returns
     -------
     sitk.Image | np.ndarray
         Image with all pixel values randomly shuffled with same dimensions and object type as input image.
     """
-    # # Check if baseImage is a sitk.Image or np.ndarray
-    arrImage = getArrayFromImageOrArray(baseImage)
+    # Set the random seed for np random generator
+    randNumGen = np.random.default_rng(seed=randomSeed)
 
-    # Get array dimensions to reshape back to
-    imgDimensions = arrImage.shape
+    if bufferPool is not None and type(baseImage) == sitk.Image:
+        # Shuffle a pooled copy of the image values in place
+        shuffled3DArrImage = bufferPool.acquire_copy(sitk.GetArrayViewFromImage(baseImage))
+        randNumGen.shuffle(shuffled3DArrImage.reshape(-1))
+    else:
+        # # Check if baseImage is a sitk.Image or np.ndarray
+        arrImage = getArrayFromImageOrArray(baseImage)
 
-    # Flatten the 3D array to 1D so values can be shuffled
-    flatArrImage = arrImage.flatten()
+        # Get array dimensions to reshape back to
+        imgDimensions = arrImage.shape
 
-    # Set the random seed for np random generator
-    randNumGen = np.random.default_rng(seed=randomSeed)
+        # Flatten the 3D array to 1D so values can be shuffled
+        flatArrImage = arrImage.flatten()
 
-    # Shuffle the flat array
-    randNumGen.shuffle(flatArrImage)
+        # Shuffle the flat array
+        randNumGen.shuffle(flatArrImage)
 
-    # Reshape the array back into the original image dimensions
-    shuffled3DArrImage = np.reshape(flatArrImage, imgDimensions)
+        # Reshape the array back into the original image dimensions
+        shuffled3DArrImage = np.reshape(flatArrImage, imgDimensions)
 
     if type(baseImage) == sitk.Image:
         # Convert back to sitk Image
         shuffledImage = sitk.GetImageFromArray(shuffled3DArrImage)
+        if bufferPool is not None:
+            bufferPool.release(shuffled3DArrImage)
 
         # Set the origin/direction/spacing from original image to shuffled image
         alignedShuffledImage = alignImages(baseImage, shuffledImage)
@@ -87,6 +106,9 @@ def makeShuffleImage(
 def makeRandomImage(
     baseImage: Union[Image, ndarray],
     randomSeed: Optional[int] = None,
+    nThreads: int = 1,
+    nChunks: Optional[int] = None,
+    bufferPool: Optional[BufferPool] = None,
 ) -> Union[sitk.Image, np.ndarray]:
     """Function to generate random pixel values based on the range of values in a sitk.Image or np.ndarray (developed for 3D, should work on 2D as well)
 
@@ -96,14 +118,32 @@ def makeRandomImage(
         Image to randomly generate pixel values. Can be a sitk.Image or np.ndarray.
     randomSeed : int
         Value to initialize random number generator with. Set for reproducible results.
+    nThreads : int, default 1
+        Number of threads to generate the random values with.
+    nChunks : int, optional
+        Number of independently seeded chunks to split the image into. Defaults to nThreads.
+        Set to get the same image for any nThreads.
+    bufferPool : BufferPool, optional
+        Pool to take full-volume working arrays from when baseImage is a sitk.Image. The arrays are given back to the
+        pool once the output image is created, so they are reused by the next negative control of the same size.
 
     Returns
     -------
     sitk.Image | np.ndarray
         Image with all pixel values randomly generated with same dimensions and object type as input image.
+
+    Notes
+    -----
+    With the default nThreads=1 and nChunks=None, the values are drawn from a single
+    generator seeded with randomSeed. See readii.negative_controls_refactor.parallel_random
+    for how the values are split across threads.
     """
     # # Check if baseImage is a sitk.Image or np.ndarray
-    arrImage = getArrayFromImageOrArray(baseImage)
+    # The values are only read, so with a buffer pool avoid copying them out of the sitk Image
+    if bufferPool is not None and type(baseImage) == sitk.Image:
+        arrImage = sitk.GetArrayViewFromImage(baseImage)
+    else:
+        arrImage = getArrayFromImageOrArray(baseImage)
 
     # Get array dimensions to reshape back to
     imgDimensions = arrImage.shape
@@ -115,17 +155,20 @@ def makeRandomImage(
     # Delete arrImage to save memory
     del arrImage
 
-    # Set the random seed for np random generator
-    randNumGen = np.random.default_rng(seed=randomSeed)
+    # Generate the random values into a pooled array when converting to a sitk Image afterwards
+    usePool = bufferPool is not None and type(baseImage) == sitk.Image
+    random3DArr = bufferPool.acquire(imgDimensions, np.int64) if usePool else None
 
     # Generate random array with same dimensions as baseImage with values ranging from the minimum to maximum inclusive of the original image
-    random3DArr = randNumGen.integers(
-        low=minVoxelVal, high=maxVoxelVal, endpoint=True, size=imgDimensions
+    random3DArr = random_integers(
+        minVoxelVal, maxVoxelVal, imgDimensions, randomSeed, n_threads=nThreads, n_chunks=nChunks, out=random3DArr
     )
 
     if type(baseImage) == sitk.Image:
         # Convert random array to a sitk Image
         randomImage = sitk.GetImageFromArray(random3DArr)
+        if usePool:
+            bufferPool.release(random3DArr)
 
         # Set the origin/direction/spacing from the original image to the random image
         alignedRandomImage = alignImages(baseImage, randomImage)
@@ -140,6 +183,7 @@ def makeRandomImage(
 def makeRandomSampleFromDistributionImage(
     baseImage: Union[Image, ndarray],
     randomSeed: Optional[int] = None,
+    bufferPool: Optional[BufferPool] = None,
 ) -> Union[sitk.Image, np.ndarray]:
     """Function to randomly sample all the pixel values the distribution of existing values in a sitk.Image or np.ndarray.
 
@@ -149,32 +193,44 @@ def makeRandomSampleFromDistributionImage(
         Image to randomly sample the pixels from. Can be a sitk.Image or np.ndarray.
     randomSeed : int
         Value to initialize random number generator with. Set for reproducible results.
+    bufferPool : BufferPool, optional
+        Pool to take full-volume working arrays from when baseImage is a sitk.Image. The arrays are given back to the
+        pool once the output image is created, so they are reused by the next negative control of the same size.
     Returns
     -------
     sitk.Image | np.ndarray
         Image with all pixel values randomly sampled from the initial dstribution of the image, with same dimensions and object type as input image.
+
+    Notes
+    -----
+    Values are sampled from a histogram of the image values. For a given randomSeed, the output only depends
+    on the distribution of values in the image, not on their positions. See readii.negative_controls_refactor.histogram.
     """
     # Check if baseImage is a sitk.Image or np.ndarray
-    arrImage = getArrayFromImageOrArray(baseImage)
-
-    # Get array dimensions to reshape back to
-    imgDimensions = arrImage.shape
+    # The values are only read, so with a buffer pool avoid copying them out of the sitk Image
+    if bufferPool is not None and type(baseImage) == sitk.Image:
+        arrImage = sitk.GetArrayViewFromImage(baseImage)
+    else:
+        arrImage = getArrayFromImageOrArray(baseImage)
 
-    # Flatten the 3D array to 1D so values can be shuffled
-    flatArrImage = arrImage.flatten()
+    # Count the occurrences of each value to sample from instead of copying the flattened array
+    valueHistogram = ValueHistogram.from_array(arrImage)
 
     # Set the random seed for np random number generator
     randNumGen = np.random.default_rng(seed=randomSeed)
 
-    # Randomly sample values for new array from original image distribution
-    sampled_array = randNumGen.choice(flatArrImage, size=len(flatArrImage), replace=True)
+    # Sample into a pooled array when converting to a sitk Image afterwards
+    usePool = bufferPool is not None and type(baseImage) == sitk.Image
+    randomlySampled3DArrImage = bufferPool.acquire(arrImage.shape, valueHistogram.values.dtype) if usePool else None
 
-    # Reshape the array back into the original image dimensions
-    randomlySampled3DArrImage = np.reshape(sampled_array, imgDimensions)
+    # Randomly sample values for new array from original image distribution
+    randomlySampled3DArrImage = valueHistogram.sample(arrImage.shape, randNumGen, out=randomlySampled3DArrImage)
 
     if type(baseImage) == sitk.Image:
         # Convert back to sitk Image
         randomlySampledImage = sitk.GetImageFromArray(randomlySampled3DArrImage)
+        if usePool:
+            bufferPool.release(randomlySampled3DArrImage)
 
         # Set the origin/direction/spacing from original image to sampled image
         alignedRandomlySampledImage = alignImages(baseImage, randomlySampledImage)
@@ -189,7 +245,8 @@ def negativeControlROIOnly(
         baseImage: Union[Image, ndarray], 
         roiMask: Union[Image, ndarray], 
         negativeControlType: str = "shuffled",
-        randomSeed: Optional[int] = None
+        randomSeed: Optional[int] = None,
+        bufferPool: Optional[BufferPool] = None,
         ) -> Union[Image, ndarray]:
     """Function to apply a negative control to a ROI only, without changing the background of the image.
 
@@ -203,6 +260,9 @@ def negativeControlROIOnly(
         Name of negative control to apply.
     randomSeed : int, default None    
         Value to initialize random number generator with. Set for reproducible results.
+    bufferPool : BufferPool, optional
+        Pool to take the full-volume working copy of the image and the binary mask from when baseImage is a sitk.Image.
+        They are given back to the pool once the output image is created.
     
     Returns
     -------
@@ -213,38 +273,54 @@ def negativeControlROIOnly(
     if negativeControlType not in ["shuffled", "randomized", "randomized_sampled"]:
         raise ValueError("negativeControlType must be one of 'shuffled', 'randomized', or 'randomized_sampled'")
     
-    # Check if baseImage is a sitk.Image or np.ndarray
-    arrBaseImage = getArrayFromImageOrArray(baseImage)
-    
-    # Check if roiMask is a sitk.Image or np.ndarray
-    arrROIMask = getArrayFromImageOrArray(roiMask)
-
-    # Get binary segmentation masks
-    # ROI is 1, background is 0
-    binROIMask = np.where(arrROIMask > 0, 1, 0)
-    if binROIMask.any() == False:
-        raise ValueError("ROI mask is all 0s. No pixels in ROI to apply negative control to. ROI pixels should be > 1.")
-
-    # Get just ROI pixels
-    maskIndices = np.nonzero(binROIMask)
-    # Get a 1D array of just the ROI pixels
-    flatROIBaseValues = arrBaseImage[maskIndices]
-
-    # Get desired negative control of baseImage
-    arrNCROIValues = applyNegativeControl(baseImage = flatROIBaseValues,
-                                          negativeControlType = negativeControlType,
-                                          negativeControlRegion = "full",
-                                          randomSeed = randomSeed)
-
-    arrBaseImage[maskIndices] = arrNCROIValues
-
-    # # Apply negative control to ROI pixels and keep original non-ROI pixels
-    # arrNCROIImage = (arrNCBaseImage * binROIMask) + (arrBaseImage * inverseBinROIMask)
+    usePool = bufferPool is not None and type(baseImage) == sitk.Image
+    if usePool:
+        # Work on a pooled copy of the image values and read the mask without copying it
+        arrBaseImage = bufferPool.acquire_copy(sitk.GetArrayViewFromImage(baseImage))
+        arrROIMask = sitk.GetArrayViewFromImage(roiMask) if type(roiMask) == sitk.Image else roiMask
+
+        # Get binary segmentation mask into a pooled array
+        binROIMask = bufferPool.acquire(arrROIMask.shape, bool)
+        np.greater(arrROIMask, 0, out=binROIMask)
+    else:
+        # Check if baseImage is a sitk.Image or np.ndarray
+        arrBaseImage = getArrayFromImageOrArray(baseImage)
+
+        # Check if roiMask is a sitk.Image or np.ndarray
+        arrROIMask = getArrayFromImageOrArray(roiMask)
+
+        # Get binary segmentation masks
+        # ROI is 1, background is 0
+        binROIMask = np.where(arrROIMask > 0, 1, 0)
+    # Give the pooled arrays back even if the negative control fails, e.g. for an empty ROI with keep_running
+    try:
+        if binROIMask.any() == False:
+            raise ValueError("ROI mask is all 0s. No pixels in ROI to apply negative control to. ROI pixels should be > 1.")
+
+        # Get just ROI pixels
+        maskIndices = np.nonzero(binROIMask)
+        # Get a 1D array of just the ROI pixels
+        flatROIBaseValues = arrBaseImage[maskIndices]
+
+        # Get desired negative control of baseImage
+        arrNCROIValues = applyNegativeControl(baseImage = flatROIBaseValues,
+                                              negativeControlType = negativeControlType,
+                                              negativeControlRegion = "full",
+                                              randomSeed = randomSeed)
+
+        arrBaseImage[maskIndices] = arrNCROIValues
+
+        # # Apply negative control to ROI pixels and keep original non-ROI pixels
+        # arrNCROIImage = (arrNCBaseImage * binROIMask) + (arrBaseImage * inverseBinROIMask)
+
+        if type(baseImage) == sitk.Image:
+            # Convert back to sitk Image
+            ncROIImage = sitk.GetImageFromArray(arrBaseImage)
+    finally:
+        if usePool:
+            bufferPool.release(arrBaseImage, binROIMask)
 
     if type(baseImage) == sitk.Image:
-        # Convert back to sitk Image
-        ncROIImage = sitk.GetImageFromArray(arrBaseImage)
-        
         # Set the origin/direction/spacing from original image to negative control image
         alignedNCROIImage = alignImages(baseImage, ncROIImage)
         
@@ -259,7 +335,8 @@ def negativeControlNonROIOnly(
         baseImage: Union[Image, ndarray], 
         roiMask: Union[Image, ndarray], 
         negativeControlType: str = "shuffled",
-        randomSeed: Optional[int] = None
+        randomSeed: Optional[int] = None,
+        bufferPool: Optional[BufferPool] = None,
         ) -> Union[Image, ndarray]:
     """Function to apply a negative control to all pixel values outside the ROI, without changing the ROI pixels.
 
@@ -273,6 +350,9 @@ def negativeControlNonROIOnly(
         Name of negative control to apply.
     randomSeed : int, default None    
         Value to initialize random number generator with. Set for reproducible results.
+    bufferPool : BufferPool, optional
+        Pool to take the full-volume working copy of the image and the binary mask from when baseImage is a sitk.Image.
+        They are given back to the pool once the output image is created.
     
     Returns
     -------
@@ -283,35 +363,51 @@ def negativeControlNonROIOnly(
     if negativeControlType not in ["shuffled", "randomized", "randomized_sampled"]:
         raise ValueError("negativeControlType must be one of 'shuffled', 'randomized', or 'randomized_sampled'")
     
-    # Check if baseImage is a sitk.Image or np.ndarray
-    arrBaseImage = getArrayFromImageOrArray(baseImage)
-
-    # Check if roiMask is a sitk.Image or np.ndarray
-    arrROIMask = getArrayFromImageOrArray(roiMask)
-
-    # Get binary segmentation masks
-    # ROI is 1, background is 0
-    binNonROIMask = np.where(arrROIMask > 0, 0, 1)
-    if binNonROIMask.any() == False:
-        raise ValueError("ROI mask is all 0s. No pixels in ROI to apply negative control to. ROI pixels should be > 1.")
-
-    # Get just ROI pixels
-    maskIndices = np.nonzero(binNonROIMask)
-    # Get a 1D array of just the ROI pixels
-    flatNonROIBaseValues = arrBaseImage[maskIndices]
-
-    # Get desired negative control of baseImage
-    arrNCNonROIValues = applyNegativeControl(baseImage = flatNonROIBaseValues,
-                                          negativeControlType = negativeControlType,
-                                          negativeControlRegion = "full",
-                                          randomSeed = randomSeed)
-    
-    arrBaseImage[maskIndices] = arrNCNonROIValues
+    usePool = bufferPool is not None and type(baseImage) == sitk.Image
+    if usePool:
+        # Work on a pooled copy of the image values and read the mask without copying it
+        arrBaseImage = bufferPool.acquire_copy(sitk.GetArrayViewFromImage(baseImage))
+        arrROIMask = sitk.GetArrayViewFromImage(roiMask) if type(roiMask) == sitk.Image else roiMask
+
+        # Get binary segmentation mask into a pooled array
+        binNonROIMask = bufferPool.acquire(arrROIMask.shape, bool)
+        np.less_equal(arrROIMask, 0, out=binNonROIMask)
+    else:
+        # Check if baseImage is a sitk.Image or np.ndarray
+        arrBaseImage = getArrayFromImageOrArray(baseImage)
+
+        # Check if roiMask is a sitk.Image or np.ndarray
+        arrROIMask = getArrayFromImageOrArray(roiMask)
+
+        # Get binary segmentation masks
+        # ROI is 1, background is 0
+        binNonROIMask = np.where(arrROIMask > 0, 0, 1)
+    # Give the pooled arrays back even if the negative control fails, e.g. for an empty ROI with keep_running
+    try:
+        if binNonROIMask.any() == False:
+            raise ValueError("ROI mask is all 0s. No pixels in ROI to apply negative control to. ROI pixels should be > 1.")
+
+        # Get just ROI pixels
+        maskIndices = np.nonzero(binNonROIMask)
+        # Get a 1D array of just the ROI pixels
+        flatNonROIBaseValues = arrBaseImage[maskIndices]
+
+        # Get desired negative control of baseImage
+        arrNCNonROIValues = applyNegativeControl(baseImage = flatNonROIBaseValues,
+                                              negativeControlType = negativeControlType,
+                                              negativeControlRegion = "full",
+                                              randomSeed = randomSeed)
+
+        arrBaseImage[maskIndices] = arrNCNonROIValues
+
+        if type(baseImage) == sitk.Image:
+            # Convert back to sitk Image
+            ncNonROIImage = sitk.GetImageFromArray(arrBaseImage)
+    finally:
+        if usePool:
+            bufferPool.release(arrBaseImage, binNonROIMask)
 
     if type(baseImage) == sitk.Image:
-        # Convert back to sitk Image
-        ncNonROIImage = sitk.GetImageFromArray(arrBaseImage)
-        
         # Set the origin/direction/spacing from original image to negative control image
         alignedNCNonROIImage = alignImages(baseImage, ncNonROIImage)
         
@@ -323,11 +419,114 @@ def negativeControlNonROIOnly(
 
 
 
+def _writableArrayView(image: Image) -> ndarray:
+    """Get a writable numpy view of the voxels of a sitk.Image, like sitk.GetArrayViewFromImage but not read-only.
+
+    The image must not be shared with a copy of it or modified otherwise while the view is in use.
+    """
+    readOnlyView = sitk.GetArrayViewFromImage(image)
+    imageBuffer = (ctypes.c_char * readOnlyView.nbytes).from_address(readOnlyView.__array_interface__["data"][0])
+    return np.frombuffer(imageBuffer, dtype=readOnlyView.dtype).reshape(readOnlyView.shape)
+
+
+def negativeControlInSlabs(
+        baseImage: Union[Image, ndarray],
+        negativeControlType: str = "shuffled",
+        negativeControlRegion: str = "full",
+        roiMask: Optional[Union[Image, ndarray]] = None,
+        randomSeed: Optional[int] = None,
+        slabSize: int = 32,
+        ) -> Union[Image, ndarray]:
+    """Function to apply a negative control to a sitk.Image or np.ndarray in slabs of slices, for very large volumes.
+
+    The input is read without copying it and the result is written into a single preallocated output, a sitk.Image
+    for sitk.Image inputs, so only slab-sized temporaries are created on top of the input and output.
+
+    Parameters
+    ----------
+    baseImage : sitk.Image | np.ndarray
+        Image to apply negative control to. Can be a sitk.Image or np.ndarray. Is not modified.
+    negativeControlType : {'shuffled', 'randomized', 'randomized_sampled'}, default 'shuffled'
+        Name of negative control to apply.
+    negativeControlRegion : {'full', 'roi', 'non_roi'}, default 'full'
+        Whether to apply the negative control to the entire image, to the ROI, or to the non-ROI pixels.
+    roiMask : sitk.Image | np.ndarray, default None
+        Mask of the ROI. Required for the 'roi' and 'non_roi' regions.
+    randomSeed : int, default None
+        Value to initialize random number generator with. Set for reproducible results.
+    slabSize : int, default 32
+        Number of slices (first array dimension) to process at once.
+
+    Returns
+    -------
+    sitk.Image | np.ndarray
+        Image with negative control function applied to all pixel values within the specified region, with the same
+        dimensions and object type as the input image. The pixel type is the same as the input image, except for the
+        randomized control of the full image, which is a 64-bit integer image like makeRandomImage.
+
+    Notes
+    -----
+    The randomized and randomized_sampled controls produce the same values as applyNegativeControl without slabs.
+    Shuffled controls are a uniformly random permutation of the region like applyNegativeControl, but the permutation
+    differs for each slabSize.
+    """
+    if negativeControlType not in ["shuffled", "randomized", "randomized_sampled"]:
+        raise ValueError("negativeControlType must be one of 'shuffled', 'randomized', or 'randomized_sampled'")
+
+    if negativeControlRegion != "full":
+        assert roiMask is not None, \
+            f"ROI mask is None. Must pass ROI mask to negative control function for {negativeControlType} negative control."
+
+    # Get read-only views of the image and mask to avoid copying them
+    if type(baseImage) == sitk.Image:
+        arrBaseImage = sitk.GetArrayViewFromImage(baseImage)
+    else:
+        arrBaseImage = baseImage
+
+    if type(roiMask) == sitk.Image:
+        arrROIMask = sitk.GetArrayViewFromImage(roiMask)
+    else:
+        arrROIMask = roiMask
+
+    # Preallocate the output that each slab is written into
+    # Randomizing the full image gives int64 values like makeRandomImage, other controls keep the input pixel type
+    randomizedFull = negativeControlType == "randomized" and negativeControlRegion == "full"
+    if type(baseImage) == sitk.Image:
+        # Writing into the voxels of the output image avoids copying a full array into it afterwards
+        ncImage = sitk.Image(baseImage.GetSize(), sitk.sitkInt64 if randomizedFull else baseImage.GetPixelID())
+        arrNCImage = _writableArrayView(ncImage)
+    else:
+        arrNCImage = np.empty(arrBaseImage.shape, dtype=np.int64 if randomizedFull else arrBaseImage.dtype)
+
+    # Set the random seed for np random generator
+    randNumGen = np.random.default_rng(seed=randomSeed)
+
+    slabFunctions = {
+        "shuffled": shuffle_slabs,
+        "randomized": randomize_slabs,
+        "randomized_sampled": sample_slabs,
+    }
+    slabFunctions[negativeControlType](
+        arrBaseImage, arrNCImage, randNumGen, slabSize, mask_array=arrROIMask, region=negativeControlRegion
+    )
+
+    if type(baseImage) == sitk.Image:
+        # Set the origin/direction/spacing from original image to negative control image
+        return alignImages(baseImage, ncImage)
+    else:
+        # Return the negative control array
+        return arrNCImage
+
+
 def applyNegativeControl(baseImage: Union[Image, ndarray],
                          negativeControlType: str = "shuffled",
                          negativeControlRegion: str = "full",
                          roiMask: Optional[Union[Image, ndarray]] = None,
-                         randomSeed: Optional[int] = None
+                         randomSeed: Optional[int] = None,
+                         slabSize: Optional[int] = None,
+                         nThreads: int = 1,
+                         nChunks: Optional[int] = None,
+                         bufferPool: Optional[BufferPool] = None,
 ) -> Union[Image, ndarray]:
     """Function to apply a negative control to a region of interest (ROI) within a sitk.Image or np.ndarray.
 
@@ -341,6 +540,14 @@ def applyNegativeControl(baseImage: Union[Image, ndarray],
         Whether to apply the negative control to the entire image, to the ROI, or to the non-ROI pixels.
     randomSeed : int, default None    
         Value to initialize random number generator with. Set for reproducible results.
+    slabSize : int, default None
+        If set, generate the negative control in slabs of this many slices to bound memory use. See negativeControlInSlabs.
+    nThreads : int, default 1
+        Number of threads to generate random values with for the randomized_full negative control. See makeRandomImage.
+    nChunks : int, default None
+        Number of independently seeded chunks for the randomized_full negative control. See makeRandomImage.
+    bufferPool : BufferPool, optional
+        Pool to reuse full-volume working arrays from when baseImage is a sitk.Image. Not used with slabSize.
     
     Returns
     -------
@@ -352,22 +559,118 @@ def applyNegativeControl(baseImage: Union[Image, ndarray],
         raise ValueError("negativeControlType must be one of 'shuffled', 'randomized', or 'randomized_sampled'")
     if negativeControlRegion not in ["full", "roi", "non_roi"]:
         raise ValueError("regionOfInterest must be one of 'full', 'roi', or 'non_roi'")
+
+    if slabSize is not None:
+        return negativeControlInSlabs(baseImage, negativeControlType, negativeControlRegion, roiMask, randomSeed, slabSize)
     
     if negativeControlRegion == "full":
         if negativeControlType == "shuffled":
-            return makeShuffleImage(baseImage, randomSeed)
+            return makeShuffleImage(baseImage, randomSeed, bufferPool)
         elif negativeControlType == "randomized":
-            return makeRandomImage(baseImage, randomSeed)
+            return makeRandomImage(baseImage, randomSeed, nThreads, nChunks, bufferPool)
         elif negativeControlType == "randomized_sampled":
-            return makeRandomSampleFromDistributionImage(baseImage, randomSeed)
+            return makeRandomSampleFromDistributionImage(baseImage, randomSeed, bufferPool)
     
     assert roiMask is not None, \
         f"ROI mask is None. Must pass ROI mask to negative control function for {negativeControlType} negative control."
     
     if negativeControlRegion == "roi":
-        return negativeControlROIOnly(baseImage, roiMask, negativeControlType, randomSeed)
+        return negativeControlROIOnly(baseImage, roiMask, negativeControlType, randomSeed, bufferPool)
     else: # negativeControlRegion == "non_roi":
-        return negativeControlNonROIOnly(baseImage, roiMask, negativeControlType, randomSeed)
+        return negativeControlNonROIOnly(baseImage, roiMask, negativeControlType, randomSeed, bufferPool)
+
+def _applyNegativeControlToSharedVolume(imageHandle: SharedVolumeHandle,
+                                       maskHandle: Optional[SharedVolumeHandle],
+                                       outputHandle: SharedVolumeHandle,
+                                       negativeControlType: str,
+                                       negativeControlRegion: str,
+                                       randomSeed: Optional[int],
+) -> None:
+    """Worker for applyNegativeControlsShared, writes one negative control into its shared output volume."""
+    with SharedVolume.attach(imageHandle) as sharedImage, SharedVolume.attach(outputHandle) as sharedOutput:
+        if negativeControlRegion == "full":
+            sharedOutput.array[...] = applyNegativeControl(sharedImage.array, negativeControlType, "full", randomSeed=randomSeed)
+            return
+
+        # The ROI and non-ROI controls modify an array in place, so start from a copy of the image in the output
+        sharedOutput.array[...] = sharedImage.array
+        with SharedVolume.attach(maskHandle) as sharedMask:
+            applyNegativeControl(sharedOutput.array, negativeControlType, negativeControlRegion,
+                                 roiMask=sharedMask.array, randomSeed=randomSeed)
+
+
+def applyNegativeControlsShared(baseImage: Union[Image, ndarray],
+                                negativeControls: list[tuple[str, str]],
+                                roiMask: Optional[Union[Image, ndarray]] = None,
+                                randomSeed: Optional[int] = None,
+                                nJobs: int = -1,
+) -> list[Union[Image, ndarray]]:
+    """Function to apply several negative controls to one image in parallel processes that share the image in memory.
+
+    The image and ROI mask are copied into shared memory once. Each worker process attaches to them without
+    copying and only writes its own negative control image, so memory use does not grow with the number of
+    workers by a copy of the image per worker.
+
+    Parameters
+    ----------
+    baseImage : sitk.Image | np.ndarray
+        Image to apply the negative controls to. Is not modified.
+    negativeControls : list[tuple[str, str]]
+        Pairs of negative control type and region, e.g. [("shuffled", "full"), ("randomized", "roi")].
+        See applyNegativeControl for the options.
+    roiMask : sitk.Image | np.ndarray, optional
+        ROI mask, required for the roi and non_roi regions.
+    randomSeed : int, default None
+        Value to initialize random number generator with. Set for reproducible results.
+    nJobs : int, default -1
+        Number of worker processes. -1 uses all CPUs.
+
+    Returns
+    -------
+    list[sitk.Image | np.ndarray]
+        Negative control images in the order of negativeControls, with the same object type and geometry as the input image.
+        Results, including their pixel type, are the same as calling applyNegativeControl for each pair: the dtype of the
+        input image, except for the randomized control of the full image, which is 64-bit integer like makeRandomImage.
+    """
+    for negativeControlType, negativeControlRegion in negativeControls:
+        if negativeControlType not in ["shuffled", "randomized", "randomized_sampled"]:
+            raise ValueError("negativeControlType must be one of 'shuffled', 'randomized', or 'randomized_sampled'")
+        if negativeControlRegion not in ["full", "roi", "non_roi"]:
+            raise ValueError("regionOfInterest must be one of 'full', 'roi', or 'non_roi'")
+        assert negativeControlRegion == "full" or roiMask is not None, \
+            f"ROI mask is None. Must pass ROI mask to negative control function for {negativeControlType} negative control."
+
+    sharedImage = SharedVolume.publish(baseImage)
+    sharedMask = SharedVolume.publish(roiMask) if roiMask is not None else None
+    # Randomizing the full image gives int64 values like makeRandomImage, other controls keep the input pixel type
+    sharedOutputs = [SharedVolume.create(sharedImage.array.shape,
+                                         np.int64 if negativeControl == ("randomized", "full") else sharedImage.array.dtype,
+                                         reference=baseImage if isinstance(baseImage, Image) else None)
+                     for negativeControl in negativeControls]
+
+    try:
+        Parallel(n_jobs=nJobs, prefer="processes")(
+            delayed(_applyNegativeControlToSharedVolume)(
+                sharedImage.handle,
+                sharedMask.handle if sharedMask is not None else None,
+                sharedOutput.handle,
+                negativeControlType,
+                negativeControlRegion,
+                randomSeed,
+            )
+            for sharedOutput, (negativeControlType, negativeControlRegion) in zip(sharedOutputs, negativeControls)
+        )
+
+        if isinstance(baseImage, Image):
+            return [sharedOutput.to_image() for sharedOutput in sharedOutputs]
+        return [sharedOutput.array.copy() for sharedOutput in sharedOutputs]
+
+    finally:
+        for sharedVolume in [sharedImage, sharedMask, *sharedOutputs]:
+            if sharedVolume is not None:
+                sharedVolume.close()
+                sharedVolume.unlink()
+
 
 #################################################################
 ####################### OLD FUNCTIONS ###########################
@@ -1,9 +1,21 @@
 """Module for negative control strategies and region strategies."""
 
 from .abstract_classes import NegativeControlStrategy, RegionStrategy
+from .buffer_pool import BufferPool
+from .labels import LabelGroups, label_random_seed
 from .manager import NEGATIVE_CONTROL_REGISTRY, REGION_REGISTRY, NegativeControlManager
 from .negative_controls import RandomizedControl, SampledControl, ShuffledControl
-from .regions import FullRegion, NonROIRegion, ROIRegion
+from .perturbations import (
+	PERTURBATION_REGISTRY,
+	ContourPerturbation,
+	NoisePerturbation,
+	PerturbationManager,
+	PerturbationStrategy,
+	RoiCrop,
+	RotationPerturbation,
+	TranslationPerturbation,
+)
+from .regions import FullRegion, LabelMapRegion, NonROIRegion, ROIRegion
 
 __all__ = [
 	"RegionStrategy",
@@ -11,10 +23,22 @@ __all__ = [
 	"FullRegion",
 	"ROIRegion",
 	"NonROIRegion",
+	"LabelMapRegion",
+	"LabelGroups",
+	"label_random_seed",
 	"ShuffledControl",
 	"SampledControl",
 	"RandomizedControl",
 	"REGION_REGISTRY",
 	"NEGATIVE_CONTROL_REGISTRY",
 	"NegativeControlManager",
+	"BufferPool",
+	"PerturbationStrategy",
+	"RotationPerturbation",
+	"TranslationPerturbation",
+	"NoisePerturbation",
+	"ContourPerturbation",
+	"PERTURBATION_REGISTRY",
+	"PerturbationManager",
+	"RoiCrop",
 ]
@@ -1,13 +1,19 @@
 from abc import ABC, abstractmethod
-from dataclasses import dataclass, field
-from typing import Optional, TypeVar
+from dataclasses import dataclass, field, fields, replace
+from typing import Optional, TypeVar, Union
 
 import numpy as np
 import SimpleITK as sitk
 
+from .buffer_pool import BufferPool
+from .labels import LabelGroups, label_random_seed
+
 # Define a TypeVar for image-like inputs
 ImageInput = TypeVar("ImageInput", sitk.Image, np.ndarray)
 
+# Voxels selected by a region strategy, see RegionStrategy.select
+RegionSelection = Union[np.ndarray, LabelGroups]
+
 
 @dataclass
 class RegionStrategy(ABC):
@@ -50,6 +56,24 @@ class RegionStrategy(ABC):
 		"""
 		return cls.region_name
 
+	def select(self, image_array: np.ndarray, mask_array: np.ndarray) -> RegionSelection:
+		"""Select the voxels a negative control should be applied to.
+
+		Parameters
+		----------
+		image_array : np.ndarray
+			The base image as a numpy array.
+		mask_array : np.ndarray
+			The mask defining the region to modify.
+
+		Returns
+		-------
+		np.ndarray | LabelGroups
+			Boolean mask of the region by default. Region strategies that apply the control
+			within each label of a label map independently return `LabelGroups` instead.
+		"""
+		return self(image_array, mask_array).astype(bool)
+
 
 @dataclass
 class NegativeControlStrategy(ABC):
@@ -91,6 +115,7 @@ class NegativeControlStrategy(ABC):
 		image: ImageInput,
 		mask: Optional[ImageInput] = None,
 		region: Optional[RegionStrategy] = None,
+		buffer_pool: Optional[BufferPool] = None,
 	) -> ImageInput:
 		"""Apply the negative control strategy to the input image.
 
@@ -102,30 +127,125 @@ class NegativeControlStrategy(ABC):
 			The mask defining the region to apply the control.
 		region : RegionStrategy, optional
 			The strategy to handle the region logic.
+		buffer_pool : BufferPool, optional
+			Pool to take the working copy of a SimpleITK input image from. The copy is given
+			back to the pool once the output image is created. Not used for numpy inputs.
 
 		Returns
 		-------
 		sitk.Image | np.ndarray
 			The transformed image.
 		"""
-		image_array = self.to_array(image)
+		use_pool = buffer_pool is not None and isinstance(image, sitk.Image)
+		if use_pool:
+			working_array = buffer_pool.acquire_copy(sitk.GetArrayViewFromImage(image))
+		else:
+			working_array = self.to_array(image)
 
 		if mask is not None and region is not None:
-			mask_array = self.to_array(mask)
-			region_mask = region(image_array, mask_array)
-			mask_indices = np.nonzero(region_mask)
-
-			# Apply the control only within the specified region
-			flat_region_values = image_array[mask_indices]
-			transformed_values = self.transform(flat_region_values)
-			image_array[mask_indices] = transformed_values
+			# The mask is only read, so a view is enough when pooling
+			mask_array = (
+				sitk.GetArrayViewFromImage(mask)
+				if use_pool and isinstance(mask, sitk.Image)
+				else self.to_array(mask)
+			)
+			image_array = self.apply_to_array(
+				working_array, region.select(working_array, mask_array)
+			)
 		else:
 			# Apply the control to the entire image
-			image_array = self.transform(image_array)
+			image_array = self.apply_to_array(working_array)
+
+		transformed = self.to_image_like(image_array, image)
+		if use_pool:
+			buffer_pool.release(working_array)
+		return transformed
+
+	def apply_to_array(
+		self,
+		image_array: np.ndarray,
+		region_indices: Optional[RegionSelection | tuple[np.ndarray, ...]] = None,
+	) -> np.ndarray:
+		"""Apply the transformation to an array, optionally only within a region.
+
+		Parameters
+		----------
+		image_array : np.ndarray
+			The image as a numpy array. When `region_indices` is given, the transformed
+			values are written into this array in place.
+		region_indices : np.ndarray | LabelGroups | tuple[np.ndarray, ...], optional
+			Boolean mask or index tuple (as returned by `np.nonzero`) selecting the voxels
+			to transform, or `LabelGroups` to transform the voxels of each label
+			independently. If None, the entire array is transformed.
+
+		Returns
+		-------
+		np.ndarray
+			The transformed array.
+		"""
+		if region_indices is None:
+			return self.transform(image_array)
 
-		if isinstance(image, sitk.Image):
+		if isinstance(region_indices, LabelGroups):
+			return self.apply_per_label(image_array, region_indices)
+
+		# Apply the control only within the specified region
+		flat_region_values = image_array[region_indices]
+		image_array[region_indices] = self.transform(flat_region_values)
+		return image_array
+
+	def apply_per_label(self, image_array: np.ndarray, label_groups: LabelGroups) -> np.ndarray:
+		"""Apply the transformation within each label of a label map independently.
+
+		Each label is transformed as if it were the only region, with a random seed derived
+		from `random_seed` and the label value (see `label_random_seed`).
+
+		Parameters
+		----------
+		image_array : np.ndarray
+			The image as a numpy array. Transformed values are written into this array in
+			place if it is C-contiguous.
+		label_groups : LabelGroups
+			The voxels of the label map grouped by label.
+
+		Returns
+		-------
+		np.ndarray
+			The transformed array.
+		"""
+		flat_image = image_array.reshape(-1)
+		has_seed = "random_seed" in {f.name for f in fields(self)}
+
+		for label, voxel_indices in label_groups:
+			label_control = (
+				replace(self, random_seed=label_random_seed(self.random_seed, label))
+				if has_seed
+				else self
+			)
+			flat_image[voxel_indices] = label_control.transform(flat_image[voxel_indices])
+
+		return flat_image.reshape(image_array.shape)
+
+	@staticmethod
+	def to_image_like(image_array: np.ndarray, reference: ImageInput) -> ImageInput:
+		"""Convert a numpy array back to the type of the reference input.
+
+		Parameters
+		----------
+		image_array : np.ndarray
+			The array to convert.
+		reference : sitk.Image | np.ndarray
+			The original input. If it is a SimpleITK Image, its origin, spacing, and
+			direction are copied to the output image.
+
+		Returns
+		-------
+		sitk.Image | np.ndarray
+			`image_array` as a SimpleITK Image if `reference` is one, otherwise unchanged.
+		"""
+		if isinstance(reference, sitk.Image):
 			transformed_image = sitk.GetImageFromArray(image_array)
-			transformed_image.CopyInformation(image)
+			transformed_image.CopyInformation(reference)
 			return transformed_image
 
 		return image_array
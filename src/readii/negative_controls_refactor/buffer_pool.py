@@ -0,0 +1,139 @@
+"""Reusable working arrays for negative control generation.
+
+Generating a negative control for a `sitk.Image` needs full-volume working arrays: a
+writable copy of the image, region masks, and the generated values. When controls are
+generated for many images of the same size, `BufferPool` hands out arrays released by
+earlier controls instead of allocating new ones, which avoids repeated large
+allocations and the memory fragmentation they cause.
+
+Buffers are keyed by shape and dtype. A buffer handed out by `acquire` belongs to the
+caller until it is given back with `release`; its contents are undefined when acquired.
+"""
+
+import threading
+import weakref
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Iterator
+
+import numpy as np
+
+BufferKey = tuple[tuple[int, ...], str]
+
+
+class BufferPool:
+	"""Thread-safe pool of numpy arrays keyed by shape and dtype.
+
+	Parameters
+	----------
+	max_free_per_key : int, default 4
+		Maximum number of released buffers kept for each shape and dtype. Buffers released
+		beyond this are dropped and freed by numpy.
+	"""
+
+	def __init__(self, max_free_per_key: int = 4) -> None:
+		self.max_free_per_key = max_free_per_key
+		self.n_allocated = 0
+		self.n_reused = 0
+
+		self._free: dict[BufferKey, list[np.ndarray]] = defaultdict(list)
+		# Weak references, so buffers that are never released are still freed by numpy
+		self._in_use: weakref.WeakValueDictionary[int, np.ndarray] = weakref.WeakValueDictionary()
+		self._lock = threading.Lock()
+
+	@staticmethod
+	def _key(shape: tuple[int, ...], dtype: np.dtype | str) -> BufferKey:
+		return tuple(int(dim) for dim in shape), np.dtype(dtype).str
+
+	def acquire(self, shape: tuple[int, ...], dtype: np.dtype | str) -> np.ndarray:
+		"""Get an uninitialized C-contiguous array, reusing a released one if available.
+
+		Parameters
+		----------
+		shape : tuple[int, ...]
+			Shape of the array.
+		dtype : np.dtype | str
+			Numpy dtype of the array.
+
+		Returns
+		-------
+		np.ndarray
+			Array owned by the caller until it is passed to `release`.
+		"""
+		key = self._key(shape, dtype)
+		with self._lock:
+			if self._free[key]:
+				buffer = self._free[key].pop()
+				self.n_reused += 1
+			else:
+				buffer = np.empty(key[0], dtype=key[1])
+				self.n_allocated += 1
+			self._in_use[id(buffer)] = buffer
+		return buffer
+
+	def acquire_copy(self, array: np.ndarray) -> np.ndarray:
+		"""Get a pooled array holding a copy of `array`.
+
+		Parameters
+		----------
+		array : np.ndarray
+			Array to copy, e.g. a read-only view from `sitk.GetArrayViewFromImage`.
+
+		Returns
+		-------
+		np.ndarray
+			Writable copy of `array`, owned by the caller until it is passed to `release`.
+		"""
+		buffer = self.acquire(array.shape, array.dtype)
+		np.copyto(buffer, array)
+		return buffer
+
+	def release(self, *buffers: np.ndarray) -> None:
+		"""Give buffers back to the pool. They must not be used afterwards.
+
+		Parameters
+		----------
+		*buffers : np.ndarray
+			Arrays returned by `acquire` or `acquire_copy`.
+
+		Raises
+		------
+		ValueError
+			If an array was not acquired from this pool or was already released.
+		"""
+		with self._lock:
+			for buffer in buffers:
+				if self._in_use.pop(id(buffer), None) is not buffer:
+					msg = "Can only release arrays acquired from this BufferPool, and only once."
+					raise ValueError(msg)
+
+				free_buffers = self._free[self._key(buffer.shape, buffer.dtype)]
+				if len(free_buffers) < self.max_free_per_key:
+					free_buffers.append(buffer)
+
+	@contextmanager
+	def borrow(self, shape: tuple[int, ...], dtype: np.dtype | str) -> Iterator[np.ndarray]:
+		"""Acquire a buffer for the duration of a `with` block.
+
+		Parameters
+		----------
+		shape : tuple[int, ...]
+			Shape of the array.
+		dtype : np.dtype | str
+			Numpy dtype of the array.
+
+		Yields
+		------
+		np.ndarray
+			Array that is released when the block exits.
+		"""
+		buffer = self.acquire(shape, dtype)
+		try:
+			yield buffer
+		finally:
+			self.release(buffer)
+
+	def clear(self) -> None:
+		"""Drop all released buffers. Buffers in use are unaffected."""
+		with self._lock:
+			self._free.clear()
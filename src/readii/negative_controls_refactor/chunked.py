@@ -0,0 +1,307 @@
+"""Negative controls generated slab by slab for very large volumes.
+
+The functions in this module process an image array in slabs along its first axis
+(z for arrays from `sitk.GetArrayFromImage`) and write the result into a preallocated
+output array. Only slab-sized temporaries are created, so the peak memory is close to the
+size of the input plus the output, regardless of the size of the volume.
+
+The statistics of each control are the same as when processing the whole volume at once:
+
+- `shuffle_slabs` applies a uniformly random permutation across the whole region, done in
+  blocks. The number of values moving from each source slab to each destination slab is
+  drawn from a multivariate hypergeometric distribution, values are distributed
+  accordingly, then shuffled within each destination slab.
+- `randomize_slabs` draws uniformly between the minimum and maximum of the region.
+- `sample_slabs` samples from the `ValueHistogram` of the region.
+
+For a given random generator, `randomize_slabs` and `sample_slabs` produce the same values
+as processing the whole region at once, independent of the slab size. `shuffle_slabs`
+produces a different, equally random, permutation for each slab size.
+"""
+
+from typing import Callable, Iterator, Literal, Optional
+
+import numpy as np
+
+from .histogram import ValueHistogram
+
+SlabRegion = Literal["full", "roi", "non_roi"]
+
+
+def iter_slabs(depth: int, slab_size: int) -> Iterator[slice]:
+	"""Yield consecutive slices of at most `slab_size` along an axis of length `depth`."""
+	if slab_size < 1:
+		msg = f"slab_size must be a positive integer, got {slab_size}."
+		raise ValueError(msg)
+	for start in range(0, depth, slab_size):
+		yield slice(start, min(start + slab_size, depth))
+
+
+def _region_slab_mask(
+	mask_array: Optional[np.ndarray],
+	region: SlabRegion,
+	slab: slice,
+) -> Optional[np.ndarray]:
+	"""Get the boolean region mask for one slab, or None if the whole slab is in the region."""
+	match region:
+		case "full":
+			return None
+		case "roi":
+			return mask_array[slab] > 0
+		case "non_roi":
+			return mask_array[slab] == 0
+		case _:
+			msg = f"region must be one of 'full', 'roi', or 'non_roi', got {region}."
+			raise ValueError(msg)
+
+
+def _check_arrays(
+	image_array: np.ndarray,
+	out: np.ndarray,
+	mask_array: Optional[np.ndarray],
+	region: SlabRegion,
+) -> None:
+	"""Validate the shapes of the input, output, and mask arrays."""
+	if out.shape != image_array.shape:
+		msg = f"out has shape {out.shape}, expected {image_array.shape}."
+		raise ValueError(msg)
+	if np.shares_memory(out, image_array):
+		msg = "out must not share memory with image_array."
+		raise ValueError(msg)
+	if region != "full" and (mask_array is None or mask_array.shape != image_array.shape):
+		msg = f"A mask with shape {image_array.shape} is required for the '{region}' region."
+		raise ValueError(msg)
+
+
+def _region_sizes(
+	image_array: np.ndarray,
+	mask_array: Optional[np.ndarray],
+	region: SlabRegion,
+	slabs: list[slice],
+) -> np.ndarray:
+	"""Count the voxels of the region in each slab."""
+	sizes = []
+	for slab in slabs:
+		region_mask = _region_slab_mask(mask_array, region, slab)
+		if region_mask is None:
+			sizes.append(image_array[slab].size)
+		else:
+			sizes.append(int(np.count_nonzero(region_mask)))
+
+	sizes = np.asarray(sizes, dtype=np.int64)
+	if sizes.sum() == 0:
+		msg = f"No voxels in the '{region}' region to apply negative control to."
+		raise ValueError(msg)
+	return sizes
+
+
+def _fill_slabs(
+	image_array: np.ndarray,
+	out: np.ndarray,
+	mask_array: Optional[np.ndarray],
+	region: SlabRegion,
+	slabs: list[slice],
+	*,
+	generate: Callable[[int], np.ndarray],
+) -> np.ndarray:
+	"""Write `generate(n)` values into the region of each slab and copy the rest of the image."""
+	for slab in slabs:
+		region_mask = _region_slab_mask(mask_array, region, slab)
+		if region_mask is None:
+			out[slab] = generate(out[slab].size).reshape(out[slab].shape)
+			continue
+
+		out[slab] = image_array[slab]
+		region_size = int(np.count_nonzero(region_mask))
+		if region_size:
+			out[slab][region_mask] = generate(region_size)
+
+	return out
+
+
+def shuffle_slabs(
+	image_array: np.ndarray,
+	out: np.ndarray,
+	rng: np.random.Generator,
+	slab_size: int,
+	*,
+	mask_array: Optional[np.ndarray] = None,
+	region: SlabRegion = "full",
+) -> np.ndarray:
+	"""Shuffle the values of a region of an image, slab by slab.
+
+	Parameters
+	----------
+	image_array : np.ndarray
+		Image to shuffle the values of. Is not modified, can be a read-only view.
+	out : np.ndarray
+		Preallocated array with the same shape as `image_array` to write the result to.
+	rng : np.random.Generator
+		Random number generator to draw from.
+	slab_size : int
+		Number of slices along the first axis to process at once.
+	mask_array : np.ndarray, optional
+		Mask of the ROI, required for the 'roi' and 'non_roi' regions.
+	region : {'full', 'roi', 'non_roi'}, default 'full'
+		Region of the image to shuffle the values within.
+
+	Returns
+	-------
+	np.ndarray
+		`out`, with the values within the region shuffled and all other values copied
+		from `image_array`.
+	"""
+	_check_arrays(image_array, out, mask_array, region)
+	slabs = list(iter_slabs(image_array.shape[0], slab_size))
+	sizes = _region_sizes(image_array, mask_array, region, slabs)
+
+	# Number of values moving from each source slab (rows) to each destination slab (columns)
+	transfers = np.empty((len(slabs), len(slabs)), dtype=np.int64)
+	remaining = sizes.copy()
+	for source_index, source_size in enumerate(sizes):
+		transfers[source_index] = rng.multivariate_hypergeometric(remaining, source_size)
+		remaining -= transfers[source_index]
+
+	# Stage the values for each destination slab at the start of its own output slab
+	filled = np.zeros(len(slabs), dtype=np.int64)
+	for source_index, source_slab in enumerate(slabs):
+		region_mask = _region_slab_mask(mask_array, region, source_slab)
+		source_values = image_array[source_slab]
+		source_values = (
+			source_values.reshape(-1).copy() if region_mask is None else source_values[region_mask]
+		)
+		rng.shuffle(source_values)
+
+		split_points = np.cumsum(transfers[source_index])[:-1]
+		for dest_index, values in enumerate(np.split(source_values, split_points)):
+			staged = out[slabs[dest_index]].reshape(-1)
+			staged[filled[dest_index] : filled[dest_index] + values.size] = values
+			filled[dest_index] += values.size
+
+	# Shuffle the values received by each destination slab and put them into its region
+	for dest_index, dest_slab in enumerate(slabs):
+		region_mask = _region_slab_mask(mask_array, region, dest_slab)
+		if region_mask is None:
+			rng.shuffle(out[dest_slab].reshape(-1))
+			continue
+
+		received = out[dest_slab].reshape(-1)[: sizes[dest_index]].copy()
+		rng.shuffle(received)
+		out[dest_slab] = image_array[dest_slab]
+		out[dest_slab][region_mask] = received
+
+	return out
+
+
+def randomize_slabs(
+	image_array: np.ndarray,
+	out: np.ndarray,
+	rng: np.random.Generator,
+	slab_size: int,
+	*,
+	mask_array: Optional[np.ndarray] = None,
+	region: SlabRegion = "full",
+) -> np.ndarray:
+	"""Randomly generate values within the range of a region of an image, slab by slab.
+
+	Parameters
+	----------
+	image_array : np.ndarray
+		Image to base the range of random values on. Is not modified, can be a read-only view.
+	out : np.ndarray
+		Preallocated array with the same shape as `image_array` to write the result to.
+	rng : np.random.Generator
+		Random number generator to draw from.
+	slab_size : int
+		Number of slices along the first axis to process at once.
+	mask_array : np.ndarray, optional
+		Mask of the ROI, required for the 'roi' and 'non_roi' regions.
+	region : {'full', 'roi', 'non_roi'}, default 'full'
+		Region of the image to randomize the values within.
+
+	Returns
+	-------
+	np.ndarray
+		`out`, with the values within the region drawn uniformly between the minimum and
+		maximum of the region (inclusive) and all other values copied from `image_array`.
+	"""
+	_check_arrays(image_array, out, mask_array, region)
+	slabs = list(iter_slabs(image_array.shape[0], slab_size))
+
+	min_value, max_value = None, None
+	for slab in slabs:
+		region_mask = _region_slab_mask(mask_array, region, slab)
+		values = image_array[slab] if region_mask is None else image_array[slab][region_mask]
+		if values.size:
+			min_value = values.min() if min_value is None else min(min_value, values.min())
+			max_value = values.max() if max_value is None else max(max_value, values.max())
+
+	if min_value is None:
+		msg = f"No voxels in the '{region}' region to apply negative control to."
+		raise ValueError(msg)
+
+	return _fill_slabs(
+		image_array,
+		out,
+		mask_array,
+		region,
+		slabs,
+		generate=lambda size: rng.integers(low=min_value, high=max_value, endpoint=True, size=size),
+	)
+
+
+def sample_slabs(
+	image_array: np.ndarray,
+	out: np.ndarray,
+	rng: np.random.Generator,
+	slab_size: int,
+	*,
+	mask_array: Optional[np.ndarray] = None,
+	region: SlabRegion = "full",
+) -> np.ndarray:
+	"""Randomly sample values from the distribution of a region of an image, slab by slab.
+
+	Parameters
+	----------
+	image_array : np.ndarray
+		Image to sample the values of. Is not modified, can be a read-only view.
+	out : np.ndarray
+		Preallocated array with the same shape as `image_array` to write the result to.
+	rng : np.random.Generator
+		Random number generator to draw from.
+	slab_size : int
+		Number of slices along the first axis to process at once.
+	mask_array : np.ndarray, optional
+		Mask of the ROI, required for the 'roi' and 'non_roi' regions.
+	region : {'full', 'roi', 'non_roi'}, default 'full'
+		Region of the image to sample the values from and into.
+
+	Returns
+	-------
+	np.ndarray
+		`out`, with the values within the region sampled with replacement from the values
+		of the region and all other values copied from `image_array`.
+	"""
+	_check_arrays(image_array, out, mask_array, region)
+	slabs = list(iter_slabs(image_array.shape[0], slab_size))
+
+	slab_histograms = []
+	for slab in slabs:
+		region_mask = _region_slab_mask(mask_array, region, slab)
+		values = image_array[slab] if region_mask is None else image_array[slab][region_mask]
+		if values.size:
+			slab_histograms.append(ValueHistogram.from_array(values))
+
+	if not slab_histograms:
+		msg = f"No voxels in the '{region}' region to apply negative control to."
+		raise ValueError(msg)
+	histogram = ValueHistogram.merge(slab_histograms)
+
+	return _fill_slabs(
+		image_array,
+		out,
+		mask_array,
+		region,
+		slabs,
+		generate=lambda size: histogram.sample(size, rng),
+	)
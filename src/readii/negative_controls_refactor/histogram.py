@@ -0,0 +1,211 @@
+"""Histogram-based sampling of voxel values with replacement.
+
+Sampling with replacement from the values of an image only depends on how often each
+value occurs, so instead of copying the flattened image and drawing indices into it,
+`ValueHistogram` counts the occurrences of each value once (`np.bincount` for integer
+images) and draws new values through the inverse of the cumulative counts.
+
+Reproducibility
+---------------
+For a fixed numpy version, the values returned by `ValueHistogram.sample` are fully
+determined by:
+
+- the histogram, i.e. the multiset of values it was built from,
+- the requested output size, and
+- the state of the `np.random.Generator` passed in (e.g. its seed).
+
+They do not depend on the order or layout of the voxels the histogram was built from,
+on which region of an image they came from, or on the `chunk_size` used while sampling.
+A histogram computed on one region can therefore be reused to sample values into another
+region with the same results as building it again from the same values.
+"""
+
+from dataclasses import dataclass, field
+from typing import Iterable, Optional
+
+import numpy as np
+
+# Largest span of integer values to count with np.bincount before falling back to np.unique
+MAX_BINCOUNT_SPAN = 1 << 24
+
+# Number of draws generated at once, bounds the temporary memory used while sampling
+DEFAULT_SAMPLE_CHUNK_SIZE = 1 << 20
+
+# Number of bits used to index the lookup table that resolves most draws without a search
+GUIDE_TABLE_BITS = 16
+
+
+@dataclass
+class ValueHistogram:
+	"""Counts of each distinct value in an image or region, used to sample new values.
+
+	Parameters
+	----------
+	values : np.ndarray
+		Sorted distinct values. Sampled arrays have the same dtype as `values`.
+	counts : np.ndarray
+		Number of occurrences of each entry in `values`. Must be positive.
+	"""
+
+	values: np.ndarray
+	counts: np.ndarray
+
+	cumulative_counts: np.ndarray = field(init=False, repr=False)
+	_guide_shift: int = field(init=False, repr=False)
+	_guide_values: np.ndarray = field(init=False, repr=False)
+	_guide_ambiguous: np.ndarray = field(init=False, repr=False)
+
+	def __post_init__(self) -> None:
+		"""Validate the counts and build the inverse-CDF lookup tables."""
+		self.counts = np.asarray(self.counts, dtype=np.int64)
+		if self.values.shape != self.counts.shape or self.values.ndim != 1:
+			msg = "values and counts must be 1D arrays of the same length."
+			raise ValueError(msg)
+		if self.counts.size == 0 or np.any(self.counts <= 0):
+			msg = "ValueHistogram needs at least one value and all counts must be positive."
+			raise ValueError(msg)
+
+		self.cumulative_counts = np.cumsum(self.counts)
+
+		# Split [0, total) into at most 2**GUIDE_TABLE_BITS buckets of equal width.
+		# Buckets that only cover draws mapping to a single value resolve with one lookup,
+		# only draws falling into the remaining buckets need a binary search.
+		self._guide_shift = max(0, (self.total - 1).bit_length() - GUIDE_TABLE_BITS)
+		bucket_starts = np.arange(((self.total - 1) >> self._guide_shift) + 1, dtype=np.int64)
+		bucket_starts <<= self._guide_shift
+		bucket_ends = np.minimum(bucket_starts + (1 << self._guide_shift) - 1, self.total - 1)
+
+		first_value_index = np.searchsorted(self.cumulative_counts, bucket_starts, side="right")
+		last_value_index = np.searchsorted(self.cumulative_counts, bucket_ends, side="right")
+
+		self._guide_values = self.values[first_value_index]
+		self._guide_ambiguous = first_value_index != last_value_index
+
+	@property
+	def total(self) -> int:
+		"""Total number of values counted in the histogram."""
+		return int(self.cumulative_counts[-1])
+
+	@classmethod
+	def from_array(cls, array: np.ndarray) -> "ValueHistogram":
+		"""Count the values of an array.
+
+		Parameters
+		----------
+		array : np.ndarray
+			Array of values to count, of any shape. Integer arrays are counted with
+			`np.bincount`, other dtypes with `np.unique`.
+
+		Returns
+		-------
+		ValueHistogram
+			Histogram of the values in `array`.
+		"""
+		flat_array = array.reshape(-1)
+		if flat_array.size == 0:
+			msg = "Cannot build a ValueHistogram from an empty array."
+			raise ValueError(msg)
+
+		if np.issubdtype(flat_array.dtype, np.integer) or flat_array.dtype == np.bool_:
+			min_value = int(flat_array.min())
+			value_span = int(flat_array.max()) - min_value + 1
+
+			if value_span <= MAX_BINCOUNT_SPAN:
+				bin_counts = np.zeros(value_span, dtype=np.int64)
+				# Count in chunks so the offset copy never spans the whole array
+				for start in range(0, flat_array.size, DEFAULT_SAMPLE_CHUNK_SIZE):
+					chunk = flat_array[start : start + DEFAULT_SAMPLE_CHUNK_SIZE].astype(np.int64)
+					chunk -= min_value
+					bin_counts += np.bincount(chunk, minlength=value_span)
+
+				present = np.flatnonzero(bin_counts)
+				values = (present + min_value).astype(flat_array.dtype)
+				return cls(values=values, counts=bin_counts[present])
+
+		values, counts = np.unique(flat_array, return_counts=True)
+		return cls(values=values, counts=counts)
+
+	@classmethod
+	def merge(cls, histograms: Iterable["ValueHistogram"]) -> "ValueHistogram":
+		"""Combine histograms, e.g. computed on separate chunks of an image.
+
+		Parameters
+		----------
+		histograms : Iterable[ValueHistogram]
+			Histograms to combine. Values are cast to the dtype of the first histogram.
+
+		Returns
+		-------
+		ValueHistogram
+			Histogram with the summed counts of every value.
+		"""
+		histograms = list(histograms)
+		if not histograms:
+			msg = "Need at least one ValueHistogram to merge."
+			raise ValueError(msg)
+
+		values, inverse = np.unique(
+			np.concatenate([histogram.values for histogram in histograms]), return_inverse=True
+		)
+		counts = np.zeros(values.size, dtype=np.int64)
+		np.add.at(counts, inverse, np.concatenate([histogram.counts for histogram in histograms]))
+
+		return cls(values=values.astype(histograms[0].values.dtype), counts=counts)
+
+	def sample(
+		self,
+		size: int | tuple[int, ...],
+		rng: np.random.Generator,
+		chunk_size: int = DEFAULT_SAMPLE_CHUNK_SIZE,
+		out: Optional[np.ndarray] = None,
+	) -> np.ndarray:
+		"""Randomly sample values with replacement, proportional to their counts.
+
+		Parameters
+		----------
+		size : int | tuple[int, ...]
+			Shape of the output array.
+		rng : np.random.Generator
+			Random number generator to draw from.
+		chunk_size : int, optional
+			Number of values drawn at once. Does not affect the result, only the amount of
+			temporary memory used.
+		out : np.ndarray, optional
+			C-contiguous array of shape `size` and the dtype of `values` to write the
+			sampled values into, instead of allocating a new array.
+
+		Returns
+		-------
+		np.ndarray
+			Array of sampled values with the same dtype as `values`, or `out` if given.
+		"""
+		if out is None:
+			sampled = np.empty(size, dtype=self.values.dtype)
+		elif (
+			out.shape != tuple(np.atleast_1d(size))
+			or out.dtype != self.values.dtype
+			or not out.flags.c_contiguous
+		):
+			msg = f"out must be a C-contiguous {self.values.dtype} array of shape {size}."
+			raise ValueError(msg)
+		else:
+			sampled = out
+		flat_sampled = sampled.reshape(-1)
+
+		for start in range(0, flat_sampled.size, chunk_size):
+			chunk = flat_sampled[start : start + chunk_size]
+			# Each draw picks one of the counted voxels uniformly at random
+			draws = rng.integers(0, self.total, size=chunk.size, dtype=np.int64)
+
+			buckets = draws >> self._guide_shift
+			np.take(self._guide_values, buckets, out=chunk)
+
+			# Resolve draws from buckets spanning several values with the full inverse CDF
+			ambiguous = np.take(self._guide_ambiguous, buckets)
+			if ambiguous.any():
+				value_index = np.searchsorted(
+					self.cumulative_counts, draws[ambiguous], side="right"
+				)
+				chunk[ambiguous] = self.values[value_index]
+
+		return sampled
@@ -0,0 +1,102 @@
+"""Grouping of the voxels of a label map by label.
+
+A label map stores several structures in one mask, each with its own positive voxel value.
+`LabelGroups.from_mask` finds the labelled voxels once and sorts them by label, so a
+negative control can be applied within every label independently at a cost that depends
+on the number of labelled voxels rather than on the number of labels times the volume.
+"""
+
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+import numpy as np
+
+
+@dataclass
+class LabelGroups:
+	"""Flat voxel indices of a label map, grouped by label.
+
+	Parameters
+	----------
+	labels : np.ndarray
+		Sorted distinct positive label values.
+	voxel_indices : np.ndarray
+		Flat (C-order) indices of all labelled voxels, sorted by label. Within each label
+		the indices are in increasing order.
+	offsets : np.ndarray
+		Start of each label's indices in `voxel_indices`, followed by the total number of
+		labelled voxels, so label `labels[i]` owns `voxel_indices[offsets[i]:offsets[i + 1]]`.
+	"""
+
+	labels: np.ndarray
+	voxel_indices: np.ndarray
+	offsets: np.ndarray
+
+	@classmethod
+	def from_mask(cls, mask_array: np.ndarray) -> "LabelGroups":
+		"""Group the voxels of a label map by their label value.
+
+		Parameters
+		----------
+		mask_array : np.ndarray
+			Label map where background is 0 and each structure has its own positive value.
+
+		Returns
+		-------
+		LabelGroups
+			The labelled voxels of `mask_array` grouped by label.
+
+		Raises
+		------
+		ValueError
+			If the label map contains no positive labels.
+		"""
+		flat_mask = mask_array.reshape(-1)
+		labelled_indices = np.flatnonzero(flat_mask > 0)
+		if labelled_indices.size == 0:
+			msg = "Label map is all 0s. No labelled voxels to apply negative control to."
+			raise ValueError(msg)
+
+		# A single stable sort groups the voxels by label, keeping C-order within each label
+		voxel_labels = flat_mask[labelled_indices]
+		order = np.argsort(voxel_labels, kind="stable")
+		sorted_labels = voxel_labels[order]
+
+		labels, starts = np.unique(sorted_labels, return_index=True)
+		offsets = np.append(starts, sorted_labels.size)
+
+		return cls(labels=labels, voxel_indices=labelled_indices[order], offsets=offsets)
+
+	def __len__(self) -> int:
+		"""Return the number of labels."""
+		return len(self.labels)
+
+	def __iter__(self) -> Iterator[tuple[int, np.ndarray]]:
+		"""Iterate over each label value and the flat indices of its voxels."""
+		for label_index, label in enumerate(self.labels):
+			start, stop = self.offsets[label_index], self.offsets[label_index + 1]
+			yield int(label), self.voxel_indices[start:stop]
+
+
+def label_random_seed(random_seed: Optional[int], label: int) -> Optional[int]:
+	"""Derive an independent random seed for one label from a base seed.
+
+	The seed only depends on `random_seed` and `label`, so the control applied within a
+	label is reproducible regardless of which other labels are present in the label map.
+
+	Parameters
+	----------
+	random_seed : int, optional
+		Base seed. If None, None is returned and every label is random.
+	label : int
+		Positive label value.
+
+	Returns
+	-------
+	int | None
+		Seed to use for `label`.
+	"""
+	if random_seed is None:
+		return None
+	seed_sequence = np.random.SeedSequence(random_seed, spawn_key=(label,))
+	return int(seed_sequence.generate_state(1)[0])
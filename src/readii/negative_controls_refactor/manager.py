@@ -1,19 +1,25 @@
 from dataclasses import dataclass, field
 from itertools import product
-from typing import Iterator, List, Optional, TypeVar
+from typing import Iterator, List, Literal, Optional, TypeVar
 
 import numpy as np
 import SimpleITK as sitk
+from joblib import Parallel, delayed
+
+from readii.utils.shared_volume import SharedVolume, SharedVolumeHandle
 
 from .abstract_classes import NegativeControlStrategy, RegionStrategy
+from .buffer_pool import BufferPool
 from .negative_controls import RandomizedControl, SampledControl, ShuffledControl
-from .regions import FullRegion, NonROIRegion, ROIRegion
+from .regions import FullRegion, LabelMapRegion, NonROIRegion, ROIRegion
 
 # Define a TypeVar for image-like inputs
 ImageInput = TypeVar("ImageInput", sitk.Image, np.ndarray)
 
 
-REGION_REGISTRY = {cls.region_name: cls for cls in [FullRegion, ROIRegion, NonROIRegion]}
+REGION_REGISTRY = {
+	cls.region_name: cls for cls in [FullRegion, ROIRegion, NonROIRegion, LabelMapRegion]
+}
 
 NEGATIVE_CONTROL_REGISTRY = {
 	cls.negative_control_name: cls for cls in [ShuffledControl, SampledControl, RandomizedControl]
@@ -53,16 +59,140 @@ class NegativeControlManager:
 		return product(self.negative_control_strategies, self.region_strategies)
 
 	def apply(
-		self, base_image: ImageInput, mask: ImageInput
+		self,
+		base_image: ImageInput,
+		mask: ImageInput,
+		n_jobs: int = 1,
+		prefer: Literal["threads", "processes"] = "threads",
+		buffer_pool: Optional[BufferPool] = None,
 	) -> Iterator[tuple[ImageInput, str, str]]:
-		"""Apply the negative control strategies to the region strategies."""
-		for control_strategy, region_strategy in self.strategy_products:
-			yield (
-				control_strategy(base_image, mask, region_strategy),
+		"""Apply the negative control strategies to the region strategies.
+
+		The image and mask are converted to arrays once and each region mask is computed
+		once, then shared by every negative control strategy applied to that region.
+
+		Parameters
+		----------
+		base_image : np.ndarray | sitk.Image
+			The base image to apply the negative controls to. Is not modified.
+		mask : np.ndarray | sitk.Image
+			The mask image defining regions of interest.
+		n_jobs : int, default 1
+			Number of threads to generate the strategy combinations with. Results are
+			yielded in the order of `strategy_products` regardless of this value.
+		prefer : {'threads', 'processes'}, default 'threads'
+			Run the combinations in threads, or in worker processes that attach to the
+			image and mask in shared memory instead of receiving a pickled copy each
+			(see `readii.utils.shared_volume`). Processes compute their region masks
+			themselves. Results are the same either way.
+		buffer_pool : BufferPool, optional
+			Pool to take the working copy of the image for each combination from when
+			`base_image` is a SimpleITK Image. Each copy is given back to the pool once its
+			output image is created. Not used for numpy inputs or with processes.
+
+		Yields
+		------
+		tuple[ImageInput, str, str]
+			The transformed image, the name of the control strategy used, and the name
+			of the region strategy used.
+		"""
+		if prefer == "processes" and n_jobs != 1:
+			yield from self._apply_in_processes(base_image, mask, n_jobs)
+			return
+
+		use_pool = buffer_pool is not None and isinstance(base_image, sitk.Image)
+		if use_pool:
+			# The shared array is only read and copied, so a view avoids one more copy
+			image_array = sitk.GetArrayViewFromImage(base_image)
+		else:
+			image_array = NegativeControlStrategy.to_array(base_image)
+		mask_array = NegativeControlStrategy.to_array(mask)
+
+		# Select each region once, keyed by object so repeated region names stay distinct
+		region_selections = {
+			id(region_strategy): region_strategy.select(image_array, mask_array)
+			for region_strategy in self.region_strategies
+		}
+
+		def _apply_combination(
+			control_strategy: NegativeControlStrategy,
+			region_strategy: RegionStrategy,
+		) -> tuple[ImageInput, str, str]:
+			# Work on a copy so the shared image array is never modified
+			working_array = (
+				buffer_pool.acquire_copy(image_array) if use_pool else image_array.copy()
+			)
+			control_array = control_strategy.apply_to_array(
+				working_array, region_selections[id(region_strategy)]
+			)
+			control_image = control_strategy.to_image_like(control_array, base_image)
+			if use_pool:
+				buffer_pool.release(working_array)
+			return (
+				control_image,
 				control_strategy.name(),
 				region_strategy.name(),
 			)
 
+		if n_jobs == 1:
+			for control_strategy, region_strategy in self.strategy_products:
+				yield _apply_combination(control_strategy, region_strategy)
+			return
+
+		# Threads share the converted arrays; the generator preserves submission order
+		yield from Parallel(n_jobs=n_jobs, prefer="threads", return_as="generator")(
+			delayed(_apply_combination)(control_strategy, region_strategy)
+			for control_strategy, region_strategy in self.strategy_products
+		)
+
+	def _apply_in_processes(
+		self,
+		base_image: ImageInput,
+		mask: ImageInput,
+		n_jobs: int,
+	) -> Iterator[tuple[ImageInput, str, str]]:
+		"""Apply every combination in worker processes sharing the image and mask in memory."""
+		strategy_products = list(self.strategy_products)
+
+		shared_image = SharedVolume.publish(base_image)
+		shared_mask = SharedVolume.publish(mask)
+		shared_outputs = [
+			SharedVolume.create(shared_image.array.shape, shared_image.array.dtype)
+			for _ in strategy_products
+		]
+
+		try:
+			# Workers only write their own output; yield each one as soon as it is done
+			completed = Parallel(n_jobs=n_jobs, prefer="processes", return_as="generator")(
+				delayed(_apply_combination_to_shared)(
+					shared_image.handle,
+					shared_mask.handle,
+					shared_output.handle,
+					control_strategy,
+					region_strategy,
+				)
+				for shared_output, (control_strategy, region_strategy) in zip(
+					shared_outputs, strategy_products, strict=True
+				)
+			)
+			for _, shared_output, (control_strategy, region_strategy) in zip(
+				completed, shared_outputs, strategy_products, strict=True
+			):
+				control_array = shared_output.array.copy()
+				shared_output.close()
+				shared_output.unlink()
+				yield (
+					control_strategy.to_image_like(control_array, base_image),
+					control_strategy.name(),
+					region_strategy.name(),
+				)
+
+		finally:
+			for shared_volume in [shared_image, shared_mask, *shared_outputs]:
+				if shared_volume.is_open:
+					shared_volume.close()
+					shared_volume.unlink()
+
 	def apply_single(
 		self,
 		base_image: ImageInput,
@@ -122,3 +252,27 @@ class NegativeControlManager:
 	def __repr__(self) -> str:
 		"""Return a string representation of the manager."""
 		return f"NegativeControlManager(negative_controls={len(self.negative_control_strategies)}, regions={len(self.region_strategies)})"
+
+
+def _apply_combination_to_shared(
+	image_handle: SharedVolumeHandle,
+	mask_handle: SharedVolumeHandle,
+	output_handle: SharedVolumeHandle,
+	control_strategy: NegativeControlStrategy,
+	region_strategy: RegionStrategy,
+) -> None:
+	"""Worker for `NegativeControlManager.apply` with processes, writes into the shared output."""
+	with (
+		SharedVolume.attach(image_handle) as shared_image,
+		SharedVolume.attach(mask_handle) as shared_mask,
+		SharedVolume.attach(output_handle) as shared_output,
+	):
+		selection = region_strategy.select(shared_image.array, shared_mask.array)
+		shared_output.array[...] = shared_image.array
+
+		control_array = control_strategy.apply_to_array(shared_output.array, selection)
+		if not np.shares_memory(control_array, shared_output.array):
+			shared_output.array[...] = control_array
+
+		# Views of the shared memory must be released before it is closed
+		del control_array
@@ -4,6 +4,8 @@ from typing import Optional
 import numpy as np
 
 from .abstract_classes import NegativeControlStrategy
+from .histogram import ValueHistogram
+from .parallel_random import random_integers
 
 
 @dataclass
@@ -38,43 +40,62 @@ class ShuffledControl(NegativeControlStrategy):
 
 @dataclass
 class SampledControl(NegativeControlStrategy):
-	"""Randomly sample pixel values with replacement from the distribution of existing pixel values within the image."""
+	"""Randomly sample pixel values with replacement from the distribution of existing pixel values within the image.
+
+	Values are drawn from a `ValueHistogram` of the input values rather than from a copy of
+	the values themselves. See `readii.negative_controls_refactor.histogram` for the
+	reproducibility contract of the sampled values.
+	"""
 
 	negative_control_name = "sampled"
 
 	random_seed: Optional[int] = field(
 		default=None, metadata={"description": "Seed for reproducibility"}
 	)
+	histogram: Optional[ValueHistogram] = field(
+		default=None,
+		metadata={
+			"description": "Histogram to sample from, e.g. computed on another region. "
+			"If None, the histogram of the values being transformed is used."
+		},
+	)
 
 	def transform(self, image_array: np.ndarray) -> np.ndarray:
 		"""Randomly sample pixel values."""
-		# Get array dimensions to reshape back to
-		imgDimensions = image_array.shape
-
-		# Flatten the 3D array to 1D so values can be shuffled
-		flatArrImage = image_array.flatten()
+		histogram = self.histogram
+		if histogram is None:
+			histogram = ValueHistogram.from_array(image_array)
 
 		# Set the random seed for np random number generator
 		randNumGen = np.random.default_rng(seed=self.random_seed)
 
 		# Randomly sample values for new array from original image distribution
-		sampled_array = randNumGen.choice(flatArrImage, size=len(flatArrImage), replace=True)
-
-		# Reshape the array back into the original image dimensions
-		randomlySampled3DArrImage = np.reshape(sampled_array, imgDimensions)
-
-		return randomlySampled3DArrImage
+		return histogram.sample(image_array.shape, randNumGen)
 
 
 @dataclass
 class RandomizedControl(NegativeControlStrategy):
-	"""Randomly generate pixel values within the range of the original image pixel values."""
+	"""Randomly generate pixel values within the range of the original image pixel values.
+
+	With `n_threads` > 1 the values are generated in parallel threads, see
+	`readii.negative_controls_refactor.parallel_random` for the reproducibility contract.
+	"""
 
 	negative_control_name = "randomized"
 
 	random_seed: Optional[int] = field(
 		default=None, metadata={"description": "Seed for reproducibility"}
 	)
+	n_threads: int = field(
+		default=1, metadata={"description": "Number of threads to generate values with"}
+	)
+	n_chunks: Optional[int] = field(
+		default=None,
+		metadata={
+			"description": "Number of independently seeded chunks. "
+			"If set, the output is the same for any n_threads."
+		},
+	)
 
 	def transform(self, image_array: np.ndarray) -> np.ndarray:
 		"""Randomly generate pixel values."""
@@ -85,11 +106,13 @@ class RandomizedControl(NegativeControlStrategy):
 		minVoxelVal = np.min(image_array)
 		maxVoxelVal = np.max(image_array)
 
-		# Set the random seed for np random generator
-		randNumGen = np.random.default_rng(seed=self.random_seed)
-
 		# Generate random array with same dimensions as baseImage with values ranging from the minimum to maximum inclusive of the original image
-		random3DArr = randNumGen.integers(
-			low=minVoxelVal, high=maxVoxelVal, endpoint=True, size=imgDimensions
+		random3DArr = random_integers(
+			minVoxelVal,
+			maxVoxelVal,
+			imgDimensions,
+			self.random_seed,
+			n_threads=self.n_threads,
+			n_chunks=self.n_chunks,
 		)
 		return random3DArr
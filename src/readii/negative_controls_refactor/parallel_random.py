@@ -0,0 +1,127 @@
+"""Random integer generation split across threads.
+
+Filling a large volume with random values from a single `np.random.Generator` runs on
+one core. `random_integers` splits the flattened output into contiguous chunks, gives
+each chunk its own generator spawned from the seed (`np.random.SeedSequence.spawn`), and
+fills the chunks in parallel threads. numpy releases the GIL while generating bounded
+integers, so the threads run concurrently.
+
+Reproducibility
+---------------
+The values only depend on the seed, the output size, and the number of chunks:
+
+- With `n_chunks=None`, one chunk is used per thread, so the output is reproducible for a
+  given seed and `n_threads`. With a single thread this is the same as drawing from
+  `np.random.default_rng(random_seed)` directly.
+- With a fixed `n_chunks`, the output is bitwise identical for any `n_threads`.
+"""
+
+from typing import Optional
+
+import numpy as np
+from joblib import Parallel, delayed
+
+# Number of values generated at once within a chunk, bounds the temporary memory per thread
+DEFAULT_FILL_BLOCK_SIZE = 1 << 20
+
+
+def spawn_generators(random_seed: Optional[int], n_generators: int) -> list[np.random.Generator]:
+	"""Create independent random generators derived from one seed.
+
+	Parameters
+	----------
+	random_seed : int, optional
+		Seed to derive the generators from. If None, fresh entropy is used.
+	n_generators : int
+		Number of generators to create.
+
+	Returns
+	-------
+	list[np.random.Generator]
+		Statistically independent generators, reproducible for a given seed.
+	"""
+	seed_sequence = np.random.SeedSequence(random_seed)
+	return [np.random.default_rng(child) for child in seed_sequence.spawn(n_generators)]
+
+
+def _fill_integers(
+	out: np.ndarray,
+	rng: np.random.Generator,
+	low: int,
+	high: int,
+) -> None:
+	"""Fill `out` with integers drawn uniformly from [low, high], block by block."""
+	for start in range(0, out.size, DEFAULT_FILL_BLOCK_SIZE):
+		block = out[start : start + DEFAULT_FILL_BLOCK_SIZE]
+		block[:] = rng.integers(low=low, high=high, endpoint=True, size=block.size)
+
+
+def random_integers(
+	low: int,
+	high: int,
+	size: int | tuple[int, ...],
+	random_seed: Optional[int] = None,
+	*,
+	n_threads: int = 1,
+	n_chunks: Optional[int] = None,
+	out: Optional[np.ndarray] = None,
+) -> np.ndarray:
+	"""Draw integers uniformly from [low, high], optionally in parallel threads.
+
+	Parameters
+	----------
+	low : int
+		Lowest value to draw (inclusive).
+	high : int
+		Highest value to draw (inclusive).
+	size : int | tuple[int, ...]
+		Shape of the output array.
+	random_seed : int, optional
+		Seed for reproducibility.
+	n_threads : int, default 1
+		Number of threads to fill the output with.
+	n_chunks : int, optional
+		Number of chunks, each with its own generator, to split the output into.
+		Defaults to `n_threads`. Set it to get the same output for any `n_threads`.
+	out : np.ndarray, optional
+		C-contiguous array of shape `size` to write the values into, instead of allocating
+		a new array. The values are the same as without `out`, cast to its dtype.
+
+	Returns
+	-------
+	np.ndarray
+		Array of shape `size` with int64 values between `low` and `high` inclusive, or
+		`out` if given.
+	"""
+	if n_threads < 1:
+		msg = f"n_threads must be a positive integer, got {n_threads}."
+		raise ValueError(msg)
+	if n_chunks is None:
+		n_chunks = n_threads
+	elif n_chunks < 1:
+		msg = f"n_chunks must be a positive integer, got {n_chunks}."
+		raise ValueError(msg)
+
+	if out is not None and (out.shape != tuple(np.atleast_1d(size)) or not out.flags.c_contiguous):
+		msg = f"out must be a C-contiguous array of shape {size}."
+		raise ValueError(msg)
+
+	if n_chunks == 1:
+		# Same stream as a single generator seeded with random_seed
+		rng = np.random.default_rng(seed=random_seed)
+		if out is None:
+			return rng.integers(low=low, high=high, endpoint=True, size=size)
+		# Drawing in blocks gives the same values as drawing all at once
+		_fill_integers(out.reshape(-1), rng, low, high)
+		return out
+
+	random_array = np.empty(size, dtype=np.int64) if out is None else out
+	chunks = np.array_split(random_array.reshape(-1), n_chunks)
+	generators = spawn_generators(random_seed, n_chunks)
+
+	Parallel(n_jobs=min(n_threads, n_chunks), prefer="threads")(
+		delayed(_fill_integers)(chunk, rng, low, high)
+		for chunk, rng in zip(chunks, generators, strict=True)
+	)
+
+	return random_array
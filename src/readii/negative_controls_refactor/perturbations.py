@@ -0,0 +1,577 @@
+"""Image perturbations for feature robustness analysis.
+
+Perturbations slightly change the image or the ROI the way a repeated acquisition or
+a second segmentation would: small rotations and translations of image and mask
+together, additive noise on the image, and random growing or shrinking of the contour.
+Robustness analyses use many perturbations per ROI, so they are generated in batches on
+a padded crop around the ROI rather than on the whole image:
+
+- `RoiCrop` crops the image and mask once per ROI, with enough padding for the largest
+  displacement of any perturbation, and computes the resampling grid of the crop once.
+- Each `PerturbationStrategy` draws the parameters of `n_perturbations` perturbations
+  from generators spawned from its `random_seed` and applies them to the crop, resampling
+  `batch_size` perturbations per call.
+- `PerturbationManager` runs several strategies on one crop and returns each perturbed
+  crop as an image with the geometry of the crop, ready for feature extraction.
+"""
+
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import ClassVar, Iterator, List, Optional
+
+import numpy as np
+import SimpleITK as sitk
+from scipy.ndimage import binary_dilation, binary_erosion, map_coordinates
+
+from .abstract_classes import ImageInput, NegativeControlStrategy, RegionStrategy
+from .parallel_random import spawn_generators
+
+
+def _array_view(input_data: ImageInput) -> np.ndarray:
+	"""Get a read-only view of the voxels of a SimpleITK image without copying them, or the numpy array itself."""
+	if isinstance(input_data, sitk.Image):
+		return sitk.GetArrayViewFromImage(input_data)
+	return NegativeControlStrategy.to_array(input_data)
+
+
+@dataclass
+class RoiCrop:
+	"""Padded crop of an image and mask around an ROI, with its resampling grid.
+
+	Parameters
+	----------
+	image : np.ndarray
+		Cropped image, in numpy (z, y, x) order.
+	mask : np.ndarray
+		Cropped mask, same shape as `image`.
+	start : tuple[int, ...]
+		Index of the first voxel of the crop in the full image, in numpy order.
+	spacing : np.ndarray
+		Voxel spacing in mm, in numpy order.
+	center : np.ndarray
+		Centroid of the ROI in crop voxel coordinates, the center of rotations.
+	"""
+
+	image: np.ndarray
+	mask: np.ndarray
+	start: tuple[int, ...]
+	spacing: np.ndarray
+	center: np.ndarray
+
+	_grid: Optional[np.ndarray] = field(default=None, init=False, repr=False)
+
+	@staticmethod
+	def roi_bounds(mask_array: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+		"""Get the first voxel, the voxel past the last one and the centroid of the ROI of a mask, in numpy order."""
+		roi_indices = np.argwhere(mask_array > 0)
+		if roi_indices.size == 0:
+			msg = "ROI mask is all 0s. No pixels in ROI to perturb."
+			raise ValueError(msg)
+		return roi_indices.min(axis=0), roi_indices.max(axis=0) + 1, roi_indices.mean(axis=0)
+
+	@classmethod
+	def from_arrays(
+		cls,
+		image_array: np.ndarray,
+		mask_array: np.ndarray,
+		spacing: Optional[tuple[float, ...]] = None,
+		padding_mm: float = 0.0,
+		roi_bounds: Optional[tuple[np.ndarray, np.ndarray, np.ndarray]] = None,
+	) -> "RoiCrop":
+		"""Crop an image and mask to the bounding box of the ROI plus padding.
+
+		Parameters
+		----------
+		image_array : np.ndarray
+			The full image, in numpy order.
+		mask_array : np.ndarray
+			The full mask. Voxels greater than 0 are part of the ROI.
+		spacing : tuple[float, ...], optional
+			Voxel spacing in numpy order. Defaults to 1 mm along every axis.
+		padding_mm : float, default 0.0
+			Margin to keep around the bounding box of the ROI, clipped to the image.
+		roi_bounds : tuple[np.ndarray, np.ndarray, np.ndarray], optional
+			`roi_bounds(mask_array)`, if already computed.
+
+		Returns
+		-------
+		RoiCrop
+			The crop of the image and mask.
+		"""
+		roi_start, roi_stop, roi_centroid = (
+			cls.roi_bounds(mask_array) if roi_bounds is None else roi_bounds
+		)
+
+		spacing = np.ones(image_array.ndim) if spacing is None else np.asarray(spacing, float)
+		padding = np.ceil(padding_mm / spacing).astype(int)
+
+		start = np.maximum(roi_start - padding, 0)
+		stop = np.minimum(roi_stop + padding, image_array.shape)
+		crop = tuple(slice(begin, end) for begin, end in zip(start, stop, strict=True))
+
+		return cls(
+			image=image_array[crop].copy(),
+			mask=mask_array[crop].copy(),
+			start=tuple(int(begin) for begin in start),
+			spacing=spacing,
+			center=roi_centroid - start,
+		)
+
+	@classmethod
+	def from_image(cls, image: ImageInput, mask: ImageInput, padding_mm: float = 0.0) -> "RoiCrop":
+		"""Crop a SimpleITK image or numpy array and its mask, see `from_arrays`."""
+		spacing = image.GetSpacing()[::-1] if isinstance(image, sitk.Image) else None
+		return cls.from_arrays(
+			_array_view(image),
+			_array_view(mask),
+			spacing=spacing,
+			padding_mm=padding_mm,
+		)
+
+	@property
+	def grid(self) -> np.ndarray:
+		"""Position of every crop voxel relative to the ROI centroid, in mm.
+
+		Array of shape (ndim, number of voxels), computed on first use and reused by every
+		geometric perturbation of this crop.
+		"""
+		if self._grid is None:
+			indices = np.indices(self.image.shape, dtype=np.float32).reshape(self.image.ndim, -1)
+			offsets = (self.center * self.spacing).astype(np.float32)[:, None]
+			self._grid = indices * self.spacing.astype(np.float32)[:, None] - offsets
+		return self._grid
+
+	def resample(
+		self, matrices: np.ndarray, translations: np.ndarray
+	) -> tuple[np.ndarray, np.ndarray]:
+		"""Resample the crop under a batch of affine transforms about the ROI centroid.
+
+		Each output voxel at position `p` (in mm from the centroid) takes the value of the
+		crop at `matrix @ p + translation`. The image is interpolated linearly and the mask
+		with nearest neighbour, so labels are preserved.
+
+		Parameters
+		----------
+		matrices : np.ndarray
+			Array of shape (batch, ndim, ndim).
+		translations : np.ndarray
+			Array of shape (batch, ndim), in mm.
+
+		Returns
+		-------
+		tuple[np.ndarray, np.ndarray]
+			Perturbed images and masks, each of shape (batch, *crop shape).
+		"""
+		n_transforms = len(matrices)
+		spacing = self.spacing.astype(np.float32)[None, :, None]
+
+		# Sample positions for the whole batch, in crop voxel coordinates
+		positions = np.einsum("bij,jn->bin", matrices.astype(np.float32), self.grid)
+		positions += translations.astype(np.float32)[:, :, None]
+		positions /= spacing
+		positions += self.center.astype(np.float32)[None, :, None]
+		coordinates = positions.transpose(1, 0, 2).reshape(self.image.ndim, -1)
+
+		images = map_coordinates(
+			self.image, coordinates, output=np.float32, order=1, mode="nearest"
+		)
+		masks = map_coordinates(self.mask, coordinates, order=0, mode="constant", cval=0)
+
+		batch_shape = (n_transforms, *self.image.shape)
+		return (
+			_cast_like(images.reshape(batch_shape), self.image.dtype),
+			masks.reshape(batch_shape),
+		)
+
+	def to_image_like(self, crop_array: np.ndarray, reference: ImageInput) -> ImageInput:
+		"""Convert a crop-sized array to the type of `reference`, with the geometry of the crop.
+
+		Parameters
+		----------
+		crop_array : np.ndarray
+			Array with the shape of the crop.
+		reference : sitk.Image | np.ndarray
+			The full image the crop was taken from.
+
+		Returns
+		-------
+		sitk.Image | np.ndarray
+			A SimpleITK Image positioned where the crop is in `reference`, or `crop_array`
+			unchanged if `reference` is a numpy array.
+		"""
+		if not isinstance(reference, sitk.Image):
+			return crop_array
+
+		crop_image = sitk.GetImageFromArray(crop_array)
+		crop_image.SetSpacing(reference.GetSpacing())
+		crop_image.SetDirection(reference.GetDirection())
+		crop_image.SetOrigin(reference.TransformIndexToPhysicalPoint(self.start[::-1]))
+		return crop_image
+
+
+def _cast_like(values: np.ndarray, dtype: np.dtype) -> np.ndarray:
+	"""Cast interpolated or noisy values back to the image dtype, rounding and clipping integers."""
+	if np.issubdtype(dtype, np.integer):
+		limits = np.iinfo(dtype)
+		values = np.clip(np.rint(values), limits.min, limits.max)
+	return values.astype(dtype, copy=False)
+
+
+def _rotation_matrix(angle: float, ndim: int) -> np.ndarray:
+	"""Rotation by `angle` radians in the axial (y, x) plane, in numpy axis order."""
+	matrix = np.eye(ndim)
+	cos, sin = np.cos(angle), np.sin(angle)
+	matrix[-2:, -2:] = [[cos, -sin], [sin, cos]]
+	return matrix
+
+
+@dataclass
+class PerturbationStrategy(ABC):
+	"""Abstract base class for perturbations applied to an image and its mask."""
+
+	perturbation_name: ClassVar[str]
+
+	random_seed: Optional[int] = field(
+		default=None, metadata={"description": "Seed for reproducibility"}
+	)
+	n_perturbations: int = field(
+		default=1, metadata={"description": "Number of perturbations to generate"}
+	)
+	batch_size: int = field(
+		default=8, metadata={"description": "Number of perturbations resampled at once"}
+	)
+
+	@classmethod
+	def name(cls) -> str:
+		"""Return the name of the perturbation strategy."""
+		return cls.perturbation_name
+
+	def max_displacement_mm(self, roi_radius_mm: float, spacing: np.ndarray) -> float:
+		"""Largest distance an ROI voxel can move, used to pad the crop.
+
+		Parameters
+		----------
+		roi_radius_mm : float
+			Distance from the ROI centroid to its farthest bounding box corner.
+		spacing : np.ndarray
+			Voxel spacing in mm, in numpy order.
+
+		Returns
+		-------
+		float
+			Maximum displacement in mm. 0 for perturbations that do not move voxels.
+		"""
+		return 0.0
+
+	@abstractmethod
+	def perturb_batch(
+		self,
+		crop: RoiCrop,
+		rngs: List[np.random.Generator],
+		region_mask: Optional[np.ndarray] = None,
+	) -> tuple[np.ndarray, np.ndarray]:
+		"""Generate one perturbation of the crop per generator.
+
+		Parameters
+		----------
+		crop : RoiCrop
+			The crop to perturb. Must not be modified.
+		rngs : list[np.random.Generator]
+			One generator per perturbation of the batch.
+		region_mask : np.ndarray, optional
+			Boolean mask of the crop limiting intensity perturbations. Geometric
+			perturbations ignore it.
+
+		Returns
+		-------
+		tuple[np.ndarray, np.ndarray]
+			Perturbed images and masks, each of shape (len(rngs), *crop shape).
+		"""
+		pass
+
+	def iter_perturbations(
+		self,
+		crop: RoiCrop,
+		region_mask: Optional[np.ndarray] = None,
+	) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+		"""Generate all `n_perturbations` perturbations of a crop, `batch_size` at a time.
+
+		Each perturbation draws from its own generator spawned from `random_seed`, so
+		perturbation `i` is the same for any `batch_size`.
+
+		Yields
+		------
+		tuple[np.ndarray, np.ndarray]
+			The perturbed image and mask crops.
+		"""
+		if self.batch_size < 1:
+			msg = f"batch_size must be a positive integer, got {self.batch_size}."
+			raise ValueError(msg)
+
+		rngs = spawn_generators(self.random_seed, self.n_perturbations)
+		for start in range(0, self.n_perturbations, self.batch_size):
+			images, masks = self.perturb_batch(
+				crop, rngs[start : start + self.batch_size], region_mask
+			)
+			yield from zip(images, masks, strict=True)
+
+	def __call__(
+		self,
+		image: ImageInput,
+		mask: ImageInput,
+		region: Optional[RegionStrategy] = None,
+	) -> List[tuple[ImageInput, ImageInput]]:
+		"""Perturb an image and its mask.
+
+		Parameters
+		----------
+		image : sitk.Image | np.ndarray
+			The input image.
+		mask : sitk.Image | np.ndarray
+			The ROI mask. Perturbations are computed on a padded crop around it.
+		region : RegionStrategy, optional
+			Region of the crop that intensity perturbations are limited to.
+
+		Returns
+		-------
+		list[tuple[sitk.Image | np.ndarray, sitk.Image | np.ndarray]]
+			The perturbed image and mask crops, as SimpleITK Images positioned within
+			`image` if it is one.
+		"""
+		manager = PerturbationManager(perturbation_strategies=[self], region_strategy=region)
+		return [
+			(image_crop, mask_crop) for image_crop, mask_crop, _, _ in manager.apply(image, mask)
+		]
+
+
+@dataclass
+class RotationPerturbation(PerturbationStrategy):
+	"""Rotate image and mask together about the ROI centroid, in the axial plane."""
+
+	perturbation_name: ClassVar[str] = "rotation"
+
+	max_angle_degrees: float = field(
+		default=10.0, metadata={"description": "Angles are drawn uniformly in +/- this value"}
+	)
+
+	def max_displacement_mm(self, roi_radius_mm: float, spacing: np.ndarray) -> float:
+		"""Chord length of the largest rotation at the ROI radius."""
+		return 2 * roi_radius_mm * np.sin(np.deg2rad(min(abs(self.max_angle_degrees), 180)) / 2)
+
+	def perturb_batch(
+		self,
+		crop: RoiCrop,
+		rngs: List[np.random.Generator],
+		region_mask: Optional[np.ndarray] = None,
+	) -> tuple[np.ndarray, np.ndarray]:
+		"""Rotate the crop by a random angle per generator."""
+		max_angle = np.deg2rad(self.max_angle_degrees)
+		matrices = np.stack(
+			[_rotation_matrix(rng.uniform(-max_angle, max_angle), crop.image.ndim) for rng in rngs]
+		)
+		return crop.resample(matrices, np.zeros((len(rngs), crop.image.ndim)))
+
+
+@dataclass
+class TranslationPerturbation(PerturbationStrategy):
+	"""Shift image and mask together by a random sub-voxel to few-voxel offset."""
+
+	perturbation_name: ClassVar[str] = "translation"
+
+	max_shift_mm: float = field(
+		default=1.0, metadata={"description": "Shifts are drawn uniformly in +/- this value"}
+	)
+
+	def max_displacement_mm(self, roi_radius_mm: float, spacing: np.ndarray) -> float:
+		"""Length of the largest shift vector."""
+		return abs(self.max_shift_mm) * np.sqrt(3)
+
+	def perturb_batch(
+		self,
+		crop: RoiCrop,
+		rngs: List[np.random.Generator],
+		region_mask: Optional[np.ndarray] = None,
+	) -> tuple[np.ndarray, np.ndarray]:
+		"""Shift the crop by a random vector per generator."""
+		ndim = crop.image.ndim
+		translations = np.stack(
+			[rng.uniform(-self.max_shift_mm, self.max_shift_mm, size=ndim) for rng in rngs]
+		)
+		matrices = np.broadcast_to(np.eye(ndim), (len(rngs), ndim, ndim))
+		return crop.resample(matrices, translations)
+
+
+@dataclass
+class NoisePerturbation(PerturbationStrategy):
+	"""Add Gaussian noise to the image, optionally only within a region."""
+
+	perturbation_name: ClassVar[str] = "noise"
+
+	sigma: float = field(
+		default=10.0, metadata={"description": "Standard deviation of the noise, in image units"}
+	)
+
+	def perturb_batch(
+		self,
+		crop: RoiCrop,
+		rngs: List[np.random.Generator],
+		region_mask: Optional[np.ndarray] = None,
+	) -> tuple[np.ndarray, np.ndarray]:
+		"""Add independent noise per generator."""
+		images = np.empty((len(rngs), *crop.image.shape), dtype=crop.image.dtype)
+		for image, rng in zip(images, rngs, strict=True):
+			if region_mask is None:
+				noisy = crop.image + rng.normal(0.0, self.sigma, size=crop.image.shape)
+				image[...] = _cast_like(noisy, crop.image.dtype)
+			else:
+				image[...] = crop.image
+				noisy = crop.image[region_mask] + rng.normal(
+					0.0, self.sigma, size=int(np.count_nonzero(region_mask))
+				)
+				image[region_mask] = _cast_like(noisy, crop.image.dtype)
+
+		masks = np.broadcast_to(crop.mask, images.shape)
+		return images, masks
+
+
+@dataclass
+class ContourPerturbation(PerturbationStrategy):
+	"""Randomly grow or shrink the ROI by dilating or eroding the mask."""
+
+	perturbation_name: ClassVar[str] = "contour"
+
+	max_iterations: int = field(
+		default=1, metadata={"description": "Maximum number of voxels to grow or shrink by"}
+	)
+
+	def max_displacement_mm(self, roi_radius_mm: float, spacing: np.ndarray) -> float:
+		"""Nothing moves, the crop only needs room for the dilated contour."""
+		return float(self.max_iterations * spacing.max())
+
+	def perturb_batch(
+		self,
+		crop: RoiCrop,
+		rngs: List[np.random.Generator],
+		region_mask: Optional[np.ndarray] = None,
+	) -> tuple[np.ndarray, np.ndarray]:
+		"""Dilate or erode the ROI by a random number of iterations per generator."""
+		roi = crop.mask > 0
+		label = crop.mask[roi].max()
+
+		masks = np.zeros((len(rngs), *crop.mask.shape), dtype=crop.mask.dtype)
+		for mask, rng in zip(masks, rngs, strict=True):
+			iterations = int(rng.integers(1, self.max_iterations, endpoint=True))
+			# Dilate or erode with equal probability
+			if rng.integers(2):
+				perturbed_roi = binary_dilation(roi, iterations=iterations)
+			else:
+				perturbed_roi = binary_erosion(roi, iterations=iterations)
+				# Keep the original contour rather than erasing a small ROI entirely
+				if not perturbed_roi.any():
+					perturbed_roi = roi
+			mask[perturbed_roi] = label
+
+		images = np.broadcast_to(crop.image, masks.shape)
+		return images, masks
+
+
+@dataclass
+class PerturbationManager:
+	"""Generate the perturbations of several strategies from a single crop per ROI."""
+
+	perturbation_strategies: List[PerturbationStrategy] = field(default_factory=list)
+	region_strategy: Optional[RegionStrategy] = None
+
+	@classmethod
+	def from_strings(
+		cls,
+		perturbation_types: List[str],
+		n_perturbations: int = 1,
+		random_seed: Optional[int] = None,
+	) -> "PerturbationManager":
+		"""Create a PerturbationManager from names in PERTURBATION_REGISTRY."""
+		return cls(
+			perturbation_strategies=[
+				PERTURBATION_REGISTRY[perturbation_type](
+					random_seed=random_seed, n_perturbations=n_perturbations
+				)
+				for perturbation_type in perturbation_types
+			]
+		)
+
+	def crop(self, image: ImageInput, mask: ImageInput) -> RoiCrop:
+		"""Crop around the ROI with enough padding for every perturbation strategy."""
+		# The crop is copied out of the full volumes, so they are only read through views
+		image_array = _array_view(image)
+		mask_array = _array_view(mask)
+		spacing = (
+			np.asarray(image.GetSpacing()[::-1], float)
+			if isinstance(image, sitk.Image)
+			else np.ones(image_array.ndim)
+		)
+
+		roi_bounds = RoiCrop.roi_bounds(mask_array)
+		roi_start, roi_stop, roi_centroid = roi_bounds
+		roi_radius_mm = float(
+			np.linalg.norm(np.maximum(roi_centroid - roi_start, roi_stop - roi_centroid) * spacing)
+		)
+		padding_mm = max(
+			(
+				strategy.max_displacement_mm(roi_radius_mm, spacing)
+				for strategy in self.perturbation_strategies
+			),
+			default=0.0,
+		)
+		# Pad by at least one voxel so interpolation at the ROI border has neighbours
+		padding_mm += float(spacing.max())
+		return RoiCrop.from_arrays(
+			image_array, mask_array, spacing=spacing, padding_mm=padding_mm, roi_bounds=roi_bounds
+		)
+
+	def apply(
+		self,
+		image: ImageInput,
+		mask: ImageInput,
+	) -> Iterator[tuple[ImageInput, ImageInput, str, int]]:
+		"""Apply every perturbation strategy to a padded crop around the ROI.
+
+		Parameters
+		----------
+		image : sitk.Image | np.ndarray
+			The image to perturb. Is not modified.
+		mask : sitk.Image | np.ndarray
+			The ROI mask.
+
+		Yields
+		------
+		tuple[ImageInput, ImageInput, str, int]
+			The perturbed image crop, the perturbed mask crop, the name of the perturbation
+			strategy, and the index of the perturbation within that strategy.
+		"""
+		roi_crop = self.crop(image, mask)
+		region_mask = (
+			None
+			if self.region_strategy is None
+			else self.region_strategy(roi_crop.image, roi_crop.mask).astype(bool)
+		)
+
+		for strategy in self.perturbation_strategies:
+			perturbations = strategy.iter_perturbations(roi_crop, region_mask)
+			for index, (image_crop, mask_crop) in enumerate(perturbations):
+				yield (
+					roi_crop.to_image_like(np.ascontiguousarray(image_crop), image),
+					roi_crop.to_image_like(np.ascontiguousarray(mask_crop), mask),
+					strategy.name(),
+					index,
+				)
+
+
+PERTURBATION_REGISTRY = {
+	cls.perturbation_name: cls
+	for cls in [
+		RotationPerturbation,
+		TranslationPerturbation,
+		NoisePerturbation,
+		ContourPerturbation,
+	]
+}
@@ -4,6 +4,7 @@ import numpy as np
 from scipy.ndimage import binary_dilation
 
 from .abstract_classes import RegionStrategy
+from .labels import LabelGroups
 
 
 class FullRegion(RegionStrategy):
@@ -70,6 +71,61 @@ class ROIRegion(RegionStrategy):
 		return region_mask
 
 
+class LabelMapRegion(RegionStrategy):
+	"""Region strategy to apply control within each label of a label map independently.
+
+	A strategy for masks that store several structures as distinct positive values.
+	The control is applied to every label as if it were the only ROI, in a single pass
+	over the labelled voxels, with a random seed derived from the control's seed and the
+	label value so each label is reproducible on its own.
+	"""
+
+	region_name: Final[str] = "label_map"
+
+	def __call__(self, image_array: np.ndarray, mask_array: np.ndarray) -> np.ndarray:
+		"""Apply the region mask to the image array.
+
+		Parameters
+		----------
+		image_array : np.ndarray
+		  The input image array (unused in this strategy)
+		mask_array : np.ndarray
+		  The label map, with 0 as background
+
+		Returns
+		-------
+		np.ndarray
+		  A binary mask of the union of all labels
+
+		Raises
+		------
+		ValueError
+		  If the label map contains no positive pixels
+		"""
+		region_mask = np.where(mask_array > 0, 1, 0)
+		if not region_mask.any():
+			msg = "Label map is all 0s. No labelled voxels to apply negative control to."
+			raise ValueError(msg)
+		return region_mask
+
+	def select(self, image_array: np.ndarray, mask_array: np.ndarray) -> LabelGroups:
+		"""Group the voxels of the label map by label.
+
+		Parameters
+		----------
+		image_array : np.ndarray
+		  The input image array (unused in this strategy)
+		mask_array : np.ndarray
+		  The label map, with 0 as background
+
+		Returns
+		-------
+		LabelGroups
+		  The labelled voxels grouped by label
+		"""
+		return LabelGroups.from_mask(mask_array)
+
+
 class NonROIRegion(RegionStrategy):
 	"""Region strategy to apply control outside the ROI.
 
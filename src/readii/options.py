@@ -0,0 +1,91 @@
+"""Options of a feature extraction run, passed as one object from radiomicFeatureExtraction down to each ROI.
+
+`ExtractionOptions` groups how the series of a run are extracted: the engines, the parallel workers, the
+memory limits, ROI QC and the working arrays shared between extractions. They do not change which images
+features are extracted from, which stays in the arguments of the extraction functions (the negative
+control, random seed, perturbations and parameter files).
+"""
+
+from dataclasses import dataclass, replace
+from typing import Optional
+
+from readii.negative_controls_refactor.buffer_pool import BufferPool
+from readii.qc import ROIQCCriteria
+
+
+@dataclass(frozen=True)
+class ExtractionOptions:
+	"""How the features of the series of a run are extracted.
+
+	Parameters
+	----------
+	slabSize : int, optional
+		If set, generate negative controls in slabs of this many slices to bound memory use for very large volumes.
+	bufferPool : BufferPool, optional
+		Pool to reuse full-volume working arrays from when generating negative controls. Share the options between
+		the runs of several negative control types to reuse arrays across them.
+	unionCropMaxBytes : float, optional
+		If set, the CT is cropped to the union of the ROI bounding boxes of each segmentation file and filtered (e.g.
+		LoG, wavelet) once for all of its ROIs, as long as the filtered images take at most this many bytes. Otherwise,
+		and when the filtered images depend on the ROI, each ROI is cropped and filtered separately. Features of filtered
+		image types can differ slightly near the ROI border, see unionCropFeatureExtraction.
+	firstOrderEngine : {"pyradiomics", "numpy"}
+		Engine to compute first order features with. "numpy" is a vectorized engine that matches PyRadiomics to
+		floating point tolerance with less overhead per ROI and image type.
+	textureEngine : {"pyradiomics", "numpy"}
+		Engine to compute glcm, glrlm and glszm features with. "numpy" builds the texture matrices with numpy and gives
+		the same results as PyRadiomics. It is not faster than PyRadiomics, as each image is extracted on its own, see
+		readii.extractor.NumpyFeatureExtractor.
+	roiJobs : int, optional
+		If set, the extraction of each ROI is split over this many workers (-1 for all CPUs), one for each image type and
+		for each feature class of each filtered image, e.g. for large ROIs with many filtered images. The features are
+		the same. Not used for perturbations. Combining it with parallel runs more workers than CPUs.
+	roiParallelBackend : {"processes", "threads"}
+		Run the roiJobs workers as processes or threads. PyRadiomics computes texture matrices while holding the GIL, so
+		with threads only the image filters run in parallel.
+	sliceAggregation : {"mean", "max", "slices"}, optional
+		If set, extract 2D features (force2D) from each axial slice of each ROI in parallel, for thick-slice images.
+		"mean" and "max" give one row per ROI with the mean or maximum of each feature over its slices, "slices" a row
+		for each slice with its index in a "slice" column. See sliceRadiomicFeatureExtraction. Not used with several
+		parameter files or perturbations.
+	sliceJobs : int, default -1
+		Number of worker processes to extract the slices of each ROI with, -1 for all CPUs.
+	roiQC : ROIQCCriteria, optional
+		If set, compute QC statistics of each ROI from its mask and the CT (see readii.qc.roiQCStatistics) as the
+		segmentations are loaded, and exclude the ROIs that fail these criteria from extraction. Without a negative
+		control, radiomicFeatureExtraction saves the statistics to qc/roiqc_{dataset}.csv in its outputDirPath, with
+		the failed criteria of each ROI in a "qc_failures" column.
+	downsampleFactor : int, optional
+		If set, downsample each CT and its ROIs by this factor along each axis before extraction. For pilot runs only,
+		see readii.pilot.
+	memoryBudget : float, optional
+		With parallel, only start extracting a CT series when its estimated peak memory, from the DICOM headers (see
+		readii.preflight), fits in this many bytes next to the series already running. Series that fit run around those
+		that wait. See readii.scheduler.memoryAdmittedMap. By default, a series is started for each CPU.
+	isolateSeries : bool, default False
+		Extract each series in a supervised worker process (see readii.supervisor), one for each series extracted at
+		once. A native crash, e.g. a segmentation fault in ITK, then fails only that series, with the stderr of the
+		worker logged if keep_running, and a new worker takes over. bufferPool is not used.
+	"""
+
+	slabSize: Optional[int] = None
+	bufferPool: Optional[BufferPool] = None
+	unionCropMaxBytes: Optional[float] = None
+	firstOrderEngine: str = "pyradiomics"
+	textureEngine: str = "pyradiomics"
+	roiJobs: Optional[int] = None
+	roiParallelBackend: str = "processes"
+	sliceAggregation: Optional[str] = None
+	sliceJobs: int = -1
+	roiQC: Optional[ROIQCCriteria] = None
+	downsampleFactor: Optional[int] = None
+	memoryBudget: Optional[float] = None
+	isolateSeries: bool = False
+
+	def forWorkerProcess(self) -> "ExtractionOptions":
+		"""Get the options without the bufferPool, which is only shared within a process."""
+		return replace(self, bufferPool=None)
+
+
+# Options of the functions given none, the defaults of every option
+DEFAULT_EXTRACTION_OPTIONS = ExtractionOptions()
@@ -0,0 +1,242 @@
+"""Pilot runs of feature extraction on a small, stratified subset of a dataset.
+
+`selectPilotSeries` picks CT series from a med-imagetools match list in proportion to their
+segmentation modality and size, so the pilot covers the kinds of series in the full dataset.
+`downsampleImage` and `downsampleMask` make the pilot images smaller still. Since the images are
+downsampled after they are loaded, `timeSeriesLoading` times loading the pilot series at full
+resolution. After the pilot has run, `extrapolatePilotRun` measures its cost per CT and ROI voxel
+against the pre-flight plan (see readii.preflight) and extrapolates the runtime and output size of the
+full run.
+"""
+
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+import SimpleITK as sitk
+from imgtools.io.readers import read_dicom_auto
+
+from readii.loaders import loadSegmentation
+from readii.preflight import SECONDS_PER_CT_VOXEL, SECONDS_PER_ROI_VOXEL, estimateSeriesSeconds
+
+
+def _allocateSeries(stratumSizes: np.ndarray, nSeries: int) -> np.ndarray:
+	"""Split nSeries over strata in proportion to their sizes, giving the rounded off series to the largest remainders."""
+	quotas = stratumSizes * nSeries / stratumSizes.sum()
+	allocation = np.floor(quotas).astype(int)
+	remainders = quotas - allocation
+	allocation[np.argsort(-remainders, kind="stable")[: nSeries - allocation.sum()]] += 1
+	return allocation
+
+
+def selectPilotSeries(
+	pdImageInfo: pd.DataFrame,
+	nSeries: int,
+	nSizeBins: int = 3,
+	randomSeed: Optional[int] = None,
+) -> pd.DataFrame:
+	"""Select a stratified random subset of the CT series of a match list.
+
+	Series are stratified by segmentation modality and by number of CT slices, in nSizeBins bins of
+	equal count, and each stratum gets a number of pilot series in proportion to its size.
+
+	Parameters
+	----------
+	pdImageInfo : pd.DataFrame
+		Match list of CTs and segmentations, as read from imageMetadataPath in radiomicFeatureExtraction.
+	nSeries : int
+		Number of CT series to select. All series if the match list has no more than this.
+	nSizeBins : int, default 3
+		Number of CT size strata.
+	randomSeed : int, optional
+		Seed of the random selection within each stratum.
+
+	Returns
+	-------
+	pd.DataFrame
+		The rows of the match list for the selected CT series.
+	"""
+	if nSeries < 1:
+		msg = f"The number of pilot series must be at least 1, got {nSeries}."
+		raise ValueError(msg)
+
+	seriesInfo = pdImageInfo.drop_duplicates(subset="series_CT").reset_index(drop=True)
+	if nSeries >= len(seriesInfo):
+		return pdImageInfo
+
+	# Rank first so that series with the same number of slices can still be split into bins of equal count
+	sizeBins = pd.qcut(
+		seriesInfo["instances_CT"].rank(method="first"),
+		q=min(nSizeBins, len(seriesInfo)),
+		labels=False,
+	)
+	strata = list(seriesInfo.groupby([seriesInfo["modality_seg"], sizeBins]).groups.values())
+	allocation = _allocateSeries(np.array([len(stratum) for stratum in strata]), nSeries)
+
+	rng = np.random.default_rng(randomSeed)
+	pilotSeriesIDs = [
+		seriesID
+		for stratum, nStratumSeries in zip(strata, allocation, strict=True)
+		for seriesID in rng.choice(
+			seriesInfo.loc[stratum, "series_CT"].to_numpy(), size=nStratumSeries, replace=False
+		)
+	]
+	return pdImageInfo.loc[pdImageInfo["series_CT"].isin(pilotSeriesIDs)]
+
+
+def downsampleImage(image: sitk.Image, factor: int) -> sitk.Image:
+	"""Downsample an image by averaging blocks of factor voxels along each axis.
+
+	Axes shorter than the factor are averaged to a single voxel.
+	"""
+	if factor < 1:
+		msg = f"The downsampling factor must be at least 1, got {factor}."
+		raise ValueError(msg)
+	return sitk.BinShrink(image, [min(factor, size) for size in image.GetSize()])
+
+
+def downsampleMask(mask: sitk.Image, image: sitk.Image, downsampledImage: sitk.Image) -> sitk.Image:
+	"""Resample a mask of an image onto the voxel grid of downsampleImage(image), with nearest neighbour interpolation.
+
+	The mask must have the size of the image. Its voxels are taken to be the image voxels, as loaded segmentations
+	may not have the origin and spacing of the image.
+	"""
+	alignedMask = sitk.Image(mask)
+	alignedMask.CopyInformation(image)
+	return sitk.Resample(
+		alignedMask,
+		downsampledImage,
+		sitk.Transform(),
+		sitk.sitkNearestNeighbor,
+		0,
+		mask.GetPixelID(),
+	)
+
+
+def directoryBytes(dirPath: str | Path) -> int:
+	"""Get the total size of the files in a directory and its subdirectories."""
+	return sum(
+		filePath.stat().st_size for filePath in Path(dirPath).rglob("*") if filePath.is_file()
+	)
+
+
+def timeSeriesLoading(
+	pdImageInfo: pd.DataFrame, imageDirPath: str | Path, roiNames: Optional[str] = None
+) -> float:
+	"""Time loading the CT and segmentations of each series of a match list once, one series after the other.
+
+	Parameters
+	----------
+	pdImageInfo : pd.DataFrame
+		Match list of CTs and segmentations, e.g. from selectPilotSeries.
+	imageDirPath : str | Path
+		Directory the paths of the match list are relative to, as in radiomicFeatureExtraction.
+	roiNames : str, optional
+		Pattern of the ROIs to load from the segmentations.
+
+	Returns
+	-------
+	float
+		Seconds spent loading.
+	"""
+	imageDirPath = Path(imageDirPath)
+	startTime = time.perf_counter()
+	for ctSeriesID, ctSeriesInfo in pdImageInfo.groupby("series_CT", sort=False):
+		ctDirPath = imageDirPath / ctSeriesInfo.iloc[0]["folder_CT"]
+		read_dicom_auto(path=ctDirPath.as_posix(), series_id=ctSeriesID)
+		for _, segSeriesInfo in ctSeriesInfo.drop_duplicates(subset="series_seg").iterrows():
+			loadSegmentation(
+				imageDirPath / segSeriesInfo["file_path_seg"],
+				modality=segSeriesInfo["modality_seg"],
+				baseImageDirPath=ctDirPath,
+				roiNames=roiNames,
+			)
+	return time.perf_counter() - startTime
+
+
+def extrapolatePilotRun(
+	plan: pd.DataFrame,
+	pilotSeriesIDs: Sequence[str],
+	pilotSeconds: float,
+	pilotOutputBytes: int,
+	*,
+	downsampleFactor: int = 1,
+	pilotLoadSeconds: Optional[float] = None,
+) -> OrderedDict[str, Any]:
+	"""Extrapolate the runtime and output size of a full run from a pilot run.
+
+	The pilot runtime calibrates the per voxel costs of readii.preflight.estimateSeriesSeconds. Downsampling by a
+	factor f leaves the pilot f ** 3 times fewer ROI voxels to extract features from, but the CT and segmentations are
+	still loaded at full resolution, so only the ROI term of the pilot estimate is divided by f ** 3. With
+	pilotLoadSeconds, the cost per CT voxel is calibrated from the time to load the pilot series once, and the cost per
+	ROI voxel from the rest of the pilot runtime. Otherwise both default costs are scaled by the ratio of the measured
+	runtime to the estimate for the pilot series. The output size is extrapolated by the number of ROIs, as every ROI
+	gives a row of features.
+
+	Parameters
+	----------
+	plan : pd.DataFrame
+		Pre-flight plan of the full run, from readii.preflight.planFeatureExtraction.
+	pilotSeriesIDs : Sequence[str]
+		CT series the pilot was run on, see selectPilotSeries.
+	pilotSeconds : float
+		Measured runtime of the pilot.
+	pilotOutputBytes : int
+		Size of the feature files written by the pilot.
+	downsampleFactor : int, default 1
+		Factor the pilot images were downsampled by, see downsampleImage.
+	pilotLoadSeconds : float, optional
+		Time to load the CT and segmentations of the pilot series once, see timeSeriesLoading. Only meaningful if the
+		pilot extracted its series one after the other, as the estimates are single-core.
+
+	Returns
+	-------
+	OrderedDict[str, Any]
+		n_pilot_series, n_series, downsample_factor, pilot_seconds, the calibrated seconds_per_ct_voxel and
+		seconds_per_roi_voxel, estimated_seconds, pilot_output_bytes and estimated_output_bytes of the full run.
+		The estimates are NaN if the plan has no estimate for the pilot series.
+	"""
+	# Each series is loaded and extracted once for the original images and once for each negative control
+	nRuns = plan["estimated_seconds"] / estimateSeriesSeconds(plan["ct_voxels"], plan["roi_voxels"])
+	ctVoxelRuns = nRuns * plan["ct_voxels"]
+	roiVoxelRuns = nRuns * np.nan_to_num(plan["roi_voxels"])
+
+	isPilot = plan["series_CT"].isin(pilotSeriesIDs)
+	pilotPlan = plan.loc[isPilot]
+	pilotCTVoxelRuns = ctVoxelRuns[isPilot].sum()
+	pilotROIVoxelRuns = roiVoxelRuns[isPilot].sum() / downsampleFactor**3
+	pilotROIs = pilotPlan["n_rois"].sum()
+
+	if pilotLoadSeconds is not None:
+		pilotCTVoxels = pilotPlan["ct_voxels"].sum()
+		secondsPerCTVoxel = pilotLoadSeconds / pilotCTVoxels if pilotCTVoxels > 0 else np.nan
+		pilotROISeconds = pilotSeconds - pilotCTVoxelRuns * secondsPerCTVoxel
+		secondsPerROIVoxel = (
+			pilotROISeconds / pilotROIVoxelRuns if pilotROIVoxelRuns > 0 else np.nan
+		)
+	else:
+		pilotEstimate = estimateSeriesSeconds(pilotCTVoxelRuns, pilotROIVoxelRuns)
+		costScale = pilotSeconds / pilotEstimate if pilotEstimate > 0 else np.nan
+		secondsPerCTVoxel = SECONDS_PER_CT_VOXEL * costScale
+		secondsPerROIVoxel = SECONDS_PER_ROI_VOXEL * costScale
+	bytesPerROI = pilotOutputBytes / pilotROIs if pilotROIs > 0 else np.nan
+
+	return OrderedDict(
+		n_pilot_series=len(pilotPlan["series_CT"].unique()),
+		n_series=len(plan["series_CT"].unique()),
+		downsample_factor=downsampleFactor,
+		pilot_seconds=pilotSeconds,
+		seconds_per_ct_voxel=secondsPerCTVoxel,
+		seconds_per_roi_voxel=secondsPerROIVoxel,
+		estimated_seconds=estimateSeriesSeconds(
+			ctVoxelRuns.sum(),
+			roiVoxelRuns.sum(),
+			secondsPerCTVoxel=secondsPerCTVoxel,
+			secondsPerROIVoxel=secondsPerROIVoxel,
+		),
+		pilot_output_bytes=pilotOutputBytes,
+		estimated_output_bytes=plan["n_rois"].sum() * bytesPerROI,
+	)
@@ -1,8 +1,20 @@
 from argparse import ArgumentParser
+from dataclasses import replace
+from datetime import datetime
 import os
+import time
 
 from readii.metadata import *
 from readii.feature_extraction import *
+from readii.logqueue import aggregatedLogs
+from readii.negative_controls_refactor import BufferPool
+from readii.negative_controls_refactor.perturbations import PerturbationManager
+from readii.options import ExtractionOptions
+from readii.pilot import directoryBytes, extrapolatePilotRun, selectPilotSeries, timeSeriesLoading
+from readii.preflight import planFeatureExtraction
+from readii.progress import ExtractionProgress
+from readii.qc import ROIQCCriteria
+from readii.threads import setThreadBudget
 
 from readii.utils import logger
 
@@ -21,9 +33,10 @@ def parser():
     parser.add_argument("--roi_names", type=str, default=None,
                         help="Name of region of interest in RTSTRUCT to perform extraction on.")
     
-    parser.add_argument("--pyradiomics_setting", type=str, default=None,
+    parser.add_argument("--pyradiomics_setting", type=str, nargs="+", default=None,
                         help="Path to PyRadiomics configuration YAML file. If none provided, will use \
-                              default in src/readii/data/.")
+                              default in src/readii/data/. If several are provided, each image is loaded and cropped once for all of them \
+                              and features are saved to one file per configuration, with the configuration file name in the file name.")
     
     parser.add_argument("--negative_controls", type=str, default=None,
                         help="List of negative control types to run feature extraction on. Input as comma-separated list with no spaces.  \
@@ -32,6 +45,23 @@ def parser():
     parser.add_argument("--parallel", action="store_true",
                         help="Whether to run feature extraction in a parallel process. False by default.")
 
+    parser.add_argument("--memory_budget_gb", type=float, default=None,
+                        help="With --parallel, only start extracting a CT series when its peak memory, estimated from the DICOM headers, \
+                              fits in this many GB next to the series already running. Smaller series run while larger ones wait. \
+                              One series per CPU by default.")
+
+    parser.add_argument("--isolate_series", action="store_true",
+                        help="Flag to extract each series in a supervised worker process, so that a crash in native code (e.g. a segmentation \
+                              fault in ITK or GDCM) fails only that series. With --keep_running, the crash and the stderr of the worker are \
+                              logged and the run continues with a new worker. False by default.")
+
+    parser.add_argument("--threads", type=int, default=None,
+                        help="Total number of threads to use. Divided between the parallel workers of each step, which limit their SimpleITK \
+                              and BLAS threads to their share. All CPUs by default.")
+
+    parser.add_argument("--threads_per_worker", type=int, default=None,
+                        help="Number of SimpleITK and BLAS threads of each parallel worker, instead of an equal share of --threads.")
+
     parser.add_argument("--update", action="store_true", help="Flag to force rerun all steps of pipeline. False by default.")
 
     parser.add_argument("--random_seed", type=int,
@@ -40,15 +70,134 @@ def parser():
     parser.add_argument("--keep_running", action="store_true",
                         help="Flag to keep pipeline running even when feature extraction for a patient fails. False by default.")
 
+    parser.add_argument("--retry_failed", action="store_true",
+                        help="Flag to only extract the series listed in the failure manifests of an earlier run (readii_outputs/failures/) \
+                              and merge them into its feature files, instead of rerunning every series. Each run writes the series that \
+                              failed, with the stage, exception type and message, to these manifests. False by default.")
+
+    parser.add_argument("--slab_size", type=int, default=None,
+                        help="Number of slices to generate negative controls in at once to bound memory use for very large volumes. \
+                              Whole volume at once by default.")
+
+    parser.add_argument("--perturbations", type=str, default=None,
+                        help="List of perturbation types to extract features from for robustness analysis. Input as comma-separated list with no spaces. \
+                              Options: rotation,translation,noise,contour")
+
+    parser.add_argument("--n_perturbations", type=int, default=30,
+                        help="Number of perturbations of each type to generate per ROI. 30 by default.")
+
+    parser.add_argument("--firstorder_engine", type=str, default="pyradiomics", choices=["pyradiomics", "numpy"],
+                        help="Engine to compute first order features with. numpy is a vectorized engine that matches PyRadiomics \
+                              within floating point tolerance. pyradiomics by default.")
+
+    parser.add_argument("--texture_engine", type=str, default="pyradiomics", choices=["pyradiomics", "numpy"],
+                        help="Engine to compute GLCM, GLRLM and GLSZM features with. numpy builds the texture matrices with numpy \
+                              and gives the same results as PyRadiomics, but is not faster, as each image is extracted on its own. \
+                              pyradiomics by default.")
+
+    parser.add_argument("--union_crop_max_gb", type=float, default=None,
+                        help="Compute filtered images (e.g. LoG, wavelet) once over the union of the ROI bounding boxes of each segmentation, \
+                              using at most this many GB for them, instead of once per ROI. Falls back to per-ROI processing above this. \
+                              Filtered image features can differ slightly near the ROI border. Off by default.")
+
+    parser.add_argument("--roi_jobs", type=int, default=None,
+                        help="Number of workers to split the feature extraction of each ROI over, one for each image type and feature class. \
+                              Use -1 for all CPUs. Speeds up large ROIs with many filtered images. Off by default.")
+
+    parser.add_argument("--roi_parallel_backend", type=str, default="processes", choices=["processes", "threads"],
+                        help="Run the --roi_jobs workers as processes or threads. With threads, only the image filters run in parallel. \
+                              processes by default.")
+
+    parser.add_argument("--slice_aggregation", type=str, default=None, choices=["mean", "max", "slices"],
+                        help="Extract 2D features from each axial slice of each ROI in parallel, for thick-slice images. mean and max give one \
+                              row per ROI aggregated over its slices, slices gives one row per slice. Off (3D extraction) by default.")
+
+    parser.add_argument("--slice_jobs", type=int, default=-1,
+                        help="Number of worker processes to extract the slices of each ROI with in 2D mode. All CPUs (-1) by default.")
+
+    parser.add_argument("--plan", action="store_true",
+                        help="Flag to only run the pre-flight check: read the DICOM headers of every CT and segmentation in the match list, \
+                              save the geometry mismatches, missing ROIs, voxel counts and runtime and memory estimates to \
+                              readii_outputs/plan, and stop before feature extraction. False by default.")
+
+    parser.add_argument("--preflight", action="store_true",
+                        help="Flag to run the pre-flight check of --plan first and skip the series that fail it in feature extraction. \
+                              False by default.")
+
+    parser.add_argument("--pilot", type=int, default=None,
+                        help="Run the pipeline, including negative controls and perturbations, on a stratified random subset of this many CT \
+                              series (by segmentation modality and CT size) and save an estimate of the runtime and output size of the full \
+                              run, extrapolated from the measured cost per voxel. Outputs are saved to readii_outputs/pilot. Off by default.")
+
+    parser.add_argument("--pilot_downsample", type=int, default=None,
+                        help="With --pilot, downsample the CTs and ROIs by this factor along each axis for a faster pilot. \
+                              The images are still loaded at full resolution, so only extraction is faster. Off by default.")
+
+    parser.add_argument("--roi_qc", action="store_true",
+                        help="Flag to compute QC statistics of each ROI (voxel count, volume, bounding box, HU range, connected components, \
+                              slice coverage, border contact) and save them to readii_outputs/qc. ROIs that fail the --qc_ criteria are \
+                              excluded from feature extraction. False by default.")
+
+    parser.add_argument("--qc_min_voxels", type=int, default=1,
+                        help="With --roi_qc, exclude ROIs with fewer voxels than this. 1 by default.")
+
+    parser.add_argument("--qc_max_components", type=int, default=None,
+                        help="With --roi_qc, exclude ROIs with more connected components than this. Not checked by default.")
+
+    parser.add_argument("--qc_exclude_border", action="store_true",
+                        help="With --roi_qc, exclude ROIs that touch the image border. False by default.")
+
+    parser.add_argument("--reuse_buffers", action="store_true",
+                        help="Flag to reuse full-volume working arrays across negative controls instead of allocating new ones for each image. False by default.")
+
     return parser.parse_known_args()[0]
     
 
     
 
+def featureOutputPaths(outputDir, featureSetName, datasetName, configNames=None):
+    """Function to get the radiomic feature file paths of a feature set, by PyRadiomics configuration name.
+    The only key is None when a single configuration is used.
+    """
+    if configNames is None:
+        return {None: os.path.join(outputDir, "features/", "radiomicfeatures_" + featureSetName + "_" + datasetName + ".csv")}
+    return {configName: os.path.join(outputDir, "features/", "radiomicfeatures_" + featureSetName + "_" + configName + "_" + datasetName + ".csv")
+            for configName in configNames}
+
+
+def usesProcessWorkers(args):
+    """Function to check whether feature extraction with the parsed command line arguments runs tasks in worker processes,
+    whose logs are then forwarded to the main process. Series run in parallel are extracted in threads.
+    """
+    if args.plan:
+        return False
+    return (args.isolate_series
+            or (args.roi_jobs != None and args.roi_parallel_backend == "processes")
+            or args.slice_aggregation != None)
+
+
 def main():
     """Function to run READII radiomic feature extraction pipeline.
+    The logs of the run, including those of worker processes, are also written to readii_outputs/logs/ as JSON lines.
+    The progress of the feature extraction is shown as a progress bar for each feature set on a terminal, and logged
+    every minute otherwise, see readii.progress.
     """
     args = parser()
+    datasetName = os.path.basename(os.path.normpath(args.data_directory))
+    runLogPath = os.path.join(args.output_directory, "readii_outputs", "logs/",
+                              f"readii_{datasetName}_{datetime.now():%Y-%m-%d_%H-%M-%S}.jsonl")
+    featureSetNames = ["original",
+                       *(args.negative_controls.split(",") if args.negative_controls != None else []),
+                       *(["original_perturbed"] if args.perturbations != None else [])]
+    progress = ExtractionProgress(featureSetNames)
+    with progress.display(), aggregatedLogs(runLogPath, processWorkers = usesProcessWorkers(args)):
+        runPipeline(args, progress)
+
+
+def runPipeline(args, progress=None):
+    """Function to run the steps of the READII pipeline with the parsed command line arguments.
+    The series of each feature set extracted are counted in progress, an ExtractionProgress, if given.
+    """
     pretty_args = '\n\t'.join([f"{k}: {v}" for k, v in vars(args).items()])
     logger.debug(
         f"Arguments:\n\t{pretty_args}"
@@ -56,6 +205,46 @@ def main():
 
     logger.info("Starting readii pipeline...", args=vars(args))
 
+    setThreadBudget(totalThreads = args.threads, threadsPerWorker = args.threads_per_worker)
+
+    unionCropMaxBytes = args.union_crop_max_gb * 1024**3 if args.union_crop_max_gb is not None else None
+    memoryBudget = args.memory_budget_gb * 1024**3 if args.memory_budget_gb is not None else None
+    roiQC = None
+    if args.roi_qc:
+        roiQC = ROIQCCriteria(minVoxels = args.qc_min_voxels,
+                              maxComponents = args.qc_max_components,
+                              excludeBorder = args.qc_exclude_border)
+    options = ExtractionOptions(slabSize = args.slab_size,
+                                unionCropMaxBytes = unionCropMaxBytes,
+                                firstOrderEngine = args.firstorder_engine,
+                                textureEngine = args.texture_engine,
+                                roiJobs = args.roi_jobs,
+                                roiParallelBackend = args.roi_parallel_backend,
+                                sliceAggregation = args.slice_aggregation,
+                                sliceJobs = args.slice_jobs,
+                                roiQC = roiQC,
+                                downsampleFactor = args.pilot_downsample,
+                                memoryBudget = memoryBudget,
+                                isolateSeries = args.isolate_series)
+
+    # A single PyRadiomics configuration keeps the output file names without a configuration name
+    pyradiomicsSetting = args.pyradiomics_setting
+    configNames = None
+    if pyradiomicsSetting is not None:
+        if len(pyradiomicsSetting) == 1:
+            pyradiomicsSetting = pyradiomicsSetting[0]
+        else:
+            configNames = [pyradiomicsConfigName(configPath) for configPath in pyradiomicsSetting]
+            if args.perturbations != None:
+                raise ValueError("Perturbation feature extraction supports a single PyRadiomics configuration.")
+    if args.retry_failed and (args.update or args.pilot != None):
+        raise ValueError("Retrying failed series with --retry_failed cannot be combined with --update or --pilot.")
+    if args.pilot_downsample != None and args.pilot == None:
+        raise ValueError("Downsampling with --pilot_downsample is only supported for pilot runs with --pilot.")
+    # Fail before any extraction if 2D mode is combined with options it does not support
+    if args.slice_aggregation != None and (configNames is not None or args.perturbations != None):
+        raise ValueError("2D slice feature extraction supports a single PyRadiomics configuration and no perturbations.")
+
     # Set up output directory
     outputDir = os.path.join(args.output_directory, "readii_outputs")
     if not os.path.exists(outputDir):
@@ -94,44 +283,140 @@ def main():
         imageFileListPath, 
         args.update)
     
+    # Check every CT/segmentation pair from the DICOM headers before any pixel data is decoded
+    seriesPlan = None
+    if args.plan or args.preflight or args.pilot != None:
+        logger.info("Running pre-flight check...")
+        nNegativeControls = len(args.negative_controls.split(",")) if args.negative_controls != None else 0
+        fullPlan = planFeatureExtraction(imageMetadataPath, parentDirPath, args.roi_names, nNegativeControls)
+        planOutPath = os.path.join(outputDir, "plan/", "plan_" + datasetName + ".csv")
+        saveDataframeCSV(fullPlan, planOutPath)
+        if args.plan:
+            logger.info(f"Pre-flight check saved to {planOutPath}. Skipping feature extraction.")
+            return
+        if args.preflight:
+            seriesPlan = fullPlan
+
+    # Run the rest of the pipeline on a stratified subset of the series, with its own outputs, to time it
+    if args.pilot != None:
+        pilotImageInfo = selectPilotSeries(pd.read_csv(imageMetadataPath, header=0), args.pilot, randomSeed = args.random_seed)
+        outputDir = os.path.join(outputDir, "pilot")
+        imageMetadataPath = os.path.join(outputDir, "ct_to_seg_match_list_" + datasetName + ".csv")
+        saveDataframeCSV(pilotImageInfo, imageMetadataPath)
+        logger.info(f"Starting pilot run on {pilotImageInfo['series_CT'].nunique()} CT series. See {imageMetadataPath}")
+        # Loading is not made faster by --pilot_downsample, so its cost is calibrated separately. Series run in parallel
+        # only give the wall time of the pilot, which cannot be split into loading and extraction
+        pilotLoadSeconds = None
+        if not args.parallel:
+            logger.info("Timing the loading of the pilot series...")
+            pilotLoadSeconds = timeSeriesLoading(pilotImageInfo, parentDirPath, args.roi_names)
+        # Features from earlier pilots are extracted again so that the whole pilot is timed
+        args.update = True
+        pilotStartTime = time.perf_counter()
+
     # Check if radiomic feature file already exists
-    radFeatOutPath = os.path.join(outputDir, "features/", "radiomicfeatures_original_" + datasetName + ".csv")
-    if not os.path.exists(radFeatOutPath) or args.update:
+    radFeatOutPaths = featureOutputPaths(outputDir, "original", datasetName, configNames)
+    if not all(os.path.exists(radFeatOutPath) for radFeatOutPath in radFeatOutPaths.values()) or args.update or args.retry_failed:
         logger.info("Starting radiomic feature extraction...")
         radiomicFeatures = radiomicFeatureExtraction(imageMetadataPath = imageMetadataPath,
                                                      imageDirPath = parentDirPath,
                                                      roiNames = args.roi_names,
-                                                     pyradiomicsParamFilePath = args.pyradiomics_setting,
+                                                     pyradiomicsParamFilePath = pyradiomicsSetting,
                                                      outputDirPath = outputDir,
                                                      negativeControl = None,
                                                      parallel = args.parallel,
-                                                     keep_running = args.keep_running)
+                                                     keep_running = args.keep_running,
+                                                     options = options,
+                                                     seriesPlan = seriesPlan,
+                                                     progress = progress,
+                                                     retryFailed = args.retry_failed)
     else:
-        logger.info(f"Radiomic features have already been extracted. See {radFeatOutPath}")
+        logger.info(f"Radiomic features have already been extracted. See {list(radFeatOutPaths.values())}")
+        if progress is not None:
+            progress.skipFeatureSet("original")
+        radiomicFeatures = {configName: pd.read_csv(radFeatOutPath) for configName, radFeatOutPath in radFeatOutPaths.items()}
+        if configNames is None:
+            radiomicFeatures = radiomicFeatures[None]
 
     # Negative control radiomic feature extraction
     if args.negative_controls != None:
         # Get all negative controls to run
         negativeControlList = args.negative_controls.split(",")
 
+        # Share one pool of working arrays across all negative control types
+        ncOptions = replace(options, bufferPool = BufferPool() if args.reuse_buffers else None)
+
         # Perform feature extraction for each negative control type
         for negativeControl in negativeControlList:
-            ncRadFeatOutPath = os.path.join(outputDir, "features/", "radiomicfeatures_" + negativeControl + "_" + datasetName + ".csv")
-            if not os.path.exists(ncRadFeatOutPath) or args.update:
+            ncRadFeatOutPaths = featureOutputPaths(outputDir, negativeControl, datasetName, configNames)
+            if not all(os.path.exists(ncRadFeatOutPath) for ncRadFeatOutPath in ncRadFeatOutPaths.values()) or args.update or args.retry_failed:
                 logger.info(f"Starting radiomic feature extraction for negative control: {negativeControl}")
                 ncRadiomicFeatures = radiomicFeatureExtraction(imageMetadataPath = imageMetadataPath,
                                                                imageDirPath = parentDirPath,
                                                                roiNames = args.roi_names,
-                                                               pyradiomicsParamFilePath = args.pyradiomics_setting,
+                                                               pyradiomicsParamFilePath = pyradiomicsSetting,
                                                                outputDirPath = outputDir,
                                                                negativeControl = negativeControl,
                                                                randomSeed=args.random_seed,
                                                                parallel = args.parallel,
-                                                               keep_running = args.keep_running)
+                                                               keep_running = args.keep_running,
+                                                               options = ncOptions,
+                                                               originalFeatures = radiomicFeatures,
+                                                               seriesPlan = seriesPlan,
+                                                               progress = progress,
+                                                               retryFailed = args.retry_failed)
             else:
-                logger.info(f"{negativeControl} radiomic features have already been extracted. See {ncRadFeatOutPath}")
+                logger.info(f"{negativeControl} radiomic features have already been extracted. See {list(ncRadFeatOutPaths.values())}")
+                if progress is not None:
+                    progress.skipFeatureSet(negativeControl)
 
     
+    # Perturbation radiomic feature extraction
+    if args.perturbations != None:
+        perturbationManager = PerturbationManager.from_strings(args.perturbations.split(","),
+                                                               n_perturbations = args.n_perturbations,
+                                                               random_seed = args.random_seed)
+        # Perturbations are extracted from the whole image of each ROI, without the ROI level options
+        perturbationOptions = ExtractionOptions(firstOrderEngine = options.firstOrderEngine,
+                                                textureEngine = options.textureEngine,
+                                                downsampleFactor = options.downsampleFactor,
+                                                memoryBudget = options.memoryBudget,
+                                                isolateSeries = options.isolateSeries)
+
+        perturbedRadFeatOutPath = os.path.join(outputDir, "features/", "radiomicfeatures_original_perturbed_" + datasetName + ".csv")
+        if not os.path.exists(perturbedRadFeatOutPath) or args.update or args.retry_failed:
+            logger.info(f"Starting radiomic feature extraction for perturbations: {args.perturbations}")
+            perturbedRadiomicFeatures = radiomicFeatureExtraction(imageMetadataPath = imageMetadataPath,
+                                                                  imageDirPath = parentDirPath,
+                                                                  roiNames = args.roi_names,
+                                                                  pyradiomicsParamFilePath = pyradiomicsSetting,
+                                                                  outputDirPath = outputDir,
+                                                                  parallel = args.parallel,
+                                                                  keep_running = args.keep_running,
+                                                                  options = perturbationOptions,
+                                                                  perturbationManager = perturbationManager,
+                                                                  seriesPlan = seriesPlan,
+                                                                  progress = progress,
+                                                                  retryFailed = args.retry_failed)
+        else:
+            logger.info(f"Perturbation radiomic features have already been extracted. See {perturbedRadFeatOutPath}")
+            if progress is not None:
+                progress.skipFeatureSet("original_perturbed")
+
+    if args.pilot != None:
+        pilotEstimate = extrapolatePilotRun(fullPlan,
+                                            pilotImageInfo["series_CT"].unique(),
+                                            pilotSeconds = time.perf_counter() - pilotStartTime,
+                                            pilotOutputBytes = directoryBytes(os.path.join(outputDir, "features")),
+                                            downsampleFactor = args.pilot_downsample or 1,
+                                            pilotLoadSeconds = pilotLoadSeconds)
+        pilotEstimateOutPath = os.path.join(outputDir, "pilot_estimate_" + datasetName + ".csv")
+        saveDataframeCSV(pd.DataFrame([pilotEstimate]), pilotEstimateOutPath)
+        # The estimate is the result of a pilot run, so it is printed rather than logged below the default log level
+        print(f"Pilot run took {pilotEstimate['pilot_seconds']:.0f} s. "
+              f"Full run of {pilotEstimate['n_series']} CT series estimated to take {pilotEstimate['estimated_seconds'] / 3600:.2f} hours "
+              f"and write {pilotEstimate['estimated_output_bytes'] / 1024**2:.1f} MB of features. See {pilotEstimateOutPath}")
+
     logger.info("Pipeline complete.")
 
 if __name__ == "__main__":
@@ -0,0 +1,354 @@
+"""Pre-flight check of a feature extraction run from DICOM headers only.
+
+`planFeatureExtraction` reads the headers of the CT and segmentation of every row of a
+med-imagetools match list, without decoding any pixel data. It reports the problems
+`featureExtraction` would only find after loading the images (CT and ROI size mismatches,
+missing RTSTRUCT ROIs, unreadable series), the expected voxel counts, and an estimate of the
+runtime and peak memory of each CT/segmentation pair. `plannedImageInfo` keeps only the rows
+that passed, so failing series can be skipped before any pixel decoding.
+"""
+
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+import pydicom
+
+from readii.utils import logger
+
+# Rough single-core costs of the default PyRadiomics configuration, to re-calibrate for other configurations
+# Seconds to load and prepare each CT voxel
+SECONDS_PER_CT_VOXEL = 2e-8
+# Seconds to extract features for each ROI voxel
+SECONDS_PER_ROI_VOXEL = 4e-4
+
+# Rough peak memory per CT voxel while a series is processed
+# Loaded CT image
+CT_BYTES_PER_VOXEL = 4
+# Mask image of each ROI
+ROI_BYTES_PER_VOXEL = 1
+# Working arrays and output image of a negative control
+NEGATIVE_CONTROL_BYTES_PER_VOXEL = 16
+
+# CT header tags the plan needs
+CT_HEADER_TAGS = ["SeriesInstanceUID", "Rows", "Columns", "PixelSpacing", "ImagePositionPatient"]
+
+# Columns of the plan made by planFeatureExtraction
+PLAN_COLUMNS = (
+	"patient_ID",
+	"series_CT",
+	"series_seg",
+	"modality_seg",
+	"ct_size",
+	"ct_spacing",
+	"ct_voxels",
+	"rois",
+	"n_rois",
+	"roi_voxels",
+	"estimated_seconds",
+	"estimated_memory_bytes",
+	"issues",
+	"passed",
+)
+
+
+def readCTHeaders(ctDirPath: str | Path, ctSeriesID: str) -> Dict[str, Any]:
+	"""Read the geometry of a CT series from the headers of its DICOM files.
+
+	Parameters
+	----------
+	ctDirPath : str | Path
+		Directory containing the DICOM files of the series.
+	ctSeriesID : str
+		Series Instance UID of the CT. Files of other series in the directory are ignored.
+
+	Returns
+	-------
+	Dict[str, Any]
+		The image size as (columns, rows, slices), like SimpleITK, and the voxel spacing in mm.
+
+	Raises
+	------
+	FileNotFoundError
+		If the directory does not exist or has no DICOM files of the series.
+	"""
+	ctDirPath = Path(ctDirPath)
+	if not ctDirPath.is_dir():
+		msg = f"CT directory not found: {ctDirPath}"
+		raise FileNotFoundError(msg)
+
+	sliceHeaders = []
+	for filePath in sorted(ctDirPath.iterdir()):
+		if not filePath.is_file():
+			continue
+		try:
+			header = pydicom.dcmread(
+				filePath, stop_before_pixels=True, specific_tags=CT_HEADER_TAGS
+			)
+		except pydicom.errors.InvalidDicomError:
+			continue
+		if header.get("SeriesInstanceUID") == ctSeriesID:
+			sliceHeaders.append(header)
+
+	if not sliceHeaders:
+		msg = f"No DICOM files of series {ctSeriesID} in {ctDirPath}"
+		raise FileNotFoundError(msg)
+
+	firstHeader = sliceHeaders[0]
+	# Slice spacing from the distance between slice positions, as SimpleITK computes it
+	slicePositions = np.sort([float(header.ImagePositionPatient[2]) for header in sliceHeaders])
+	sliceSpacing = float(np.median(np.diff(slicePositions))) if len(slicePositions) > 1 else 1.0
+
+	return {
+		"size": (int(firstHeader.Columns), int(firstHeader.Rows), len(sliceHeaders)),
+		"spacing": (
+			float(firstHeader.PixelSpacing[1]),
+			float(firstHeader.PixelSpacing[0]),
+			sliceSpacing,
+		),
+	}
+
+
+def contourVoxelCount(contourData: Sequence[float], pixelArea: float) -> float:
+	"""Estimate the number of voxels inside a planar RTSTRUCT contour from its area in its axial slice."""
+	points = np.asarray(contourData, dtype=float).reshape(-1, 3)
+	x, y = points[:, 0], points[:, 1]
+	area = 0.5 * abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+	return area / pixelArea
+
+
+def readSegmentationHeader(
+	segFilePath: str | Path,
+	modality: str,
+	roiNames: Optional[str | Sequence[str]] = None,
+	pixelArea: float = 1.0,
+) -> Dict[str, Any]:
+	"""Read the ROIs of a segmentation file and estimate their size from its header.
+
+	Parameters
+	----------
+	segFilePath : str | Path
+		Path to the RTSTRUCT or SEG file.
+	modality : {"RTSTRUCT", "SEG"}
+		Type of the segmentation file.
+	roiNames : str | Sequence[str], optional
+		Names of the RTSTRUCT ROIs to extract. All ROIs of the file if None. Not used for SEG, whose first
+		segment is extracted, as in readii.loaders.loadSegmentation.
+	pixelArea : float, default 1.0
+		Area of a CT pixel in mm², to convert RTSTRUCT contour areas to voxel counts.
+
+	Returns
+	-------
+	Dict[str, Any]
+		"rois": estimated voxel count of each ROI that will be extracted by name, NaN if the header does not
+		tell (SEG), "missing_rois": requested ROIs that are not in the file, and "size": the size of the ROI
+		images as (columns, rows, frames) for SEG, None for RTSTRUCT, whose masks are made on the CT grid.
+	"""
+	header = pydicom.dcmread(segFilePath, stop_before_pixels=True)
+
+	if modality.upper() == "SEG":
+		return {
+			"rois": {header.SegmentSequence[0].SegmentLabel: np.nan},
+			"missing_rois": [],
+			"size": (int(header.Columns), int(header.Rows), int(header.NumberOfFrames)),
+		}
+
+	roiNumberNames = {
+		str(roi.ROINumber): str(roi.ROIName) for roi in header.get("StructureSetROISequence", [])
+	}
+	if roiNames is None:
+		roiNames = list(roiNumberNames.values())
+	elif isinstance(roiNames, str):
+		roiNames = [roiNames]
+
+	roiVoxelCounts = dict.fromkeys(roiNumberNames.values(), 0.0)
+	for roiContour in header.get("ROIContourSequence", []):
+		roiName = roiNumberNames.get(str(roiContour.ReferencedROINumber))
+		for contour in roiContour.get("ContourSequence", []):
+			if roiName is not None and contour.ContourGeometricType == "CLOSED_PLANAR":
+				roiVoxelCounts[roiName] += contourVoxelCount(contour.ContourData, pixelArea)
+
+	return {
+		"rois": {
+			roiName: roiVoxelCounts[roiName] for roiName in roiNames if roiName in roiVoxelCounts
+		},
+		"missing_rois": [roiName for roiName in roiNames if roiName not in roiVoxelCounts],
+		"size": None,
+	}
+
+
+def estimateSeriesSeconds(
+	ctVoxels: int,
+	roiVoxels: float,
+	nRuns: int = 1,
+	secondsPerCTVoxel: float = SECONDS_PER_CT_VOXEL,
+	secondsPerROIVoxel: float = SECONDS_PER_ROI_VOXEL,
+) -> float:
+	"""Estimate the runtime of extracting features from a CT and its ROIs.
+
+	Parameters
+	----------
+	ctVoxels : int
+		Number of CT voxels.
+	roiVoxels : float
+		Total number of voxels of the ROIs to extract. NaN counts as 0.
+	nRuns : int, default 1
+		Number of times the series is extracted, e.g. 1 + the number of negative controls.
+	secondsPerCTVoxel, secondsPerROIVoxel : float
+		Cost of each CT and ROI voxel. The defaults are rough single-core costs of the default configuration.
+	"""
+	return nRuns * (ctVoxels * secondsPerCTVoxel + np.nan_to_num(roiVoxels) * secondsPerROIVoxel)
+
+
+def estimateSeriesMemory(ctVoxels: int, nROIs: int, negativeControl: bool = False) -> int:
+	"""Estimate the peak memory in bytes of extracting features from a CT and its ROIs.
+
+	The CT, a mask for each ROI and, with a negative control, its working arrays are full volume images.
+	"""
+	bytesPerVoxel = CT_BYTES_PER_VOXEL + nROIs * ROI_BYTES_PER_VOXEL
+	if negativeControl:
+		bytesPerVoxel += NEGATIVE_CONTROL_BYTES_PER_VOXEL
+	return int(ctVoxels * bytesPerVoxel)
+
+
+def planSeriesPair(
+	segSeriesInfo: pd.Series,
+	imageDirPath: str | Path,
+	roiNames: Optional[str | Sequence[str]] = None,
+	nNegativeControls: int = 0,
+) -> OrderedDict[str, Any]:
+	"""Check one CT/segmentation pair of a match list from its headers and estimate its cost.
+
+	Parameters
+	----------
+	segSeriesInfo : pd.Series
+		Row of the match list for the pair.
+	imageDirPath : str | Path
+		Directory the folder_CT and file_path_seg paths of the match list are relative to.
+	roiNames : str | Sequence[str], optional
+		Names of the RTSTRUCT ROIs to extract.
+	nNegativeControls : int, default 0
+		Number of negative controls the series will be extracted for besides the original image.
+
+	Returns
+	-------
+	OrderedDict[str, Any]
+		A row of the plan, see planFeatureExtraction. Only the IDs, issues and passed if the headers cannot be read.
+	"""
+	imageDirPath = Path(imageDirPath)
+	planRow = OrderedDict(
+		patient_ID=segSeriesInfo["patient_ID"],
+		series_CT=segSeriesInfo["series_CT"],
+		series_seg=segSeriesInfo["series_seg"],
+		modality_seg=segSeriesInfo["modality_seg"],
+	)
+	issues = []
+
+	try:
+		ctHeader = readCTHeaders(
+			imageDirPath / segSeriesInfo["folder_CT"], segSeriesInfo["series_CT"]
+		)
+		segHeader = readSegmentationHeader(
+			imageDirPath / segSeriesInfo["file_path_seg"],
+			segSeriesInfo["modality_seg"],
+			roiNames,
+			pixelArea=ctHeader["spacing"][0] * ctHeader["spacing"][1],
+		)
+	except Exception as e:
+		planRow.update(issues=f"unreadable: {type(e).__name__}: {e}", passed=False)
+		return planRow
+
+	ctVoxels = int(np.prod(ctHeader["size"]))
+	roiVoxels = float(np.sum(list(segHeader["rois"].values())))
+
+	if segHeader["size"] is not None and segHeader["size"] != ctHeader["size"]:
+		issues.append(f"size mismatch: CT {ctHeader['size']}, segmentation {segHeader['size']}")
+	if segHeader["missing_rois"]:
+		issues.append(f"missing ROIs: {', '.join(segHeader['missing_rois'])}")
+	if not segHeader["rois"]:
+		issues.append("no ROIs to extract")
+
+	planRow.update(
+		ct_size=ctHeader["size"],
+		ct_spacing=ctHeader["spacing"],
+		ct_voxels=ctVoxels,
+		rois=", ".join(segHeader["rois"]),
+		n_rois=len(segHeader["rois"]),
+		roi_voxels=roiVoxels,
+		estimated_seconds=estimateSeriesSeconds(ctVoxels, roiVoxels, nRuns=1 + nNegativeControls),
+		estimated_memory_bytes=estimateSeriesMemory(
+			ctVoxels, len(segHeader["rois"]), negativeControl=nNegativeControls > 0
+		),
+		issues="; ".join(issues),
+		passed=not issues,
+	)
+	return planRow
+
+
+def planFeatureExtraction(
+	imageMetadataPath: str | Path,
+	imageDirPath: str | Path,
+	roiNames: Optional[str | Sequence[str]] = None,
+	nNegativeControls: int = 0,
+) -> pd.DataFrame:
+	"""Check every CT/segmentation pair of a match list from the DICOM headers, without decoding pixel data.
+
+	Parameters
+	----------
+	imageMetadataPath : str | Path
+		Path to the match list of CTs and segmentations, as for radiomicFeatureExtraction.
+	imageDirPath : str | Path
+		Directory the folder_CT and file_path_seg paths of the match list are relative to.
+	roiNames : str | Sequence[str], optional
+		Names of the RTSTRUCT ROIs to extract. All ROIs of each file if None.
+	nNegativeControls : int, default 0
+		Number of negative controls each series will be extracted for besides the original image.
+
+	Returns
+	-------
+	pd.DataFrame
+		One row for each CT/segmentation pair with the patient and series IDs, the CT size, spacing and voxel
+		count, the ROIs to extract and their estimated voxel count (from the RTSTRUCT contours, NaN for SEG),
+		estimated_seconds and estimated_memory_bytes (peak, see estimateSeriesMemory), the problems found in
+		"issues", and whether the pair "passed".
+	"""
+	pdImageInfo = pd.read_csv(imageMetadataPath, header=0)
+	# CTs with subseries have a row per subseries, but are loaded once
+	pairInfo = pdImageInfo.drop_duplicates(subset=["series_CT", "series_seg"])
+
+	planRows: List[OrderedDict[str, Any]] = [
+		planSeriesPair(segSeriesInfo, imageDirPath, roiNames, nNegativeControls)
+		for _, segSeriesInfo in pairInfo.iterrows()
+	]
+	# Pairs that could not be read have no values for the header columns
+	plan = pd.DataFrame(planRows, columns=list(PLAN_COLUMNS))
+	if plan.empty:
+		logger.warning("No CT/segmentation pairs to check in the match list.")
+		return plan
+
+	failedPlan = plan.loc[~plan["passed"]]
+	for _, planRow in failedPlan.iterrows():
+		logger.warning(
+			"CT/segmentation pair fails pre-flight check.",
+			patient_ID=planRow["patient_ID"],
+			series_CT=planRow["series_CT"],
+			series_seg=planRow["series_seg"],
+			issues=planRow["issues"],
+		)
+	logger.info(
+		"Pre-flight check finished.",
+		n_pairs=len(plan),
+		n_failed=len(failedPlan),
+		estimated_hours=plan["estimated_seconds"].sum() / 3600,
+		peak_memory_gb=plan["estimated_memory_bytes"].max() / 1024**3,
+	)
+
+	return plan
+
+
+def plannedImageInfo(pdImageInfo: pd.DataFrame, plan: pd.DataFrame) -> pd.DataFrame:
+	"""Keep the rows of a match list whose CT/segmentation pair passed the pre-flight check."""
+	passedPairs = plan.loc[plan["passed"], ["series_CT", "series_seg"]]
+	return pdImageInfo.merge(passedPairs, on=["series_CT", "series_seg"], how="inner")
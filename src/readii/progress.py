@@ -0,0 +1,357 @@
+"""Live progress of feature extraction runs, with throughput, ETA, active workers and memory in use.
+
+A run extracts feature sets one after the other: the original images, each negative control and the
+perturbations, each over all series of the match list. `ExtractionProgress` counts the series of a
+feature set as they start and finish in the process running the extraction. The series may run one
+after the other, in threads, or in worker processes (see readii.supervisor), and are counted the
+same in every mode. Throughput is measured over the last ROLLING_WINDOW_SERIES series, and the ETA
+assumes the feature sets still to come take as long as the current one.
+
+Within `ExtractionProgress.display`, a progress bar is drawn for each feature set when stderr is a
+terminal. Otherwise, e.g. in batch jobs, a progress line is logged every PROGRESS_LOG_SECONDS.
+"""
+
+import contextlib
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import timedelta
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Iterator, Optional, Sequence, Tuple
+
+import pandas as pd
+import pydicom
+from imgtools.loggers import tqdm_logging_redirect
+from tqdm import tqdm
+
+from readii.utils import getLogger
+
+try:
+	import psutil
+except ImportError:
+	psutil = None
+
+# Seconds between updates of the progress bars
+PROGRESS_REFRESH_SECONDS = 1.0
+# Seconds between progress log lines when stderr is not a terminal
+PROGRESS_LOG_SECONDS = 60.0
+# Number of latest finished series the throughput is measured over
+ROLLING_WINDOW_SERIES = 20
+
+# Name of the logger of the progress lines
+PROGRESS_LOGGER = "readii.progress"
+progressLogger = getLogger(PROGRESS_LOGGER)
+
+
+def memoryInUse() -> Optional[int]:
+	"""Get the resident memory of this process in bytes, with its worker processes if psutil is installed.
+
+	Without psutil, only the memory of this process is read, from /proc on Linux. None if it cannot be read.
+	"""
+	if psutil is not None:
+		process = psutil.Process()
+		memoryBytes = 0
+		for workerProcess in [process, *process.children(recursive=True)]:
+			# A worker may exit while it is being measured
+			with contextlib.suppress(psutil.Error):
+				memoryBytes += workerProcess.memory_info().rss
+		return memoryBytes
+
+	statmPath = Path("/proc/self/statm")
+	if not statmPath.exists():
+		return None
+	residentPages = int(statmPath.read_text().split()[1])
+	return residentPages * os.sysconf("SC_PAGE_SIZE")
+
+
+def ctVoxelCount(pdImageInfo: pd.DataFrame, imageDirPath: str | Path, ctSeriesID: str) -> int:
+	"""Count the voxels of a CT series, from the rows and columns in the header of one of its files and its slices in the match list.
+
+	Parameters
+	----------
+	pdImageInfo : pd.DataFrame
+		Match list of CTs and segmentations, as read from imageMetadataPath in radiomicFeatureExtraction.
+	imageDirPath : str | Path
+		Directory the folder_CT paths of the match list are relative to.
+	ctSeriesID : str
+		CT series to count the voxels of.
+
+	Returns
+	-------
+	int
+		Number of voxels, 0 if no DICOM file of the series is found.
+	"""
+	ctSeriesInfo = pdImageInfo.loc[pdImageInfo["series_CT"] == ctSeriesID].iloc[0]
+	ctDirPath = Path(imageDirPath) / ctSeriesInfo["folder_CT"]
+	for filePath in sorted(ctDirPath.iterdir()):
+		if not filePath.is_file():
+			continue
+		try:
+			header = pydicom.dcmread(
+				filePath,
+				stop_before_pixels=True,
+				specific_tags=["SeriesInstanceUID", "Rows", "Columns"],
+			)
+		except pydicom.errors.InvalidDicomError:
+			continue
+		if header.get("SeriesInstanceUID") == ctSeriesID:
+			return int(header.Rows) * int(header.Columns) * int(ctSeriesInfo["instances_CT"])
+	return 0
+
+
+def _formatDuration(seconds: Optional[float]) -> str:
+	return str(timedelta(seconds=round(seconds))) if seconds is not None else "?"
+
+
+@dataclass
+class _FeatureSetProgress:
+	name: str
+	total: Optional[int] = None
+	done: int = 0
+	failed: int = 0
+	voxels: int = 0
+	skipped: bool = False
+	finished: bool = False
+	# Time and voxels done when each of the latest series finished, from the start of the feature set
+	window: Deque[Tuple[float, int]] = field(
+		default_factory=lambda: deque(maxlen=ROLLING_WINDOW_SERIES + 1)
+	)
+	bar: Optional[tqdm] = None
+
+
+class ExtractionProgress:
+	"""Thread-safe progress of the series of each feature set of a run.
+
+	Parameters
+	----------
+	featureSetNames : Sequence[str], optional
+		Feature sets the run will extract, in order, e.g. "original" and the negative control names, to include
+		those not started yet in the ETA. Feature sets started without being listed are added.
+	interactive : bool, optional
+		Draw progress bars instead of logging progress lines. Whether stderr is a terminal if None.
+	"""
+
+	def __init__(
+		self,
+		featureSetNames: Sequence[str] = (),
+		interactive: Optional[bool] = None,
+	) -> None:
+		self.interactive = sys.stderr.isatty() if interactive is None else interactive
+		self.activeSeries = 0
+
+		self._featureSets: OrderedDict[str, _FeatureSetProgress] = OrderedDict(
+			(name, _FeatureSetProgress(name)) for name in featureSetNames
+		)
+		self._current: Optional[_FeatureSetProgress] = None
+		self._displaying = False
+		self._lock = threading.Lock()
+
+	def startFeatureSet(self, featureSetName: str, nSeries: int) -> None:
+		"""Start counting the nSeries series of a feature set."""
+		with self._lock:
+			featureSet = self._featureSets.setdefault(
+				featureSetName, _FeatureSetProgress(featureSetName)
+			)
+			featureSet.total = nSeries
+			featureSet.window.append((time.monotonic(), 0))
+			self._current = featureSet
+			if self._displaying and self.interactive:
+				featureSet.bar = tqdm(
+					total=nSeries,
+					desc=self._label(featureSet),
+					unit="series",
+					bar_format="{desc}: {percentage:3.0f}%|{bar}| {n_fmt}/{total_fmt} [{elapsed}] {postfix}",
+					dynamic_ncols=True,
+				)
+
+	def skipFeatureSet(self, featureSetName: str) -> None:
+		"""Leave a feature set out of the ETA, e.g. because it was extracted by an earlier run."""
+		with self._lock:
+			self._featureSets.setdefault(
+				featureSetName, _FeatureSetProgress(featureSetName)
+			).skipped = True
+
+	def finishFeatureSet(self, featureSetName: str) -> None:
+		"""Mark a feature set as finished and report its final progress."""
+		with self._lock:
+			featureSet = self._featureSets[featureSetName]
+			featureSet.finished = True
+			if featureSet.bar is not None:
+				featureSet.bar.set_postfix_str(self._postfix(self._summary()), refresh=False)
+				featureSet.bar.close()
+		if not self.interactive:
+			self.logProgress("Finished feature set.")
+
+	def trackSeries(
+		self,
+		extractSeries: Callable[[str], Any],
+		seriesVoxels: Optional[Callable[[str], int]] = None,
+	) -> Callable[[str], Any]:
+		"""Wrap the function extracting a series of the current feature set to count it.
+
+		A series counts as failed if the function returns no features. seriesVoxels, e.g. ctVoxelCount with the
+		match list, gives the voxels of a series for the throughput in voxels per second.
+		"""
+		return partial(self._extractTrackedSeries, extractSeries, seriesVoxels)
+
+	def _extractTrackedSeries(
+		self,
+		extractSeries: Callable[[str], Any],
+		seriesVoxels: Optional[Callable[[str], int]],
+		ctSeriesID: str,
+	) -> Any:  # noqa: ANN401
+		with self._lock:
+			self.activeSeries += 1
+		features = None
+		try:
+			features = extractSeries(ctSeriesID)
+			return features
+		finally:
+			voxels = 0
+			if seriesVoxels is not None:
+				# The throughput is only informative, so a series that cannot be read counts no voxels
+				with contextlib.suppress(Exception):
+					voxels = seriesVoxels(ctSeriesID)
+			self._seriesFinished(failed=not features, voxels=voxels)
+
+	def _seriesFinished(self, failed: bool, voxels: int) -> None:
+		with self._lock:
+			self.activeSeries -= 1
+			featureSet = self._current
+			featureSet.done += 1
+			featureSet.failed += int(failed)
+			featureSet.voxels += voxels
+			featureSet.window.append((time.monotonic(), featureSet.voxels))
+			if featureSet.bar is not None:
+				featureSet.bar.update(1)
+
+	def _label(self, featureSet: _FeatureSetProgress) -> str:
+		index = list(self._featureSets).index(featureSet.name) + 1
+		return f"[{index}/{len(self._featureSets)}] {featureSet.name}"
+
+	def _summary(self) -> Dict[str, Any]:
+		"""Progress of the current feature set. Called with the lock held."""
+		featureSet = self._current
+		startTime, startVoxels = featureSet.window[0]
+		endTime, endVoxels = featureSet.window[-1]
+		# The time since the last series finished counts too, so that the throughput drops while series stall
+		elapsed = max(time.monotonic(), endTime) - startTime
+		seriesPerSecond = (len(featureSet.window) - 1) / elapsed if elapsed > 0 else 0.0
+
+		remainingSeries = featureSet.total - featureSet.done
+		currentIndex = list(self._featureSets.values()).index(featureSet)
+		for laterFeatureSet in list(self._featureSets.values())[currentIndex + 1 :]:
+			if not laterFeatureSet.skipped:
+				remainingSeries += laterFeatureSet.total or featureSet.total
+
+		memoryBytes = memoryInUse()
+		return OrderedDict(
+			feature_set=self._label(featureSet),
+			series_done=featureSet.done,
+			series_failed=featureSet.failed,
+			series_total=featureSet.total,
+			series_per_min=round(seriesPerSecond * 60, 2),
+			voxels_per_s=round((endVoxels - startVoxels) / elapsed) if elapsed > 0 else 0,
+			eta_seconds=round(remainingSeries / seriesPerSecond) if seriesPerSecond > 0 else None,
+			active_workers=self.activeSeries,
+			memory_gb=round(memoryBytes / 1024**3, 2) if memoryBytes is not None else None,
+		)
+
+	def summary(self) -> Optional[Dict[str, Any]]:
+		"""Get the progress of the current feature set, or None if no feature set was started.
+
+		Series done, failed and in total, series per minute and voxels per second over the latest series, ETA of
+		the run in seconds (None before a series finished), active workers and memory in use in GB.
+		"""
+		with self._lock:
+			return self._summary() if self._current is not None else None
+
+	@staticmethod
+	def _postfix(summary: Dict[str, Any]) -> str:
+		memory = f"{summary['memory_gb']:.1f} GB" if summary["memory_gb"] is not None else "?"
+		return (
+			f"{summary['series_per_min']:.1f} series/min, {summary['voxels_per_s'] / 1e6:.1f} Mvoxels/s, "
+			f"ETA {_formatDuration(summary['eta_seconds'])}, {summary['active_workers']} workers, {memory}"
+		)
+
+	def logProgress(self, message: str = "Feature extraction progress.") -> None:
+		"""Log the progress of the current feature set."""
+		summary = self.summary()
+		if summary is None:
+			return
+		progressLogger.info(
+			message,
+			**summary,
+			eta=_formatDuration(summary["eta_seconds"]),
+		)
+
+	def _refresh(self, stopped: threading.Event) -> None:
+		lastLogTime = time.monotonic()
+		while not stopped.wait(PROGRESS_REFRESH_SECONDS):
+			if not self.interactive:
+				if time.monotonic() - lastLogTime >= PROGRESS_LOG_SECONDS:
+					self.logProgress()
+					lastLogTime = time.monotonic()
+				continue
+			with self._lock:
+				featureSet = self._current
+				if (
+					featureSet is not None
+					and featureSet.bar is not None
+					and not featureSet.finished
+				):
+					featureSet.bar.set_postfix_str(self._postfix(self._summary()))
+
+	@contextmanager
+	def display(self) -> Iterator["ExtractionProgress"]:
+		"""Draw progress bars or log progress lines while the block runs.
+
+		With progress bars, readii logs are written above the bars instead of through them. Progress lines are logged
+		at INFO, so the level of their logger is set to INFO within the block, to show them at the default WARNING
+		level of readii.
+		"""
+		stopped = threading.Event()
+		refresher = threading.Thread(target=self._refresh, args=(stopped,), daemon=True)
+		redirect = tqdm_logging_redirect("readii") if self.interactive else contextlib.nullcontext()
+		stdProgressLogger = logging.getLogger(PROGRESS_LOGGER)
+		previousLevel = stdProgressLogger.level
+		with redirect:
+			stdProgressLogger.setLevel(logging.INFO)
+			self._displaying = True
+			refresher.start()
+			try:
+				yield self
+			finally:
+				stopped.set()
+				refresher.join()
+				self._displaying = False
+				stdProgressLogger.setLevel(previousLevel)
+
+
+@contextmanager
+def trackedFeatureSet(
+	progress: Optional[ExtractionProgress],
+	featureSetName: str,
+	ctSeriesIDs: Sequence[str],
+	extractSeries: Callable[[str], Any],
+	seriesVoxels: Optional[Callable[[str], int]] = None,
+) -> Iterator[Callable[[str], Any]]:
+	"""Count the series extracted with extractSeries within the block as the feature set featureSetName.
+
+	Yields extractSeries as it is if progress is None, otherwise wrapped by ExtractionProgress.trackSeries.
+	"""
+	if progress is None:
+		yield extractSeries
+		return
+
+	progress.startFeatureSet(featureSetName, len(ctSeriesIDs))
+	try:
+		yield progress.trackSeries(extractSeries, seriesVoxels)
+	finally:
+		progress.finishFeatureSet(featureSetName)
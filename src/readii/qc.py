@@ -0,0 +1,119 @@
+"""Quality control (QC) statistics of ROIs, computed without PyRadiomics.
+
+`roiQCStatistics` describes an ROI and the CT intensities in it from one pass over the mask, so it is
+cheap next to feature extraction. `ROIQCCriteria` decides which ROIs to exclude from extraction.
+"""
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import SimpleITK as sitk
+
+# Axes of the SimpleITK index, in the order of the bounding box columns
+QC_AXES = ("x", "y", "z")
+
+
+def roiQCStatistics(ctImage: sitk.Image, roiImage: sitk.Image) -> OrderedDict[str, Any]:
+	"""Compute QC statistics of an ROI in a CT.
+
+	Parameters
+	----------
+	ctImage : sitk.Image
+		CT image the ROI belongs to.
+	roiImage : sitk.Image
+		ROI segmentation with the same size as the CT. Every non-zero voxel is part of the ROI.
+
+	Returns
+	-------
+	OrderedDict[str, Any]
+		voxel_count, volume_mm3, the bounding box as bbox_{x,y,z}_{min,max} voxel indices, hu_min, hu_max and
+		hu_mean of the CT in the ROI, n_components (26-connected), n_slices with ROI voxels, slice_coverage (fraction
+		of the slices between the first and last ROI slice that contain it) and touches_border. Values that need ROI
+		voxels are NaN for an empty ROI.
+	"""
+	roiMask = sitk.GetArrayViewFromImage(roiImage) != 0
+	voxelCount = int(np.count_nonzero(roiMask))
+
+	qcStatistics = OrderedDict(
+		voxel_count=voxelCount,
+		volume_mm3=voxelCount * float(np.prod(roiImage.GetSpacing())),
+	)
+
+	if voxelCount == 0:
+		qcStatistics.update(
+			(f"bbox_{axis}_{end}", np.nan) for axis in QC_AXES for end in ("min", "max")
+		)
+		qcStatistics.update(
+			hu_min=np.nan,
+			hu_max=np.nan,
+			hu_mean=np.nan,
+			n_components=0,
+			n_slices=0,
+			slice_coverage=np.nan,
+			touches_border=False,
+		)
+		return qcStatistics
+
+	# Indices of the planes along each numpy axis (z, y, x) that contain ROI voxels
+	roiPlanes = [
+		np.flatnonzero(
+			roiMask.any(axis=tuple(otherAxis for otherAxis in range(3) if otherAxis != axis))
+		)
+		for axis in range(3)
+	]
+	touchesBorder = False
+	for axisName, planes, axisSize in zip(
+		QC_AXES, reversed(roiPlanes), reversed(roiMask.shape), strict=True
+	):
+		qcStatistics[f"bbox_{axisName}_min"] = int(planes[0])
+		qcStatistics[f"bbox_{axisName}_max"] = int(planes[-1])
+		touchesBorder = touchesBorder or planes[0] == 0 or planes[-1] == axisSize - 1
+
+	roiIntensities = sitk.GetArrayViewFromImage(ctImage)[roiMask]
+	componentFilter = sitk.ConnectedComponentImageFilter()
+	componentFilter.FullyConnectedOn()
+	componentFilter.Execute(roiImage != 0)
+
+	roiSlices = roiPlanes[0]
+	qcStatistics.update(
+		hu_min=float(roiIntensities.min()),
+		hu_max=float(roiIntensities.max()),
+		hu_mean=float(roiIntensities.mean()),
+		n_components=int(componentFilter.GetObjectCount()),
+		n_slices=len(roiSlices),
+		slice_coverage=len(roiSlices) / float(roiSlices[-1] - roiSlices[0] + 1),
+		touches_border=bool(touchesBorder),
+	)
+	return qcStatistics
+
+
+@dataclass(frozen=True)
+class ROIQCCriteria:
+	"""Criteria an ROI must meet to be used for feature extraction.
+
+	Parameters
+	----------
+	minVoxels : int, default 1
+		Minimum number of ROI voxels.
+	maxComponents : int, optional
+		Maximum number of connected components of the ROI. Not checked if None.
+	excludeBorder : bool, default False
+		Exclude ROIs that touch the border of the image, e.g. because they were cut off.
+	"""
+
+	minVoxels: int = 1
+	maxComponents: Optional[int] = None
+	excludeBorder: bool = False
+
+	def failures(self, qcStatistics: Dict[str, Any]) -> List[str]:
+		"""List the criteria an ROI fails, given its roiQCStatistics. Empty if the ROI passes."""
+		failures = []
+		if qcStatistics["voxel_count"] < self.minVoxels:
+			failures.append(f"voxel_count < {self.minVoxels}")
+		if self.maxComponents is not None and qcStatistics["n_components"] > self.maxComponents:
+			failures.append(f"n_components > {self.maxComponents}")
+		if self.excludeBorder and qcStatistics["touches_border"]:
+			failures.append("touches_border")
+		return failures
@@ -0,0 +1,111 @@
+"""Memory admission control for running feature extraction on several series at once.
+
+Running one series per core does not bound memory: a few large CTs at the same time can exceed
+the memory of a node. `memoryAdmittedMap` only starts a series when its estimated peak memory
+(see readii.preflight.estimateSeriesMemory) fits in a memory budget next to the series already
+running. Series that do not fit wait, while later series that fit start in their place, so small
+series keep flowing around large ones.
+"""
+
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Sequence
+
+import numpy as np
+import pandas as pd
+from joblib import effective_n_jobs
+
+from readii.utils import logger
+
+
+def seriesMemoryEstimates(plan: pd.DataFrame, ctSeriesIDs: Sequence[str]) -> List[float]:
+	"""Get the estimated peak memory of each CT series from a pre-flight plan.
+
+	A CT series is loaded once for all of its segmentations, which are extracted one after the other, so its peak
+	is the largest estimate of its CT/segmentation pairs. Series without an estimate, e.g. because their headers
+	could not be read, get the largest estimate of the plan.
+
+	Parameters
+	----------
+	plan : pd.DataFrame
+		Pre-flight plan from readii.preflight.planFeatureExtraction.
+	ctSeriesIDs : Sequence[str]
+		CT series to get the estimates of.
+
+	Returns
+	-------
+	List[float]
+		Estimated peak memory in bytes of each CT series, in the order of ctSeriesIDs.
+	"""
+	seriesMemory = plan.groupby("series_CT")["estimated_memory_bytes"].max()
+	unknownMemory = np.nan_to_num(seriesMemory.max())
+	return [
+		float(np.nan_to_num(seriesMemory.get(ctSeriesID, np.nan), nan=unknownMemory))
+		for ctSeriesID in ctSeriesIDs
+	]
+
+
+def memoryAdmittedMap(
+	function: Callable[[Any], Any],
+	items: Sequence[Any],
+	memoryEstimates: Sequence[float],
+	memoryBudget: float,
+	nJobs: int = -1,
+) -> List[Any]:
+	"""Apply a function to items in parallel threads, keeping the estimated memory in use within a budget.
+
+	Whenever a thread is free, the first waiting item whose estimate fits in the budget left is started. An item
+	larger than the whole budget is started alone once nothing else runs.
+
+	Parameters
+	----------
+	function : Callable[[Any], Any]
+		Function to apply to each item.
+	items : Sequence[Any]
+		Items to apply the function to, e.g. CT series IDs.
+	memoryEstimates : Sequence[float]
+		Estimated peak memory of the function for each item, in bytes.
+	memoryBudget : float
+		Maximum total estimated memory of the items running at once, in bytes.
+	nJobs : int, default -1
+		Maximum number of items running at once, -1 for the number of CPUs.
+
+	Returns
+	-------
+	List[Any]
+		Result of the function for each item, in the order of items.
+	"""
+	if len(memoryEstimates) != len(items):
+		msg = "A memory estimate is needed for each item."
+		raise ValueError(msg)
+
+	nWorkers = effective_n_jobs(nJobs)
+	results: List[Any] = [None] * len(items)
+	waiting = list(range(len(items)))
+	running: Dict[Future, int] = {}
+	memoryInUse = 0.0
+
+	with ThreadPoolExecutor(max_workers=nWorkers) as executor:
+		while waiting or running:
+			for index in list(waiting):
+				if len(running) >= nWorkers:
+					break
+				if running and memoryInUse + memoryEstimates[index] > memoryBudget:
+					continue
+				if memoryEstimates[index] > memoryBudget:
+					logger.warning(
+						"Estimated memory exceeds the memory budget. Running it alone.",
+						item=items[index],
+						estimated_memory_gb=memoryEstimates[index] / 1024**3,
+						memory_budget_gb=memoryBudget / 1024**3,
+					)
+				waiting.remove(index)
+				memoryInUse += memoryEstimates[index]
+				running[executor.submit(function, items[index])] = index
+
+			finished, _ = wait(running, return_when=FIRST_COMPLETED)
+			for future in finished:
+				index = running.pop(future)
+				memoryInUse -= memoryEstimates[index]
+				results[index] = future.result()
+
+	return results
@@ -0,0 +1,276 @@
+"""Supervised worker processes that survive native crashes of the tasks they run.
+
+A segmentation fault in native code, e.g. ITK or GDCM reading a malformed series, kills the
+process it happens in. `SupervisedProcessPool` runs each task in one of a set of worker processes
+watched by a supervisor thread. When a worker dies during a task, the task fails with a
+`WorkerCrashError` carrying the exit code and what the worker wrote to stderr, a new worker
+replaces it, and the other tasks go on. Results of finished tasks are kept in the parent process.
+"""
+
+import contextlib
+import faulthandler
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import tempfile
+import threading
+import traceback
+from collections import deque
+from concurrent.futures import Executor, Future
+from multiprocessing.connection import Connection, wait
+from pathlib import Path
+from typing import Any, Callable, Deque, List, Optional, Tuple
+
+from readii.utils import logger
+
+# Forking a process with running ITK or BLAS threads is not safe, so workers start a new interpreter
+WORKER_START_METHOD = "spawn"
+# Seconds the supervisor waits for the workers before it checks for new tasks
+SUPERVISOR_POLL_SECONDS = 0.1
+# Characters of the stderr of a crashed worker kept in its WorkerCrashError, from the end
+MAX_CRASH_STDERR_CHARS = 64 * 1024
+
+# Function, positional and keyword arguments of a task
+Task = Tuple[Callable[..., Any], Tuple[Any, ...], dict]
+
+
+def describeExitCode(exitcode: int) -> str:
+	"""Describe the exit code of a process, with the name of the signal that killed it if any."""
+	if exitcode >= 0:
+		return f"exit code {exitcode}"
+	try:
+		return f"signal {signal.Signals(-exitcode).name}"
+	except ValueError:
+		return f"signal {-exitcode}"
+
+
+class WorkerCrashError(RuntimeError):
+	"""A worker process died while running a task, e.g. from a segmentation fault.
+
+	Parameters
+	----------
+	exitcode : int
+		Exit code of the worker process, the negative signal number if a signal killed it.
+	stderr : str
+		What the worker wrote to stderr while running the task, including the Python traceback of a fatal signal.
+	"""
+
+	def __init__(self, exitcode: int, stderr: str) -> None:
+		self.exitcode = exitcode
+		self.stderr = stderr
+		super().__init__(f"Worker process died with {describeExitCode(exitcode)}.")
+
+
+def _workerMain(connection: Connection, stderrPath: str) -> None:
+	"""Run the tasks received on connection until None is received, sending back their results."""
+	# Everything written to stderr, by Python or native code, goes to a file the supervisor reads
+	stderrFd = os.open(stderrPath, os.O_WRONLY | os.O_APPEND)
+	os.dup2(stderrFd, sys.stderr.fileno())
+	os.close(stderrFd)
+	# Write the Python traceback of the task to stderr on a fatal signal
+	faulthandler.enable()
+
+	while True:
+		try:
+			task = connection.recv()
+		except EOFError:
+			return
+		if task is None:
+			return
+
+		function, args, kwargs = task
+		try:
+			result = (True, function(*args, **kwargs))
+		except Exception as e:
+			result = (False, e)
+		sys.stderr.flush()
+
+		try:
+			connection.send(result)
+		except Exception as e:
+			# The result or exception could not be pickled
+			message = f"Could not send the result of the task: {e!r}\n{traceback.format_exc()}"
+			connection.send((False, RuntimeError(message)))
+
+
+class _Worker:
+	"""A worker process, the task it runs and the file its stderr goes to."""
+
+	def __init__(self, context: multiprocessing.context.BaseContext, stderrDir: str) -> None:
+		stderrFd, self.stderrPath = tempfile.mkstemp(dir=stderrDir, suffix=".stderr")
+		os.close(stderrFd)
+		self.stderrOffset = 0
+		self.future: Optional[Future] = None
+
+		self.connection, workerConnection = context.Pipe()
+		self.process = context.Process(
+			target=_workerMain, args=(workerConnection, self.stderrPath), daemon=True
+		)
+		self.process.start()
+		workerConnection.close()
+
+	def readStderr(self) -> str:
+		"""Read what the worker wrote to stderr since the last read."""
+		with Path(self.stderrPath).open(errors="replace") as stderrFile:
+			stderrFile.seek(self.stderrOffset)
+			stderr = stderrFile.read()
+			self.stderrOffset = stderrFile.tell()
+		return stderr
+
+	def stop(self) -> None:
+		if self.process.is_alive():
+			with contextlib.suppress(OSError):
+				self.connection.send(None)
+		self.process.join()
+		self.connection.close()
+
+
+class SupervisedProcessPool(Executor):
+	"""Executor running tasks in worker processes that are replaced when they crash.
+
+	Tasks and their results must be picklable. Output a worker writes to stderr is relayed to the stderr of this
+	process after each task.
+
+	Parameters
+	----------
+	maxWorkers : int, default 1
+		Number of worker processes.
+	"""
+
+	def __init__(self, maxWorkers: int = 1) -> None:
+		if maxWorkers < 1:
+			msg = f"maxWorkers must be at least 1, got {maxWorkers}."
+			raise ValueError(msg)
+		self.maxWorkers = maxWorkers
+		self.nCrashes = 0
+
+		self._context = multiprocessing.get_context(WORKER_START_METHOD)
+		self._stderrDir = tempfile.TemporaryDirectory(prefix="readii_workers_")
+		self._submitted: queue.SimpleQueue[Tuple[Future, Task]] = queue.SimpleQueue()
+		self._shutdownLock = threading.Lock()
+		self._isShutdown = False
+		self._supervisor = threading.Thread(target=self._supervise, daemon=True)
+		self._supervisor.start()
+
+	def submit(self, fn: Callable[..., Any], /, *args: Any, **kwargs: Any) -> Future:  # noqa: ANN401
+		"""Schedule fn(*args, **kwargs) to run in a worker process."""
+		with self._shutdownLock:
+			if self._isShutdown:
+				msg = "Cannot submit tasks after shutdown."
+				raise RuntimeError(msg)
+			future: Future = Future()
+			self._submitted.put((future, (fn, args, kwargs)))
+		return future
+
+	def shutdown(self, wait: bool = True, *, cancel_futures: bool = False) -> None:
+		"""Stop the workers once the submitted tasks are done, or cancel the tasks not started yet."""
+		with self._shutdownLock:
+			self._isShutdown = True
+			if cancel_futures:
+				while True:
+					try:
+						future, _ = self._submitted.get_nowait()
+					except queue.Empty:
+						break
+					future.cancel()
+		if wait:
+			self._supervisor.join()
+			self._stderrDir.cleanup()
+
+	def _supervise(self) -> None:
+		workers: List[_Worker] = []
+		waiting: Deque[Tuple[Future, Task]] = deque()
+		try:
+			while True:
+				self._collectSubmitted(waiting)
+				self._startTasks(workers, waiting)
+				busyWorkers = [worker for worker in workers if worker.future is not None]
+				if self._isShutdown and not waiting and not busyWorkers and self._submitted.empty():
+					return
+
+				ready = wait(
+					[worker.connection for worker in busyWorkers]
+					+ [worker.process.sentinel for worker in busyWorkers],
+					timeout=SUPERVISOR_POLL_SECONDS,
+				)
+				for worker in busyWorkers:
+					if worker.connection in ready or worker.process.sentinel in ready:
+						self._finishTask(worker, workers)
+		except Exception as e:
+			# Fail the tasks left instead of leaving their callers waiting
+			logger.exception("Supervisor of the worker processes failed.")
+			for future in [worker.future for worker in workers if worker.future is not None]:
+				future.set_exception(e)
+			for future, _ in waiting:
+				future.set_exception(e)
+		finally:
+			for worker in workers:
+				worker.stop()
+
+	def _collectSubmitted(self, waiting: Deque[Tuple[Future, Task]]) -> None:
+		while True:
+			try:
+				waiting.append(self._submitted.get_nowait())
+			except queue.Empty:
+				return
+
+	def _startTasks(self, workers: List[_Worker], waiting: Deque[Tuple[Future, Task]]) -> None:
+		"""Send waiting tasks to idle workers, starting new workers up to maxWorkers."""
+		# Replace workers that died while idle
+		for worker in [worker for worker in workers if worker.future is None]:
+			if not worker.process.is_alive():
+				worker.stop()
+				workers.remove(worker)
+
+		while waiting:
+			idleWorkers = [worker for worker in workers if worker.future is None]
+			if not idleWorkers and len(workers) >= self.maxWorkers:
+				return
+			future, task = waiting.popleft()
+			if not future.set_running_or_notify_cancel():
+				continue
+
+			if idleWorkers:
+				worker = idleWorkers[0]
+			else:
+				worker = _Worker(self._context, self._stderrDir.name)
+				workers.append(worker)
+			try:
+				worker.connection.send(task)
+			except Exception as e:
+				# E.g. the task could not be pickled
+				future.set_exception(e)
+				continue
+			worker.future = future
+
+	def _finishTask(self, worker: _Worker, workers: List[_Worker]) -> None:
+		"""Set the result of the task of a worker that sent it or died, replacing the worker if it died."""
+		future = worker.future
+		worker.future = None
+		try:
+			succeeded, value = worker.connection.recv()
+		except (EOFError, OSError):
+			# The worker died before sending a result
+			worker.process.join()
+			stderr = worker.readStderr()
+			self.nCrashes += 1
+			logger.error(
+				f"Worker process died with {describeExitCode(worker.process.exitcode)}. Starting a new worker.",
+				pid=worker.process.pid,
+			)
+			future.set_exception(
+				WorkerCrashError(worker.process.exitcode, stderr[-MAX_CRASH_STDERR_CHARS:])
+			)
+			worker.stop()
+			workers.remove(worker)
+			return
+
+		stderr = worker.readStderr()
+		if stderr:
+			sys.stderr.write(stderr)
+		if succeeded:
+			future.set_result(value)
+		else:
+			future.set_exception(value)
@@ -0,0 +1,399 @@
+"""Batched texture matrices for replicate images sharing one mask.
+
+Negative control replicates of an ROI only differ in their intensities, so the voxel
+neighbourhoods PyRadiomics walks to build texture matrices are the same for all of them.
+`textureFeatures` finds the neighbouring ROI voxel pairs, the voxel order along every run
+direction and the zone adjacency once from the mask. It then builds the GLCM, GLRLM and GLSZM
+of every replicate with a single `np.bincount` per matrix, instead of one PyRadiomics pass per
+replicate.
+
+Each replicate is discretized with PyRadiomics' own bin edges. Replicates with the same set
+of gray levels are computed together, and the feature values come from the PyRadiomics
+feature classes applied to the batched matrices, so results match PyRadiomics.
+"""
+
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import SimpleITK as sitk
+from radiomics import cMatrices
+from radiomics.glcm import RadiomicsGLCM
+from radiomics.glrlm import RadiomicsGLRLM
+from radiomics.glszm import RadiomicsGLSZM
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+TEXTURE_FEATURE_CLASSES = {
+	"glcm": RadiomicsGLCM,
+	"glrlm": RadiomicsGLRLM,
+	"glszm": RadiomicsGLSZM,
+}
+
+# Settings changing the matrices in ways the batched engine does not implement
+UNSUPPORTED_SETTINGS = ("force2D", "weightingNorm", "voxelBased")
+
+
+def isTextureEngineSupported(featureClassName: str, settings: Dict[str, Any]) -> bool:
+	"""Check whether `textureFeatures` can compute a feature class with the given settings."""
+	return featureClassName in TEXTURE_FEATURE_CLASSES and not any(
+		settings.get(setting) for setting in UNSUPPORTED_SETTINGS
+	)
+
+
+class _MaskGeometry:
+	"""Neighbourhood structure of the voxels in a mask, shared by every replicate."""
+
+	def __init__(self, maskArray: np.ndarray, distances: Sequence[int] = (1,)) -> None:
+		self.shape = maskArray.shape
+		self.roiCoordinates = np.argwhere(maskArray)
+		self.nVoxels = len(self.roiCoordinates)
+
+		# Position of every mask voxel in the flattened ROI values, -1 outside the mask
+		self.roiIndex = np.full(maskArray.shape, -1, dtype=np.int64)
+		self.roiIndex[maskArray] = np.arange(self.nVoxels)
+
+		boundingBoxSize = np.ptp(self.roiCoordinates, axis=0) + 1
+		self.glcmAngles = cMatrices.generate_angles(
+			boundingBoxSize, np.asarray(distances, dtype=int), False, False, 0
+		)
+		self.unitAngles = cMatrices.generate_angles(
+			boundingBoxSize, np.array([1], dtype=int), False, False, 0
+		)
+
+		self._neighbourPairs: Dict[tuple, tuple[np.ndarray, np.ndarray]] = {}
+		self._lineOrders: Dict[tuple, tuple[np.ndarray, np.ndarray]] = {}
+
+	def neighbourPairs(self, angle: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+		"""ROI indices of the voxel pairs (x, x + angle) that are both in the mask."""
+		key = tuple(angle)
+		if key not in self._neighbourPairs:
+			self._neighbourPairs[key] = self._findNeighbourPairs(angle)
+		return self._neighbourPairs[key]
+
+	def _findNeighbourPairs(self, angle: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+		sourceSlices, targetSlices = [], []
+		for size, offset in zip(self.shape, angle, strict=True):
+			sourceSlices.append(slice(max(0, -offset), size - max(0, offset)))
+			targetSlices.append(slice(max(0, offset), size - max(0, -offset)))
+
+		sourceIndex = self.roiIndex[tuple(sourceSlices)].ravel()
+		targetIndex = self.roiIndex[tuple(targetSlices)].ravel()
+		inMask = (sourceIndex >= 0) & (targetIndex >= 0)
+		return sourceIndex[inMask], targetIndex[inMask]
+
+	def lineOrder(self, angle: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+		"""Order of the ROI voxels along the lines of `angle`, and which voxels continue the previous one.
+
+		Returns
+		-------
+		tuple[np.ndarray, np.ndarray]
+			ROI indices sorted by line and position along it, and a boolean array that is True
+			where the voxel directly follows the previous one on the same line.
+		"""
+		key = tuple(angle)
+		if key not in self._lineOrders:
+			self._lineOrders[key] = self._findLineOrder(angle)
+		return self._lineOrders[key]
+
+	def _findLineOrder(self, angle: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+		shape = np.array(self.shape)
+		# Steps back along the line to its first voxel in the image
+		stepsFromStart = np.min(
+			[
+				self.roiCoordinates[:, dim]
+				if offset > 0
+				else shape[dim] - 1 - self.roiCoordinates[:, dim]
+				for dim, offset in enumerate(angle)
+				if offset != 0
+			],
+			axis=0,
+		)
+		lineStart = self.roiCoordinates - stepsFromStart[:, None] * angle[None, :]
+		lineId = np.ravel_multi_index(lineStart.T, self.shape)
+
+		order = np.lexsort((stepsFromStart, lineId))
+		continuesLine = np.zeros(self.nVoxels, dtype=bool)
+		continuesLine[1:] = (np.diff(lineId[order]) == 0) & (np.diff(stepsFromStart[order]) == 1)
+		return order, continuesLine
+
+
+def _batchedGLCM(
+	geometry: _MaskGeometry,
+	grayLevels: np.ndarray,
+	nGrayLevels: int,
+	presentGrayLevels: np.ndarray,
+	symmetrical: bool,
+) -> np.ndarray:
+	"""Build normalized GLCMs of shape (replicates, present gray levels, gray levels, angles)."""
+	nReplicates, nAngles = len(grayLevels), len(geometry.glcmAngles)
+	nBins = nReplicates * nGrayLevels * nGrayLevels * nAngles
+
+	replicateOffset = (np.arange(nReplicates) * nGrayLevels * nGrayLevels * nAngles)[:, None]
+	bins = []
+	for angleIndex, angle in enumerate(geometry.glcmAngles):
+		sources, targets = geometry.neighbourPairs(angle)
+		angleBins = (grayLevels[:, sources] - 1) * nGrayLevels + grayLevels[:, targets] - 1
+		bins.append((angleBins * nAngles + angleIndex + replicateOffset).ravel())
+	counts = np.bincount(np.concatenate(bins), minlength=nBins).astype(np.float64)
+
+	P_glcm = counts.reshape(nReplicates, nGrayLevels, nGrayLevels, nAngles)
+	P_glcm = _keepPresentGrayLevels(P_glcm, presentGrayLevels, axes=(1, 2))
+	if symmetrical:
+		P_glcm += np.transpose(P_glcm, (0, 2, 1, 3)).copy()
+
+	# Same handling of empty angles and normalization as RadiomicsGLCM
+	sumP_glcm = np.sum(P_glcm, (1, 2))
+	if P_glcm.shape[3] > 1:
+		emptyAngles = np.where(np.sum(sumP_glcm, 0) == 0)
+		P_glcm = np.delete(P_glcm, emptyAngles, 3)
+		sumP_glcm = np.delete(sumP_glcm, emptyAngles, 1)
+	sumP_glcm[sumP_glcm == 0] = np.nan
+	P_glcm /= sumP_glcm[:, None, None, :]
+	return P_glcm
+
+
+def _batchedGLRLM(
+	geometry: _MaskGeometry, grayLevels: np.ndarray, nGrayLevels: int, presentGrayLevels: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+	"""Build GLRLMs of shape (replicates, present gray levels, run lengths, angles), and run counts."""
+	nReplicates, nAngles = len(grayLevels), len(geometry.unitAngles)
+	maxRunLength = max(geometry.shape)
+	nBins = nReplicates * nGrayLevels * maxRunLength * nAngles
+
+	bins = []
+	for angleIndex, angle in enumerate(geometry.unitAngles):
+		order, continuesLine = geometry.lineOrder(angle)
+		orderedGrayLevels = grayLevels[:, order]
+
+		# A run continues while the next voxel on the line has the same gray level
+		startsRun = np.ones(orderedGrayLevels.shape, dtype=bool)
+		startsRun[:, 1:] = ~(
+			continuesLine[None, 1:] & (orderedGrayLevels[:, 1:] == orderedGrayLevels[:, :-1])
+		)
+		runStarts = np.flatnonzero(startsRun)
+		runLengths = np.diff(np.append(runStarts, startsRun.size))
+
+		runReplicates = runStarts // geometry.nVoxels
+		runGrayLevels = orderedGrayLevels.ravel()[runStarts]
+		bins.append(
+			((runReplicates * nGrayLevels + runGrayLevels - 1) * maxRunLength + runLengths - 1)
+			* nAngles
+			+ angleIndex
+		)
+	counts = np.bincount(np.concatenate(bins), minlength=nBins).astype(np.float64)
+
+	P_glrlm = counts.reshape(nReplicates, nGrayLevels, maxRunLength, nAngles)
+	P_glrlm = _keepPresentGrayLevels(P_glrlm, presentGrayLevels, axes=(1,))
+
+	# Same handling of empty angles as RadiomicsGLRLM
+	Nr = np.sum(P_glrlm, (1, 2))
+	if P_glrlm.shape[3] > 1:
+		emptyAngles = np.where(np.sum(Nr, 0) == 0)
+		P_glrlm = np.delete(P_glrlm, emptyAngles, 3)
+		Nr = np.delete(Nr, emptyAngles, 1)
+	Nr[Nr == 0] = np.nan
+	return P_glrlm, Nr
+
+
+def _batchedGLSZM(
+	geometry: _MaskGeometry, grayLevels: np.ndarray, nGrayLevels: int, presentGrayLevels: np.ndarray
+) -> np.ndarray:
+	"""Build GLSZMs of shape (replicates, present gray levels, zone sizes)."""
+	nReplicates, nVoxels = grayLevels.shape
+
+	# Neighbouring ROI voxels with the same gray level belong to the same zone
+	sources, targets = [], []
+	for angle in geometry.unitAngles:
+		angleSources, angleTargets = geometry.neighbourPairs(angle)
+		sameGrayLevel = grayLevels[:, angleSources] == grayLevels[:, angleTargets]
+		replicates, pairs = np.nonzero(sameGrayLevel)
+		sources.append(replicates * nVoxels + angleSources[pairs])
+		targets.append(replicates * nVoxels + angleTargets[pairs])
+	sources, targets = np.concatenate(sources), np.concatenate(targets)
+
+	nNodes = nReplicates * nVoxels
+	adjacency = coo_matrix(
+		(np.ones(len(sources), dtype=np.int8), (sources, targets)), (nNodes, nNodes)
+	)
+	_, zoneLabels = connected_components(adjacency, directed=False)
+
+	zoneSizes = np.bincount(zoneLabels)
+	zoneVoxels = np.unique(zoneLabels, return_index=True)[1]
+	zoneReplicates = zoneVoxels // nVoxels
+	zoneGrayLevels = grayLevels.ravel()[zoneVoxels]
+
+	# Like PyRadiomics, the zone size axis only goes up to the largest zone instead of the number of ROI voxels
+	maxZoneSize = int(zoneSizes.max())
+	bins = (zoneReplicates * nGrayLevels + zoneGrayLevels - 1) * maxZoneSize + zoneSizes - 1
+	counts = np.bincount(bins, minlength=nReplicates * nGrayLevels * maxZoneSize).astype(np.float64)
+
+	P_glszm = counts.reshape(nReplicates, nGrayLevels, maxZoneSize)
+	return _keepPresentGrayLevels(P_glszm, presentGrayLevels, axes=(1,))
+
+
+def _keepPresentGrayLevels(
+	matrix: np.ndarray, presentGrayLevels: np.ndarray, axes: tuple[int, ...]
+) -> np.ndarray:
+	"""Keep the rows (and columns) of the gray levels present in the ROI, like PyRadiomics."""
+	for axis in axes:
+		matrix = np.take(matrix, presentGrayLevels - 1, axis=axis)
+	return matrix
+
+
+def _binEdges(values: np.ndarray, binWidth: float, binCount: Optional[int]) -> np.ndarray:
+	"""Compute the bin edges of `radiomics.imageoperations.getBinEdges` with numpy reductions."""
+	if binCount is not None:
+		binEdges = np.histogram(values, binCount)[1]
+		binEdges[-1] += 1
+		return binEdges
+
+	minimum, maximum = values.min(), values.max()
+	lowBound = minimum - (minimum % binWidth)
+	highBound = maximum + 2 * binWidth
+	binEdges = np.arange(lowBound, highBound, binWidth)
+	if len(binEdges) == 1:
+		binEdges = np.array([binEdges[0] - 0.5, binEdges[0] + 0.5])
+	return binEdges
+
+
+def _discretize(roiValues: np.ndarray, settings: Dict[str, Any]) -> np.ndarray:
+	"""Discretize the ROI values of each replicate with its own PyRadiomics bin edges."""
+	binWidth, binCount = settings.get("binWidth", 25), settings.get("binCount")
+	return np.stack(
+		[
+			np.digitize(replicateValues, _binEdges(replicateValues, binWidth, binCount))
+			for replicateValues in roiValues
+		]
+	)
+
+
+def textureFeatures(
+	imageArrays: np.ndarray,
+	maskArray: np.ndarray,
+	featureClassNames: Sequence[str] = ("glcm", "glrlm", "glszm"),
+	spacing: Optional[Sequence[float]] = None,
+	featureNames: Optional[Dict[str, Optional[List[str]]]] = None,
+	**settings: Any,  # noqa: ANN401
+) -> Dict[str, Dict[str, np.ndarray]]:
+	"""Compute PyRadiomics texture features for a batch of replicate images sharing one mask.
+
+	Parameters
+	----------
+	imageArrays : np.ndarray
+		Replicate images of shape (replicates, z, y, x), e.g. negative controls of one CT.
+	maskArray : np.ndarray
+		Mask of shape (z, y, x). Voxels equal to the `label` setting (default 1) are in the ROI.
+	featureClassNames : Sequence[str], default ("glcm", "glrlm", "glszm")
+		Texture feature classes to compute.
+	spacing : Sequence[float], optional
+		Voxel spacing in SimpleITK (x, y, z) order.
+	featureNames : Dict[str, List[str]], optional
+		Features to compute for each class. By default, all features that are not deprecated.
+	**settings
+		PyRadiomics settings, e.g. binWidth, binCount, distances, symmetricalGLCM.
+
+	Returns
+	-------
+	Dict[str, Dict[str, np.ndarray]]
+		For each feature class, an array with one value per replicate for each feature.
+	"""
+	unsupportedClasses = [
+		name for name in featureClassNames if not isTextureEngineSupported(name, settings)
+	]
+	if unsupportedClasses:
+		msg = f"Texture engine does not support {unsupportedClasses} with settings {settings}."
+		raise ValueError(msg)
+
+	imageArrays = np.asarray(imageArrays)
+	roiMask = np.asarray(maskArray) == settings.get("label", 1)
+	if not roiMask.any():
+		msg = "ROI mask is empty. No voxels to compute texture features from."
+		raise ValueError(msg)
+
+	geometry = _MaskGeometry(roiMask, distances=settings.get("distances", [1]))
+	grayLevels = _discretize(imageArrays[:, roiMask].astype(float), settings)
+	featureClasses = _referenceFeatureClasses(
+		imageArrays[0], roiMask, featureClassNames, spacing, settings
+	)
+
+	# PyRadiomics drops the gray levels missing from an ROI, so replicates are computed in
+	# groups with the same gray levels present
+	groups: Dict[tuple, List[int]] = {}
+	for replicate, replicateGrayLevels in enumerate(grayLevels):
+		groups.setdefault(tuple(np.unique(replicateGrayLevels)), []).append(replicate)
+
+	features: Dict[str, Dict[str, np.ndarray]] = {
+		featureClassName: OrderedDict() for featureClassName in featureClassNames
+	}
+	for presentGrayLevels, replicates in groups.items():
+		for featureClassName, featureClass in featureClasses.items():
+			_setBatchedMatrix(
+				featureClass, geometry, grayLevels[replicates], np.array(presentGrayLevels)
+			)
+
+			names = (featureNames or {}).get(featureClassName) or [
+				name for name, isDeprecated in featureClass.featureNames.items() if not isDeprecated
+			]
+			for name in names:
+				values = features[featureClassName].setdefault(
+					name, np.full(len(imageArrays), np.nan)
+				)
+				values[replicates] = getattr(featureClass, f"get{name}FeatureValue")()
+
+	return features
+
+
+def _referenceFeatureClasses(
+	referenceArray: np.ndarray,
+	roiMask: np.ndarray,
+	featureClassNames: Sequence[str],
+	spacing: Optional[Sequence[float]],
+	settings: Dict[str, Any],
+) -> Dict[str, Any]:
+	"""PyRadiomics feature classes providing the settings, coefficients and feature definitions.
+
+	They are created from the bounding box of the ROI in one replicate, and only used with
+	the batched matrices set by `_setBatchedMatrix`.
+	"""
+	roiCoordinates = np.nonzero(roiMask)
+	boundingBox = tuple(
+		slice(coordinates.min(), coordinates.max() + 1) for coordinates in roiCoordinates
+	)
+	referenceImage = sitk.GetImageFromArray(referenceArray[boundingBox])
+	maskImage = sitk.GetImageFromArray(roiMask[boundingBox].astype(np.uint8))
+	if spacing is not None:
+		referenceImage.SetSpacing(tuple(spacing))
+		maskImage.SetSpacing(tuple(spacing))
+
+	classSettings = {**settings, "label": 1}
+	return {
+		featureClassName: TEXTURE_FEATURE_CLASSES[featureClassName](
+			referenceImage, maskImage, **classSettings
+		)
+		for featureClassName in featureClassNames
+	}
+
+
+def _setBatchedMatrix(
+	featureClass: Any,  # noqa: ANN401
+	geometry: _MaskGeometry,
+	grayLevels: np.ndarray,
+	presentGrayLevels: np.ndarray,
+) -> None:
+	"""Set the matrices of a batch of replicates on a feature class and compute its coefficients."""
+	featureClass.coefficients["grayLevels"] = presentGrayLevels
+	featureClass.coefficients["Ng"] = nGrayLevels = int(presentGrayLevels.max())
+
+	if isinstance(featureClass, RadiomicsGLCM):
+		featureClass.P_glcm = _batchedGLCM(
+			geometry, grayLevels, nGrayLevels, presentGrayLevels, featureClass.symmetricalGLCM
+		)
+	elif isinstance(featureClass, RadiomicsGLRLM):
+		featureClass.P_glrlm, featureClass.coefficients["Nr"] = _batchedGLRLM(
+			geometry, grayLevels, nGrayLevels, presentGrayLevels
+		)
+	else:
+		featureClass.P_glszm = _batchedGLSZM(geometry, grayLevels, nGrayLevels, presentGrayLevels)
+
+	featureClass._calculateCoefficients()
@@ -0,0 +1,105 @@
+"""One thread budget for readii, shared by its parallel workers and the threads of SimpleITK and BLAS.
+
+SimpleITK filters and numpy's BLAS start a thread per CPU by default, in every worker. With a worker
+per CPU, a node then runs about CPUs squared threads. readii instead divides a budget of threads (all
+CPUs by default, see `setThreadBudget`) between the workers of each parallel step: `budgetedJobs`
+caps the number of workers at the threads available, and `workerThreads` gives each worker its
+share. `limitThreads` applies a share to SimpleITK and BLAS, in the process running a parallel step
+for its thread workers, and in each worker process.
+
+BLAS limits need the optional threadpoolctl package. Without it, joblib's worker processes still
+limit BLAS to their share of the CPUs when they start.
+"""
+
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+import SimpleITK as sitk
+from joblib import cpu_count, effective_n_jobs
+
+try:
+	from threadpoolctl import threadpool_limits
+except ImportError:
+	threadpool_limits = None
+
+_budgetLock = threading.Lock()
+_totalThreads: Optional[int] = None
+_threadsPerWorker: Optional[int] = None
+# Threads available to the current process while limitThreads applies
+_activeLimit: Optional[int] = None
+
+
+def setThreadBudget(
+	totalThreads: Optional[int] = None,
+	threadsPerWorker: Optional[int] = None,
+) -> None:
+	"""Set the thread budget of readii.
+
+	Parameters
+	----------
+	totalThreads : int, optional
+		Total number of threads of a readii run. All CPUs if None.
+	threadsPerWorker : int, optional
+		Number of SimpleITK and BLAS threads of each parallel worker, instead of an equal share of the budget.
+	"""
+	global _totalThreads, _threadsPerWorker  # noqa: PLW0603
+	for name, value in (("totalThreads", totalThreads), ("threadsPerWorker", threadsPerWorker)):
+		if value is not None and value < 1:
+			msg = f"{name} must be at least 1, got {value}."
+			raise ValueError(msg)
+	with _budgetLock:
+		_totalThreads = totalThreads
+		_threadsPerWorker = threadsPerWorker
+
+
+def getThreadBudget() -> int:
+	"""Get the total number of threads of a readii run."""
+	return _totalThreads if _totalThreads is not None else cpu_count()
+
+
+def availableThreads() -> int:
+	"""Get the number of threads available to the current process, within an active limit if any."""
+	return _activeLimit if _activeLimit is not None else getThreadBudget()
+
+
+def budgetedJobs(nJobs: int) -> int:
+	"""Cap a number of parallel workers, as for joblib.Parallel (-1 for all CPUs), at the threads available."""
+	return max(1, min(effective_n_jobs(nJobs), availableThreads()))
+
+
+def workerThreads(nJobs: int) -> int:
+	"""Get the number of SimpleITK and BLAS threads of each of nJobs parallel workers."""
+	if _threadsPerWorker is not None:
+		return _threadsPerWorker
+	return max(1, availableThreads() // budgetedJobs(nJobs))
+
+
+@contextmanager
+def limitThreads(nThreads: int) -> Iterator[None]:
+	"""Limit the SimpleITK and BLAS threads of this process, and the budget of parallel steps, within the block.
+
+	The limits are global to the process, so thread workers share them. If a limit is already active, e.g. when
+	called from one of several thread workers, the block keeps it instead of racing the other workers to set it.
+	Worker processes start without a limit, so the same block sets the limit of each worker process.
+	"""
+	global _activeLimit  # noqa: PLW0603
+	with _budgetLock:
+		outermost = _activeLimit is None
+		if outermost:
+			_activeLimit = nThreads
+	if not outermost:
+		yield
+		return
+
+	previousThreads = sitk.ProcessObject.GetGlobalDefaultNumberOfThreads()
+	blasLimits = threadpool_limits(limits=nThreads) if threadpool_limits is not None else None
+	sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(nThreads)
+	try:
+		yield
+	finally:
+		sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(previousThreads)
+		if blasLimits is not None:
+			blasLimits.restore_original_limits()
+		with _budgetLock:
+			_activeLimit = None
@@ -1,5 +1,7 @@
-from .logging_config import logger
+from .logging_config import LazyLogValue, getLogger, logger
 
 __all__ = [
+    'LazyLogValue',
+    'getLogger',
     'logger',
 ]
\ No newline at end of file
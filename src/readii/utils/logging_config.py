@@ -1,4 +1,52 @@
 from imgtools.loggers import get_logger
+import logging
 import os
+from typing import Any, Callable
+
+import structlog
+
 DEFAULT_LOGGING_LEVEL = os.environ.get('READII_LOG_LEVEL', None) or 'WARNING'
-logger = get_logger('readii', DEFAULT_LOGGING_LEVEL)
+# Configures the readii logging handlers and the structlog processors
+get_logger('readii', DEFAULT_LOGGING_LEVEL)
+
+
+def getLogger(name: str = 'readii') -> structlog.stdlib.BoundLogger:
+    """Get a structlog logger of the stdlib logger name, e.g. "readii.progress", which also logs to the readii handlers.
+
+    Events below the level of the stdlib logger are dropped before any processor runs, so that a disabled debug
+    call does not pay for e.g. the call site lookup.
+    """
+    return structlog.wrap_logger(
+        logging.getLogger(name),
+        processors=[structlog.stdlib.filter_by_level, *structlog.get_config()['processors']],
+        wrapper_class=structlog.stdlib.BoundLogger,
+    )
+
+
+logger = getLogger('readii')
+
+
+class LazyLogValue:
+    """Log value computed only when a log event is rendered, e.g. a summary of a table for a debug event.
+
+    Events below the log level are dropped before they are rendered, so the function is not called for them.
+    The value is computed once and shared by all handlers.
+    """
+
+    def __init__(self, function: Callable[[], Any]) -> None:
+        self.function = function
+        self._resolved = False
+        self._value = None
+
+    def resolve(self) -> Any:
+        if not self._resolved:
+            self._value = self.function()
+            self._resolved = True
+        return self._value
+
+    def __repr__(self) -> str:
+        return repr(self.resolve())
+
+    def __structlog__(self) -> Any:
+        # Called by structlog's JSON renderer for values it cannot serialize
+        return self.resolve()
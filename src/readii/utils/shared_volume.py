@@ -0,0 +1,187 @@
+"""Image volumes published once to shared memory for process workers.
+
+Passing a `sitk.Image` to a process worker pickles a full copy of it for every task.
+`SharedVolume.publish` copies the voxels of an image into a named shared memory block
+once, and workers attach to it with `SharedVolume.attach` using a small, picklable
+`SharedVolumeHandle`. The attached array is a zero-copy view of the shared block, and the
+handle carries the geometry (origin, spacing, direction) to rebuild a `sitk.Image`.
+
+The process that creates a volume owns it: it must `unlink` the block once all workers
+are done. Using the volume as a context manager closes it on exit, and unlinks it if owned.
+"""
+
+from dataclasses import dataclass
+from multiprocessing.shared_memory import SharedMemory
+from typing import Optional, Union
+
+import numpy as np
+import SimpleITK as sitk
+
+
+@dataclass(frozen=True)
+class SharedVolumeHandle:
+	"""Picklable description of a volume in shared memory.
+
+	Parameters
+	----------
+	name : str
+		Name of the shared memory block.
+	shape : tuple[int, ...]
+		Shape of the array, in numpy (z, y, x) order for images.
+	dtype : str
+		Numpy dtype of the array.
+	origin, spacing, direction : tuple[float, ...], optional
+		Geometry of the image the volume was published from. None for plain arrays.
+	"""
+
+	name: str
+	shape: tuple[int, ...]
+	dtype: str
+	origin: Optional[tuple[float, ...]] = None
+	spacing: Optional[tuple[float, ...]] = None
+	direction: Optional[tuple[float, ...]] = None
+
+
+class SharedVolume:
+	"""A numpy array backed by a named shared memory block.
+
+	Create volumes with `create` or `publish`, and attach to them from other processes
+	with `attach`. Do not instantiate directly.
+	"""
+
+	def __init__(
+		self, shared_memory: SharedMemory, handle: SharedVolumeHandle, owner: bool
+	) -> None:
+		self._shared_memory = shared_memory
+		self._array: Optional[np.ndarray] = np.ndarray(
+			handle.shape, dtype=np.dtype(handle.dtype), buffer=shared_memory.buf
+		)
+		self.handle = handle
+		self.owner = owner
+
+	@classmethod
+	def create(
+		cls,
+		shape: tuple[int, ...],
+		dtype: np.dtype | str,
+		reference: Optional[sitk.Image] = None,
+	) -> "SharedVolume":
+		"""Allocate an uninitialized volume in shared memory.
+
+		Parameters
+		----------
+		shape : tuple[int, ...]
+			Shape of the array.
+		dtype : np.dtype | str
+			Numpy dtype of the array.
+		reference : sitk.Image, optional
+			Image to copy the geometry from, used by `to_image`.
+
+		Returns
+		-------
+		SharedVolume
+			The new volume, owned by the calling process.
+		"""
+		dtype = np.dtype(dtype)
+		n_bytes = max(1, int(np.prod(shape)) * dtype.itemsize)
+		shared_memory = SharedMemory(create=True, size=n_bytes)
+
+		handle = SharedVolumeHandle(
+			name=shared_memory.name,
+			shape=tuple(int(dim) for dim in shape),
+			dtype=dtype.str,
+			origin=reference.GetOrigin() if reference is not None else None,
+			spacing=reference.GetSpacing() if reference is not None else None,
+			direction=reference.GetDirection() if reference is not None else None,
+		)
+		return cls(shared_memory, handle, owner=True)
+
+	@classmethod
+	def publish(cls, image: Union[sitk.Image, np.ndarray]) -> "SharedVolume":
+		"""Copy an image or array into a new shared memory volume.
+
+		Parameters
+		----------
+		image : sitk.Image | np.ndarray
+			Image to publish. The geometry of a `sitk.Image` is kept in the handle.
+
+		Returns
+		-------
+		SharedVolume
+			The published volume, owned by the calling process.
+		"""
+		if isinstance(image, sitk.Image):
+			image_array = sitk.GetArrayViewFromImage(image)
+			volume = cls.create(image_array.shape, image_array.dtype, reference=image)
+		else:
+			image_array = image
+			volume = cls.create(image_array.shape, image_array.dtype)
+
+		volume.array[...] = image_array
+		return volume
+
+	@classmethod
+	def attach(cls, handle: SharedVolumeHandle) -> "SharedVolume":
+		"""Attach to a volume created by another process.
+
+		Parameters
+		----------
+		handle : SharedVolumeHandle
+			Handle of the volume, as returned by `SharedVolume.handle` in the owner.
+
+		Returns
+		-------
+		SharedVolume
+			Volume sharing its memory with the owner. Not owned by the calling process.
+		"""
+		# Worker processes started by the owner (multiprocessing, joblib) share its resource
+		# tracker, so the block stays registered until the owner unlinks it
+		shared_memory = SharedMemory(name=handle.name)
+		return cls(shared_memory, handle, owner=False)
+
+	@property
+	def array(self) -> np.ndarray:
+		"""Zero-copy numpy view of the shared volume."""
+		if self._array is None:
+			msg = f"Shared volume {self.handle.name} is closed."
+			raise ValueError(msg)
+		return self._array
+
+	@property
+	def is_open(self) -> bool:
+		"""Whether this process still has a view of the volume."""
+		return self._array is not None
+
+	def to_image(self) -> sitk.Image:
+		"""Copy the volume into a `sitk.Image` with the geometry of the published image."""
+		image = sitk.GetImageFromArray(self.array)
+		if self.handle.origin is not None:
+			image.SetOrigin(self.handle.origin)
+			image.SetSpacing(self.handle.spacing)
+			image.SetDirection(self.handle.direction)
+		return image
+
+	def close(self) -> None:
+		"""Release this process's view of the volume.
+
+		Views of `array` must not be used after closing.
+		"""
+		self._array = None
+		self._shared_memory.close()
+
+	def unlink(self) -> None:
+		"""Free the shared memory block. Only the owner can unlink a volume."""
+		if not self.owner:
+			msg = "Only the process that created a shared volume can unlink it."
+			raise ValueError(msg)
+		self._shared_memory.unlink()
+
+	def __enter__(self) -> "SharedVolume":
+		"""Return the volume itself."""
+		return self
+
+	def __exit__(self, *_: object) -> None:
+		"""Close the volume, and unlink it if owned."""
+		self.close()
+		if self.owner:
+			self.unlink()
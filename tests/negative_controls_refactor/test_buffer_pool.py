@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+import SimpleITK as sitk
+
+from readii.negative_controls import applyNegativeControl
+from readii.negative_controls_refactor import (
+    BufferPool,
+    NegativeControlManager,
+    NonROIRegion,
+    ShuffledControl,
+)
+
+
+@pytest.fixture
+def image():
+    rng = np.random.default_rng(0)
+    image = sitk.GetImageFromArray(rng.integers(-1000, 2000, size=(8, 20, 20), dtype=np.int16))
+    image.SetSpacing((0.7, 0.7, 2.5))
+    return image
+
+
+@pytest.fixture
+def mask():
+    mask_array = np.zeros((8, 20, 20), dtype=np.uint8)
+    mask_array[2:6, 5:15, 5:15] = 1
+    return sitk.GetImageFromArray(mask_array)
+
+
+def test_acquire_reuses_released_buffers():
+    pool = BufferPool()
+    first = pool.acquire((4, 5), np.int16)
+    pool.release(first)
+
+    assert pool.acquire((4, 5), np.int16) is first
+    assert pool.acquire((4, 5), np.int16) is not first
+    assert pool.acquire((4, 5), np.float32).dtype == np.float32
+    assert pool.n_allocated == 3
+    assert pool.n_reused == 1
+
+
+def test_release_only_acquired_buffers_once():
+    pool = BufferPool()
+    with pytest.raises(ValueError):
+        pool.release(np.empty((4, 5)))
+
+    buffer = pool.acquire((4, 5), np.int16)
+    pool.release(buffer)
+    with pytest.raises(ValueError):
+        pool.release(buffer)
+
+
+def test_borrow_releases_on_exit():
+    pool = BufferPool()
+    with pool.borrow((3,), np.uint8) as buffer:
+        buffer[:] = 1
+    assert pool.acquire((3,), np.uint8) is buffer
+
+
+@pytest.mark.parametrize("control", ["shuffled", "randomized", "randomized_sampled"])
+@pytest.mark.parametrize("region", ["full", "roi", "non_roi"])
+def test_legacy_controls_with_pool(image, mask, control, region):
+    pool = BufferPool()
+    expected = applyNegativeControl(image, control, region, mask, randomSeed=10)
+
+    for _ in range(2):
+        result = applyNegativeControl(image, control, region, mask, randomSeed=10, bufferPool=pool)
+        assert result.GetPixelID() == expected.GetPixelID()
+        assert result.GetSpacing() == image.GetSpacing()
+        assert np.array_equal(sitk.GetArrayFromImage(result), sitk.GetArrayFromImage(expected))
+
+    # The second run reuses the arrays released by the first one
+    assert pool.n_reused == pool.n_allocated
+
+
+def test_strategy_and_manager_with_pool(image, mask):
+    pool = BufferPool()
+    control = ShuffledControl(random_seed=10)
+
+    expected = control(image, mask, NonROIRegion())
+    result = control(image, mask, NonROIRegion(), buffer_pool=pool)
+    assert np.array_equal(sitk.GetArrayFromImage(result), sitk.GetArrayFromImage(expected))
+
+    manager = NegativeControlManager.from_strings(["shuffled", "randomized"], ["roi", "full"], 10)
+    pooled = list(manager.apply(image, mask, buffer_pool=pool))
+    for (pooled_image, *_), (expected_image, *_) in zip(pooled, manager.apply(image, mask)):
+        assert np.array_equal(
+            sitk.GetArrayFromImage(pooled_image), sitk.GetArrayFromImage(expected_image)
+        )
+    assert pool.n_allocated == 1
+
+
+@pytest.mark.parametrize("region", ["roi", "non_roi"])
+def test_legacy_controls_with_pool_release_on_error(image, region):
+    pool = BufferPool()
+    empty_mask = sitk.GetImageFromArray(np.zeros((8, 20, 20), dtype=np.uint8))
+    full_mask = sitk.GetImageFromArray(np.ones((8, 20, 20), dtype=np.uint8))
+    # The region to apply the control to has no voxels
+    region_mask = empty_mask if region == "roi" else full_mask
+
+    for _ in range(2):
+        with pytest.raises(ValueError, match="all 0s"):
+            applyNegativeControl(image, "shuffled", region, region_mask, randomSeed=10, bufferPool=pool)
+
+    # The arrays of the failed first run are given back and reused by the second one
+    assert pool.n_reused == pool.n_allocated == 2
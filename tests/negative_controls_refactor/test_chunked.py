@@ -0,0 +1,150 @@
+import tracemalloc
+
+import numpy as np
+import pytest
+import SimpleITK as sitk
+
+from readii.negative_controls import applyNegativeControl
+from readii.negative_controls_refactor.chunked import (
+    iter_slabs,
+    randomize_slabs,
+    sample_slabs,
+    shuffle_slabs,
+)
+
+
+@pytest.fixture
+def image_array():
+    rng = np.random.default_rng(0)
+    return rng.integers(-1000, 2000, size=(23, 12, 10), dtype=np.int16)
+
+
+@pytest.fixture
+def mask_array():
+    mask = np.zeros((23, 12, 10), dtype=np.uint8)
+    mask[4:15, 3:9, 2:8] = 1
+    return mask
+
+
+def test_iter_slabs():
+    assert list(iter_slabs(7, 3)) == [slice(0, 3), slice(3, 6), slice(6, 7)]
+    with pytest.raises(ValueError):
+        list(iter_slabs(7, 0))
+
+
+@pytest.mark.parametrize("region", ["full", "roi", "non_roi"])
+@pytest.mark.parametrize("slab_size", [1, 4, 100])
+def test_shuffle_slabs_permutes_region(image_array, mask_array, region, slab_size):
+    out = np.empty_like(image_array)
+    shuffle_slabs(
+        image_array, out, np.random.default_rng(10), slab_size, mask_array=mask_array, region=region
+    )
+
+    region_mask = {
+        "full": np.ones(image_array.shape, dtype=bool),
+        "roi": mask_array > 0,
+        "non_roi": mask_array == 0,
+    }[region]
+
+    assert not np.array_equal(out, image_array)
+    assert np.array_equal(np.sort(out[region_mask]), np.sort(image_array[region_mask]))
+    assert np.array_equal(out[~region_mask], image_array[~region_mask])
+
+
+def test_shuffle_slabs_mixes_across_slabs():
+    image_array = np.repeat(np.arange(4, dtype=np.int16), 25_000).reshape(4, 250, 100)
+    out = np.empty_like(image_array)
+    shuffle_slabs(image_array, out, np.random.default_rng(10), slab_size=1)
+
+    # Each slab should receive about a quarter of the values of every other slab
+    for dest_slab in out:
+        _, counts = np.unique(dest_slab, return_counts=True)
+        assert np.allclose(counts / dest_slab.size, 0.25, atol=0.02)
+
+
+@pytest.mark.parametrize("region", ["full", "roi", "non_roi"])
+@pytest.mark.parametrize("negative_control", ["randomized", "randomized_sampled"])
+def test_slabs_match_whole_volume(image_array, mask_array, region, negative_control):
+    expected = applyNegativeControl(
+        image_array.copy(), negative_control, region, roiMask=mask_array, randomSeed=10
+    )
+    for slab_size in [1, 5, 100]:
+        chunked = applyNegativeControl(
+            image_array, negative_control, region, roiMask=mask_array, randomSeed=10,
+            slabSize=slab_size,
+        )
+        assert chunked.dtype == expected.dtype
+        assert np.array_equal(chunked, expected)
+
+
+@pytest.mark.parametrize("region", ["full", "roi", "non_roi"])
+@pytest.mark.parametrize("negative_control", ["shuffled", "randomized", "randomized_sampled"])
+def test_slabs_match_whole_volume_pixel_type(image_array, mask_array, region, negative_control):
+    image = sitk.GetImageFromArray(image_array)
+    mask = sitk.GetImageFromArray(mask_array)
+
+    expected = applyNegativeControl(image, negative_control, region, roiMask=mask, randomSeed=10)
+    chunked = applyNegativeControl(
+        image, negative_control, region, roiMask=mask, randomSeed=10, slabSize=4
+    )
+
+    # Randomizing the full image gives a 64-bit integer image, the other controls keep the int16 pixel type
+    expected_pixel_id = sitk.sitkInt64 if (negative_control, region) == ("randomized", "full") else sitk.sitkInt16
+    assert expected.GetPixelID() == chunked.GetPixelID() == expected_pixel_id
+
+
+@pytest.mark.parametrize("region", ["full", "roi", "non_roi"])
+@pytest.mark.parametrize("negative_control", ["shuffled", "randomized", "randomized_sampled"])
+def test_slabs_image_matches_array(image_array, mask_array, region, negative_control):
+    expected = applyNegativeControl(
+        image_array, negative_control, region, roiMask=mask_array, randomSeed=10, slabSize=4
+    )
+    result = applyNegativeControl(
+        sitk.GetImageFromArray(image_array), negative_control, region,
+        roiMask=sitk.GetImageFromArray(mask_array), randomSeed=10, slabSize=4,
+    )
+
+    assert np.array_equal(sitk.GetArrayViewFromImage(result), expected)
+
+
+def test_slabs_image_output_not_copied():
+    image_array = np.random.default_rng(0).integers(-1000, 2000, size=(64, 128, 128), dtype=np.int16)
+    image = sitk.GetImageFromArray(image_array)
+
+    tracemalloc.start()
+    try:
+        applyNegativeControl(image, "shuffled", "full", randomSeed=10, slabSize=4)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    # The output image is written directly, so numpy only allocates slab-sized temporaries
+    assert peak < image_array.nbytes / 4
+
+
+def test_slabs_with_image_input(image_array, mask_array):
+    image = sitk.GetImageFromArray(image_array)
+    image.SetOrigin((1.0, 2.0, 3.0))
+    mask = sitk.GetImageFromArray(mask_array)
+
+    result = applyNegativeControl(
+        image, "shuffled", "non_roi", roiMask=mask, randomSeed=10, slabSize=4
+    )
+
+    assert isinstance(result, sitk.Image)
+    assert result.GetOrigin() == image.GetOrigin()
+    result_array = sitk.GetArrayFromImage(result)
+    assert np.array_equal(result_array[mask_array > 0], image_array[mask_array > 0])
+    # The input image must be left untouched
+    assert np.array_equal(sitk.GetArrayFromImage(image), image_array)
+
+
+def test_slabs_empty_region(image_array):
+    out = np.empty_like(image_array)
+    with pytest.raises(ValueError):
+        randomize_slabs(
+            image_array, out, np.random.default_rng(10), 4,
+            mask_array=np.zeros_like(image_array), region="roi",
+        )
+    with pytest.raises(ValueError):
+        sample_slabs(image_array, image_array, np.random.default_rng(10), 4)
@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+
+from readii.negative_controls import negativeControlROIOnly
+from readii.negative_controls_refactor import ROIRegion, SampledControl
+from readii.negative_controls_refactor.histogram import ValueHistogram
+
+
+@pytest.fixture
+def ct_like_array():
+    rng = np.random.default_rng(0)
+    values = np.clip(rng.normal(-200, 400, size=(20, 32, 32)), -1024, 3071)
+    return values.astype(np.int16)
+
+
+def test_from_array_counts(ct_like_array):
+    histogram = ValueHistogram.from_array(ct_like_array)
+    values, counts = np.unique(ct_like_array, return_counts=True)
+
+    assert histogram.values.dtype == ct_like_array.dtype
+    assert np.array_equal(histogram.values, values)
+    assert np.array_equal(histogram.counts, counts)
+    assert histogram.total == ct_like_array.size
+
+
+def test_from_array_float_values():
+    array = np.array([0.5, -1.25, 0.5, 3.0])
+    histogram = ValueHistogram.from_array(array)
+
+    assert np.array_equal(histogram.values, [-1.25, 0.5, 3.0])
+    assert np.array_equal(histogram.counts, [1, 2, 1])
+
+
+def test_sample_only_contains_counted_values(ct_like_array):
+    histogram = ValueHistogram.from_array(ct_like_array)
+    sampled = histogram.sample(ct_like_array.shape, np.random.default_rng(10))
+
+    assert sampled.shape == ct_like_array.shape
+    assert sampled.dtype == ct_like_array.dtype
+    assert np.all(np.isin(sampled, ct_like_array))
+
+
+def test_sample_follows_distribution():
+    array = np.repeat(np.array([-1000, 0, 40], dtype=np.int16), [600_000, 300_000, 100_000])
+    sampled = ValueHistogram.from_array(array).sample(array.size, np.random.default_rng(10))
+
+    _, counts = np.unique(sampled, return_counts=True)
+    assert np.allclose(counts / array.size, [0.6, 0.3, 0.1], atol=0.005)
+
+
+def test_sample_reproducibility_contract(ct_like_array):
+    histogram = ValueHistogram.from_array(ct_like_array)
+    expected = histogram.sample(ct_like_array.shape, np.random.default_rng(10))
+
+    # Independent of chunk size
+    chunked = histogram.sample(ct_like_array.shape, np.random.default_rng(10), chunk_size=999)
+    assert np.array_equal(expected, chunked)
+
+    # Independent of the order of the values the histogram was built from
+    permuted = np.random.default_rng(1).permutation(ct_like_array.reshape(-1))
+    from_permuted = ValueHistogram.from_array(permuted).sample(
+        ct_like_array.shape, np.random.default_rng(10)
+    )
+    assert np.array_equal(expected, from_permuted)
+
+
+@pytest.mark.parametrize(
+    "values, counts",
+    [
+        (np.array([1, 2]), np.array([1])),
+        (np.array([1, 2]), np.array([1, 0])),
+        (np.array([], dtype=np.int16), np.array([], dtype=np.int64)),
+    ],
+)
+def test_invalid_histogram(values, counts):
+    with pytest.raises(ValueError):
+        ValueHistogram(values=values, counts=counts)
+
+
+def test_sampled_control_reuses_histogram(ct_like_array):
+    mask = np.zeros(ct_like_array.shape, dtype=np.uint8)
+    mask[5:15, 8:24, 8:24] = 1
+    source_histogram = ValueHistogram.from_array(ct_like_array[mask == 0])
+
+    control = SampledControl(random_seed=10, histogram=source_histogram)
+    result = control(ct_like_array.copy(), mask, ROIRegion())
+
+    expected = source_histogram.sample(int(mask.sum()), np.random.default_rng(10))
+    assert np.array_equal(result[mask > 0], expected)
+    assert np.array_equal(result[mask == 0], ct_like_array[mask == 0])
+
+
+def test_legacy_roi_sampling_matches_histogram(ct_like_array):
+    mask = np.zeros(ct_like_array.shape, dtype=np.uint8)
+    mask[5:15, 8:24, 8:24] = 1
+    roi_values = ct_like_array[mask > 0]
+
+    result = negativeControlROIOnly(ct_like_array.copy(), mask, "randomized_sampled", 10)
+
+    expected = ValueHistogram.from_array(roi_values).sample(
+        roi_values.size, np.random.default_rng(10)
+    )
+    assert np.array_equal(result[mask > 0], expected)
@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+import SimpleITK as sitk
+
+from readii.negative_controls_refactor import (
+    LabelGroups,
+    LabelMapRegion,
+    NegativeControlManager,
+    RandomizedControl,
+    ROIRegion,
+    SampledControl,
+    ShuffledControl,
+    label_random_seed,
+)
+
+
+@pytest.fixture
+def image_array():
+    rng = np.random.default_rng(0)
+    return rng.integers(-1000, 1000, size=(8, 16, 16), dtype=np.int16)
+
+
+@pytest.fixture
+def label_map():
+    mask = np.zeros((8, 16, 16), dtype=np.uint8)
+    mask[1:4, 2:8, 2:8] = 1
+    mask[4:7, 8:14, 8:14] = 3
+    mask[2:5, 10:15, 1:4] = 7
+    return mask
+
+
+def test_label_groups_from_mask(label_map):
+    groups = LabelGroups.from_mask(label_map)
+
+    assert len(groups) == 3
+    for label, voxel_indices in groups:
+        assert np.array_equal(voxel_indices, np.flatnonzero(label_map == label))
+
+
+def test_label_groups_empty_mask(label_map):
+    with pytest.raises(ValueError):
+        LabelGroups.from_mask(np.zeros_like(label_map))
+
+
+def test_label_random_seed():
+    assert label_random_seed(None, 1) is None
+    assert label_random_seed(10, 1) == label_random_seed(10, 1)
+    assert label_random_seed(10, 1) != label_random_seed(10, 2)
+    assert label_random_seed(10, 1) != label_random_seed(11, 1)
+
+
+@pytest.mark.parametrize("control_class", [ShuffledControl, SampledControl, RandomizedControl])
+def test_label_map_matches_each_label_alone(image_array, label_map, control_class):
+    control = control_class(random_seed=10)
+    result = control(image_array.copy(), label_map, LabelMapRegion())
+
+    # Each label is transformed exactly as if it was the only ROI, with its derived seed
+    for label in [1, 3, 7]:
+        label_control = control_class(random_seed=label_random_seed(10, label))
+        expected = label_control(image_array.copy(), label_map == label, ROIRegion())
+        assert np.array_equal(result[label_map == label], expected[label_map == label])
+
+    assert np.array_equal(result[label_map == 0], image_array[label_map == 0])
+
+
+def test_shuffle_stays_within_label(image_array, label_map):
+    result = ShuffledControl(random_seed=10)(image_array, label_map, LabelMapRegion())
+
+    for label in [1, 3, 7]:
+        in_label = label_map == label
+        assert np.array_equal(np.sort(result[in_label]), np.sort(image_array[in_label]))
+
+
+def test_label_map_with_image_input(image_array, label_map):
+    image = sitk.GetImageFromArray(image_array)
+    image.SetSpacing((0.5, 0.5, 2.0))
+    mask = sitk.GetImageFromArray(label_map)
+
+    result = ShuffledControl(random_seed=10)(image, mask, LabelMapRegion())
+
+    assert isinstance(result, sitk.Image)
+    assert result.GetSpacing() == image.GetSpacing()
+
+
+def test_manager_label_map(image_array, label_map):
+    manager = NegativeControlManager.from_strings(
+        negative_control_types=["shuffled", "randomized"],
+        region_types=["label_map"],
+        random_seed=10,
+    )
+
+    results = list(manager.apply(image_array, label_map))
+
+    assert [(control, region) for _, control, region in results] == [
+        ("shuffled", "label_map"),
+        ("randomized", "label_map"),
+    ]
+    for (neg_array, _, _), control_class in zip(results, [ShuffledControl, RandomizedControl]):
+        expected = control_class(random_seed=10)(image_array.copy(), label_map, LabelMapRegion())
+        assert np.array_equal(neg_array, expected)
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+import SimpleITK as sitk
+
+from readii.negative_controls_refactor import (
+    NegativeControlManager,
+    ROIRegion,
+    ShuffledControl,
+)
+
+
+@pytest.fixture
+def image_array():
+    rng = np.random.default_rng(0)
+    return rng.integers(-1000, 1000, size=(8, 16, 16), dtype=np.int16)
+
+
+@pytest.fixture
+def mask_array():
+    mask = np.zeros((8, 16, 16), dtype=np.uint8)
+    mask[2:6, 4:12, 4:12] = 1
+    return mask
+
+
+@pytest.fixture
+def manager():
+    return NegativeControlManager.from_strings(
+        negative_control_types=["shuffled", "sampled", "randomized"],
+        region_types=["full", "roi", "non_roi"],
+        random_seed=10,
+    )
+
+
+def test_apply_matches_individual_strategies(manager, image_array, mask_array):
+    original = image_array.copy()
+    results = list(manager.apply(image_array, mask_array))
+
+    assert len(results) == len(manager)
+    for (result, control_name, region_name), (control, region) in zip(
+        results, manager.strategy_products
+    ):
+        assert control_name == control.name()
+        assert region_name == region.name()
+        expected = control(image_array.copy(), mask_array, region)
+        assert np.array_equal(result, expected)
+
+    # The shared input array must not be modified
+    assert np.array_equal(image_array, original)
+
+
+def test_apply_parallel_keeps_order(manager, image_array, mask_array):
+    serial = list(manager.apply(image_array, mask_array))
+    parallel = list(manager.apply(image_array, mask_array, n_jobs=4))
+
+    assert [names for _, *names in serial] == [names for _, *names in parallel]
+    for (serial_result, *_), (parallel_result, *_) in zip(serial, parallel):
+        assert np.array_equal(serial_result, parallel_result)
+
+
+def test_apply_returns_images_for_image_input(image_array, mask_array):
+    image = sitk.GetImageFromArray(image_array)
+    image.SetSpacing((0.5, 0.5, 2.0))
+    mask = sitk.GetImageFromArray(mask_array)
+
+    manager = NegativeControlManager(
+        negative_control_strategies=[ShuffledControl(random_seed=10)],
+        region_strategies=[ROIRegion()],
+    )
+    (result, _, _), = manager.apply(image, mask)
+
+    assert isinstance(result, sitk.Image)
+    assert result.GetSpacing() == image.GetSpacing()
+    result_array = sitk.GetArrayFromImage(result)
+    assert np.array_equal(result_array[mask_array == 0], image_array[mask_array == 0])
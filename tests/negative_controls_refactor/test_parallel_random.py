@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from readii.negative_controls import makeRandomImage
+from readii.negative_controls_refactor import RandomizedControl
+from readii.negative_controls_refactor.parallel_random import random_integers
+
+
+@pytest.fixture
+def image_array():
+    rng = np.random.default_rng(0)
+    return rng.integers(-1000, 2000, size=(12, 32, 32), dtype=np.int16)
+
+
+def test_single_thread_matches_default_rng():
+    expected = np.random.default_rng(10).integers(-5, 5, endpoint=True, size=(4, 8))
+    assert np.array_equal(random_integers(-5, 5, (4, 8), 10), expected)
+
+
+@pytest.mark.parametrize("n_threads", [1, 2, 3, 8])
+def test_fixed_chunks_independent_of_threads(n_threads):
+    expected = random_integers(-1000, 2000, (7, 50, 50), 10, n_chunks=6)
+    result = random_integers(-1000, 2000, (7, 50, 50), 10, n_threads=n_threads, n_chunks=6)
+
+    assert np.array_equal(result, expected)
+    assert result.min() >= -1000
+    assert result.max() <= 2000
+
+
+def test_reproducible_per_thread_count():
+    first = random_integers(0, 100, 10_000, 10, n_threads=4)
+    second = random_integers(0, 100, 10_000, 10, n_threads=4)
+
+    assert np.array_equal(first, second)
+    # Each chunk has its own generator, so the values differ from a single stream
+    assert not np.array_equal(first, random_integers(0, 100, 10_000, 10))
+
+
+@pytest.mark.parametrize("kwargs", [{"n_threads": 0}, {"n_chunks": 0}])
+def test_invalid_thread_options(kwargs):
+    with pytest.raises(ValueError):
+        random_integers(0, 10, 100, 10, **kwargs)
+
+
+def test_randomized_control_threads(image_array):
+    expected = RandomizedControl(random_seed=10, n_chunks=4)(image_array)
+    result = RandomizedControl(random_seed=10, n_threads=2, n_chunks=4)(image_array)
+
+    assert np.array_equal(result, expected)
+    assert np.array_equal(
+        makeRandomImage(image_array, 10, nThreads=3, nChunks=4), expected
+    )
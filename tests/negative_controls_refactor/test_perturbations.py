@@ -0,0 +1,146 @@
+import tracemalloc
+
+import numpy as np
+import pytest
+import SimpleITK as sitk
+
+from readii.negative_controls_refactor import (
+    ContourPerturbation,
+    NoisePerturbation,
+    PerturbationManager,
+    RoiCrop,
+    ROIRegion,
+    RotationPerturbation,
+    TranslationPerturbation,
+)
+
+
+@pytest.fixture
+def image_array():
+    rng = np.random.default_rng(0)
+    return rng.integers(-1000, 1000, size=(12, 32, 32), dtype=np.int16)
+
+
+@pytest.fixture
+def mask_array():
+    mask = np.zeros((12, 32, 32), dtype=np.uint8)
+    mask[4:8, 10:20, 12:22] = 1
+    return mask
+
+
+def test_crop_geometry(image_array, mask_array):
+    image = sitk.GetImageFromArray(image_array)
+    image.SetSpacing((0.5, 0.5, 2.0))
+    image.SetOrigin((10.0, -5.0, 3.0))
+
+    crop = RoiCrop.from_image(image, mask_array, padding_mm=2.0)
+
+    # 2 mm of padding is 4 voxels in plane and 1 voxel between slices
+    assert crop.start == (3, 6, 8)
+    assert crop.image.shape == (6, 18, 18)
+    assert np.array_equal(crop.image, image_array[3:9, 6:24, 8:26])
+
+    crop_image = crop.to_image_like(crop.image, image)
+    assert crop_image.GetOrigin() == image.TransformIndexToPhysicalPoint((8, 6, 3))
+    assert crop_image.GetSpacing() == image.GetSpacing()
+
+
+def test_identity_resample(image_array, mask_array):
+    crop = RoiCrop.from_arrays(image_array, mask_array, padding_mm=2.0)
+
+    images, masks = crop.resample(np.eye(3)[None], np.zeros((1, 3)))
+
+    assert np.array_equal(images[0], crop.image)
+    assert np.array_equal(masks[0], crop.mask)
+
+
+@pytest.mark.parametrize(
+    "strategy_class", [RotationPerturbation, TranslationPerturbation, NoisePerturbation, ContourPerturbation]
+)
+def test_batch_size_invariance(image_array, mask_array, strategy_class):
+    results = [
+        strategy_class(random_seed=10, n_perturbations=5, batch_size=batch_size)(image_array, mask_array)
+        for batch_size in [1, 2, 8]
+    ]
+
+    for other in results[1:]:
+        for (image, mask), (other_image, other_mask) in zip(results[0], other):
+            assert np.array_equal(image, other_image)
+            assert np.array_equal(mask, other_mask)
+
+
+def test_manager_crop_does_not_copy_volume():
+    image_array = np.zeros((64, 128, 128), dtype=np.float64)
+    mask_array = np.zeros(image_array.shape, dtype=np.uint8)
+    mask_array[30:34, 60:68, 60:68] = 1
+    image = sitk.GetImageFromArray(image_array)
+    mask = sitk.GetImageFromArray(mask_array)
+    manager = PerturbationManager([TranslationPerturbation(random_seed=10, max_shift_mm=3.0)])
+
+    tracemalloc.start()
+    try:
+        crop = manager.crop(image, mask)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    # The image and mask are read through views, only the crop is copied
+    assert peak < image_array.nbytes / 2
+    assert crop.image.size < image_array.size
+
+
+def test_geometric_perturbations_move_roi(image_array, mask_array):
+    for strategy in [RotationPerturbation(random_seed=10), TranslationPerturbation(random_seed=10, max_shift_mm=3.0)]:
+        crop = PerturbationManager([strategy]).crop(image_array, mask_array)
+        [(image, mask)] = strategy(image_array, mask_array)
+
+        assert image.shape == crop.image.shape
+        assert not np.array_equal(mask, crop.mask)
+        assert set(np.unique(mask)) <= {0, 1}
+
+
+def test_noise_limited_to_region(image_array, mask_array):
+    strategy = NoisePerturbation(random_seed=10, n_perturbations=3)
+    crop = PerturbationManager([strategy]).crop(image_array, mask_array)
+
+    for image, mask in strategy(image_array, mask_array, ROIRegion()):
+        roi = crop.mask > 0
+        assert np.array_equal(image[~roi], crop.image[~roi])
+        assert not np.array_equal(image[roi], crop.image[roi])
+        assert np.array_equal(mask, crop.mask)
+
+
+def test_contour_changes_roi_size(mask_array, image_array):
+    strategy = ContourPerturbation(random_seed=10, n_perturbations=10)
+    crop = PerturbationManager([strategy]).crop(image_array, mask_array)
+
+    roi_sizes = {int((mask > 0).sum()) for _, mask in strategy(image_array, mask_array)}
+
+    assert roi_sizes - {int((crop.mask > 0).sum())}
+    assert 0 not in roi_sizes
+
+
+def test_manager_from_strings(image_array, mask_array):
+    image = sitk.GetImageFromArray(image_array)
+    mask = sitk.GetImageFromArray(mask_array)
+    manager = PerturbationManager.from_strings(["rotation", "noise"], n_perturbations=3, random_seed=10)
+
+    results = list(manager.apply(image, mask))
+
+    assert [(name, index) for _, _, name, index in results] == [
+        ("rotation", 0),
+        ("rotation", 1),
+        ("rotation", 2),
+        ("noise", 0),
+        ("noise", 1),
+        ("noise", 2),
+    ]
+    for image_crop, mask_crop, _, _ in results:
+        assert isinstance(image_crop, sitk.Image)
+        assert image_crop.GetSize() == mask_crop.GetSize()
+        assert image_crop.GetPixelID() == image.GetPixelID()
+
+
+def test_manager_unknown_perturbation():
+    with pytest.raises(KeyError):
+        PerturbationManager.from_strings(["blur"])
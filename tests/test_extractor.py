@@ -0,0 +1,98 @@
+from readii.extractor import (
+    NumpyFeatureExtractor,
+    getFeatureExtractor,
+    parallelExecute,
+)
+
+from radiomics import featureextractor
+import numpy as np
+import pytest
+import SimpleITK as sitk
+
+
+@pytest.fixture
+def ctImage():
+    rng = np.random.default_rng(0)
+    image = sitk.GetImageFromArray(rng.normal(0, 300, size=(16, 32, 32)).astype(np.int16))
+    image.SetSpacing((0.8, 0.8, 2.5))
+    return image
+
+@pytest.fixture
+def roiImage(ctImage):
+    mask = np.zeros((16, 32, 32), dtype=np.uint8)
+    mask[4:12, 8:24, 10:22] = 1
+    roiImage = sitk.GetImageFromArray(mask)
+    roiImage.CopyInformation(ctImage)
+    return roiImage
+
+
+@pytest.mark.parametrize(
+    "firstOrderEngine, textureEngine",
+    [
+        ("numpy", "pyradiomics"),
+        ("pyradiomics", "numpy"),
+        ("numpy", "numpy"),
+    ]
+)
+def test_numpy_extractor_matches_pyradiomics(ctImage, roiImage, firstOrderEngine, textureEngine):
+    settings = {"imageType": {"Original": {}, "LoG": {"sigma": [1.0]}},
+                "featureClass": {"firstorder": None, "glcm": ["JointEntropy"], "glrlm": None,
+                                 "glszm": None, "gldm": ["DependenceEntropy"]},
+                "setting": {"binWidth": 25}}
+    expected = featureextractor.RadiomicsFeatureExtractor(settings).execute(ctImage, roiImage)
+    result = NumpyFeatureExtractor(settings, firstOrderEngine=firstOrderEngine,
+                                   textureEngine=textureEngine).execute(ctImage, roiImage)
+
+    assert list(result) == list(expected)
+    for featureName in expected:
+        if not featureName.startswith("diagnostics_"):
+            assert float(result[featureName]) == pytest.approx(float(expected[featureName]), rel=1e-9), featureName
+
+
+def test_numpy_extractor_falls_back_for_unsupported_settings(ctImage, roiImage):
+    settings = {"imageType": {"Original": {}},
+                "featureClass": {"glcm": None},
+                "setting": {"binWidth": 25, "force2D": True}}
+    expected = featureextractor.RadiomicsFeatureExtractor(settings).execute(ctImage, roiImage)
+    result = NumpyFeatureExtractor(settings, textureEngine="numpy").execute(ctImage, roiImage)
+
+    for featureName in expected:
+        if not featureName.startswith("diagnostics_"):
+            assert float(result[featureName]) == pytest.approx(float(expected[featureName]), rel=1e-9), featureName
+
+
+def test_getFeatureExtractor():
+    paramFilePath = "src/readii/data/default_pyradiomics.yaml"
+
+    assert type(getFeatureExtractor(paramFilePath)) is featureextractor.RadiomicsFeatureExtractor
+    assert isinstance(getFeatureExtractor(paramFilePath, "numpy"), NumpyFeatureExtractor)
+
+    extractor = getFeatureExtractor(paramFilePath, textureEngine="numpy")
+    assert (extractor.firstOrderEngine, extractor.textureEngine) == ("pyradiomics", "numpy")
+
+    with pytest.raises(ValueError):
+        getFeatureExtractor(paramFilePath, "cuda")
+    with pytest.raises(ValueError):
+        getFeatureExtractor(paramFilePath, textureEngine="cuda")
+
+
+@pytest.mark.parametrize("backend", ["processes", "threads"])
+@pytest.mark.parametrize("textureEngine", ["pyradiomics", "numpy"])
+def test_parallelExecute_matches_execute(ctImage, roiImage, backend, textureEngine):
+    settings = {"imageType": {"Original": {}, "LoG": {"sigma": [1.0, 2.0]}, "Wavelet": {}},
+                "featureClass": {"shape": None, "firstorder": None, "glcm": ["JointEntropy"], "glszm": None},
+                "setting": {"binWidth": 25, "resegmentRange": [-500, 500]}}
+    extractor = NumpyFeatureExtractor(settings, firstOrderEngine="pyradiomics", textureEngine=textureEngine)
+    expected = extractor.execute(ctImage, roiImage)
+    result = parallelExecute(extractor, ctImage, roiImage, nJobs=2, backend=backend)
+
+    assert list(result) == list(expected)
+    for featureName in expected:
+        if not featureName.startswith("diagnostics_Versions"):
+            assert str(result[featureName]) == str(expected[featureName]), featureName
+
+
+def test_parallelExecute_errors(ctImage, roiImage):
+    extractor = getFeatureExtractor("src/readii/data/default_pyradiomics.yaml")
+    with pytest.raises(ValueError):
+        parallelExecute(extractor, ctImage, roiImage, backend="mpi")
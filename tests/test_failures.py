@@ -0,0 +1,95 @@
+from readii.failures import (
+    FAILURE_COLUMNS,
+    NO_FEATURES_STAGE,
+    failureManifest,
+    mergeRetriedSeries,
+    readTable,
+    recordFailure,
+    retryImageInfo,
+)
+from readii.feature_extraction import featureExtraction
+
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def lungMetadataPath():
+    return "tests/output/ct_to_seg_match_list_4D-Lung.csv"
+
+@pytest.fixture
+def pdImageInfo():
+    return pd.DataFrame({"patient_ID": ["P1", "P2", "P3"],
+                         "series_CT": ["CT1", "CT2", "CT3"],
+                         "series_seg": ["SEG1", "SEG2", "SEG3"]})
+
+
+def test_recordFailure():
+    failures = []
+    recordFailure(failures, "CT1", "load_ct", FileNotFoundError("no such file"))
+    recordFailure(None, "CT2", "load_ct", FileNotFoundError("no such file"))
+
+    assert failures == [{"series_CT": "CT1", "series_seg": None, "stage": "load_ct",
+                         "exception_type": "FileNotFoundError", "message": "no such file"}]
+
+
+def test_failureManifest(pdImageInfo):
+    failures = []
+    recordFailure(failures, "CT1", "extraction", ValueError("bad mask"), segSeriesID="SEG1")
+    manifest = failureManifest(failures, ["CT1", "CT3"], pdImageInfo, negativeControl="shuffled_full")
+
+    assert tuple(manifest.columns) == FAILURE_COLUMNS
+    assert manifest["series_CT"].tolist() == ["CT1", "CT3"]
+    assert manifest["patient_ID"].tolist() == ["P1", "P3"]
+    assert manifest["stage"].tolist() == ["extraction", NO_FEATURES_STAGE]
+    assert manifest["exception_type"].iloc[0] == "ValueError"
+    assert (manifest["negative_control"] == "shuffled_full").all()
+
+
+def test_failureManifest_empty(pdImageInfo, tmp_path):
+    manifest = failureManifest([], [], pdImageInfo)
+    manifest.to_csv(tmp_path / "failures.csv", index=False)
+
+    assert tuple(readTable(tmp_path / "failures.csv").columns) == FAILURE_COLUMNS
+    assert readTable(tmp_path / "missing.csv").empty
+
+
+def test_retryImageInfo(pdImageInfo, tmp_path):
+    manifestPath = tmp_path / "failures.csv"
+
+    # Everything is extracted when there was no earlier run
+    assert retryImageInfo(pdImageInfo, manifestPath).equals(pdImageInfo)
+
+    failureManifest([], ["CT2"], pdImageInfo).to_csv(manifestPath, index=False)
+    assert retryImageInfo(pdImageInfo, manifestPath)["series_CT"].tolist() == ["CT2"]
+
+
+def test_mergeRetriedSeries():
+    existing = pd.DataFrame({"series_UID": ["CT1", "CT3", "CT3"], "roi": ["a", "b", "c"]})
+    retried = pd.DataFrame({"series_UID": ["CT2", "CT3"], "roi": ["d", "e"]})
+
+    merged = mergeRetriedSeries(existing, retried, ["CT2", "CT3"], ["CT1", "CT2", "CT3"])
+
+    assert merged["series_UID"].tolist() == ["CT1", "CT2", "CT3"]
+    assert merged["roi"].tolist() == ["a", "d", "e"]
+
+
+def test_mergeRetriedSeries_emptyTables():
+    existing = pd.DataFrame({"series_UID": ["CT1"], "roi": ["a"]})
+
+    assert mergeRetriedSeries(existing, pd.DataFrame(), ["CT2"], ["CT1", "CT2"]).equals(existing)
+    assert mergeRetriedSeries(pd.DataFrame(), existing, ["CT1"], ["CT1"]).equals(existing)
+
+
+def test_featureExtraction_recordsFailure(lungMetadataPath):
+    failures = []
+    pdImageInfo = pd.read_csv(lungMetadataPath)
+    ctSeriesID = pdImageInfo["series_CT"].iloc[0]
+
+    features = featureExtraction(ctSeriesID, pdImageInfo, "tests/missing_directory",
+                                 keep_running=True, failures=failures)
+
+    assert features is None
+    assert len(failures) == 1
+    assert failures[0]["series_CT"] == ctSeriesID
+    assert failures[0]["stage"] == "load_ct"
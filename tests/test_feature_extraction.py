@@ -4,16 +4,32 @@ from readii.loaders import (
 ) 
 
 from readii.feature_extraction import (
+    aggregateSliceFeatures,
+    canShareFilteredImages,
+    checkPyradiomicsParamFiles,
+    checkSliceAggregation,
+    invariantFeatureClasses,
+    multiConfigRadiomicFeatureExtraction,
+    qcROIImages,
     singleRadiomicFeatureExtraction,
+    sliceRadiomicFeatureExtraction,
     radiomicFeatureExtraction,
+    unionBoundingBox,
+    unionCropFeatureExtraction,
 )
+from readii.options import ExtractionOptions
+from readii.qc import ROIQCCriteria
+from radiomics import featureextractor
 
+import numpy as np
 import pytest
 import collections
 import pandas as pd
 import os 
 import shutil
+import SimpleITK as sitk
 from pathlib import Path
+from collections import OrderedDict
 
 @pytest.fixture
 def nsclcCTImage():
@@ -43,27 +59,23 @@ def lung4DRTSTRUCTImage():
 def pyradiomicsParamFilePath():
     return "src/readii/data/default_pyradiomics.yaml"
 
-@pytest.fixture(scope="module")
-def nsclcMetadataPath():
+# Each test gets its own copy of the match list, as tests running in parallel workers, e.g. in test_metadata,
+# write and delete the match lists in procdata
+@pytest.fixture
+def nsclcMetadataPath(tmp_path):
     oldpath = Path("tests/output/ct_to_seg_match_list_NSCLC_Radiogenomics.csv")
-    newpath = Path("tests/NSCLC_Radiogenomics/procdata/ct_to_seg_match_list_NSCLC_Radiogenomics.csv")
+    newpath = tmp_path / "procdata" / "ct_to_seg_match_list_NSCLC_Radiogenomics.csv"
     newpath.parent.mkdir(parents=True, exist_ok=True)
     shutil.copy(oldpath, newpath)
-    yield newpath.as_posix()
-
-    if newpath.exists():
-        newpath.unlink()
+    return newpath.as_posix()
 
-@pytest.fixture(scope="module")
-def lung4DMetadataPath():
+@pytest.fixture
+def lung4DMetadataPath(tmp_path):
     oldpath = Path("tests/output/ct_to_seg_match_list_4D-Lung.csv")
-    newpath = Path("tests/4D-Lung/procdata/ct_to_seg_match_list_4D-Lung.csv")
+    newpath = tmp_path / "procdata" / "ct_to_seg_match_list_4D-Lung.csv"
     newpath.parent.mkdir(parents=True, exist_ok=True)
     shutil.copy(oldpath, newpath)
-    yield newpath.as_posix()
-
-    if newpath.exists():
-        newpath.unlink()
+    return newpath.as_posix()
 
 
 def test_singleRadiomicFeatureExtraction_SEG(nsclcCTImage, nsclcSEGImage, pyradiomicsParamFilePath):
@@ -178,4 +190,351 @@ def test_segmentationLabel_passed(nsclcCTImage, nsclcSEGImage):
 def test_segmentationLabel_error(nsclcCTImage, nsclcSEGImage, segmentationLabel):
     """Test passing in segmentation label"""
     with pytest.raises(ValueError):
-        singleRadiomicFeatureExtraction(nsclcCTImage, nsclcSEGImage, segmentationLabel=segmentationLabel)
\ No newline at end of file
+        singleRadiomicFeatureExtraction(nsclcCTImage, nsclcSEGImage, segmentationLabel=segmentationLabel)
+
+
+@pytest.mark.parametrize(
+    "negativeControl, settings, expected",
+    [
+        ("shuffled_full", {}, ["shape"]),
+        ("shuffled_roi", {}, ["shape", "firstorder"]),
+        ("randomized_roi", {}, ["shape"]),
+        ("randomized_sampled_non_roi", {}, ["shape", "firstorder", "glcm"]),
+        ("shuffled_roi", {"resampledPixelSpacing": [1, 1, 1]}, ["shape"]),
+        ("shuffled_non_roi", {"normalize": True}, ["shape"]),
+    ]
+)
+def test_invariantFeatureClasses(negativeControl, settings, expected):
+    featureExtractor = featureextractor.RadiomicsFeatureExtractor(**settings)
+    featureExtractor.disableAllFeatures()
+    featureExtractor.enableFeaturesByName(shape=[], firstorder=[], glcm=[])
+
+    assert invariantFeatureClasses(negativeControl, featureExtractor) == expected
+
+
+def test_invariantFeatureClasses_filtered_image():
+    featureExtractor = featureextractor.RadiomicsFeatureExtractor()
+    featureExtractor.enableImageTypeByName("LoG", customArgs={"sigma": [1.0]})
+
+    assert invariantFeatureClasses("shuffled_non_roi", featureExtractor) == ["shape"]
+
+
+@pytest.mark.parametrize("negativeControl", ["shuffled_roi", "randomized_full"])
+def test_singleRadiomicFeatureExtraction_reuses_original(lung4DCTImage, lung4DRTSTRUCTImage, pyradiomicsParamFilePath, negativeControl):
+    originalFeatures = singleRadiomicFeatureExtraction(lung4DCTImage, lung4DRTSTRUCTImage, pyradiomicsParamFilePath)
+    expected = singleRadiomicFeatureExtraction(lung4DCTImage, lung4DRTSTRUCTImage, pyradiomicsParamFilePath,
+                                               negativeControl = negativeControl, randomSeed = 10)
+    reused = singleRadiomicFeatureExtraction(lung4DCTImage, lung4DRTSTRUCTImage, pyradiomicsParamFilePath,
+                                             negativeControl = negativeControl, randomSeed = 10,
+                                             originalFeatureVector = dict(originalFeatures))
+
+    assert list(reused) == list(expected)
+    for featureName in expected:
+        if not featureName.startswith("diagnostics_"):
+            assert reused[featureName] == pytest.approx(expected[featureName]), featureName
+
+
+@pytest.fixture
+def pyradiomicsParamFilePaths(tmp_path):
+    configs = {"binWidth25": "binWidth: 25", "binWidth10": "binWidth: 10"}
+    paths = []
+    for configName, binSetting in configs.items():
+        path = tmp_path / f"{configName}.yaml"
+        path.write_text(f"imageType:\n  Original: {{}}\nfeatureClass:\n  shape:\n  firstorder:\n  glcm:\nsetting:\n  {binSetting}\n")
+        paths.append(path.as_posix())
+    return paths
+
+
+@pytest.mark.parametrize("negativeControl", [None, "shuffled_roi"])
+def test_multiConfigRadiomicFeatureExtraction(lung4DCTImage, lung4DRTSTRUCTImage, pyradiomicsParamFilePaths, negativeControl):
+    actual = multiConfigRadiomicFeatureExtraction(lung4DCTImage, lung4DRTSTRUCTImage, pyradiomicsParamFilePaths,
+                                                  negativeControl = negativeControl, randomSeed = 10)
+
+    assert list(actual) == ["binWidth25", "binWidth10"]
+    for configPath, featureVector in zip(pyradiomicsParamFilePaths, actual.values()):
+        expected = singleRadiomicFeatureExtraction(lung4DCTImage, lung4DRTSTRUCTImage, configPath,
+                                                   negativeControl = negativeControl, randomSeed = 10)
+        assert list(featureVector) == list(expected)
+        for featureName in expected:
+            if not featureName.startswith("diagnostics_"):
+                assert featureVector[featureName] == pytest.approx(expected[featureName]), featureName
+
+
+def test_checkPyradiomicsParamFiles(pyradiomicsParamFilePaths, tmp_path):
+    assert list(checkPyradiomicsParamFiles(pyradiomicsParamFilePaths)) == ["binWidth25", "binWidth10"]
+
+    duplicatePath = tmp_path / "other" / "binWidth25.yaml"
+    duplicatePath.parent.mkdir()
+    duplicatePath.write_text("setting:\n  binWidth: 5\n")
+    with pytest.raises(ValueError):
+        checkPyradiomicsParamFiles([*pyradiomicsParamFilePaths, duplicatePath])
+    with pytest.raises(FileNotFoundError):
+        checkPyradiomicsParamFiles(["not_a_config.yaml"])
+
+
+def test_4DLung_multiConfig_radiomicFeatureExtraction_output(lung4DMetadataPath, pyradiomicsParamFilePaths, tmp_path):
+    """Test one output per PyRadiomics configuration from radiomic feature extraction with several parameter files"""
+    actual = radiomicFeatureExtraction(lung4DMetadataPath,
+                                       imageDirPath = "tests/",
+                                       roiNames = ["Tumor_c40"],
+                                       pyradiomicsParamFilePath = pyradiomicsParamFilePaths,
+                                       outputDirPath = tmp_path / "results")
+
+    assert list(actual) == ["binWidth25", "binWidth10"]
+    for configName, featuresTable in actual.items():
+        assert "pyradiomics_config" not in featuresTable.columns
+        assert featuresTable["roi"].tolist() == ["Tumor_c40"]
+        assert os.path.exists(tmp_path / "results" / "features" / f"radiomicfeatures_original_{configName}_4D-Lung.csv")
+    assert (actual["binWidth25"]["original_glcm_JointEntropy"] != actual["binWidth10"]["original_glcm_JointEntropy"]).all()
+
+
+@pytest.fixture
+def syntheticCTAndROIs():
+    rng = np.random.default_rng(0)
+    ctImage = sitk.GetImageFromArray(rng.normal(0, 200, size=(24, 48, 48)).astype(np.int16))
+    ctImage.SetSpacing((0.8, 0.8, 2.0))
+    roiImages = {}
+    for roiName, box in {"near": (slice(4, 12), slice(8, 20), slice(10, 24)),
+                         "far": (slice(10, 20), slice(26, 40), slice(20, 36))}.items():
+        mask = np.zeros((24, 48, 48), dtype=np.uint8)
+        mask[box] = 1
+        roiImages[roiName] = sitk.GetImageFromArray(mask)
+        roiImages[roiName].CopyInformation(ctImage)
+    return ctImage, roiImages
+
+@pytest.fixture
+def filteredParamFilePath(tmp_path):
+    path = tmp_path / "log.yaml"
+    path.write_text("imageType:\n  Original: {}\n  LoG:\n    sigma: [1.0]\n"
+                    "featureClass:\n  shape:\n  firstorder:\n  glcm:\nsetting:\n  binWidth: 25\n")
+    return path.as_posix()
+
+
+def assertSameFeatures(actual, expected, prefixes=("original_", "log-")):
+    assert list(actual) == list(expected)
+    for featureName in expected:
+        if featureName.startswith(prefixes):
+            assert actual[featureName] == pytest.approx(expected[featureName]), featureName
+
+
+@pytest.mark.parametrize("negativeControl", [None, "shuffled_full"])
+def test_unionCropFeatureExtraction(syntheticCTAndROIs, filteredParamFilePath, negativeControl):
+    ctImage, roiImages = syntheticCTAndROIs
+    actual = unionCropFeatureExtraction(ctImage, roiImages, filteredParamFilePath, maxBytes=1e9,
+                                        negativeControl=negativeControl, randomSeed=10)
+
+    assert list(actual) == list(roiImages)
+    for roiName, roiImage in roiImages.items():
+        expected = singleRadiomicFeatureExtraction(ctImage, roiImage, filteredParamFilePath,
+                                                   negativeControl=negativeControl, randomSeed=10)
+        # Filtered images see the CT around the ROI instead of the edge of the ROI crop, so only original features match
+        assertSameFeatures(actual[roiName], expected, prefixes=("original_",))
+
+
+def test_unionCropFeatureExtraction_single_roi(syntheticCTAndROIs, filteredParamFilePath):
+    ctImage, roiImages = syntheticCTAndROIs
+    actual = unionCropFeatureExtraction(ctImage, {"near": roiImages["near"]}, filteredParamFilePath, maxBytes=1e9)
+    expected = singleRadiomicFeatureExtraction(ctImage, roiImages["near"], filteredParamFilePath)
+
+    assertSameFeatures(actual["near"], expected)
+
+
+@pytest.mark.parametrize("negativeControl", [None, "shuffled_roi"])
+def test_unionCropFeatureExtraction_falls_back(syntheticCTAndROIs, filteredParamFilePath, negativeControl):
+    """Too little memory for the filtered images, or a negative control that depends on the ROI"""
+    ctImage, roiImages = syntheticCTAndROIs
+    maxBytes = 1e9 if negativeControl else 1e3
+    actual = unionCropFeatureExtraction(ctImage, roiImages, filteredParamFilePath, maxBytes=maxBytes,
+                                        negativeControl=negativeControl, randomSeed=10)
+
+    for roiName, roiImage in roiImages.items():
+        expected = singleRadiomicFeatureExtraction(ctImage, roiImage, filteredParamFilePath,
+                                                   negativeControl=negativeControl, randomSeed=10)
+        assertSameFeatures(actual[roiName], expected)
+
+
+def test_unionCropFeatureExtraction_preCrop(syntheticCTAndROIs, tmp_path):
+    """The image and mask are cropped to each ROI when they are loaded, so the filtered images are not shared"""
+    ctImage, roiImages = syntheticCTAndROIs
+    paramFilePath = tmp_path / "precrop.yaml"
+    paramFilePath.write_text("imageType:\n  Original: {}\n  LoG:\n    sigma: [1.0]\n"
+                             "featureClass:\n  shape:\n  firstorder:\n  glcm:\nsetting:\n  binWidth: 25\n  preCrop: true\n")
+    actual = unionCropFeatureExtraction(ctImage, roiImages, paramFilePath.as_posix(), maxBytes=1e9)
+
+    for roiName, roiImage in roiImages.items():
+        expected = singleRadiomicFeatureExtraction(ctImage, roiImage, paramFilePath.as_posix())
+        assertSameFeatures(actual[roiName], expected)
+
+
+@pytest.mark.parametrize(
+    "negativeControl, settings, imageType, expected",
+    [
+        (None, {}, None, True),
+        ("randomized_full", {}, None, True),
+        ("shuffled_roi", {}, None, False),
+        ("shuffled_non_roi", {}, None, False),
+        (None, {"resampledPixelSpacing": [1, 1, 1]}, None, False),
+        (None, {"normalize": True}, None, False),
+        (None, {"preCrop": True}, None, False),
+        (None, {}, "LBP3D", False),
+    ]
+)
+def test_canShareFilteredImages(negativeControl, settings, imageType, expected):
+    featureExtractor = featureextractor.RadiomicsFeatureExtractor(**settings)
+    if imageType is not None:
+        featureExtractor.enableImageTypeByName(imageType)
+
+    assert canShareFilteredImages(featureExtractor, negativeControl) == expected
+
+
+def test_unionBoundingBox():
+    boundingBoxes = [np.array([2, 5, 10, 12, 0, 3]), np.array([4, 9, 8, 11, 1, 2])]
+    assert unionBoundingBox(boundingBoxes).tolist() == [2, 9, 8, 12, 0, 3]
+
+
+def test_singleRadiomicFeatureExtraction_roiJobs(syntheticCTAndROIs, filteredParamFilePath):
+    ctImage, roiImages = syntheticCTAndROIs
+    expected = singleRadiomicFeatureExtraction(ctImage, roiImages["far"], filteredParamFilePath)
+    actual = singleRadiomicFeatureExtraction(ctImage, roiImages["far"], filteredParamFilePath,
+                                             roiJobs=2, roiParallelBackend="threads")
+
+    assertSameFeatures(actual, expected)
+
+
+def test_sliceRadiomicFeatureExtraction(syntheticCTAndROIs, filteredParamFilePath):
+    ctImage, roiImages = syntheticCTAndROIs
+    sliceRows = sliceRadiomicFeatureExtraction(ctImage, roiImages["near"], filteredParamFilePath,
+                                               sliceAggregation="slices", sliceJobs=2)
+
+    # The "near" ROI covers slices 4 to 11
+    assert [row["slice"] for row in sliceRows] == list(range(4, 12))
+    featureExtractor = featureextractor.RadiomicsFeatureExtractor(filteredParamFilePath, force2D=True)
+    for row in sliceRows:
+        sliceIndex = row["slice"]
+        expected = featureExtractor.execute(ctImage[:, :, sliceIndex:sliceIndex + 1],
+                                            roiImages["near"][:, :, sliceIndex:sliceIndex + 1])
+        assertSameFeatures(OrderedDict(list(row.items())[1:]), expected)
+
+    meanRow, = sliceRadiomicFeatureExtraction(ctImage, roiImages["near"], filteredParamFilePath,
+                                              sliceAggregation="mean", sliceJobs=2)
+    assert (meanRow["slice_aggregation"], meanRow["n_slices"]) == ("mean", 8)
+    assert meanRow["original_glcm_JointEntropy"] == pytest.approx(
+        np.mean([float(row["original_glcm_JointEntropy"]) for row in sliceRows]))
+
+
+def test_aggregateSliceFeatures():
+    sliceFeatureVectors = {3: OrderedDict(diagnostics_Mask="a", original_firstorder_Mean=1.0),
+                           4: OrderedDict(diagnostics_Mask="b", original_firstorder_Mean=3.0)}
+
+    maxRow, = aggregateSliceFeatures(sliceFeatureVectors, "max")
+    assert maxRow == OrderedDict(slice_aggregation="max", n_slices=2, diagnostics_Mask="a",
+                                 original_firstorder_Mean=3.0)
+    with pytest.raises(ValueError):
+        aggregateSliceFeatures(sliceFeatureVectors, "median")
+
+
+def test_checkSliceAggregation(pyradiomicsParamFilePath):
+    checkSliceAggregation(None, [pyradiomicsParamFilePath, pyradiomicsParamFilePath])
+    checkSliceAggregation("mean", pyradiomicsParamFilePath)
+    with pytest.raises(ValueError):
+        checkSliceAggregation("median", pyradiomicsParamFilePath)
+    with pytest.raises(ValueError):
+        checkSliceAggregation("mean", [pyradiomicsParamFilePath])
+
+
+def test_qcROIImages(syntheticCTAndROIs):
+    ctImage, roiImages = syntheticCTAndROIs
+    qcStatistics = []
+    passedROIImages = qcROIImages(ctImage, {"near": (1, roiImages["near"]), "far": (2, roiImages["far"])},
+                                  ROIQCCriteria(minVoxels=1000), qcStatistics=qcStatistics,
+                                  qcMetadata={"patient_ID": "P1"})
+
+    # near has 8 * 12 * 14 = 1344 voxels, far has 10 * 14 * 16 = 2240
+    assert list(passedROIImages) == ["near", "far"]
+    assert [(row["patient_ID"], row["roi"], row["roi_number"], row["voxel_count"], row["qc_failures"])
+            for row in qcStatistics] == [("P1", "near", 1, 1344, ""), ("P1", "far", 2, 2240, "")]
+
+    passedROIImages = qcROIImages(ctImage, {"near": (1, roiImages["near"]), "far": (2, roiImages["far"])},
+                                  ROIQCCriteria(minVoxels=2000))
+    assert list(passedROIImages) == ["far"]
+
+
+def test_4DLung_radiomicFeatureExtraction_roiQC(lung4DMetadataPath, tmp_path):
+    """ROIs failing QC are not extracted, and the QC table is saved"""
+    actual = radiomicFeatureExtraction(lung4DMetadataPath, imageDirPath="tests/", roiNames=["Tumor_c40"],
+                                       outputDirPath=tmp_path, options=ExtractionOptions(roiQC=ROIQCCriteria(minVoxels=10**9)))
+
+    assert actual.empty
+    qcTable = pd.read_csv(tmp_path / "qc" / "roiqc_4D-Lung.csv")
+    assert len(qcTable) > 0
+    assert (qcTable["qc_failures"] == f"voxel_count < {10**9}").all()
+    assert (qcTable["voxel_count"] > 0).all()
+
+
+def test_4DLung_radiomicFeatureExtraction_downsampleFactor(lung4DMetadataPath, tmp_path):
+    """Pilot runs extract from the CT and ROI downsampled together"""
+    actual = radiomicFeatureExtraction(lung4DMetadataPath, imageDirPath="tests/", roiNames=["Tumor_c40"],
+                                       outputDirPath=tmp_path, options=ExtractionOptions(downsampleFactor=2))
+
+    assert len(actual) == 1
+    assert np.allclose(actual["diagnostics_Image-original_Spacing"].iloc[0], (1.9532, 1.9532, 6.0))
+    # The full resolution ROI has 25247 voxels
+    assert actual["diagnostics_Mask-original_VoxelNum"].iloc[0] == pytest.approx(25247 / 8, rel=0.1)
+
+
+def test_4DLung_radiomicFeatureExtraction_memoryBudget(lung4DMetadataPath, tmp_path):
+    """Series are still extracted when their estimated memory is larger than the budget"""
+    actual = radiomicFeatureExtraction(lung4DMetadataPath, imageDirPath="tests/", roiNames=["Tumor_c40"],
+                                       outputDirPath=tmp_path, parallel=True,
+                                       options=ExtractionOptions(memoryBudget=1, downsampleFactor=2))
+
+    assert len(actual) == 1
+    assert actual["roi"].iloc[0] == "Tumor_c40"
+
+
+def test_4DLung_radiomicFeatureExtraction_isolateSeries(lung4DMetadataPath, tmp_path):
+    """Series extracted in a worker process give the same features"""
+    expected = radiomicFeatureExtraction(lung4DMetadataPath, imageDirPath="tests/", roiNames=["Tumor_c40"],
+                                         options=ExtractionOptions(downsampleFactor=2, roiQC=ROIQCCriteria()))
+    actual = radiomicFeatureExtraction(lung4DMetadataPath, imageDirPath="tests/", roiNames=["Tumor_c40"],
+                                       outputDirPath=tmp_path,
+                                       options=ExtractionOptions(downsampleFactor=2, roiQC=ROIQCCriteria(),
+                                                                 isolateSeries=True))
+
+    featureColumns = [column for column in expected.columns if column.startswith("original_")]
+    assert np.allclose(actual[featureColumns].astype(float), expected[featureColumns].astype(float))
+    # QC statistics come back from the worker
+    assert len(pd.read_csv(tmp_path / "qc" / "roiqc_4D-Lung.csv")) == 1
+
+
+def test_4DLung_radiomicFeatureExtraction_retryFailed(lung4DMetadataPath, tmp_path):
+    """Failed series go to the failure manifest, and a retry only extracts those and merges them in"""
+    manifestPath = tmp_path / "failures" / "failures_original_4D-Lung.csv"
+    featuresPath = tmp_path / "features" / "radiomicfeatures_original_4D-Lung.csv"
+
+    radiomicFeatureExtraction(lung4DMetadataPath, imageDirPath="tests/", roiNames=["GTV"],
+                              outputDirPath=tmp_path, keep_running=True,
+                              options=ExtractionOptions(downsampleFactor=2))
+    manifest = pd.read_csv(manifestPath)
+    # The loader raises a KeyError for the missing ROI
+    assert manifest["stage"].tolist() == ["load_segmentation"]
+    assert manifest["exception_type"].tolist() == ["KeyError"]
+    assert manifest["patient_ID"].tolist() == ["113_HM10395"]
+
+    retried = radiomicFeatureExtraction(lung4DMetadataPath, imageDirPath="tests/", roiNames=["Tumor_c40"],
+                                        outputDirPath=tmp_path, keep_running=True,
+                                        options=ExtractionOptions(downsampleFactor=2), retryFailed=True)
+    assert retried["roi"].tolist() == ["Tumor_c40"]
+    assert len(pd.read_csv(featuresPath)) == 1
+    assert pd.read_csv(manifestPath).empty
+
+    # Nothing is left to retry, so the features are kept as they are
+    radiomicFeatureExtraction(lung4DMetadataPath, imageDirPath="tests/", roiNames=["GTV"],
+                              outputDirPath=tmp_path, options=ExtractionOptions(downsampleFactor=2),
+                              retryFailed=True)
+    assert len(pd.read_csv(featuresPath)) == 1
+
+
+def test_radiomicFeatureExtraction_retryFailed_noOutputDir(lung4DMetadataPath):
+    with pytest.raises(ValueError):
+        radiomicFeatureExtraction(lung4DMetadataPath, imageDirPath="tests/", retryFailed=True)
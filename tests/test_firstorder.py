@@ -0,0 +1,69 @@
+from readii.firstorder import (
+    firstOrderFeatures,
+    getFirstOrderFeatureNames,
+)
+
+from radiomics import featureextractor
+import numpy as np
+import pytest
+import SimpleITK as sitk
+
+
+def pyradiomicsFirstOrder(values, **settings):
+    """First order features of a single ROI, computed by PyRadiomics."""
+    image = sitk.GetImageFromArray(np.asarray(values, dtype=float).reshape(1, 1, -1))
+    mask = sitk.GetImageFromArray(np.ones((1, 1, len(values)), dtype=np.uint8))
+    extractor = featureextractor.RadiomicsFeatureExtractor(minimumROIDimensions=1, **settings)
+    extractor.disableAllFeatures()
+    extractor.enableFeatureClassByName("firstorder")
+    featureVector = extractor.execute(image, mask)
+    return {name.split("_", 2)[2]: float(value) for name, value in featureVector.items()
+            if name.startswith("original_firstorder_")}
+
+
+@pytest.mark.parametrize("settings", [{}, {"binWidth": 10, "voxelArrayShift": 1000}, {"binCount": 16}])
+def test_firstOrderFeatures_matches_pyradiomics(settings):
+    rng = np.random.default_rng(1)
+    roiValues = np.round(rng.normal(40, 200, size=(4, 500)))
+
+    features = firstOrderFeatures(roiValues, **settings)
+
+    assert list(features) == getFirstOrderFeatureNames()
+    for row, values in enumerate(roiValues):
+        expected = pyradiomicsFirstOrder(values, **settings)
+        for featureName, value in expected.items():
+            assert features[featureName][row] == pytest.approx(value, rel=1e-9, abs=1e-9), featureName
+
+
+def test_firstOrderFeatures_flat_region():
+    features = firstOrderFeatures(np.full((2, 50), 7.0))
+
+    assert features["Skewness"] == pytest.approx([0, 0])
+    assert features["Kurtosis"] == pytest.approx([0, 0])
+    assert features["Entropy"] == pytest.approx([0, 0])
+    assert features["Uniformity"] == pytest.approx([1, 1])
+
+
+def test_firstOrderFeatures_ragged_rois():
+    rng = np.random.default_rng(2)
+    roiValues = [rng.normal(size=size) * 100 for size in [20, 300, 57]]
+
+    batchFeatures = firstOrderFeatures(roiValues, featureNames=["Mean", "Median", "Entropy", "RobustMeanAbsoluteDeviation"])
+
+    for row, values in enumerate(roiValues):
+        singleFeatures = firstOrderFeatures(values, featureNames=["Mean", "Median", "Entropy", "RobustMeanAbsoluteDeviation"])
+        for featureName, value in singleFeatures.items():
+            assert batchFeatures[featureName][row] == pytest.approx(value[0]), featureName
+
+
+@pytest.mark.parametrize(
+    "roiValues, featureNames",
+    [
+        (np.empty((2, 0)), None),
+        ([np.ones(5), np.array([])], None),
+        (np.ones((2, 5)), ["NotAFeature"]),
+    ]
+)
+def test_firstOrderFeatures_errors(roiValues, featureNames):
+    with pytest.raises(ValueError):
+        firstOrderFeatures(roiValues, featureNames=featureNames)
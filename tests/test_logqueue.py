@@ -0,0 +1,110 @@
+from readii.logqueue import aggregatedLogs, forwardLogs
+from readii.supervisor import SupervisedProcessPool
+from readii.utils import LazyLogValue, logger
+
+from joblib import Parallel, delayed
+import json
+import logging
+import multiprocessing
+import os
+import warnings
+
+import pytest
+
+
+def logFromWorker(seriesID):
+    logger.info("Worker event", series=seriesID, payload=LazyLogValue(lambda: {"voxels": 10}))
+    logger.debug("Hidden worker event")
+    try:
+        raise ValueError("bad series")
+    except ValueError:
+        logger.exception("Worker exception", series=seriesID)
+    return os.getpid()
+
+
+@pytest.fixture
+def infoLevel():
+    readiiLogger = logging.getLogger("readii")
+    previousLevel = readiiLogger.level
+    readiiLogger.setLevel(logging.INFO)
+    yield
+    readiiLogger.setLevel(previousLevel)
+
+
+def readRunLog(runLogPath):
+    with open(runLogPath) as runLog:
+        return [json.loads(line) for line in runLog]
+
+
+def test_forwardLogs_outsideBlock():
+    assert forwardLogs(logFromWorker) is logFromWorker
+
+
+def test_aggregatedLogs_processWorkers(infoLevel, tmp_path):
+    runLogPath = tmp_path / "logs" / "run.jsonl"
+    with aggregatedLogs(runLogPath):
+        logger.info("Main event")
+        workerPIDs = Parallel(n_jobs=2, prefer="processes")(
+            delayed(forwardLogs(logFromWorker))(seriesID) for seriesID in ["CT1", "CT2"]
+        )
+        with SupervisedProcessPool(1) as pool:
+            workerPIDs.append(pool.submit(forwardLogs(logFromWorker), "CT3").result())
+
+    events = readRunLog(runLogPath)
+    assert [event["event"] for event in events].count("Main event") == 1
+    workerEvents = [event for event in events if event["event"] == "Worker event"]
+    assert sorted(event["series"] for event in workerEvents) == ["CT1", "CT2", "CT3"]
+    assert {event["process"] for event in workerEvents} <= set(workerPIDs)
+    assert all(event["payload"] == {"voxels": 10} for event in workerEvents)
+    # The worker level applies and exceptions arrive formatted
+    assert "Hidden worker event" not in [event["event"] for event in events]
+    exceptionEvents = [event for event in events if event["event"] == "Worker exception"]
+    assert len(exceptionEvents) == 3
+    assert all("ValueError: bad series" in event["exception"] for event in exceptionEvents)
+
+
+def test_aggregatedLogs_noProcessWorkers(infoLevel, tmp_path):
+    runLogPath = tmp_path / "logs" / "run.jsonl"
+    childProcesses = multiprocessing.active_children()
+    with aggregatedLogs(runLogPath, processWorkers=False):
+        # No manager process is started and tasks are not wrapped
+        assert multiprocessing.active_children() == childProcesses
+        assert forwardLogs(logFromWorker) is logFromWorker
+        Parallel(n_jobs=2, prefer="threads")(delayed(logFromWorker)(seriesID) for seriesID in ["CT1", "CT2"])
+
+    assert len([event for event in readRunLog(runLogPath) if event["event"] == "Worker event"]) == 2
+    # The run log is still only written within the block
+    logger.info("After the block")
+    assert "After the block" not in [event["event"] for event in readRunLog(runLogPath)]
+
+
+def test_aggregatedLogs_exceptionWarningScoped(tmp_path):
+    # Importing readii.logqueue leaves the warning filters alone
+    assert not any(getattr(message, "pattern", "").startswith("Remove") for _, message, *_ in warnings.filters)
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        with aggregatedLogs(tmp_path / "run.jsonl"):
+            Parallel(n_jobs=2, prefer="processes")(
+                delayed(forwardLogs(logFromWorker))(seriesID) for seriesID in ["CT1", "CT2"]
+            )
+        warnings.warn("Remove `format_exc_info` outside the block", UserWarning)
+
+    # Forwarded exceptions render without the warning, which still shows after the block
+    assert [str(warning.message) for warning in caught if "format_exc_info" in str(warning.message)] == [
+        "Remove `format_exc_info` outside the block"
+    ]
+
+
+def test_aggregatedLogs_threadWorkers(infoLevel, tmp_path):
+    runLogPath = tmp_path / "run.jsonl"
+    with aggregatedLogs(runLogPath):
+        workerPIDs = Parallel(n_jobs=2, prefer="threads")(
+            delayed(forwardLogs(logFromWorker))(seriesID) for seriesID in ["CT1", "CT2"]
+        )
+
+    assert set(workerPIDs) == {os.getpid()}
+    assert len([event for event in readRunLog(runLogPath) if event["event"] == "Worker event"]) == 2
+    # The run log is only written within the block
+    logger.info("After the block")
+    assert "After the block" not in [event["event"] for event in readRunLog(runLogPath)]
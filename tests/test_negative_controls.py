@@ -8,6 +8,7 @@ from readii.negative_controls import (
     negativeControlROIOnly,
     negativeControlNonROIOnly
 )
+from readii.negative_controls_refactor.histogram import ValueHistogram
 
 
 import pytest
@@ -126,11 +127,11 @@ def test_makeRandomSampleFromDistributionImage(nsclcCTImage, randomSeed):
         "No voxel values have been changed to random."
     assert np.all(np.isin(randomized_arr_image.flatten(), original_arr_image.flatten())), \
         "Retuned object has values not sampled from original image"
-    assert randomized_arr_image[0,0,0] == -1005, \
+    assert randomized_arr_image[0,0,0] == -40, \
         "Random seed is not working for randomized from distribution image, first voxel has wrong random value. Random seed should be 10."
-    assert randomized_arr_image[-1,-1,-1] == 414, \
+    assert randomized_arr_image[-1,-1,-1] == -117, \
         "Random seed is not working for randomized from distribution image, last voxel has wrong random value. Random seed should be 10."
-    assert randomized_arr_image[238,252,124] == 49, \
+    assert randomized_arr_image[238,252,124] == -1004, \
         "Random seed is not working for randomized from distribution image, central ROI voxel has wrong random value. Random seed should be 10."
 
 
@@ -217,8 +218,12 @@ def test_makeRandomSampleFromDistributionROI(nsclcCropped, randomSeed):
         "Retuned object has values not sampled from original image"
     assert randomized_roi_arr_image[0,0,0] == -740, \
         "Voxel outside the ROI is being randomized. Should just be the ROI voxels."
-    assert randomized_roi_arr_image[7,18,11] == -81, \
-        "Random seed is not working for randomized from distribution ROI image, centre pixel has wrong value. Random seed should be 10."
+    roiVoxels = sitk.GetArrayFromImage(croppedROI) > 0
+    expected_roi_values = ValueHistogram.from_array(original_arr_image[roiVoxels]).sample(
+        int(roiVoxels.sum()), np.random.default_rng(randomSeed)
+    )
+    assert np.array_equal(randomized_roi_arr_image[roiVoxels], expected_roi_values), \
+        "Random seed is not working for randomized from distribution ROI image, ROI voxels have wrong values. Random seed should be 10."
     
 
 def test_makeShuffleNonROI(nsclcCropped, randomSeed):
@@ -307,9 +312,11 @@ def test_makeRandomNonRoiFromDistribution(nsclcCropped, randomSeed):
         "No voxel values have been changed to random."
     assert np.all(np.isin(randomized_non_roi_pixels, original_pixels)), \
         "Retuned object has values outside ROI not sampled from original image"
-    assert randomized_non_roi_pixels[0,0,0] == -653, \
-        "Random seed is not working for randomized from distribution non-ROI image. Random seed should be 10."
-    assert randomized_non_roi_pixels[-1,-1,-1] == -805, \
+    nonROIVoxels = sitk.GetArrayFromImage(croppedROI) == 0
+    expected_non_roi_values = ValueHistogram.from_array(original_pixels[nonROIVoxels]).sample(
+        int(nonROIVoxels.sum()), np.random.default_rng(randomSeed)
+    )
+    assert np.array_equal(randomized_non_roi_pixels[nonROIVoxels], expected_non_roi_values), \
         "Random seed is not working for randomized from distribution non-ROI image. Random seed should be 10."
     assert randomized_non_roi_pixels[7,18,11] == -1, \
         "ROI is getting randomized when it shouldn't."
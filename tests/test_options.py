@@ -0,0 +1,20 @@
+from readii.negative_controls_refactor import BufferPool
+from readii.options import DEFAULT_EXTRACTION_OPTIONS, ExtractionOptions
+
+import dataclasses
+import pytest
+
+
+def test_forWorkerProcess():
+    options = ExtractionOptions(slabSize=8, bufferPool=BufferPool(), textureEngine="numpy", isolateSeries=True)
+    workerOptions = options.forWorkerProcess()
+
+    assert workerOptions == ExtractionOptions(slabSize=8, textureEngine="numpy", isolateSeries=True)
+    # The options of the main process are kept
+    assert options.bufferPool is not None
+
+
+def test_defaults_frozen():
+    assert DEFAULT_EXTRACTION_OPTIONS == ExtractionOptions()
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        DEFAULT_EXTRACTION_OPTIONS.roiJobs = 2
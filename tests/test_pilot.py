@@ -0,0 +1,131 @@
+from readii.pilot import (
+    directoryBytes,
+    downsampleImage,
+    downsampleMask,
+    extrapolatePilotRun,
+    selectPilotSeries,
+    timeSeriesLoading,
+)
+from readii.preflight import estimateSeriesSeconds
+
+import numpy as np
+import pandas as pd
+import pytest
+import SimpleITK as sitk
+
+
+@pytest.fixture
+def pdImageInfo():
+    # 8 RTSTRUCT and 4 SEG series of increasing size, the first with two segmentations
+    nSeries = 12
+    pdImageInfo = pd.DataFrame({
+        "series_CT": [f"ct{i}" for i in range(nSeries)],
+        "series_seg": [f"seg{i}" for i in range(nSeries)],
+        "modality_seg": ["RTSTRUCT"] * 8 + ["SEG"] * 4,
+        "instances_CT": list(range(100, 100 + nSeries)),
+    })
+    extraSegmentation = pdImageInfo.iloc[[0]].assign(series_seg="seg0b")
+    return pd.concat([pdImageInfo, extraSegmentation], ignore_index=True)
+
+
+def test_selectPilotSeries_stratified(pdImageInfo):
+    pilotImageInfo = selectPilotSeries(pdImageInfo, 3, nSizeBins=1, randomSeed=10)
+    pilotSeries = pilotImageInfo.drop_duplicates(subset="series_CT")
+
+    assert len(pilotSeries) == 3
+    assert (pilotSeries["modality_seg"].value_counts() == pd.Series({"RTSTRUCT": 2, "SEG": 1})).all()
+
+
+def test_selectPilotSeries_keeps_all_segmentations(pdImageInfo):
+    pilotImageInfo = selectPilotSeries(pdImageInfo, 12)
+    assert pilotImageInfo.equals(pdImageInfo)
+
+    for randomSeed in range(5):
+        pilotImageInfo = selectPilotSeries(pdImageInfo, 4, randomSeed=randomSeed)
+        assert pilotImageInfo["series_CT"].nunique() == 4
+        if "ct0" in set(pilotImageInfo["series_CT"]):
+            assert set(pilotImageInfo["series_seg"]) >= {"seg0", "seg0b"}
+
+
+def test_selectPilotSeries_seed(pdImageInfo):
+    assert selectPilotSeries(pdImageInfo, 5, randomSeed=1).equals(selectPilotSeries(pdImageInfo, 5, randomSeed=1))
+
+
+def test_selectPilotSeries_invalid(pdImageInfo):
+    with pytest.raises(ValueError):
+        selectPilotSeries(pdImageInfo, 0)
+
+
+def test_downsampleImage_and_mask():
+    image = sitk.GetImageFromArray(np.arange(4 * 8 * 8, dtype=np.float32).reshape(4, 8, 8))
+    image.SetSpacing((0.5, 0.5, 2.0))
+    maskArray = np.zeros((4, 8, 8), dtype=np.uint8)
+    maskArray[:2, 4:, 4:] = 1
+    # Loaded segmentations may not have the geometry of the image
+    mask = sitk.GetImageFromArray(maskArray)
+
+    downsampledImage = downsampleImage(image, 2)
+    downsampledMask = downsampleMask(mask, image, downsampledImage)
+
+    assert downsampledImage.GetSize() == (4, 4, 2)
+    assert downsampledImage.GetSpacing() == (1.0, 1.0, 4.0)
+    # Voxels are averaged over blocks of 2 x 2 x 2
+    assert sitk.GetArrayFromImage(downsampledImage)[0, 0, 0] == pytest.approx(
+        sitk.GetArrayFromImage(image)[:2, :2, :2].mean())
+    for attribute in ("GetSize", "GetSpacing", "GetOrigin", "GetDirection"):
+        assert getattr(downsampledMask, attribute)() == getattr(downsampledImage, attribute)()
+    assert sitk.GetArrayFromImage(downsampledMask).sum() == 4
+
+
+def test_downsampleImage_short_axis():
+    image = sitk.Image(8, 8, 1, sitk.sitkInt16)
+    assert downsampleImage(image, 2).GetSize() == (4, 4, 1)
+
+
+@pytest.fixture
+def plan():
+    # With the default costs, loading takes 2 s per 1e8 CT voxels and extraction 2 s per 5000 ROI voxels
+    plan = pd.DataFrame({
+        "series_CT": ["ct0", "ct1", "ct2", "ct3"],
+        "n_rois": [1, 2, 1, 4],
+        "ct_voxels": [1e8, 1e8, 2e8, 2e8],
+        "roi_voxels": [5000.0, 10000.0, 5000.0, 20000.0],
+    })
+    plan["estimated_seconds"] = estimateSeriesSeconds(plan["ct_voxels"], plan["roi_voxels"])
+    return plan
+
+
+def test_extrapolatePilotRun(plan):
+    estimate = extrapolatePilotRun(plan, ["ct0", "ct1"], pilotSeconds=9.5, pilotOutputBytes=300,
+                                   downsampleFactor=2)
+
+    assert estimate["n_pilot_series"] == 2
+    assert estimate["n_series"] == 4
+    # The CTs of the pilot are loaded at full resolution, so it is estimated to take 4 s + 6 s / 2 ** 3 and the
+    # costs are 2 times the default
+    assert estimate["estimated_seconds"] == pytest.approx(56.0)
+    assert estimate["estimated_output_bytes"] == pytest.approx(800.0)
+
+
+def test_extrapolatePilotRun_pilotLoadSeconds(plan):
+    # Negative controls load and extract each series again
+    plan["estimated_seconds"] *= 2
+    estimate = extrapolatePilotRun(plan, ["ct0", "ct1"], pilotSeconds=22.0, pilotOutputBytes=300,
+                                   downsampleFactor=2, pilotLoadSeconds=8.0)
+
+    # Loading 2e8 voxels takes 8 s, so the pilot spends 16 s loading and 6 s on 2 * 15000 / 2 ** 3 ROI voxels
+    assert estimate["seconds_per_ct_voxel"] == pytest.approx(4e-8)
+    assert estimate["seconds_per_roi_voxel"] == pytest.approx(1.6e-3)
+    assert estimate["estimated_seconds"] == pytest.approx(2 * (6e8 * 4e-8 + 40000 * 1.6e-3))
+
+
+def test_directoryBytes(tmp_path):
+    (tmp_path / "features").mkdir()
+    (tmp_path / "features" / "a.csv").write_bytes(b"x" * 10)
+    (tmp_path / "b.csv").write_bytes(b"x" * 5)
+    assert directoryBytes(tmp_path) == 15
+
+
+def test_timeSeriesLoading():
+    pdImageInfo = pd.read_csv("tests/output/ct_to_seg_match_list_4D-Lung.csv")
+    assert timeSeriesLoading(pdImageInfo, "tests/", roiNames=["Tumor_c40"]) > 0
@@ -0,0 +1,69 @@
+from readii.preflight import (
+    PLAN_COLUMNS,
+    contourVoxelCount,
+    estimateSeriesMemory,
+    planFeatureExtraction,
+    plannedImageInfo,
+)
+
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def lungMetadataPath():
+    return "tests/output/ct_to_seg_match_list_4D-Lung.csv"
+
+@pytest.fixture
+def nsclcMetadataPath():
+    return "tests/output/ct_to_seg_match_list_NSCLC_Radiogenomics.csv"
+
+
+def test_contourVoxelCount():
+    # 10 mm x 4 mm square in the z = 5 plane
+    square = [0, 0, 5, 10, 0, 5, 10, 4, 5, 0, 4, 5]
+    assert contourVoxelCount(square, pixelArea=1.0) == pytest.approx(40.0)
+    assert contourVoxelCount(square, pixelArea=0.5) == pytest.approx(80.0)
+
+
+def test_estimateSeriesMemory_negativeControl():
+    assert estimateSeriesMemory(1000, 2, negativeControl=True) > estimateSeriesMemory(1000, 2)
+
+
+def test_planFeatureExtraction_4DLung(lungMetadataPath):
+    plan = planFeatureExtraction(lungMetadataPath, "tests/", roiNames=["Tumor_c40"])
+
+    assert tuple(plan.columns) == PLAN_COLUMNS
+    assert len(plan) == 1
+    row = plan.iloc[0]
+    assert row["passed"]
+    assert row["issues"] == ""
+    assert tuple(row["ct_size"]) == (512, 512, 99)
+    assert row["n_rois"] == 1
+    # Voxel count of the loaded Tumor_c40 mask is 25247
+    assert row["roi_voxels"] == pytest.approx(25247, rel=0.15)
+    assert row["estimated_seconds"] > 0
+    assert row["estimated_memory_bytes"] > 0
+
+
+def test_planFeatureExtraction_missingROI(lungMetadataPath):
+    plan = planFeatureExtraction(lungMetadataPath, "tests/", roiNames=["GTV"])
+
+    assert not plan.iloc[0]["passed"]
+    assert "GTV" in plan.iloc[0]["issues"]
+
+
+def test_planFeatureExtraction_unreadable(nsclcMetadataPath):
+    plan = planFeatureExtraction(nsclcMetadataPath, "tests/")
+
+    assert not plan["passed"].any()
+    assert plan["issues"].str.startswith("unreadable").all()
+
+
+def test_plannedImageInfo(lungMetadataPath):
+    pdImageInfo = pd.read_csv(lungMetadataPath, header=0)
+    passedPlan = planFeatureExtraction(lungMetadataPath, "tests/", roiNames=["Tumor_c40"])
+    failedPlan = planFeatureExtraction(lungMetadataPath, "tests/", roiNames=["GTV"])
+
+    assert len(plannedImageInfo(pdImageInfo, passedPlan)) == len(pdImageInfo)
+    assert plannedImageInfo(pdImageInfo, failedPlan).empty
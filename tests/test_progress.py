@@ -0,0 +1,112 @@
+from readii.progress import ExtractionProgress, ctVoxelCount, trackedFeatureSet
+from readii.preflight import planFeatureExtraction
+
+from joblib import Parallel, delayed
+import logging
+
+import pandas as pd
+import pytest
+
+
+def extractFakeSeries(ctSeriesID):
+    # Series ending in "x" fail, like featureExtraction with keep_running
+    return None if ctSeriesID.endswith("x") else [{"series_UID": ctSeriesID}]
+
+
+class RecordList(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+@pytest.fixture
+def progressRecords():
+    progressLogger = logging.getLogger("readii.progress")
+    handler = RecordList()
+    progressLogger.addHandler(handler)
+    yield handler.records
+    progressLogger.removeHandler(handler)
+
+
+def test_trackedFeatureSet_noProgress():
+    with trackedFeatureSet(None, "original", ["CT1"], extractFakeSeries) as extractSeries:
+        assert extractSeries is extractFakeSeries
+
+
+@pytest.mark.parametrize("parallel", [False, True])
+def test_trackedFeatureSet_counts(parallel):
+    progress = ExtractionProgress(["original", "shuffled_full", "randomized_roi"], interactive=False)
+    progress.skipFeatureSet("randomized_roi")
+    ctSeriesIDs = ["CT1", "CT2x", "CT3", "CT4"]
+
+    with trackedFeatureSet(progress, "original", ctSeriesIDs, extractFakeSeries, seriesVoxels=lambda _: 1000) as extractSeries:
+        if parallel:
+            features = Parallel(n_jobs=2, require="sharedmem")(delayed(extractSeries)(ctSeriesID) for ctSeriesID in ctSeriesIDs)
+        else:
+            features = [extractSeries(ctSeriesID) for ctSeriesID in ctSeriesIDs]
+
+    assert features == [extractFakeSeries(ctSeriesID) for ctSeriesID in ctSeriesIDs]
+    summary = progress.summary()
+    assert summary["feature_set"] == "[1/3] original"
+    assert (summary["series_done"], summary["series_failed"], summary["series_total"]) == (4, 1, 4)
+    assert summary["active_workers"] == 0
+    assert summary["series_per_min"] > 0
+    assert summary["voxels_per_s"] > 0
+    # Only shuffled_full is left, as randomized_roi is skipped
+    assert summary["eta_seconds"] == pytest.approx(4 / (summary["series_per_min"] / 60), abs=1)
+
+
+def test_trackedFeatureSet_seriesError():
+    progress = ExtractionProgress(interactive=False)
+
+    def failSeries(ctSeriesID):
+        raise RuntimeError("bad series")
+
+    with pytest.raises(RuntimeError, match="bad series"):
+        with trackedFeatureSet(progress, "original", ["CT1"], failSeries, seriesVoxels=failSeries) as extractSeries:
+            extractSeries("CT1")
+
+    summary = progress.summary()
+    assert (summary["series_done"], summary["series_failed"], summary["active_workers"]) == (1, 1, 0)
+
+
+def test_summary_notStarted():
+    assert ExtractionProgress(["original"], interactive=False).summary() is None
+
+
+def test_display_logsProgress(progressRecords):
+    progress = ExtractionProgress(interactive=False)
+    with progress.display():
+        with trackedFeatureSet(progress, "original", ["CT1", "CT2"], extractFakeSeries) as extractSeries:
+            extractSeries("CT1")
+            extractSeries("CT2")
+
+    assert len(progressRecords) == 1
+    # The progress logger is only set to INFO while progress is displayed
+    assert logging.getLogger("readii.progress").level == logging.NOTSET
+    event = progressRecords[0].msg
+    assert event["event"] == "Finished feature set."
+    assert (event["series_done"], event["series_total"]) == (2, 2)
+    assert event["eta"] == "0:00:00"
+
+
+def test_display_progressBar(progressRecords):
+    progress = ExtractionProgress(["original"], interactive=True)
+    with progress.display():
+        with trackedFeatureSet(progress, "original", ["CT1"], extractFakeSeries) as extractSeries:
+            extractSeries("CT1")
+
+    assert progressRecords == []
+    assert progress.summary()["series_done"] == 1
+
+
+def test_ctVoxelCount_4DLung():
+    lungMetadataPath = "tests/output/ct_to_seg_match_list_4D-Lung.csv"
+    pdImageInfo = pd.read_csv(lungMetadataPath)
+    ctSeriesID = pdImageInfo["series_CT"].iloc[0]
+    plan = planFeatureExtraction(lungMetadataPath, "tests/", roiNames=["Tumor_c40"])
+
+    assert ctVoxelCount(pdImageInfo, "tests/", ctSeriesID) == plan["ct_voxels"].iloc[0]
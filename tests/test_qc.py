@@ -0,0 +1,61 @@
+from readii.qc import (
+    ROIQCCriteria,
+    roiQCStatistics,
+)
+
+import numpy as np
+import pytest
+import SimpleITK as sitk
+
+
+@pytest.fixture
+def ctImage():
+    ctArray = np.arange(10 * 20 * 30, dtype=np.int16).reshape(10, 20, 30)
+    ctImage = sitk.GetImageFromArray(ctArray)
+    ctImage.SetSpacing((0.5, 0.5, 2.0))
+    return ctImage
+
+def roiImageFromArray(roiArray, ctImage):
+    roiImage = sitk.GetImageFromArray(roiArray.astype(np.uint8))
+    roiImage.CopyInformation(ctImage)
+    return roiImage
+
+
+def test_roiQCStatistics(ctImage):
+    roiArray = np.zeros((10, 20, 30))
+    roiArray[2:4, 5:8, 10:15] = 1
+    # Second component, two slices further, touching the last x border
+    roiArray[6, 10, 28:30] = 1
+    qcStatistics = roiQCStatistics(ctImage, roiImageFromArray(roiArray, ctImage))
+    ctROIValues = sitk.GetArrayFromImage(ctImage)[roiArray == 1]
+
+    assert qcStatistics["voxel_count"] == 32
+    assert qcStatistics["volume_mm3"] == pytest.approx(32 * 0.5)
+    assert [qcStatistics[f"bbox_{axis}_{end}"] for axis in "xyz" for end in ("min", "max")] == [10, 29, 5, 10, 2, 6]
+    assert (qcStatistics["hu_min"], qcStatistics["hu_max"]) == (ctROIValues.min(), ctROIValues.max())
+    assert qcStatistics["hu_mean"] == pytest.approx(ctROIValues.mean())
+    assert qcStatistics["n_components"] == 2
+    assert qcStatistics["n_slices"] == 3
+    assert qcStatistics["slice_coverage"] == pytest.approx(3 / 5)
+    assert qcStatistics["touches_border"]
+
+
+def test_roiQCStatistics_empty(ctImage):
+    qcStatistics = roiQCStatistics(ctImage, roiImageFromArray(np.zeros((10, 20, 30)), ctImage))
+
+    assert (qcStatistics["voxel_count"], qcStatistics["n_components"]) == (0, 0)
+    assert np.isnan(qcStatistics["hu_mean"])
+    assert not qcStatistics["touches_border"]
+
+
+@pytest.mark.parametrize(
+    "criteria, expected",
+    [
+        (ROIQCCriteria(), []),
+        (ROIQCCriteria(minVoxels=100), ["voxel_count < 100"]),
+        (ROIQCCriteria(maxComponents=1, excludeBorder=True), ["n_components > 1", "touches_border"]),
+    ]
+)
+def test_ROIQCCriteria_failures(criteria, expected):
+    qcStatistics = {"voxel_count": 32, "n_components": 2, "touches_border": True}
+    assert criteria.failures(qcStatistics) == expected
@@ -0,0 +1,70 @@
+from readii.scheduler import (
+    memoryAdmittedMap,
+    seriesMemoryEstimates,
+)
+
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+
+class MemoryRecorder:
+    """Records the memory in use and the order items start in"""
+    def __init__(self, memoryEstimates):
+        self.memoryEstimates = memoryEstimates
+        self.memoryInUse = 0
+        self.peakMemory = 0
+        self.startOrder = []
+        self.lock = threading.Lock()
+
+    def __call__(self, item):
+        with self.lock:
+            self.memoryInUse += self.memoryEstimates[item]
+            self.peakMemory = max(self.peakMemory, self.memoryInUse)
+            self.startOrder.append(item)
+        time.sleep(0.05 * self.memoryEstimates[item])
+        with self.lock:
+            self.memoryInUse -= self.memoryEstimates[item]
+        return item * 10
+
+
+def test_memoryAdmittedMap_within_budget():
+    memoryEstimates = [6, 6, 1, 1, 1, 1]
+    recorder = MemoryRecorder(memoryEstimates)
+    results = memoryAdmittedMap(recorder, list(range(6)), memoryEstimates, memoryBudget=10, nJobs=4)
+
+    assert results == [0, 10, 20, 30, 40, 50]
+    assert recorder.peakMemory <= 10
+    # The small items start before the second large one, which does not fit next to the first
+    assert recorder.startOrder.index(1) > recorder.startOrder.index(2)
+
+
+def test_memoryAdmittedMap_larger_than_budget():
+    memoryEstimates = [1, 20, 1]
+    recorder = MemoryRecorder(memoryEstimates)
+    results = memoryAdmittedMap(recorder, list(range(3)), memoryEstimates, memoryBudget=10, nJobs=3)
+
+    assert results == [0, 10, 20]
+    # The item larger than the budget runs alone
+    assert recorder.peakMemory == 20
+
+
+def test_memoryAdmittedMap_errors():
+    def fail(item):
+        raise RuntimeError("failed")
+
+    with pytest.raises(RuntimeError):
+        memoryAdmittedMap(fail, [0, 1], [1, 1], memoryBudget=10)
+    with pytest.raises(ValueError):
+        memoryAdmittedMap(fail, [0, 1], [1], memoryBudget=10)
+
+
+def test_seriesMemoryEstimates():
+    plan = pd.DataFrame({
+        "series_CT": ["ct0", "ct0", "ct1", "ct2"],
+        "estimated_memory_bytes": [100, 300, 50, np.nan],
+    })
+    assert seriesMemoryEstimates(plan, ["ct1", "ct0", "ct2", "ct3"]) == [50, 300, 300, 300]
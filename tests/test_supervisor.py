@@ -0,0 +1,76 @@
+from readii.supervisor import (
+    SupervisedProcessPool,
+    WorkerCrashError,
+    describeExitCode,
+)
+
+import os
+import signal
+
+import pytest
+
+
+def square(x):
+    return x * x
+
+
+def crash(message):
+    os.write(2, message.encode())
+    os.kill(os.getpid(), signal.SIGSEGV)
+
+
+def fail(message):
+    raise ValueError(message)
+
+
+def workerPID(_):
+    return os.getpid()
+
+
+def test_results_in_order():
+    with SupervisedProcessPool(2) as pool:
+        futures = [pool.submit(square, x) for x in range(5)]
+        assert [future.result() for future in futures] == [0, 1, 4, 9, 16]
+        assert pool.nCrashes == 0
+
+
+def test_crash_fails_only_its_task():
+    with SupervisedProcessPool(2) as pool:
+        futures = [pool.submit(square, 2), pool.submit(crash, "native error\n"), pool.submit(square, 3)]
+
+        assert futures[0].result() == 4
+        with pytest.raises(WorkerCrashError) as excinfo:
+            futures[1].result()
+        # The worker is replaced and the run goes on
+        assert futures[2].result() == 9
+        assert pool.submit(square, 4).result() == 16
+        assert pool.nCrashes == 1
+
+    assert excinfo.value.exitcode == -signal.SIGSEGV
+    assert "native error" in excinfo.value.stderr
+    # Python traceback of the crash
+    assert "in crash" in excinfo.value.stderr
+
+
+def test_exception_is_raised():
+    with SupervisedProcessPool(1) as pool:
+        with pytest.raises(ValueError, match="bad series"):
+            pool.submit(fail, "bad series").result()
+        # An exception does not replace the worker
+        assert pool.submit(workerPID, None).result() == pool.submit(workerPID, None).result()
+        assert pool.nCrashes == 0
+
+
+def test_submit_after_shutdown():
+    pool = SupervisedProcessPool(1)
+    pool.shutdown()
+    with pytest.raises(RuntimeError):
+        pool.submit(square, 1)
+
+
+@pytest.mark.parametrize(
+    "exitcode, expected",
+    [(1, "exit code 1"), (-signal.SIGSEGV, "signal SIGSEGV"), (-signal.SIGKILL, "signal SIGKILL")]
+)
+def test_describeExitCode(exitcode, expected):
+    assert describeExitCode(exitcode) == expected
@@ -0,0 +1,116 @@
+from readii.texture import (
+    TEXTURE_FEATURE_CLASSES,
+    _MaskGeometry,
+    _batchedGLSZM,
+    _discretize,
+    isTextureEngineSupported,
+    textureFeatures,
+)
+
+import numpy as np
+import pytest
+import SimpleITK as sitk
+
+SPACING = (0.7, 0.7, 2.0)
+
+
+@pytest.fixture
+def maskArray():
+    mask = np.zeros((10, 24, 24), dtype=np.uint8)
+    mask[2:8, 4:18, 5:20] = 1
+    mask[2:4, 4:8, 5:9] = 0
+    mask[5, 10, 10:15] = 0
+    # Isolated voxel, which is its own zone and run in every direction
+    mask[1, 6, 6] = 1
+    return mask
+
+@pytest.fixture
+def replicateArrays(maskArray):
+    """Original image, shuffled replicates with the same gray levels, and random replicates."""
+    rng = np.random.default_rng(0)
+    original = rng.normal(0, 120, maskArray.shape).round()
+    replicates = [original]
+    for _ in range(3):
+        shuffled = original.copy()
+        shuffled[maskArray == 1] = rng.permutation(original[maskArray == 1])
+        replicates.append(shuffled)
+    replicates.extend(rng.integers(-300, 300, maskArray.shape) for _ in range(3))
+    return np.stack(replicates).astype(np.int16)
+
+
+def pyradiomicsTexture(imageArray, maskArray, featureClassName, **settings):
+    """Texture features of one image, computed by PyRadiomics."""
+    image = sitk.GetImageFromArray(imageArray)
+    image.SetSpacing(SPACING)
+    mask = sitk.GetImageFromArray(maskArray)
+    mask.CopyInformation(image)
+    return TEXTURE_FEATURE_CLASSES[featureClassName](image, mask, **settings).execute()
+
+
+@pytest.mark.parametrize(
+    "settings",
+    [
+        {"binWidth": 25},
+        {"binWidth": 5},
+        {"binCount": 8, "distances": [1, 2], "symmetricalGLCM": False},
+    ]
+)
+def test_textureFeatures_matches_pyradiomics(replicateArrays, maskArray, settings):
+    result = textureFeatures(replicateArrays, maskArray, spacing=SPACING, **settings)
+
+    for featureClassName in TEXTURE_FEATURE_CLASSES:
+        for replicate, imageArray in enumerate(replicateArrays):
+            expected = pyradiomicsTexture(imageArray, maskArray, featureClassName, **settings)
+            assert list(result[featureClassName]) == list(expected)
+            for featureName, value in expected.items():
+                assert result[featureClassName][featureName][replicate] == pytest.approx(
+                    float(value), rel=1e-9, nan_ok=True), (featureClassName, featureName, replicate)
+
+
+def test_textureFeatures_selected_features(replicateArrays, maskArray):
+    result = textureFeatures(replicateArrays, maskArray, featureClassNames=("glszm",),
+                             featureNames={"glszm": ["ZoneEntropy", "SmallAreaEmphasis"]})
+
+    assert list(result) == ["glszm"]
+    assert list(result["glszm"]) == ["ZoneEntropy", "SmallAreaEmphasis"]
+    assert result["glszm"]["ZoneEntropy"].shape == (len(replicateArrays),)
+
+
+@pytest.mark.parametrize(
+    "featureClassName, settings, expected",
+    [
+        ("glcm", {}, True),
+        ("glszm", {"binCount": 16}, True),
+        ("gldm", {}, False),
+        ("glcm", {"force2D": True}, False),
+        ("glrlm", {"weightingNorm": "euclidean"}, False),
+    ]
+)
+def test_isTextureEngineSupported(featureClassName, settings, expected):
+    assert isTextureEngineSupported(featureClassName, settings) == expected
+
+
+def test_textureFeatures_errors(replicateArrays, maskArray):
+    with pytest.raises(ValueError):
+        textureFeatures(replicateArrays, maskArray, featureClassNames=("gldm",))
+    with pytest.raises(ValueError):
+        textureFeatures(replicateArrays, maskArray, force2D=True)
+    with pytest.raises(ValueError):
+        textureFeatures(replicateArrays, np.zeros_like(maskArray))
+
+
+def test_batchedGLSZM_largestZone(replicateArrays, maskArray):
+    """The zone size axis goes up to the largest zone like PyRadiomics, not up to the number of ROI voxels"""
+    roiMask = maskArray == 1
+    grayLevels = _discretize(replicateArrays[:2, roiMask].astype(float), {"binWidth": 25})
+    presentGrayLevels = np.unique(grayLevels)
+    P_glszm = _batchedGLSZM(_MaskGeometry(roiMask), grayLevels, int(presentGrayLevels.max()), presentGrayLevels)
+
+    largestZones = []
+    for imageArray in replicateArrays[:2]:
+        image = sitk.GetImageFromArray(imageArray)
+        glszm = TEXTURE_FEATURE_CLASSES["glszm"](image, sitk.GetImageFromArray(maskArray), binWidth=25)
+        glszm.execute()
+        # PyRadiomics keeps the zone sizes present in its matrix in jvector
+        largestZones.append(glszm.coefficients["jvector"].max())
+    assert P_glszm.shape[2] == max(largestZones) < roiMask.sum()
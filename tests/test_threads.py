@@ -0,0 +1,84 @@
+from readii.threads import (
+    availableThreads,
+    budgetedJobs,
+    getThreadBudget,
+    limitThreads,
+    setThreadBudget,
+    workerThreads,
+)
+
+import threading
+
+from joblib import Parallel, cpu_count, delayed
+import pytest
+import SimpleITK as sitk
+
+
+@pytest.fixture(autouse=True)
+def resetThreadBudget():
+    yield
+    setThreadBudget()
+
+
+def test_default_budget():
+    assert getThreadBudget() == cpu_count()
+
+
+def test_budget_shares():
+    setThreadBudget(totalThreads=32)
+
+    assert budgetedJobs(-1) == min(cpu_count(), 32)
+    assert budgetedJobs(64) == 32
+    assert workerThreads(4) == 8
+    assert workerThreads(64) == 1
+    assert workerThreads(5) == 6
+
+
+def test_threadsPerWorker():
+    setThreadBudget(totalThreads=32, threadsPerWorker=3)
+    assert workerThreads(4) == 3
+
+
+def test_invalid_budget():
+    with pytest.raises(ValueError):
+        setThreadBudget(totalThreads=0)
+
+
+def test_limitThreads():
+    setThreadBudget(totalThreads=16)
+    defaultThreads = sitk.ProcessObject.GetGlobalDefaultNumberOfThreads()
+
+    with limitThreads(4):
+        assert sitk.ProcessObject.GetGlobalDefaultNumberOfThreads() == 4
+        # Nested parallel steps share the limit of the enclosing one
+        assert availableThreads() == 4
+        assert workerThreads(2) == 2
+        with limitThreads(2):
+            assert sitk.ProcessObject.GetGlobalDefaultNumberOfThreads() == 4
+
+    assert sitk.ProcessObject.GetGlobalDefaultNumberOfThreads() == defaultThreads
+    assert availableThreads() == 16
+
+
+def test_limitThreads_thread_workers():
+    """Thread workers keep the limit of the process instead of setting their own"""
+    limits = []
+    lock = threading.Lock()
+
+    def worker(_):
+        with limitThreads(1):
+            with lock:
+                limits.append(sitk.ProcessObject.GetGlobalDefaultNumberOfThreads())
+
+    with limitThreads(3):
+        Parallel(n_jobs=2, prefer="threads")(delayed(worker)(i) for i in range(4))
+
+    assert limits == [3, 3, 3, 3]
+
+
+def test_limitThreads_worker_processes():
+    def worker(_):
+        with limitThreads(2):
+            return sitk.ProcessObject.GetGlobalDefaultNumberOfThreads()
+
+    assert Parallel(n_jobs=2, prefer="processes")(delayed(worker)(i) for i in range(2)) == [2, 2]
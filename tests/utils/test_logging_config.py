@@ -0,0 +1,31 @@
+import logging
+
+import pytest
+
+from readii.utils import LazyLogValue, logger
+
+
+@pytest.fixture
+def warningLevel():
+    readiiLogger = logging.getLogger("readii")
+    previousLevel = readiiLogger.level
+    readiiLogger.setLevel(logging.WARNING)
+    yield
+    readiiLogger.setLevel(previousLevel)
+
+
+def test_lazyLogValue_notComputedBelowLevel(warningLevel):
+    calls = []
+    logger.debug("Debug event", payload=LazyLogValue(lambda: calls.append("debug")))
+    assert calls == []
+
+    logger.warning("Warning event", payload=LazyLogValue(lambda: calls.append("warning")))
+    assert calls == ["warning"]
+
+
+def test_lazyLogValue_computedOnce():
+    calls = []
+    value = LazyLogValue(lambda: calls.append(1) or [1, 2])
+    assert repr(value) == "[1, 2]"
+    assert value.__structlog__() == [1, 2]
+    assert calls == [1]
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+import SimpleITK as sitk
+
+from readii.negative_controls import applyNegativeControl, applyNegativeControlsShared
+from readii.negative_controls_refactor import NegativeControlManager
+from readii.utils.shared_volume import SharedVolume
+
+
+@pytest.fixture
+def image_array():
+    rng = np.random.default_rng(0)
+    return rng.integers(-1000, 2000, size=(10, 24, 24), dtype=np.int16)
+
+
+@pytest.fixture
+def mask_array():
+    mask = np.zeros((10, 24, 24), dtype=np.uint8)
+    mask[3:7, 6:18, 6:18] = 1
+    return mask
+
+
+def test_publish_and_attach(image_array):
+    image = sitk.GetImageFromArray(image_array)
+    image.SetSpacing((0.5, 0.5, 2.0))
+
+    with SharedVolume.publish(image) as published:
+        with SharedVolume.attach(published.handle) as attached:
+            assert not attached.owner
+            attached.array[0, 0, 0] = 42
+            # Both views see the same memory
+            assert published.array[0, 0, 0] == 42
+
+        result = published.to_image()
+        assert result.GetSpacing() == image.GetSpacing()
+        assert result.GetPixelID() == image.GetPixelID()
+
+    assert not published.is_open
+    with pytest.raises(ValueError):
+        published.array
+
+
+def test_only_owner_unlinks(image_array):
+    with SharedVolume.publish(image_array) as published:
+        attached = SharedVolume.attach(published.handle)
+        with pytest.raises(ValueError):
+            attached.unlink()
+        attached.close()
+
+
+def test_apply_negative_controls_shared(image_array, mask_array):
+    image = sitk.GetImageFromArray(image_array)
+    image.SetOrigin((1.0, 2.0, 3.0))
+    mask = sitk.GetImageFromArray(mask_array)
+    negative_controls = [
+        ("shuffled", "full"),
+        ("randomized", "full"),
+        ("randomized", "roi"),
+        ("randomized_sampled", "non_roi"),
+    ]
+
+    results = applyNegativeControlsShared(image, negative_controls, mask, randomSeed=10, nJobs=2)
+
+    for result, (control_type, region) in zip(results, negative_controls):
+        expected = applyNegativeControl(image, control_type, region, mask, randomSeed=10)
+        assert result.GetOrigin() == image.GetOrigin()
+        assert result.GetPixelID() == expected.GetPixelID()
+        assert np.array_equal(sitk.GetArrayFromImage(result), sitk.GetArrayFromImage(expected))
+    # The input image must be left untouched
+    assert np.array_equal(sitk.GetArrayFromImage(image), image_array)
+
+
+def test_manager_processes_match_threads(image_array, mask_array):
+    manager = NegativeControlManager.from_strings(
+        negative_control_types=["shuffled", "sampled", "randomized"],
+        region_types=["full", "roi", "non_roi"],
+        random_seed=10,
+    )
+
+    threaded = list(manager.apply(image_array, mask_array))
+    in_processes = list(manager.apply(image_array, mask_array, n_jobs=2, prefer="processes"))
+
+    assert [names for _, *names in in_processes] == [names for _, *names in threaded]
+    for (process_array, _, _), (thread_array, _, _) in zip(in_processes, threaded):
+        assert np.array_equal(process_array, thread_array)